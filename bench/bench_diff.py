@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark diff engines on long paragraphs with Docbook markup.
+
+Paragraphs are assembled from translations of a synthetic corpus
+(see C{corpus.py}), and each is paired with a randomly edited copy
+(words replaced, removed or inserted).
+For each diff engine (see L{pology.diff.set_diff_engine}), measured are
+paragraph pairs processed per second by character-level C{tdiff}
+and by C{word_diff} with markup.
+Also recorded are whether all differences reconstruct both texts,
+the number of matched characters, and the mean difference ratio,
+so that engines can be compared by quality as well as by speed.
+Results are written in JSON format.
+
+This script is intended to be run standalone.
+
+Usage::
+    bench_diff.py [options]
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import json
+import locale
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from pology import version, _
+from pology.catalog import Catalog
+from pology.colors import ColorOptionParser
+from pology.diff import set_diff_engine, tdiff, word_diff
+from pology.report import report
+
+from corpus import add_corpus_options, corpus_params, make_corpus
+from bench_rules import current_commit
+
+
+_engines = ["difflib", "lcs"]
+
+
+def main ():
+
+    locale.setlocale(locale.LC_ALL, "")
+
+    usage = _("@info command usage",
+        "%(cmd)s [OPTIONS]",
+        cmd="%prog")
+    desc = _("@info command description",
+        "Benchmark diff engines on long paragraphs with Docbook markup.")
+
+    opars = ColorOptionParser(usage=usage, description=desc)
+    add_corpus_options(opars)
+    opars.set_defaults(nmsgs=2000, markup_density=0.6)
+    opars.add_option(
+        "-o", "--output",
+        metavar=_("@info command line value placeholder", "FILE"),
+        dest="output",
+        help=_("@info command line option description",
+               "Write results into a file instead of standard output."))
+    opars.add_option(
+        "-r", "--repeat",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="repeat", type="int", default=3,
+        help=_("@info command line option description",
+               "Run each benchmark this many times and take "
+               "the best timings (default: %(num)d).",
+               num=3))
+    opars.add_option(
+        "-w", "--words",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="nwords", type="int", default=300,
+        help=_("@info command line option description",
+               "Approximate number of words in a paragraph "
+               "(default: %(num)d).",
+               num=300))
+    opars.add_option(
+        "-e", "--edit-ratio",
+        metavar=_("@info command line value placeholder", "RATIO"),
+        dest="edit_ratio", type="float", default=0.05,
+        help=_("@info command line option description",
+               "Fraction of words edited in each paragraph "
+               "(default: %(val)s).",
+               val=0.05))
+    options, free_args = opars.parse_args()
+
+    cparams = corpus_params(options)
+    tmpdir = tempfile.mkdtemp(prefix="pology-bench-")
+    try:
+        catpaths = make_corpus(tmpdir, **cparams)
+        pairs = make_pairs(catpaths, options.nwords, options.edit_ratio,
+                           cparams["seed"])
+    finally:
+        shutil.rmtree(tmpdir)
+
+    results = {}
+    repeat = max(1, options.repeat)
+    for engine in _engines:
+        prev_engine = set_diff_engine(engine)
+        try:
+            results["char_" + engine] = best_of(run_char, pairs, repeat)
+            results["word_" + engine] = best_of(run_word, pairs, repeat)
+        finally:
+            set_diff_engine(prev_engine)
+    for name, result in sorted(results.items()):
+        report(_("@info:progress",
+                 "%(name)s: %(rate).1f paragraphs/s.",
+                 name=name, rate=result["pairs_per_sec"]))
+
+    output = {
+        "benchmark": "diff",
+        "pology": version(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": cparams,
+        "words": options.nwords,
+        "edit_ratio": options.edit_ratio,
+        "paragraphs": len(pairs),
+        "results": results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True) + "\n"
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def make_pairs (catpaths, nwords, edit_ratio, seed):
+    """
+    Assemble paragraphs from translations and pair them with edited copies.
+
+    @returns: old and new paragraphs
+    @rtype: [(string, string)*]
+    """
+
+    texts = []
+    for catpath in catpaths:
+        for msg in Catalog(catpath, monitored=False):
+            if msg.translated:
+                texts.extend(msg.msgstr)
+
+    rnd = random.Random(seed)
+    pairs = []
+    words = []
+    for text in texts:
+        words.extend(text.split())
+        if len(words) < nwords:
+            continue
+        new_words = []
+        for word in words:
+            r = rnd.random()
+            if r < edit_ratio / 3:
+                continue # removed
+            elif r < edit_ratio * 2 / 3:
+                new_words.append(rnd.choice(words)) # replaced
+            elif r < edit_ratio:
+                new_words.extend([word, rnd.choice(words)]) # inserted
+            else:
+                new_words.append(word)
+        pairs.append((" ".join(words), " ".join(new_words)))
+        words = []
+
+    return pairs
+
+
+def best_of (runf, pairs, repeat):
+    """
+    Run the benchmark several times and take the best timing.
+
+    @rtype: dict
+    """
+
+    best = None
+    for i in range(repeat):
+        result = runf(pairs)
+        if best is None or result["time"] < best["time"]:
+            best = result
+    best["pairs_per_sec"] = best["pairs"] / (best["time"] or 1e-9)
+    return best
+
+
+def run_char (pairs):
+    """
+    Make character-level differences of all pairs.
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    t0 = time.perf_counter()
+    diffs = [tdiff(old, new, diffr=True) for old, new in pairs]
+    diff_time = time.perf_counter() - t0
+
+    return summarize(pairs, diffs, diff_time)
+
+
+def run_word (pairs):
+    """
+    Make word-level differences of all pairs.
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    t0 = time.perf_counter()
+    diffs = [word_diff(old, new, markup=True, diffr=True)
+             for old, new in pairs]
+    diff_time = time.perf_counter() - t0
+
+    return summarize(pairs, diffs, diff_time)
+
+
+def summarize (pairs, diffs, diff_time):
+
+    valid = True
+    nmatched = 0
+    sumdr = 0.0
+    for (old, new), (dlist, dr) in zip(pairs, diffs):
+        valid = (    valid
+                 and "".join(x for t, x in dlist if t != "+") == old
+                 and "".join(x for t, x in dlist if t != "-") == new)
+        nmatched += sum(len(x) for t, x in dlist if t == " ")
+        sumdr += dr
+
+    return {
+        "pairs": len(pairs),
+        "valid": valid,
+        "matched": nmatched,
+        "diff_ratio": sumdr / (len(pairs) or 1),
+        "time": diff_time,
+    }
+
+
+if __name__ == '__main__':
+    main()
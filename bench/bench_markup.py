@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark markup checking and conversion on Docbook catalogs.
+
+Messages of given catalogs, or of a synthetic corpus (see C{corpus.py})
+if no catalogs are given, are checked by the C{check_docbook4_sp} hook
+and converted to plain text by C{docbook4_to_plain}.
+Measured are messages processed per second, both when nothing is
+remembered from earlier processing, and when the same messages
+are processed again (with hit rates of the involved caches).
+Checking can be distributed over several threads, in which case
+the results are compared to those of checking in a single thread.
+The number of detected problems and a digest of all reported spans
+and converted texts are recorded as well, so that a change in performance
+can be told apart from a change in results.
+Results are written in JSON format.
+
+This script is intended to be run standalone.
+
+Usage::
+    bench_markup.py [options] [CATALOGS...]
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import locale
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from pology import version, _
+from pology.cache import cache_stats, named_cache
+from pology.catalog import Catalog
+from pology.colors import ColorOptionParser
+from pology.fsops import collect_catalogs
+from pology.markup import check_docbook4_sp, docbook4_to_plain
+from pology.report import report
+
+from corpus import add_corpus_options, corpus_params, make_corpus
+from bench_rules import current_commit
+
+
+def main ():
+
+    locale.setlocale(locale.LC_ALL, "")
+
+    usage = _("@info command usage",
+        "%(cmd)s [OPTIONS] [CATALOGS...]",
+        cmd="%prog")
+    desc = _("@info command description",
+        "Benchmark markup checking and conversion on Docbook catalogs, "
+        "given or synthetic.")
+
+    opars = ColorOptionParser(usage=usage, description=desc)
+    add_corpus_options(opars)
+    opars.add_option(
+        "-o", "--output",
+        metavar=_("@info command line value placeholder", "FILE"),
+        dest="output",
+        help=_("@info command line option description",
+               "Write results into a file instead of standard output."))
+    opars.add_option(
+        "-r", "--repeat",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="repeat", type="int", default=3,
+        help=_("@info command line option description",
+               "Run each benchmark this many times and take "
+               "the best timings (default: %(num)d).",
+               num=3))
+    opars.add_option(
+        "-t", "--threads",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="threads", type="int", default=1,
+        help=_("@info command line option description",
+               "Check messages in this many threads (default: %(num)d).",
+               num=1))
+    options, free_args = opars.parse_args()
+
+    if free_args:
+        cparams = None
+        messages = collect_messages(collect_catalogs(free_args))
+    else:
+        cparams = corpus_params(options)
+        tmpdir = tempfile.mkdtemp(prefix="pology-bench-")
+        try:
+            messages = collect_messages(make_corpus(tmpdir, **cparams))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    results = {}
+    repeat = max(1, options.repeat)
+    results["check"] = best_of(run_check, messages, 1, repeat)
+    results["check_warm"] = best_of(run_check, messages, 1, repeat, True)
+    if options.threads > 1:
+        result = best_of(run_check, messages, options.threads, repeat)
+        result["consistent"] = (   result["output_digest"]
+                                == results["check"]["output_digest"])
+        results["check_threads"] = result
+    results["plain"] = best_of(run_plain, messages, 1, repeat)
+    results["plain_warm"] = best_of(run_plain, messages, 1, repeat, True)
+    for name, result in sorted(results.items()):
+        report(_("@info:progress",
+                 "%(name)s: %(rate).0f messages/s.",
+                 name=name, rate=result["msgs_per_sec"]))
+
+    output = {
+        "benchmark": "markup",
+        "pology": version(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": cparams,
+        "catalogs": free_args,
+        "threads": options.threads,
+        "results": results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True) + "\n"
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def collect_messages (catpaths):
+    """
+    Collect translated messages from catalogs.
+
+    @returns: messages with their catalogs
+    @rtype: [(Message, Catalog)*]
+    """
+
+    messages = []
+    for catpath in catpaths:
+        cat = Catalog(catpath, monitored=False)
+        cat.set_markup("docbook4")
+        for msg in cat:
+            if msg.translated:
+                messages.append((msg, cat))
+    return messages
+
+
+_memo_caches = ["markup-validation", "markup-plain"]
+
+def best_of (runf, messages, threads, repeat, warm=False):
+    """
+    Run the benchmark several times and take the best timing.
+
+    Before each run, caches of markup processing are cleared;
+    if warm runs are requested, another run is made after that
+    and only it is measured.
+
+    @rtype: dict
+    """
+
+    best = None
+    for i in range(repeat):
+        for name in _memo_caches:
+            cache = named_cache(name)
+            cache.clear()
+            cache.hits = cache.misses = 0
+        if warm:
+            runf(messages, threads)
+        stats0 = cache_stats()
+        result = runf(messages, threads)
+        stats1 = cache_stats()
+        hitrates = {}
+        for name in _memo_caches:
+            hits = stats1[name][2] - stats0[name][2]
+            lookups = hits + stats1[name][3] - stats0[name][3]
+            if lookups:
+                hitrates[name] = hits / lookups
+        result["hit_rates"] = hitrates
+        if best is None or result["time"] < best["time"]:
+            best = result
+    best["msgs_per_sec"] = best["messages"] / (best["time"] or 1e-9)
+    return best
+
+
+def run_check (messages, threads):
+    """
+    Check markup in all messages, in the given number of threads.
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    check = check_docbook4_sp(strict=False, entities=None)
+
+    def checkf (item):
+        msg, cat = item
+        return [check(x, msg, cat) for x in msg.msgstr]
+
+    t0 = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            allspans = list(executor.map(checkf, messages, chunksize=64))
+    else:
+        allspans = [checkf(x) for x in messages]
+    check_time = time.perf_counter() - t0
+
+    digest = hashlib.md5()
+    nproblems = 0
+    for msgspans in allspans:
+        for spans in msgspans:
+            nproblems += len(spans)
+            digest.update(repr(spans).encode("UTF-8"))
+
+    return {
+        "messages": len(messages),
+        "problems": nproblems,
+        "output_digest": digest.hexdigest(),
+        "time": check_time,
+    }
+
+
+def run_plain (messages, threads):
+    """
+    Convert all messages to plain text.
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    t0 = time.perf_counter()
+    texts = []
+    for msg, cat in messages:
+        texts.append(docbook4_to_plain(msg.msgid))
+        texts.extend(docbook4_to_plain(x) for x in msg.msgstr)
+    plain_time = time.perf_counter() - t0
+
+    digest = hashlib.md5()
+    for text in texts:
+        digest.update(text.encode("UTF-8"))
+
+    return {
+        "messages": len(messages),
+        "output_digest": digest.hexdigest(),
+        "time": plain_time,
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark merge engines on a synthetic corpus.
+
+Catalogs of a synthetic corpus (see C{corpus.py}) are merged with
+templates derived from them, in which original texts of some messages
+are slightly edited (to be fuzzy matched), some messages are replaced
+by new ones, and some removed (to become obsolete).
+For each merge engine (see L{pology.merge.merge_pofile}), measured are
+messages merged per second, with and without a compendium.
+For the native engine, the compendium is indexed before merging
+(see L{pology.compendium}), and the time to build the index
+is reported separately.
+Also recorded are the numbers of translated, fuzzy, untranslated and
+obsolete messages in merged catalogs, and, when C{msgmerge} is available,
+the fraction of merged messages in which the native engine agrees
+with C{msgmerge} (translation, fuzzy state and previous fields).
+Results are written in JSON format.
+
+This script is intended to be run standalone.
+
+Usage::
+    bench_merge.py [options]
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import json
+import locale
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from pology import version, _
+from pology.catalog import Catalog
+from pology.colors import ColorOptionParser
+from pology.compendium import compendium_index
+from pology.merge import merge_pofile
+from pology.message import MessageUnsafe
+from pology.report import report, warning
+
+from corpus import add_corpus_options, corpus_params, make_corpus
+from bench_rules import current_commit
+
+
+def main ():
+
+    locale.setlocale(locale.LC_ALL, "")
+
+    usage = _("@info command usage",
+        "%(cmd)s [OPTIONS]",
+        cmd="%prog")
+    desc = _("@info command description",
+        "Benchmark merge engines on a synthetic corpus.")
+
+    opars = ColorOptionParser(usage=usage, description=desc)
+    add_corpus_options(opars)
+    opars.add_option(
+        "-o", "--output",
+        metavar=_("@info command line value placeholder", "FILE"),
+        dest="output",
+        help=_("@info command line option description",
+               "Write results into a file instead of standard output."))
+    opars.add_option(
+        "-r", "--repeat",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="repeat", type="int", default=3,
+        help=_("@info command line option description",
+               "Run each benchmark this many times and take "
+               "the best timings (default: %(num)d).",
+               num=3))
+    opars.add_option(
+        "-e", "--edit-ratio",
+        metavar=_("@info command line value placeholder", "RATIO"),
+        dest="edit_ratio", type="float", default=0.1,
+        help=_("@info command line option description",
+               "Fraction of messages edited in templates, "
+               "and also of those replaced and of those removed "
+               "(default: %(val)s).",
+               val=0.1))
+    options, free_args = opars.parse_args()
+
+    engines = ["native"]
+    if shutil.which("msgmerge"):
+        engines.insert(0, "msgmerge")
+    else:
+        warning(_("@info",
+                  "Command '%(cmd)s' not available, "
+                  "benchmarking only the native engine.",
+                  cmd="msgmerge"))
+
+    cparams = corpus_params(options)
+    repeat = max(1, options.repeat)
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix="pology-bench-")
+    try:
+        catpaths = make_corpus(tmpdir, **cparams)
+        tplpaths = make_templates(catpaths, options.edit_ratio,
+                                  cparams["seed"])
+        cmppath = make_compendium(catpaths, tmpdir, cparams["seed"])
+        # Keep compendium indexes out of the user cache directory.
+        os.environ["XDG_CACHE_HOME"] = tmpdir
+        for engine in engines:
+            for cmpname, cmppaths in (("", []), ("_compendium", [cmppath])):
+                name = engine + cmpname
+                outdir = os.path.join(tmpdir, name)
+                os.mkdir(outdir)
+                index_time = None
+                if engine == "native" and cmppaths:
+                    t0 = time.perf_counter()
+                    compendium_index(cmppath)
+                    index_time = time.perf_counter() - t0
+                results[name] = best_of(run_merge, repeat, catpaths, tplpaths,
+                                        cmppaths, outdir, engine)
+                if index_time is not None:
+                    results[name]["index_time"] = index_time
+        if len(engines) > 1:
+            for cmpname in ("", "_compendium"):
+                agreement = compare_merged(
+                    os.path.join(tmpdir, "msgmerge" + cmpname),
+                    os.path.join(tmpdir, "native" + cmpname))
+                results["native" + cmpname]["agreement"] = agreement
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for name, result in sorted(results.items()):
+        report(_("@info:progress",
+                 "%(name)s: %(rate).1f messages/s.",
+                 name=name, rate=result["msgs_per_sec"]))
+
+    output = {
+        "benchmark": "merge",
+        "pology": version(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": cparams,
+        "edit_ratio": options.edit_ratio,
+        "results": results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True) + "\n"
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def make_templates (catpaths, edit_ratio, seed):
+    """
+    Derive templates from catalogs, with some messages changed.
+
+    @returns: paths of templates
+    @rtype: [string*]
+    """
+
+    rnd = random.Random(seed)
+    tplpaths = []
+    for catpath in catpaths:
+        cat = Catalog(catpath, monitored=False)
+        tcat = Catalog("", create=True, monitored=False)
+        tcat.header = cat.header
+        tcat.header.set_field("POT-Creation-Date", "2030-01-01 00:00+0000")
+        msgs = list(cat)
+        for msg in msgs:
+            r = rnd.random()
+            if r < edit_ratio:
+                continue # removed
+            tmsg = MessageUnsafe(msg)
+            tmsg.msgstr = [""] * len(msg.msgstr)
+            if r < edit_ratio * 2:
+                # Replaced by a message with text of another one.
+                tmsg.msgid = "%s %s" % (rnd.choice(msgs).msgid, tmsg.msgid)
+            elif r < edit_ratio * 3:
+                words = tmsg.msgid.split(" ")
+                words.insert(rnd.randrange(len(words) + 1), "also")
+                tmsg.msgid = " ".join(words)
+            if tmsg not in tcat:
+                tcat.add_last(tmsg)
+        tcat.filename = catpath + "t"
+        tcat.sync()
+        tplpaths.append(tcat.filename)
+
+    return tplpaths
+
+
+def make_compendium (catpaths, dirpath, seed):
+    """
+    Make a compendium from translated messages of every other catalog,
+    with original texts changed a bit, to produce fuzzy matches.
+
+    @returns: path of the compendium
+    @rtype: string
+    """
+
+    rnd = random.Random(seed)
+    ccat = Catalog("", create=True, monitored=False)
+    for catpath in catpaths[::2]:
+        for msg in Catalog(catpath, monitored=False):
+            cmsg = MessageUnsafe(msg)
+            if rnd.random() < 0.5:
+                cmsg.msgid = cmsg.msgid + " now"
+            if cmsg not in ccat:
+                ccat.add_last(cmsg)
+    ccat.filename = os.path.join(dirpath, "compendium.po")
+    ccat.sync()
+
+    return ccat.filename
+
+
+def best_of (runf, repeat, *args):
+    """
+    Run the benchmark several times and take the best timing.
+
+    @rtype: dict
+    """
+
+    best = None
+    for i in range(repeat):
+        result = runf(*args)
+        if best is None or result["time"] < best["time"]:
+            best = result
+    best["msgs_per_sec"] = best["messages"] / (best["time"] or 1e-9)
+    return best
+
+
+def run_merge (catpaths, tplpaths, cmppaths, outdir, engine):
+    """
+    Merge all catalogs with their templates.
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    outpaths = [os.path.join(outdir, os.path.basename(x)) for x in catpaths]
+    t0 = time.perf_counter()
+    for catpath, tplpath, outpath in zip(catpaths, tplpaths, outpaths):
+        merge_pofile(catpath, tplpath, outpath=outpath, cmppaths=cmppaths,
+                     quiet=True, abort=True, engine=engine)
+    merge_time = time.perf_counter() - t0
+
+    counts = dict(translated=0, fuzzy=0, untranslated=0, obsolete=0)
+    for outpath in outpaths:
+        for msg in Catalog(outpath, monitored=False):
+            if msg.obsolete:
+                counts["obsolete"] += 1
+            elif msg.translated:
+                counts["translated"] += 1
+            elif msg.fuzzy:
+                counts["fuzzy"] += 1
+            else:
+                counts["untranslated"] += 1
+
+    return {
+        "messages": sum(counts.values()),
+        "states": counts,
+        "time": merge_time,
+    }
+
+
+def compare_merged (dirpath1, dirpath2):
+    """
+    Compare same-named catalogs in two directories message by message.
+
+    @returns: fraction of messages equal by translation,
+        fuzzy state and previous fields
+    @rtype: float
+    """
+
+    nequal = 0
+    ntotal = 0
+    for fname in sorted(os.listdir(dirpath1)):
+        msgs1 = list(Catalog(os.path.join(dirpath1, fname), monitored=False))
+        msgs2 = list(Catalog(os.path.join(dirpath2, fname), monitored=False))
+        states2 = dict((x.key, merge_state(x)) for x in msgs2)
+        for msg in msgs1:
+            nequal += int(merge_state(msg) == states2.get(msg.key))
+        ntotal += max(len(msgs1), len(msgs2))
+
+    return nequal / (ntotal or 1)
+
+
+def merge_state (msg):
+
+    return (tuple(msg.msgstr), msg.fuzzy, msg.obsolete,
+            msg.msgctxt_previous, msg.msgid_previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark the rules engine on a synthetic corpus.
+
+For each requested language having rules in Pology, a synthetic corpus
+is generated (see C{corpus.py}) and checked by the C{check-rules} sieve,
+in a separate process for each language.
+Measured are the time to load the rules, the checking throughput
+in messages and rule evaluations per second, and the peak memory use.
+The number of detected problems and a digest of the complete sieve output
+are recorded as well, so that a change in performance can be told apart
+from a change in what the rules find.
+
+Results are written in JSON format, and two result files
+(e.g. made before and after a change) can be compared.
+When comparing, the exit status is non-zero if the findings differ.
+
+This script is intended to be run standalone.
+
+Usage::
+    bench_rules.py [options] [LANG...]
+    bench_rules.py --compare OLD.json NEW.json
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import hashlib
+import json
+import locale
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import ModuleType
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from pology import datadir, version, _, n_
+from pology.catalog import Catalog
+from pology.colors import ColorOptionParser
+from pology.fsops import collect_catalogs
+from pology.report import report, error, warning
+from pology.subcmd import ParamParser
+from pology.tabulate import tabulate
+
+from corpus import add_corpus_options, corpus_params, make_corpus
+
+
+def main ():
+
+    locale.setlocale(locale.LC_ALL, "")
+
+    usage = _("@info command usage",
+        "%(cmd)s [OPTIONS] [LANG...]\n"
+        "%(cmd)s --compare OLD NEW",
+        cmd="%prog")
+    desc = _("@info command description",
+        "Benchmark the rules engine on a synthetic corpus, "
+        "for all or given languages having rules in Pology.")
+
+    opars = ColorOptionParser(usage=usage, description=desc)
+    add_corpus_options(opars)
+    opars.add_option(
+        "-o", "--output",
+        metavar=_("@info command line value placeholder", "FILE"),
+        dest="output",
+        help=_("@info command line option description",
+               "Write results into a file instead of standard output."))
+    opars.add_option(
+        "-r", "--repeat",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="repeat", type="int", default=3,
+        help=_("@info command line option description",
+               "Run each benchmark this many times and take "
+               "the best timings (default: %(num)d).",
+               num=3))
+    opars.add_option(
+        "-s", "--sieve-param",
+        metavar=_("@info command line value placeholder", "PARAM[:VALUE]"),
+        dest="sieve_params", action="append", default=[],
+        help=_("@info command line option description",
+               "Additional parameter for the %(sieve)s sieve.",
+               sieve="check-rules"))
+    opars.add_option(
+        "-c", "--compare",
+        action="store_true", dest="compare", default=False,
+        help=_("@info command line option description",
+               "Compare two result files."))
+    opars.add_option(
+        "--run-one",
+        metavar=_("@info command line value placeholder", "DIR"),
+        dest="run_one",
+        help=_("@info command line option description",
+               "Internal: check catalogs in the directory and "
+               "report measurements."))
+    options, free_args = opars.parse_args()
+
+    if options.compare:
+        if len(free_args) != 2:
+            error(_("@info",
+                    "Exactly two result files must be given to compare."))
+        sys.exit(compare_results(*free_args))
+
+    if options.run_one:
+        result = run_check_rules(options.run_one, options.lang,
+                                 options.sieve_params)
+        sys.stdout.write(json.dumps(result) + "\n")
+        return
+
+    langs = free_args or rules_languages()
+    cparams = corpus_params(options)
+    results = {}
+    tmpdir = tempfile.mkdtemp(prefix="pology-bench-")
+    try:
+        for lang in langs:
+            cparams["lang"] = lang
+            corpdir = os.path.join(tmpdir, lang)
+            make_corpus(corpdir, **cparams)
+            runs = []
+            for i in range(max(1, options.repeat)):
+                run = run_in_subprocess(corpdir, lang, options.sieve_params)
+                if run is None:
+                    break
+                runs.append(run)
+            if runs:
+                results[lang] = best_of_runs(runs)
+                report(_("@info:progress",
+                         "%(lang)s: %(rate).0f messages/s, "
+                         "%(num)d problems.",
+                         lang=lang, rate=results[lang]["msgs_per_sec"],
+                         num=results[lang]["problems"]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    cparams.pop("lang")
+    output = {
+        "benchmark": "rules",
+        "pology": version(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": cparams,
+        "sieve_params": options.sieve_params,
+        "results": results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True) + "\n"
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def rules_languages ():
+    """
+    Get all languages which have rules in Pology.
+
+    @rtype: [string*]
+    """
+
+    langdir = os.path.join(datadir(), "lang")
+    langs = []
+    for lang in sorted(os.listdir(langdir)):
+        rulesdir = os.path.join(langdir, lang, "rules")
+        if (os.path.isdir(rulesdir)
+            and any(x.endswith(".rules") for x in os.listdir(rulesdir))
+        ):
+            langs.append(lang)
+    return langs
+
+
+def current_commit ():
+    """
+    Get the current commit of the Pology source tree, if in a Git clone.
+
+    @rtype: string or C{None}
+    """
+
+    try:
+        res = subprocess.run(["git", "rev-parse", "HEAD"],
+                             cwd=datadir(), capture_output=True, text=True)
+    except OSError:
+        return None
+    if res.returncode != 0:
+        return None
+    return res.stdout.strip()
+
+
+def run_in_subprocess (corpdir, lang, sieve_params):
+    """
+    Run the benchmark on a corpus in a separate process.
+
+    @returns: measurements, or C{None} if the run failed
+    @rtype: dict or C{None}
+    """
+
+    cmdline = [sys.executable, os.path.realpath(__file__),
+               "--run-one", corpdir, "--lang", lang]
+    for param in sieve_params:
+        cmdline.extend(["--sieve-param", param])
+    res = subprocess.run(cmdline, capture_output=True, text=True)
+    if res.returncode != 0:
+        warning(_("@info",
+                  "Benchmark failed for language '%(lang)s':\n%(msg)s",
+                  lang=lang, msg=res.stderr.strip()))
+        return None
+    return json.loads(res.stdout.strip().split("\n")[-1])
+
+
+def best_of_runs (runs):
+    """
+    Combine measurements of several runs, taking the best timings.
+
+    @rtype: dict
+    """
+
+    best = dict(runs[0])
+    best["load_time"] = min(x["load_time"] for x in runs)
+    best["check_time"] = min(x["check_time"] for x in runs)
+    best["peak_rss_kib"] = max(x["peak_rss_kib"] for x in runs)
+    best["runs"] = len(runs)
+    _set_rates(best)
+    return best
+
+
+def _set_rates (result):
+
+    ctime = result["check_time"] or 1e-9
+    result["msgs_per_sec"] = result["messages"] / ctime
+    result["evals_per_sec"] = result["rule_evals"] / ctime
+
+
+def _load_sieve (name):
+
+    # Load the same way as posieve does.
+    path = os.path.join(datadir(), "sieve", name.replace("-", "_") + ".py")
+    with open(path) as f:
+        code = f.read()
+    mod = ModuleType("sieve_0")
+    exec(code, mod.__dict__)
+    sys.modules[mod.__name__] = mod
+    return mod
+
+
+def run_check_rules (corpdir, lang, sieve_params):
+    """
+    Check catalogs in the directory with the C{check-rules} sieve,
+    measuring the performance.
+
+    Sieve output is discarded, only its digest is kept.
+
+    @param corpdir: directory with catalogs
+    @type corpdir: string
+    @param lang: language of rules
+    @type lang: string
+    @param sieve_params: additional sieve parameters
+    @type sieve_params: [string*]
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    mod = _load_sieve("check-rules")
+    pp = ParamParser()
+    mod.setup_sieve(pp.add_subcmd("check-rules"))
+    params = ["lang:%s" % lang, "jobs:1"] + list(sieve_params)
+    sparams, nacc_params = pp.parse(params, ["check-rules"])
+    if nacc_params:
+        error(_("@info",
+                "Parameters not accepted by the sieve: %(paramlist)s.",
+                paramlist=", ".join(nacc_params)))
+    sp = sparams["check-rules"]
+    sp.root_paths = ["."]
+    sp.raw_colors = False
+    sp.is_cat_included = lambda x: True
+
+    # Collect paths relative to corpus directory,
+    # so that the sieve output does not depend on its location.
+    os.chdir(corpdir)
+    catpaths = collect_catalogs(["."])
+
+    parse_time = 0.0
+    load_time = 0.0
+    check_time = 0.0
+    nmsgs = 0
+    rulesets = {}
+
+    # Redirect standard output to a file at descriptor level,
+    # to capture output of the sieve regardless of how it is written.
+    outfile = tempfile.TemporaryFile()
+    sys.stdout.flush()
+    stdout_fd = os.dup(1)
+    os.dup2(outfile.fileno(), 1)
+    try:
+        sieve = mod.Sieve(sp)
+        for catpath in catpaths:
+            t0 = time.perf_counter()
+            cat = Catalog(catpath, monitored=False)
+            parse_time += time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            sieve.process_header(cat.header, cat)
+            dt = time.perf_counter() - t0
+            rkey = (sieve.lang, tuple(sieve.envs))
+            if rkey not in rulesets:
+                # Loading rules dominates the first header in language.
+                load_time += dt
+                rulesets[rkey] = sieve.rules
+            else:
+                check_time += dt
+
+            t0 = time.perf_counter()
+            for msg in cat:
+                sieve.process(msg, cat)
+            check_time += time.perf_counter() - t0
+            nmsgs += len(cat)
+
+        t0 = time.perf_counter()
+        sieve.finalize()
+        check_time += time.perf_counter() - t0
+        sys.stdout.flush()
+    finally:
+        os.dup2(stdout_fd, 1)
+        os.close(stdout_fd)
+
+    outfile.seek(0)
+    digest = hashlib.md5(outfile.read()).hexdigest()
+    outfile.close()
+
+    nrules = 0
+    nevals = 0
+    for rules in rulesets.values():
+        nrules += len(rules)
+        nevals += sum(x.count for x in rules)
+
+    result = {
+        "catalogs": len(catpaths),
+        "messages": nmsgs,
+        "rules": nrules,
+        "rule_evals": nevals,
+        "problems": sieve.nmatch,
+        "output_digest": digest,
+        "parse_time": parse_time,
+        "load_time": load_time,
+        "check_time": check_time,
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    _set_rates(result)
+    return result
+
+
+def compare_results (oldpath, newpath):
+    """
+    Compare two benchmark result files and report differences.
+
+    @returns: 0 if findings are the same in both, 1 otherwise
+    @rtype: int
+    """
+
+    with open(oldpath) as f:
+        old = json.load(f)
+    with open(newpath) as f:
+        new = json.load(f)
+    if old.get("corpus") != new.get("corpus"):
+        warning(_("@info",
+                  "Results were made on different corpora."))
+
+    langs = sorted(set(old["results"]).union(new["results"]))
+    data = [[] for i in range(5)]
+    nchanged = 0
+    for lang in langs:
+        ores = old["results"].get(lang)
+        nres = new["results"].get(lang)
+        if not ores or not nres:
+            for col in data:
+                col.append("-")
+            nchanged += 1
+            continue
+        data[0].append("%.2f" % (nres["load_time"] / ores["load_time"]))
+        data[1].append("%.2f" % (nres["msgs_per_sec"] / ores["msgs_per_sec"]))
+        data[2].append("%.2f" % (nres["evals_per_sec"]
+                                 / (ores["evals_per_sec"] or 1e-9)))
+        data[3].append("%.2f" % (nres["peak_rss_kib"] / ores["peak_rss_kib"]))
+        if ores["output_digest"] == nres["output_digest"]:
+            data[4].append(_("@item:intable findings are unchanged", "same"))
+        else:
+            data[4].append(_("@item:intable findings are changed", "CHANGED"))
+            nchanged += 1
+
+    coln = [_("@title:column", "load"),
+            _("@title:column", "msg/s"),
+            _("@title:column", "eval/s"),
+            _("@title:column", "memory"),
+            _("@title:column", "findings")]
+    report(_("@info",
+             "Ratios of new to old measurements:"))
+    report(tabulate(data, rown=langs, coln=coln, none="-"))
+    if nchanged:
+        report(n_("@info",
+                  "Findings changed for %(num)d language.",
+                  "Findings changed for %(num)d languages.",
+                  num=nchanged))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    main()
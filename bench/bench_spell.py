@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Benchmark spell-checking backends on a synthetic corpus.
+
+Words of translations in a synthetic corpus (see C{corpus.py})
+are checked by each of the available Aspell backends:
+the Aspell library through C{ctypes}, the C{aspell -a} process
+in pipe mode, and the internal supplemental-dictionary checker.
+Measured are words checked per second, with and without
+fetching suggestions for unknown words.
+Results are written in JSON format.
+
+This script is intended to be run standalone.
+
+Usage::
+    bench_spell.py [options]
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import json
+import locale
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from pology import PologyError, version, _
+from pology.catalog import Catalog
+from pology.colors import ColorOptionParser
+from pology.fsops import collect_catalogs
+from pology.report import report
+import pology.spell as S
+
+from corpus import add_corpus_options, corpus_params, make_corpus
+from bench_rules import current_commit
+
+
+_backends = ["library", "pipe", "supplements"]
+
+
+def main ():
+
+    locale.setlocale(locale.LC_ALL, "")
+
+    usage = _("@info command usage",
+        "%(cmd)s [OPTIONS]",
+        cmd="%prog")
+    desc = _("@info command description",
+        "Benchmark spell-checking backends on a synthetic corpus.")
+
+    opars = ColorOptionParser(usage=usage, description=desc)
+    add_corpus_options(opars)
+    opars.add_option(
+        "-o", "--output",
+        metavar=_("@info command line value placeholder", "FILE"),
+        dest="output",
+        help=_("@info command line option description",
+               "Write results into a file instead of standard output."))
+    opars.add_option(
+        "-e", "--encoding",
+        metavar=_("@info command line value placeholder", "ENCODING"),
+        dest="encoding", default="UTF-8",
+        help=_("@info command line option description",
+               "Encoding of the Aspell dictionary (default: %(val)s).",
+               val="UTF-8"))
+    options, free_args = opars.parse_args()
+
+    cparams = corpus_params(options)
+    tmpdir = tempfile.mkdtemp(prefix="pology-bench-")
+    try:
+        make_corpus(tmpdir, **cparams)
+        texts = collect_texts(tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    results = {}
+    for backend in _backends:
+        try:
+            results[backend] = run_backend(backend, texts, options.lang,
+                                           options.encoding)
+        except PologyError as e:
+            results[backend] = {"error": str(e)}
+        except Exception as e:
+            results[backend] = {"error": "%s: %s" % (type(e).__name__, e)}
+        if "error" in results[backend]:
+            report(_("@info:progress",
+                     "%(backend)s: failed.",
+                     backend=backend))
+        else:
+            report(_("@info:progress",
+                     "%(backend)s: %(rate).0f words/s.",
+                     backend=backend,
+                     rate=results[backend]["words_per_sec"]))
+
+    output = {
+        "benchmark": "spell",
+        "pology": version(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus": cparams,
+        "results": results,
+    }
+    text = json.dumps(output, indent=2, sort_keys=True) + "\n"
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def collect_texts (corpdir):
+    """
+    Collect words of translations in the corpus, by message.
+
+    @returns: list of word lists
+    @rtype: [[string*]*]
+    """
+
+    # Same splitting as in spell-checking hooks.
+    wsplit_rx = re.compile(r"[^\W\d_]+", re.U)
+    texts = []
+    for catpath in collect_catalogs([corpdir]):
+        for msg in Catalog(catpath, monitored=False):
+            for msgstr in msg.msgstr:
+                words = wsplit_rx.findall(msgstr)
+                if words:
+                    texts.append(words)
+    return texts
+
+
+def run_backend (backend, texts, lang, encoding):
+    """
+    Check all words by the backend, measuring the performance.
+
+    Each backend is used without caching of results.
+
+    @returns: measurements
+    @rtype: dict
+    """
+
+    t0 = time.perf_counter()
+    if backend == "library":
+        checker = S._construct_aspell(lang, [], encoding, None, {}, False)
+    elif backend == "pipe":
+        if not S.AspellPipe.available():
+            raise PologyError(_("@info", "Aspell command not found."))
+        checker = S._construct_aspell(lang, [], encoding, None, {}, False,
+                                      pipe=True)
+    else:
+        checker = S._construct_aspell(lang, [], encoding, None, {}, True)
+    start_time = time.perf_counter() - t0
+
+    nwords = sum(len(x) for x in texts)
+    enctexts = [[w.encode(encoding) for w in x] for x in texts]
+
+    # Only verdicts.
+    t0 = time.perf_counter()
+    nunknown = 0
+    for words in enctexts:
+        if hasattr(checker, "check_words"):
+            verdicts = checker.check_words(words)
+        else:
+            verdicts = [checker.check(w) for w in words]
+        nunknown += verdicts.count(False)
+    check_time = time.perf_counter() - t0
+
+    # Verdicts and suggestions for unknown words.
+    t0 = time.perf_counter()
+    for words in enctexts:
+        if hasattr(checker, "check_words"):
+            verdicts = checker.check_words(words)
+        else:
+            verdicts = [checker.check(w) for w in words]
+        for word, verdict in zip(words, verdicts):
+            if not verdict:
+                checker.suggest(word)
+    suggest_time = time.perf_counter() - t0
+
+    if hasattr(checker, "close"):
+        checker.close()
+
+    return {
+        "words": nwords,
+        "unknown": nunknown,
+        "start_time": start_time,
+        "check_time": check_time,
+        "suggest_time": suggest_time,
+        "words_per_sec": nwords / (check_time or 1e-9),
+        "words_per_sec_suggest": nwords / (suggest_time or 1e-9),
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+"""
+Generate a synthetic corpus of PO files for benchmarking.
+
+The corpus is fully determined by its parameters (including the seed),
+so that the same corpus can be regenerated to compare different
+versions of Pology on exactly the same input.
+Translations are assembled from words of the language's supplemental
+spelling dictionaries in Pology (where available), and messages can be
+made to contain plural forms, markup, accelerators and format directives
+in requested proportions.
+
+This script is intended to be run standalone, or imported by
+other benchmark scripts in this directory.
+
+Usage::
+    corpus.py [options] DIR
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import codecs
+import glob
+import locale
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from pology import datadir, _, n_
+from pology.colors import ColorOptionParser
+from pology.escape import escape_c
+from pology.fsops import mkdirpath
+from pology.report import report
+
+
+# Plural forms of languages having rules in Pology.
+_plural_forms = {
+    "cs": "nplurals=3; plural=(n==1) ? 0 : (n>=2 && n<=4) ? 1 : 2;",
+    "fr": "nplurals=2; plural=(n > 1);",
+    "ja": "nplurals=1; plural=0;",
+    "ko": "nplurals=1; plural=0;",
+    "ro": "nplurals=3; plural=n==1 ? 0 : (n==0 || (n%100 > 0 && n%100 < 20)) ? 1 : 2;",
+    "ru": "nplurals=3; plural=(n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2);",
+    "sr": "nplurals=4; plural=n==1 ? 3 : n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2;",
+}
+_plural_forms_default = "nplurals=2; plural=n != 1;"
+
+# Words for original texts, and for translations in languages
+# without any supplemental spelling dictionaries.
+_source_words = """
+    a about account action add address all allow already an and any
+    application apply are as at available back be bookmark box but by
+    cancel cannot change check choose clear click close collection color
+    configure connection contact copy could create current default delete
+    desktop dialog directory disk display do document download edit empty
+    enable enter error every export failed file files filter find folder
+    font for from game general go group has have help here hide history
+    if image import in information is item it key language last layout
+    least line link list load local location mail may menu message mode
+    more move name network new next no not number of on one only open
+    option or page password paste path please preview print project
+    properties quit read recent remove rename replace required restore
+    save search select selected send server set settings show size some
+    sort start status stop system tab text the this time to tool type
+    undo update use user value version view was when will window with
+    word you your
+""".split()
+
+_tags = [
+    ("<b>", "</b>"),
+    ("<i>", "</i>"),
+    ("<filename>", "</filename>"),
+    ("<command>", "</command>"),
+    ("<emphasis>", "</emphasis>"),
+    ("<application>", "</application>"),
+    ("<a href=\"https://example.org\">", "</a>"),
+]
+_entities = ["&amp;", "&lt;", "&gt;"]
+
+
+def main ():
+
+    locale.setlocale(locale.LC_ALL, "")
+
+    usage = _("@info command usage",
+        "%(cmd)s [OPTIONS] DIR",
+        cmd="%prog")
+    desc = _("@info command description",
+        "Generate a synthetic corpus of PO files into the given directory.")
+
+    opars = ColorOptionParser(usage=usage, description=desc)
+    add_corpus_options(opars)
+    options, free_args = opars.parse_args()
+    if len(free_args) != 1:
+        opars.error(_("@info",
+                      "Exactly one output directory must be given."))
+
+    paths = make_corpus(free_args[0], **corpus_params(options))
+    report(n_("@info:progress",
+              "Generated %(num)d catalog.",
+              "Generated %(num)d catalogs.",
+              num=len(paths)))
+
+
+def add_corpus_options (opars):
+    """
+    Add options for corpus parameters to the option parser.
+
+    Options are stored into the same attributes as the keyword
+    parameters of L{make_corpus}, and can be collected for it
+    by L{corpus_params}.
+
+    @param opars: the option parser
+    @type opars: OptionParser
+    """
+
+    opars.add_option(
+        "-l", "--lang",
+        metavar=_("@info command line value placeholder", "CODE"),
+        dest="lang", default="fr",
+        help=_("@info command line option description",
+               "Language of translations (default: %(val)s).",
+               val="fr"))
+    opars.add_option(
+        "-n", "--messages",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="nmsgs", type="int", default=5000,
+        help=_("@info command line option description",
+               "Total number of messages (default: %(num)d).",
+               num=5000))
+    opars.add_option(
+        "-f", "--files",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="nfiles", type="int", default=4,
+        help=_("@info command line option description",
+               "Number of catalogs to distribute messages into "
+               "(default: %(num)d).",
+               num=4))
+    opars.add_option(
+        "-p", "--plural-ratio",
+        metavar=_("@info command line value placeholder", "RATIO"),
+        dest="plural_ratio", type="float", default=0.1,
+        help=_("@info command line option description",
+               "Fraction of messages with plural forms (default: %(val)s).",
+               val=0.1))
+    opars.add_option(
+        "-m", "--markup-density",
+        metavar=_("@info command line value placeholder", "RATIO"),
+        dest="markup_density", type="float", default=0.3,
+        help=_("@info command line option description",
+               "Fraction of messages containing markup (default: %(val)s).",
+               val=0.3))
+    opars.add_option(
+        "-S", "--seed",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="seed", type="int", default=1,
+        help=_("@info command line option description",
+               "Seed for random generation of the corpus "
+               "(default: %(num)d).",
+               num=1))
+
+
+def corpus_params (options):
+    """
+    Collect corpus parameters from parsed command line options.
+
+    @param options: options as added by L{add_corpus_options}
+    @type options: options object
+
+    @returns: keyword parameters for L{make_corpus}
+    @rtype: dict
+    """
+
+    return dict(lang=options.lang, nmsgs=options.nmsgs,
+                nfiles=options.nfiles, plural_ratio=options.plural_ratio,
+                markup_density=options.markup_density, seed=options.seed)
+
+
+def language_words (lang):
+    """
+    Get words for synthetic translations into the given language.
+
+    Words are taken from supplemental spelling dictionaries
+    of the language in Pology. If there are none, English words are used.
+
+    @param lang: language code
+    @type lang: string
+
+    @returns: sorted list of words
+    @rtype: [string*]
+    """
+
+    words = set()
+    dictpaths = glob.glob(os.path.join(datadir(), "lang", lang,
+                                       "spell", "*.aspell"))
+    for dictpath in dictpaths:
+        with codecs.open(dictpath, "r", "UTF-8") as f:
+            lines = f.read().split("\n")[1:] # first line is header
+        for line in lines:
+            word = line.strip()
+            if word and not word.startswith("#") and " " not in word:
+                words.add(word)
+
+    return sorted(words) or list(_source_words)
+
+
+def _make_text (rnd, words, nwords, markup, accel, fmtdir):
+
+    # Draw exactly one number per word, to keep the generator
+    # in the same state for word lists of different length.
+    tokens = [words[int(rnd.random() * len(words))] for i in range(nwords)]
+    if markup:
+        for i in range(rnd.randint(1, 2)):
+            p1 = rnd.randrange(len(tokens))
+            p2 = min(len(tokens), p1 + rnd.randint(1, 3))
+            otag, ctag = rnd.choice(_tags)
+            tokens[p1] = otag + tokens[p1]
+            tokens[p2 - 1] += ctag
+        if rnd.random() < 0.2:
+            tokens.insert(rnd.randrange(len(tokens) + 1),
+                          rnd.choice(_entities))
+    if accel:
+        p = rnd.randrange(len(tokens))
+        tokens[p] = "&" + tokens[p]
+    if fmtdir:
+        tokens.insert(rnd.randrange(len(tokens) + 1), "%1")
+    text = " ".join(tokens)
+    text = text[:1].upper() + text[1:]
+    if nwords > 4:
+        text += rnd.choice([".", ".", ".", ":", "?", "!"])
+    return text
+
+
+def _make_entry (rnd, words, index, keys, nplurals,
+                 plural_ratio, markup_density):
+
+    nwords = rnd.choice([1, 1, 2, 2, 3, 4, 6, 8, 12, 20, 40])
+    plural = rnd.random() < plural_ratio
+    markup = rnd.random() < markup_density and nwords > 1
+    accel = nwords <= 3 and rnd.random() < 0.3
+    fmtdir = plural or rnd.random() < 0.1
+
+    # Start each text from the same state of the generator,
+    # so that original and translation have similar structure.
+    state = rnd.getstate()
+    texts = []
+    for i in range(2 if plural else 1):
+        rnd.setstate(state)
+        texts.append(_make_text(rnd, _source_words, nwords, markup,
+                                accel, fmtdir))
+    trans = []
+    for i in range(nplurals if plural else 1):
+        rnd.setstate(state)
+        trans.append(_make_text(rnd, words, nwords, markup,
+                                accel, fmtdir))
+
+    msgctxt = None
+    if rnd.random() < 0.1:
+        msgctxt = "@action:inmenu"
+    if (msgctxt, texts[0]) in keys:
+        msgctxt = "bench-%d" % index
+    keys.add((msgctxt, texts[0]))
+
+    lines = []
+    lines.append("#: src/file%d.cpp:%d" % (index % 97, index))
+    if fmtdir:
+        lines.append("#, kde-format")
+    if msgctxt is not None:
+        lines.append("msgctxt \"%s\"" % escape_c(msgctxt))
+    lines.append("msgid \"%s\"" % escape_c(texts[0]))
+    if plural:
+        lines.append("msgid_plural \"%s\"" % escape_c(texts[1]))
+        for i, text in enumerate(trans):
+            lines.append("msgstr[%d] \"%s\"" % (i, escape_c(text)))
+    else:
+        lines.append("msgstr \"%s\"" % escape_c(trans[0]))
+
+    return "\n".join(lines) + "\n"
+
+
+def make_corpus (dirpath, lang="fr", nmsgs=5000, nfiles=4,
+                 plural_ratio=0.1, markup_density=0.3, seed=1):
+    """
+    Generate a synthetic corpus of PO files.
+
+    Messages are evenly distributed into catalogs named C{bench-N.po}
+    in the given directory, which is created if it does not exist.
+    Catalog headers state the language, plural forms,
+    accelerator marker and markup type.
+
+    @param dirpath: directory to write catalogs into
+    @type dirpath: string
+    @param lang: language of translations
+    @type lang: string
+    @param nmsgs: total number of messages
+    @type nmsgs: int
+    @param nfiles: number of catalogs
+    @type nfiles: int
+    @param plural_ratio: fraction of messages with plural forms
+    @type plural_ratio: float
+    @param markup_density: fraction of messages with markup
+    @type markup_density: float
+    @param seed: seed for random generation
+    @type seed: int
+
+    @returns: paths of generated catalogs
+    @rtype: [string*]
+    """
+
+    rnd = random.Random(seed)
+    words = language_words(lang)
+    plforms = _plural_forms.get(lang, _plural_forms_default)
+    nplurals = int(plforms.split(";")[0].split("=")[1])
+
+    mkdirpath(dirpath)
+    nfiles = max(1, min(nfiles, nmsgs))
+    paths = []
+    index = 0
+    for i in range(nfiles):
+        count = nmsgs // nfiles + (1 if i < nmsgs % nfiles else 0)
+        path = os.path.join(dirpath, "bench-%d.po" % (i + 1))
+        lines = [
+            "msgid \"\"",
+            "msgstr \"\"",
+            "\"Project-Id-Version: bench-%d\\n\"" % (i + 1),
+            "\"Language: %s\\n\"" % lang,
+            "\"MIME-Version: 1.0\\n\"",
+            "\"Content-Type: text/plain; charset=UTF-8\\n\"",
+            "\"Content-Transfer-Encoding: 8bit\\n\"",
+            "\"Plural-Forms: %s\\n\"" % plforms,
+            "\"X-Accelerator-Marker: &\\n\"",
+            "\"X-Text-Markup: kde4\\n\"",
+            "",
+        ]
+        entries = []
+        keys = set()
+        for j in range(count):
+            index += 1
+            entries.append(_make_entry(rnd, words, index, keys, nplurals,
+                                       plural_ratio, markup_density))
+        with codecs.open(path, "w", "UTF-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.write("\n".join(entries))
+        paths.append(path)
+
+    return paths
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,491 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Bounded in-process caches, optionally persistent between runs.
+
+Many processing steps in Pology are pure functions of some text
+(filtering messages, checking markup, spelling words...),
+and the same texts repeat a lot over catalogs and over repeated runs.
+A L{Cache} object keeps such results in memory up to a given number
+of entries, dropping the least recently used ones when full.
+
+If persistence is enabled by L{set_persistent}, each named cache
+is loaded from the user cache directory (see L{cachedir}) on first use,
+and written back on L{sync_caches}.
+Persistent caches are versioned, so that a cache written by an
+incompatible version of the producing code is simply ignored.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+
+from pology import _
+import pology.config
+from pology.fsops import mkdirpath
+from pology.report import warning
+
+
+def cachedir (subdir=None):
+    """
+    Get the directory in which Pology keeps persistent caches.
+
+    The directory is taken from the C{[global]/cache-dir} user configuration
+    field if set, otherwise it is C{pology} in C{$XDG_CACHE_HOME}
+    (which defaults to C{~/.cache}).
+    The directory is created if it does not exist.
+
+    @param subdir: subdirectory within the cache directory
+    @type subdir: string
+
+    @returns: absolute directory path
+    @rtype: string
+    """
+
+    cdir = pology.config.section("global").string("cache-dir")
+    if not cdir:
+        xdgdir = os.environ.get("XDG_CACHE_HOME")
+        if not xdgdir:
+            xdgdir = os.path.join(os.path.expanduser("~"), ".cache")
+        cdir = os.path.join(xdgdir, "pology")
+    if subdir:
+        cdir = os.path.join(cdir, subdir)
+    cdir = os.path.abspath(os.path.expanduser(cdir))
+    if not os.path.isdir(cdir):
+        mkdirpath(cdir)
+
+    return cdir
+
+
+def text_hash (*texts):
+    """
+    Compute a compact hash of a sequence of texts.
+
+    C{None} elements are distinguished from empty strings.
+    Elements may also be byte strings, e.g. other hashes.
+
+    @param texts: texts to hash
+    @type texts: strings, byte strings, or C{None}
+
+    @returns: binary digest
+    @rtype: bytes
+    """
+
+    h = hashlib.md5()
+    for text in texts:
+        if text is None:
+            h.update(b"\x00")
+        elif isinstance(text, bytes):
+            h.update(text)
+        else:
+            h.update(text.encode("utf8", "surrogatepass"))
+        h.update(b"\x04")
+
+    return h.digest()
+
+
+def file_hash (paths):
+    """
+    Compute a compact hash of contents of files.
+
+    Paths are hashed in the order given, and a missing file
+    is hashed as if it were empty.
+
+    @param paths: paths of files to hash
+    @type paths: sequence of strings
+
+    @returns: hexadecimal digest
+    @rtype: string
+    """
+
+    h = hashlib.md5()
+    for path in paths:
+        h.update(path.encode("utf8", "surrogatepass") + b"\x04")
+        if os.path.isfile(path):
+            with open(path, "rb") as fh:
+                h.update(fh.read())
+        h.update(b"\x05")
+
+    return h.hexdigest()
+
+
+_persistent = False
+_caches = {}
+
+def set_persistent (enable=True):
+    """
+    Set whether named caches are to be kept on disk between runs.
+
+    This should be called before any cache is used.
+    At the end of processing, L{sync_caches} should be called
+    to write out the caches.
+
+    @param enable: whether to enable persistence
+    @type enable: bool
+    """
+
+    global _persistent
+    _persistent = enable
+
+
+def is_persistent ():
+    """
+    Check whether named caches are to be kept on disk between runs.
+
+    Code which keeps own caches in other ways should use this
+    to decide whether to keep them.
+
+    @rtype: bool
+    """
+
+    return _persistent
+
+
+def sync_caches ():
+    """
+    Write out all modified persistent caches.
+
+    Does nothing if persistence was not enabled by L{set_persistent}.
+    """
+
+    for cache in list(_caches.values()):
+        cache.sync()
+
+
+_tracking = False
+
+def track_updates ():
+    """
+    Start tracking entries set in persistent named caches.
+
+    This is used in worker processes forked from the main process
+    (see L{pology.parallel}), for collecting the entries
+    which the worker added by L{collect_updates}, so that they can be
+    merged by L{merge_updates} into caches of the main process,
+    which are synced at the end.
+    """
+
+    global _tracking
+    _tracking = True
+    for cache in list(_caches.values()):
+        cache._updates.clear()
+
+
+def collect_updates ():
+    """
+    Collect entries set in persistent named caches since the last collection.
+
+    Nothing is collected unless persistence was enabled
+    by L{set_persistent} and tracking started by L{track_updates}.
+
+    @returns: updates, as passed to L{merge_updates}
+    @rtype: dict
+    """
+
+    updates = {}
+    if not _persistent or not _tracking:
+        return updates
+
+    for name, cache in list(_caches.items()):
+        if not cache._persistent or not cache._updates:
+            continue
+        dumpf = cache._dumpf
+        items = []
+        for key in cache._updates:
+            value = cache._data.get(key, _no_value)
+            if value is not _no_value:
+                if dumpf:
+                    value = dumpf(value)
+                items.append((key, value))
+        cache._updates.clear()
+        updates[name] = (cache.size, cache._version, items)
+
+    return updates
+
+
+def merge_updates (updates):
+    """
+    Merge entries collected by L{collect_updates} into named caches.
+
+    If a cache does not exist yet, it is created, to be written out
+    by L{sync_caches} even if it is not used by the main process.
+
+    @param updates: updates from L{collect_updates}
+    @type updates: dict
+    """
+
+    for name, (size, version, items) in list(updates.items()):
+        cache = _caches.get(name)
+        if cache is None:
+            # Values are kept as dumped, until the cache is fetched
+            # by L{named_cache} with conversion functions.
+            cache = Cache(name, size, version)
+            cache._raw = True
+        elif cache._version != version:
+            continue
+        loadf = cache._loadf
+        for key, value in items:
+            if loadf:
+                value = loadf(value)
+            cache.set(key, value)
+
+
+def cache_stats ():
+    """
+    Report usage statistics of all named caches created so far.
+
+    @returns: statistics by cache name, as tuples of
+        (number of entries, maximum size, hits, misses)
+    @rtype: {string: (int, int, int, int)}
+    """
+
+    stats = {}
+    for name, cache in list(_caches.items()):
+        stats[name] = (len(cache), cache.size, cache.hits, cache.misses)
+
+    return stats
+
+
+_cache_file_dver = b"0001"
+
+class Cache (object):
+    """
+    Bounded mapping of keys to computed values.
+
+    Lookups are counted, so that hit rates can be reported
+    and cache sizes tuned (see L{cache_stats}).
+
+    If the cache is named, it is registered globally, so that
+    the same cache object can be fetched by name (see L{named_cache})
+    and that it can be kept on disk between runs.
+    Named caches whose keys are meaningful only within the current
+    process (e.g. contain object identities) can be excluded
+    from persistence, while still being reported in statistics.
+    For persistence, both keys and values must be picklable,
+    or converted into picklable objects by C{dumpf} and C{loadf}.
+
+    @ivar size: maximum number of entries
+    @type size: int
+    @ivar hits: number of successful lookups
+    @type hits: int
+    @ivar misses: number of failed lookups
+    @type misses: int
+    """
+
+    def __init__ (self, name=None, size=10000, version="",
+                  dumpf=None, loadf=None, persistent=True):
+        """
+        Constructor.
+
+        @param name: name of the cache, used for the file name
+            when persistent
+        @type name: string or C{None}
+        @param size: maximum number of entries (0 for unbounded)
+        @type size: int
+        @param version: version of the producing code;
+            persistent caches of other versions are ignored
+        @type version: string
+        @param dumpf: function to convert a value for writing to disk
+        @type dumpf: (value) -> object
+        @param loadf: function to convert a value read from disk
+        @type loadf: (object) -> value
+        @param persistent: whether the cache may be kept on disk
+        @type persistent: bool
+        """
+
+        self.name = name
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+        self._version = version
+        self._dumpf = dumpf
+        self._loadf = loadf
+        self._persistent = persistent
+        self._data = OrderedDict()
+        self._loaded = False
+        self._modified = False
+        self._updates = OrderedDict()
+        self._raw = False
+
+        if name is not None:
+            _caches[name] = self
+
+
+    def _load (self):
+
+        self._loaded = True
+        if not _persistent or self.name is None or not self._persistent:
+            return
+
+        path = self._path()
+        try:
+            with open(path, "rb") as fh:
+                if fh.read(len(_cache_file_dver)) != _cache_file_dver:
+                    return
+                version, items = pickle.load(fh)
+        except (OSError, EOFError, pickle.PickleError, ValueError):
+            return
+        if version != self._version:
+            return
+
+        loadf = self._loadf
+        for key, value in items:
+            if loadf:
+                value = loadf(value)
+            self._data[key] = value
+        self._trim()
+
+
+    def _path (self):
+
+        return os.path.join(cachedir(), self.name + ".cache")
+
+
+    def _trim (self):
+
+        if self.size > 0:
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+    def get (self, key, default=None):
+        """
+        Get the value for the key, if cached.
+
+        @param key: the key
+        @param default: value to return if the key is not cached
+
+        @returns: the cached value or C{default}
+        """
+
+        if not self._loaded:
+            self._load()
+
+        value = self._data.get(key, _no_value)
+        if value is _no_value:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+
+        return value
+
+
+    def set (self, key, value):
+        """
+        Cache a value for the key.
+
+        If the cache is full, the least recently used entry is dropped.
+
+        @param key: the key
+        @param value: the value
+        """
+
+        if not self._loaded:
+            self._load()
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if _tracking:
+            self._updates[key] = True
+        self._trim()
+        self._modified = True
+
+
+    def clear (self):
+        """
+        Remove all entries from the cache.
+        """
+
+        self._data.clear()
+        self._loaded = True
+        self._modified = True
+
+
+    def sync (self):
+        """
+        Write the cache to disk if persistent and modified.
+        """
+
+        if (   not _persistent or self.name is None or not self._persistent
+            or not self._modified
+        ):
+            return
+
+        dumpf = self._dumpf
+        items = []
+        for key, value in self._data.items():
+            if dumpf:
+                value = dumpf(value)
+            items.append((key, value))
+
+        path = self._path()
+        tmppath = "%s~%d" % (path, os.getpid())
+        try:
+            with open(tmppath, "wb") as fh:
+                fh.write(_cache_file_dver)
+                pickle.dump((self._version, items), fh, 4)
+            os.replace(tmppath, path)
+        except (OSError, pickle.PickleError) as e:
+            warning(_("@info",
+                      "Cannot write cache file '%(file)s':\n%(msg)s",
+                      file=path, msg=e))
+            if os.path.isfile(tmppath):
+                os.unlink(tmppath)
+            return
+        self._modified = False
+
+
+    def __len__ (self):
+
+        return len(self._data)
+
+
+    def __contains__ (self, key):
+
+        if not self._loaded:
+            self._load()
+
+        return key in self._data
+
+
+_no_value = object()
+
+
+def named_cache (name, size=10000, version="", dumpf=None, loadf=None,
+                 persistent=True):
+    """
+    Fetch the named cache, creating it if it does not exist yet.
+
+    All code in the process asking for the cache of the same name
+    gets the same cache object.
+    Parameters other than the name are used only when the cache is created.
+
+    See L{Cache} for description of parameters.
+
+    @returns: the cache
+    @rtype: L{Cache}
+    """
+
+    cache = _caches.get(name)
+    if cache is None:
+        cache = Cache(name, size, version, dumpf, loadf, persistent)
+    elif cache._raw:
+        # Created when merging updates from worker processes,
+        # before the conversion functions were known.
+        if not cache._loaded:
+            cache._load()
+        if loadf:
+            for key, value in list(cache._data.items()):
+                cache._data[key] = loadf(value)
+        cache._dumpf = dumpf
+        cache._loadf = loadf
+        cache._persistent = persistent
+        cache._raw = False
+
+    return cache
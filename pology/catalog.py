@@ -1092,6 +1092,52 @@ class Catalog (Monitored):
         self.__dict__["#"]["*"] += 1 # indicate sequence change
 
 
+    def remove_more (self, idents):
+        """
+        Remove more than one message from the catalog.
+
+        Like L{remove}, except that several messages are removed in one call.
+        Positions are given relative to state before the call.
+
+        Runtime complexity O(n), for all removed messages together.
+
+        @param idents: position indices or other messages
+        @type idents: [int or L{Message_base}, ...]
+
+        @returns: C{None}
+        """
+
+        self._assert_headonly()
+
+        # Determine positions by given idents.
+        ips = set()
+        for ident in idents:
+            if isinstance(ident, int):
+                self._messages[ident] # signal if out of range
+                if ident < 0:
+                    ident += len(self._messages)
+                ips.add(ident)
+            else:
+                ips.add(self._msgpos[ident.key])
+        if not ips:
+            return
+
+        # Remove from messages and key-position links.
+        kept = []
+        for i, msg in enumerate(self._messages):
+            if i in ips:
+                self._msgpos.pop(msg.key)
+            else:
+                kept.append(msg)
+        self._messages[:] = kept
+
+        # Update key-position links from the first removed index.
+        for i in range(min(ips), len(self._messages)):
+            ckey = self._messages[i].key
+            self._msgpos[ckey] = i
+        self.__dict__["#"]["*"] += 1 # indicate sequence change
+
+
     def remove_on_sync (self, ident):
         """
         Remove a message from the catalog, by position or another message,
@@ -1208,6 +1254,10 @@ class Catalog (Monitored):
 
         if not self._wrap_determined:
             self.wrapping()
+        # Messages with no-wrap flag are not wrapped on column count,
+        # as by Gettext tools.
+        wrapkw = self._wrapkw if self._wrapkw is not None else ["basic"]
+        nowrapf = select_field_wrapper(set(wrapkw).difference(["basic"]))
 
         flines = []
         i = 0
@@ -1226,8 +1276,10 @@ class Catalog (Monitored):
             else:
                 # Normal message, append formatted lines to rest.
                 committed = msg.get("_committed", False)
-                flines.extend(msg.to_lines(self._wrapf,
-                                           force or not committed))
+                wrapf = self._wrapf
+                if i > 0 and "no-wrap" in msg.flag:
+                    wrapf = nowrapf
+                flines.extend(msg.to_lines(wrapf, force or not committed))
                 # Message should finish with one empty line.
                 if flines[-1] != "\n":
                     flines.append("\n")
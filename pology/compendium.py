@@ -0,0 +1,502 @@
+# -*- coding: UTF-8 -*-
+
+"""
+On-disk indexes of compendium catalogs.
+
+A compendium is a catalog collecting translations from many other
+catalogs, and can grow quite large (hundreds of megabytes).
+Parsing it whenever it is consulted, e.g. for every catalog merged,
+would then take much more time than the actual work.
+Instead, a compendium can be indexed once by L{build_compendium_index},
+and the index queried through L{CompendiumIndex}.
+
+The index file is memory-mapped rather than read, so that opening it
+is cheap regardless of its size, only the parts actually looked up
+are brought into memory, and processes working on the same index
+share its pages.
+It contains a map of message keys to translations, for exact matching,
+and a map of character n-grams of original texts to messages containing
+them, for selecting candidates for fuzzy matching.
+
+Indexes are normally kept in the user cache directory (see
+L{cachedir<cache.cachedir>}), and L{compendium_index} takes care
+of building them when missing or when the compendium has changed.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import heapq
+import mmap
+import os
+import pickle
+import struct
+
+from pology import PologyError, _
+from pology.cache import cachedir, text_hash
+from pology.catalog import Catalog
+from pology.header import Header
+from pology.message import MessageUnsafe
+
+
+def ngrams (text, n=3):
+    """
+    Get character n-grams of the text.
+
+    The text is padded at both ends, so that even short texts
+    have some n-grams.
+
+    @param text: the text
+    @type text: string
+    @param n: length of n-grams
+    @type n: int
+
+    @returns: n-grams
+    @rtype: set of strings
+    """
+
+    pad = "\0" * (n - 1)
+    text = pad + text + pad
+    return set(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+class CompendiumIndex (object):
+    """
+    Memory-mapped index of a compendium.
+
+    Only non-obsolete messages of the compendium are indexed.
+    Of messages with equal keys, the first translated message is kept,
+    or the first message if none is translated.
+
+    The index behaves like a read-only catalog with respect to
+    checking whether a message is contained in it (C{msg in index})
+    and fetching the message by key (C{index[msg]}).
+    Each fetch creates a new message, so modifying it does not
+    affect the index.
+
+    @ivar filename: path of the indexed compendium
+    @type filename: string
+    @ivar fingerprint: fingerprint of the compendium when it was indexed
+        (see L{compendium_fingerprint})
+    @type fingerprint: tuple
+    @ivar header: header of the indexed compendium
+    @type header: L{Header<header.Header>}
+    """
+
+    def __init__ (self, idxpath):
+        """
+        Constructor.
+
+        @param idxpath: path of the index file
+        @type idxpath: string
+        """
+
+        try:
+            with open(idxpath, "rb") as fh:
+                self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise PologyError(
+                _("@info",
+                  "Cannot open compendium index '%(file)s':\n%(msg)s",
+                  file=idxpath, msg=e))
+        self._views = []
+        try:
+            head = struct.unpack_from(_index_head_fmt, self._mmap)
+            if head[0] != _index_magic or head[1] != _index_dver:
+                raise ValueError
+            offsets = head[2:]
+            view = self._view(memoryview(self._mmap))
+            sections = []
+            for k, fmt in enumerate(_index_section_fmts):
+                section = self._view(view[offsets[k]:offsets[k + 1]])
+                if fmt:
+                    section = self._view(section.cast(fmt))
+                sections.append(section)
+            meta = pickle.loads(sections[0])
+        except (struct.error, ValueError, TypeError, pickle.PickleError,
+                EOFError):
+            self.close()
+            raise PologyError(
+                _("@info",
+                  "File '%(file)s' is not a compendium index "
+                  "of supported version.",
+                  file=idxpath))
+        (self._entry_offs, self._lens, self._key_hashes, self._key_ids,
+         self._gram_hashes, self._gram_offs, self._postings,
+         self._data) = sections[1:]
+
+        self.fingerprint = meta["fingerprint"]
+        self.filename = meta["filename"]
+        self.header = Header(MessageUnsafe(meta["header"]))
+        self._ngram_len = meta["ngram_len"]
+
+
+    def __len__ (self):
+
+        return len(self._lens)
+
+
+    def message (self, eid):
+        """
+        Get the message by its entry number in the index.
+
+        Entry numbers are as reported by L{candidates}.
+
+        @param eid: entry number
+        @type eid: int
+
+        @returns: the message
+        @rtype: L{MessageUnsafe<message.MessageUnsafe>}
+        """
+
+        entry = self._data[self._entry_offs[eid]:self._entry_offs[eid + 1]]
+        return MessageUnsafe(pickle.loads(entry))
+
+
+    def get (self, key, default=None):
+        """
+        Get the message by key.
+
+        @param key: the key of the message (see
+            L{Message_base<message.Message_base>})
+        @type key: string
+        @param default: value to return if there is no such message
+
+        @returns: the message or C{default}
+        @rtype: L{MessageUnsafe<message.MessageUnsafe>}
+        """
+
+        hashes = self._key_hashes
+        khash = _hash64(key)
+        pos = bisect_left(hashes, khash)
+        while pos < len(hashes) and hashes[pos] == khash:
+            msg = self.message(self._key_ids[pos])
+            if msg.key == key:
+                return msg
+            pos += 1
+
+        return default
+
+
+    def __contains__ (self, msg):
+
+        return self.get(msg.key) is not None
+
+
+    def __getitem__ (self, msg):
+
+        imsg = self.get(msg.key)
+        if imsg is None:
+            raise KeyError(msg.key)
+        return imsg
+
+
+    def candidates (self, text, minsim=0.0, limit=None):
+        """
+        Select candidate messages for fuzzy matching of the text.
+
+        Candidates are translated messages whose original texts share
+        character n-grams with the given text (see L{ngrams}),
+        ordered by the number of shared n-grams.
+        Messages whose original texts are so much shorter or longer
+        that their similarity to the text could not exceed
+        the given minimum, are not selected.
+
+        @param text: the text to match
+        @type text: string
+        @param minsim: minimal similarity of texts in range 0.0-1.0
+        @type minsim: float
+        @param limit: maximum number of candidates to select
+        @type limit: int or C{None}
+
+        @returns: entry numbers of candidates (see L{message})
+            and numbers of shared n-grams
+        @rtype: [(int, int)*]
+        """
+
+        counts = Counter()
+        hashes = self._gram_hashes
+        offs = self._gram_offs
+        for gram in ngrams(text, self._ngram_len):
+            ghash = _hash64(gram)
+            pos = bisect_left(hashes, ghash)
+            if pos < len(hashes) and hashes[pos] == ghash:
+                counts.update(self._postings[offs[pos]:offs[pos + 1]])
+
+        # Similarity cannot exceed 2 * min(lenc, lent) / (lenc + lent).
+        lens = self._lens
+        lent = len(text)
+        cands = [(-count, eid) for eid, count in counts.items()
+                 if 2.0 * min(lens[eid], lent) > minsim * (lens[eid] + lent)]
+        if limit is not None:
+            cands = heapq.nsmallest(limit, cands)
+        else:
+            cands.sort()
+
+        return [(eid, -count) for count, eid in cands]
+
+
+    def close (self):
+        """
+        Close the index.
+
+        The index must not be used afterwards.
+        """
+
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+
+    def _view (self, view):
+
+        self._views.append(view)
+        return view
+
+
+_index_magic = b"PLGYCIDX"
+_index_dver = 1
+
+# Index file starts with the magic, the format version,
+# and offsets of sections (plus the end of the last section).
+# Sections are: pickled meta data, offsets of entries in the data section,
+# lengths of msgids, sorted key hashes, entry numbers by key hashes,
+# sorted n-gram hashes, offsets of posting lists by n-gram hashes,
+# posting lists (entry numbers), data (pickled entries).
+# Sections are aligned to 8 bytes, for array access.
+_index_section_fmts = ("", "Q", "I", "Q", "I", "Q", "Q", "I", "")
+_index_head_fmt = "<8sQ%dQ" % (len(_index_section_fmts) + 1)
+
+# Message fields stored in the index.
+_index_msg_fields = (
+    "msgctxt", "msgid", "msgid_plural", "msgstr", "flag",
+    "msgctxt_previous", "msgid_previous", "msgid_plural_previous",
+    "manual_comment",
+)
+
+
+def _hash64 (text):
+
+    return int.from_bytes(text_hash(text)[:8], "little")
+
+
+def _is_blank (msg):
+
+    return len(msg.msgstr) == 1 and not msg.msgstr[0]
+
+
+def compendium_fingerprint (cmppath):
+    """
+    Get the fingerprint of a compendium file.
+
+    The fingerprint changes whenever the file is modified,
+    and it is recorded in the index, to detect stale indexes.
+
+    @param cmppath: path of the compendium
+    @type cmppath: string
+
+    @rtype: tuple
+    """
+
+    st = os.stat(cmppath)
+    return (os.path.abspath(cmppath), st.st_size, st.st_mtime_ns)
+
+
+def build_compendium_index (cmppath, idxpath=None):
+    """
+    Build the index of a compendium.
+
+    The index is written to a temporary file first, and then moved
+    into place, so that other processes never see a partially written index.
+
+    @param cmppath: path of the compendium
+    @type cmppath: string
+    @param idxpath: path of the index file; if not given,
+        the standard location in the user cache directory is used
+    @type idxpath: string
+
+    @returns: path of the index file
+    @rtype: string
+    """
+
+    if not os.path.isfile(cmppath):
+        raise PologyError(
+            _("@info",
+              "Compendium does not exist at '%(path)s'.",
+              path=cmppath))
+    if idxpath is None:
+        idxpath = compendium_index_path(cmppath)
+    fingerprint = compendium_fingerprint(cmppath)
+    cat = Catalog(cmppath, monitored=False)
+
+    # Select messages to index, one by key.
+    msgs = []
+    inds = {}
+    for msg in cat:
+        if msg.obsolete:
+            continue
+        i = inds.get(msg.key)
+        if i is None:
+            inds[msg.key] = len(msgs)
+            msgs.append(msg)
+        elif _is_blank(msgs[i]) and not _is_blank(msg):
+            msgs[i] = msg
+
+    # Serialize messages.
+    entry_offs = array("Q", [0])
+    lens = array("I")
+    chunks = []
+    size = 0
+    for msg in msgs:
+        entry = dict((x, msg.get(x)) for x in _index_msg_fields)
+        entry["msgstr"] = list(entry["msgstr"])
+        entry["flag"] = list(entry["flag"])
+        entry["manual_comment"] = list(entry["manual_comment"])
+        chunk = pickle.dumps(entry, 4)
+        chunks.append(chunk)
+        size += len(chunk)
+        entry_offs.append(size)
+        lens.append(len(msg.msgid))
+
+    # Map key hashes to messages.
+    keys = sorted((_hash64(x.key), i) for i, x in enumerate(msgs))
+    key_hashes = array("Q", [x[0] for x in keys])
+    key_ids = array("I", [x[1] for x in keys])
+
+    # Map n-gram hashes to translated messages containing them.
+    gram_lists = {}
+    for i, msg in enumerate(msgs):
+        if _is_blank(msg):
+            continue
+        for gram in ngrams(msg.msgid):
+            lst = gram_lists.get(gram)
+            if lst is None:
+                lst = gram_lists[gram] = array("I")
+            lst.append(i)
+    grams = sorted((_hash64(x), x) for x in gram_lists)
+    gram_hashes = array("Q", [x[0] for x in grams])
+    gram_offs = array("Q", [0])
+    postings = array("I")
+    for ghash, gram in grams:
+        postings.extend(gram_lists[gram])
+        gram_offs.append(len(postings))
+    gram_lists = None
+
+    hmsg = cat.header.to_msg()
+    meta = dict(fingerprint=fingerprint, filename=cmppath, ngram_len=3,
+                header=dict(msgid="", msgstr=[hmsg.msgstr[0]],
+                            manual_comment=list(hmsg.manual_comment)))
+    sections = [pickle.dumps(meta, 4), entry_offs.tobytes(), lens.tobytes(),
+                key_hashes.tobytes(), key_ids.tobytes(),
+                gram_hashes.tobytes(), gram_offs.tobytes(),
+                postings.tobytes(), None]
+
+    tmppath = "%s~%d" % (idxpath, os.getpid())
+    try:
+        with open(tmppath, "wb") as fh:
+            offsets = []
+            pos = struct.calcsize(_index_head_fmt)
+            fh.write(b"\0" * pos)
+            for section in sections:
+                pad = -pos % 8
+                fh.write(b"\0" * pad)
+                pos += pad
+                offsets.append(pos)
+                if section is not None:
+                    fh.write(section)
+                    pos += len(section)
+                else:
+                    for chunk in chunks:
+                        fh.write(chunk)
+                    pos += size
+            offsets.append(pos)
+            fh.seek(0)
+            fh.write(struct.pack(_index_head_fmt, _index_magic, _index_dver,
+                                 *offsets))
+        os.replace(tmppath, idxpath)
+    except OSError as e:
+        if os.path.isfile(tmppath):
+            os.unlink(tmppath)
+        raise PologyError(
+            _("@info",
+              "Cannot write compendium index '%(file)s':\n%(msg)s",
+              file=idxpath, msg=e))
+
+    return idxpath
+
+
+def compendium_index_path (cmppath):
+    """
+    Get the standard path of the index of a compendium.
+
+    Indexes are kept in the C{compendium} subdirectory of the user
+    cache directory, named by a hash of the absolute compendium path.
+
+    @param cmppath: path of the compendium
+    @type cmppath: string
+
+    @returns: path of the index file
+    @rtype: string
+    """
+
+    name = text_hash(os.path.abspath(cmppath)).hex() + ".idx"
+    return os.path.join(cachedir("compendium"), name)
+
+
+def compendium_index (cmppath):
+    """
+    Get the index of a compendium, building it if necessary.
+
+    The index is taken from the standard location (see
+    L{compendium_index_path}), and built anew if it does not exist,
+    if it is of an unsupported version, or if the compendium
+    has been modified since.
+    Once opened, the index is reused for the rest of the process
+    (and in processes forked afterwards), as long as the compendium
+    does not change; when it changes, the old index is closed.
+
+    @param cmppath: path of the compendium
+    @type cmppath: string
+
+    @returns: the index
+    @rtype: L{CompendiumIndex}
+    """
+
+    if not os.path.isfile(cmppath):
+        raise PologyError(
+            _("@info",
+              "Compendium does not exist at '%(path)s'.",
+              path=cmppath))
+    fingerprint = compendium_fingerprint(cmppath)
+    cmpidx = _indexes.get(fingerprint[0])
+    if cmpidx is not None:
+        if cmpidx.fingerprint == fingerprint:
+            return cmpidx
+        # The compendium has changed, the old index is of no further use.
+        del _indexes[fingerprint[0]]
+        cmpidx.close()
+
+    idxpath = compendium_index_path(cmppath)
+    cmpidx = None
+    if os.path.isfile(idxpath):
+        try:
+            cmpidx = CompendiumIndex(idxpath)
+        except PologyError:
+            pass
+        if cmpidx is not None and cmpidx.fingerprint != fingerprint:
+            cmpidx.close()
+            cmpidx = None
+    if cmpidx is None:
+        build_compendium_index(cmppath, idxpath)
+        cmpidx = CompendiumIndex(idxpath)
+    _indexes[fingerprint[0]] = cmpidx
+
+    return cmpidx
+
+
+# Opened indexes by absolute compendium path.
+_indexes = {}
@@ -12,9 +12,11 @@ import random
 import re
 
 from pology import PologyError, _, n_
+from pology.cache import named_cache, text_hash
+import pology.config
 from pology.colors import ColorString, cjoin
 from pology.message import MessageUnsafe
-from pology.report import error
+from pology.report import error, format_item_list
 from pology.split import split_text
 
 
@@ -64,7 +66,173 @@ class _Sequence_diff_wrapper:
         return self._robj == other._robj
 
 
-def tdiff (seq_old, seq_new, reductf=None, diffr=False):
+_diff_engines = ("difflib", "lcs")
+_diff_engine = "difflib"
+
+def set_diff_engine (engine):
+    """
+    Set the engine used to compute differences.
+
+    Differences in this module (L{tdiff}, L{itdiff}, L{word_diff},
+    L{msg_diff}, etc.) can be computed by one of the following engines:
+      - C{"difflib"}: the default, C{SequenceMatcher} from the standard
+        C{difflib} module, which builds the difference around longest
+        contiguous matching blocks
+      - C{"lcs"}: the longest common subsequence, computed with
+        bit-parallel operations on integers; it is much faster on long
+        sequences (e.g. character differences of long paragraphs),
+        and the difference is minimal, but changes may be grouped
+        differently than by C{"difflib"}
+
+    The initial engine is taken from the C{[global]/diff-engine}
+    configuration field, if set.
+
+    @param engine: name of the engine
+    @type engine: string
+
+    @returns: name of the previously set engine
+    @rtype: string
+    """
+
+    global _diff_engine
+
+    _check_diff_engine(engine)
+    prev_engine = _diff_engine
+    _diff_engine = engine
+
+    return prev_engine
+
+
+def _check_diff_engine (engine):
+
+    if engine not in _diff_engines:
+        raise PologyError(
+            _("@info",
+              "Unknown diff engine '%(name)s', "
+              "expected one of: %(namelist)s.",
+              name=engine, namelist=format_item_list(_diff_engines)))
+
+
+def _init_diff_engine ():
+
+    engine = pology.config.section("global").string("diff-engine")
+    if engine:
+        if engine not in _diff_engines:
+            error(_("@info",
+                    "User configuration: unknown diff engine '%(name)s' "
+                    "in field '%(field)s' in section '%(sec)s', "
+                    "expected one of: %(namelist)s.",
+                    name=engine, field="diff-engine", sec="global",
+                    namelist=format_item_list(_diff_engines)))
+        set_diff_engine(engine)
+
+_init_diff_engine()
+
+
+def _diff_opcodes (seq_old, seq_new, engine=None, ratio_only=False):
+    # Returns operation codes as those of SequenceMatcher,
+    # and the similarity ratio of the two sequences.
+
+    if engine is None:
+        engine = _diff_engine
+    if engine == "lcs":
+        return _lcs_opcodes(seq_old, seq_new, ratio_only)
+    _check_diff_engine(engine)
+
+    seqmatch = SequenceMatcher(None, seq_old, seq_new)
+    if ratio_only:
+        return None, seqmatch.ratio()
+    opcodes = seqmatch.get_opcodes()
+    return opcodes, seqmatch.ratio()
+
+
+def _lcs_opcodes (seq_old, seq_new, ratio_only=False):
+
+    # Match common prefix and suffix directly.
+    len_old, len_new = len(seq_old), len(seq_new)
+    lenmax = min(len_old, len_new)
+    lpre = 0
+    while lpre < lenmax and seq_old[lpre] == seq_new[lpre]:
+        lpre += 1
+    lenmax -= lpre
+    lsuf = 0
+    while (    lsuf < lenmax
+           and seq_old[len_old - lsuf - 1] == seq_new[len_new - lsuf - 1]):
+        lsuf += 1
+    els_old = seq_old[lpre:len_old - lsuf]
+    els_new = seq_new[lpre:len_new - lsuf]
+
+    # Positions of elements in the old sequence, as bits.
+    posbits = {}
+    for i, el in enumerate(els_old):
+        posbits[el] = posbits.get(el, 0) | (1 << i)
+
+    # Bit i of row j is 0 when the longest common subsequence of
+    # first i + 1 old and first j new elements is longer than that of
+    # first i old and first j new elements [Hyyro, "Bit-parallel
+    # LCS-length computation revisited", 2004].
+    full = (1 << len(els_old)) - 1
+    row = full
+    rows = [row]
+    for el in els_new:
+        mrow = row & posbits.get(el, 0)
+        row = ((row + mrow) | (row - mrow)) & full
+        if not ratio_only:
+            rows.append(row)
+    nmatch = lpre + lsuf + len(els_old) - bin(row).count("1")
+    lentot = len_old + len_new
+    ratio = 2.0 * nmatch / lentot if lentot else 1.0
+    if ratio_only:
+        return None, ratio
+
+    # Trace back one longest common subsequence,
+    # collecting blocks of matching elements in reverse.
+    rblocks = []
+    if lsuf:
+        rblocks.append([len_old - lsuf, len_new - lsuf, lsuf])
+    i, j = len(els_old), len(els_new)
+    while i > 0 and j > 0:
+        if els_old[i - 1] == els_new[j - 1]:
+            i -= 1
+            j -= 1
+            i1, j1 = lpre + i, lpre + j
+            if (    rblocks and rblocks[-1][0] == i1 + 1
+                and rblocks[-1][1] == j1 + 1):
+                rblocks[-1][0] = i1
+                rblocks[-1][1] = j1
+                rblocks[-1][2] += 1
+            else:
+                rblocks.append([i1, j1, 1])
+        elif (rows[j] >> (i - 1)) & 1:
+            i -= 1
+        else:
+            j -= 1
+    if lpre:
+        if rblocks and rblocks[-1][:2] == [lpre, lpre]:
+            rblocks[-1] = [0, 0, rblocks[-1][2] + lpre]
+        else:
+            rblocks.append([0, 0, lpre])
+
+    # Convert matching blocks to operation codes.
+    rblocks.reverse()
+    rblocks.append([len_old, len_new, 0])
+    opcodes = []
+    i = j = 0
+    for i1, j1, n in rblocks:
+        if i < i1 and j < j1:
+            opcodes.append(("replace", i, i1, j, j1))
+        elif i < i1:
+            opcodes.append(("delete", i, i1, j, j1))
+        elif j < j1:
+            opcodes.append(("insert", i, i1, j, j1))
+        if n:
+            opcodes.append(("equal", i1, i1 + n, j1, j1 + n))
+        i, j = i1 + n, j1 + n
+
+    return opcodes, ratio
+
+
+def tdiff (seq_old, seq_new, reductf=None, diffr=False, engine=None):
     """
     Create tagged difference of two sequences.
 
@@ -97,6 +265,9 @@ def tdiff (seq_old, seq_new, reductf=None, diffr=False):
     Parameter C{reductf} can be used to specify a reduction function, which
     will be called on each element to produce its diffing representative.
 
+    The difference is computed by the engine set by L{set_diff_engine},
+    unless another is given by the C{engine} parameter.
+
     @param seq_old: sequence to diff from
     @type seq_old: sequence with hashable elements
     @param seq_new: sequence to diff to
@@ -105,6 +276,8 @@ def tdiff (seq_old, seq_new, reductf=None, diffr=False):
     @type reductf: (sequence element) -> diffing representative
     @param diffr: whether to report difference ratio
     @type diffr: bool
+    @param engine: name of the diff engine
+    @type engine: string
 
     @returns: difference list and possibly difference ratio
     @rtype: [(string, element)...] or ([(string, element)...], float)
@@ -115,10 +288,9 @@ def tdiff (seq_old, seq_new, reductf=None, diffr=False):
         seq_new = [_Sequence_diff_wrapper(x, reductf) for x in seq_new]
 
     dlist = []
-    seqmatch = SequenceMatcher(None, seq_old, seq_new)
-    opcodes = seqmatch.get_opcodes()
+    opcodes, ratio = _diff_opcodes(seq_old, seq_new, engine)
     if diffr:
-        dr = 1.0 - seqmatch.ratio()
+        dr = 1.0 - ratio
     for opcode, i1, i2, j1, j2 in opcodes:
         if opcode == "equal":
             dlist.extend([(_equ_tag, el) for el in seq_old[i1:i2]])
@@ -141,7 +313,64 @@ def tdiff (seq_old, seq_new, reductf=None, diffr=False):
     return diffr and (dlist, dr) or dlist
 
 
-def itdiff (seq_old, seq_new, reductf=None, cutoff=0.6, diffr=False):
+def tmatch_many (pairs, engine=None):
+    """
+    Count common elements and compute difference ratios of many pairs
+    of sequences.
+
+    For each pair, gives the number of elements which L{tdiff} would tag
+    as belonging to both sequences, and the difference ratio as reported
+    by L{tdiff}, but without constructing difference lists.
+    Equal sequences are not diffed, and with the default engine,
+    the matcher is set to each distinct new sequence only once.
+    This makes it much faster than L{tdiff} on each pair when
+    many pairs are to be compared (e.g. all messages between
+    two versions of a catalog, where most messages are unchanged).
+    Sequences themselves must be hashable (e.g. strings or tuples).
+
+    @param pairs: old and new sequences
+    @type pairs: sequence of (sequence, sequence)
+    @param engine: name of the diff engine
+    @type engine: string
+
+    @returns: number of common elements and difference ratio for each pair
+    @rtype: [(int, float)*]
+    """
+
+    if engine is None:
+        engine = _diff_engine
+    _check_diff_engine(engine)
+
+    res = [None] * len(pairs)
+    # Indices of pairs to match by the new sequence.
+    todo = {}
+    for i, (seq_old, seq_new) in enumerate(pairs):
+        if seq_old == seq_new:
+            res[i] = (len(seq_new), 0.0)
+        elif not seq_old or not seq_new:
+            res[i] = (0, 1.0)
+        elif engine == "lcs":
+            ratio = _lcs_opcodes(seq_old, seq_new, ratio_only=True)[1]
+            nmatch = int(round(ratio * (len(seq_old) + len(seq_new)) / 2))
+            res[i] = (nmatch, 1.0 - ratio)
+        else:
+            todo.setdefault(seq_new, []).append(i)
+
+    seqmatch = SequenceMatcher(None)
+    for seq_new, inds in todo.items():
+        seqmatch.set_seq2(seq_new)
+        for i in inds:
+            seq_old = pairs[i][0]
+            seqmatch.set_seq1(seq_old)
+            nmatch = sum(x[2] for x in seqmatch.get_matching_blocks())
+            ratio = 2.0 * nmatch / (len(seq_old) + len(seq_new))
+            res[i] = (nmatch, 1.0 - ratio)
+
+    return res
+
+
+def itdiff (seq_old, seq_new, reductf=None, cutoff=0.6, diffr=False,
+            engine=None):
     """
     Create interleaved tagged difference of two sequences.
 
@@ -181,12 +410,15 @@ def itdiff (seq_old, seq_new, reductf=None, cutoff=0.6, diffr=False):
     @type cutoff: float [0, 1]
     @param diffr: whether to report difference ratio
     @type diffr: bool
+    @param engine: name of the diff engine (see L{tdiff})
+    @type engine: string
 
     @returns: interleaved difference list and possibly difference ratio
     @rtype: [(string, element)...] or ([(string, element)...], float)
     """
 
-    dres = tdiff(seq_old, seq_new, reductf=reductf, diffr=diffr)
+    dres = tdiff(seq_old, seq_new, reductf=reductf, diffr=diffr,
+                 engine=engine)
     if diffr:
         dlist, dr = dres
     else:
@@ -209,7 +441,8 @@ def itdiff (seq_old, seq_new, reductf=None, cutoff=0.6, diffr=False):
                 els_new.append(dlist[i][1])
             i += 1
         if els_old and els_new:
-            idlist.extend(_dinterleave(els_old, els_new, reductf, cutoff))
+            idlist.extend(_dinterleave(els_old, els_new, reductf, cutoff,
+                                       engine))
         else:
             idlist.extend([(_old_tag, x) for x in els_old])
             idlist.extend([(_new_tag, x) for x in els_new])
@@ -217,7 +450,7 @@ def itdiff (seq_old, seq_new, reductf=None, cutoff=0.6, diffr=False):
     return diffr and (idlist, dr) or idlist
 
 
-def _dinterleave (els_old, els_new, reductf, cutoff):
+def _dinterleave (els_old, els_new, reductf, cutoff, engine):
 
     reductf = reductf or (lambda x: x)
 
@@ -239,7 +472,7 @@ def _dinterleave (els_old, els_new, reductf, cutoff):
                     continue
                 seq_old = reductf(els_old[i_old])
                 seq_new = reductf(els_new[i_new])
-                r = SequenceMatcher(None, seq_old, seq_new).ratio()
+                r = _diff_opcodes(seq_old, seq_new, engine, True)[1]
                 if r < cutoff:
                     r = 0.0
                 sim += r
@@ -1648,20 +1881,63 @@ def editprob (oldtext, newtext):
     @rtype: float
     """
 
-    if oldtext == newtext:
-        return 1.0
-    if not oldtext or not newtext:
-        return 0.0
+    return editprob_many([(oldtext, newtext)])[0]
+
+
+# Edit probabilities by hash of the old and new text.
+_editprob_memo = named_cache("editprob", size=50000, version="1")
+
+def editprob_many (pairs):
+    """
+    Compute edit probabilities of many pairs of texts.
+
+    Gives same results as calling L{editprob} on each pair,
+    but faster when many pairs share a text (e.g. when checking
+    several candidate old texts against the same new text).
+    Results are remembered by hash of the texts, also between runs
+    if caches are persistent (see L{pology.cache.set_persistent}).
+
+    @param pairs: old and new texts
+    @type pairs: sequence of (string, string)
+
+    @returns: probabilities of editing old into new texts
+    @rtype: [float*]
+    """
+
+    probs = [None] * len(pairs)
+    # Indices and hashes of pairs by the shorter text,
+    # to which the matcher is set only once.
+    todo = {}
+    for i, (oldtext, newtext) in enumerate(pairs):
+        if oldtext == newtext:
+            probs[i] = 1.0
+        elif not oldtext or not newtext:
+            probs[i] = 0.0
+        else:
+            key = text_hash(oldtext, newtext)
+            probs[i] = _editprob_memo.get(key)
+            if probs[i] is None:
+                # Consider always the case of editing from longer to shorter.
+                if len(oldtext) < len(newtext):
+                    shorttext, longtext = oldtext, newtext
+                else:
+                    shorttext, longtext = newtext, oldtext
+                todo.setdefault(shorttext, []).append((i, key, longtext))
+
+    sm = SequenceMatcher(None)
+    for shorttext, items in todo.items():
+        sm.set_seq2(shorttext)
+        for i, key, longtext in items:
+            sm.set_seq1(longtext)
+            probs[i] = _editprob_blocks(sm.get_matching_blocks(),
+                                        len(shorttext), len(longtext))
+            _editprob_memo.set(key, probs[i])
+
+    return probs
 
-    # Consider always the case of editing from longer to shorter text.
-    if len(oldtext) < len(newtext):
-        shorttext, longtext = oldtext, newtext
-    else:
-        shorttext, longtext = newtext, oldtext
 
-    # Construct diff.
-    sm = SequenceMatcher(None, longtext, shorttext)
-    mblocks = sm.get_matching_blocks()
+def _editprob_blocks (mblocks, lenshort, lenlong):
+
     mblocks = sorted(mblocks, key=lambda x: x[1])
     mblocks.insert(0, (0, 0, 0))
 
@@ -1675,10 +1951,10 @@ def editprob (oldtext, newtext):
         # ...if cf would be set to 1, probability would be equal
         # to ordinary similarity ratio.
         ep += lm * cf
-    ep /= len(shorttext)
+    ep /= lenshort
 
     # Correct for different lengths of texts.
-    rl = float(len(shorttext)) / len(longtext)
+    rl = float(lenshort) / lenlong
     ep *= 1 - (rl - 1)**4
 
     return ep
@@ -1723,6 +1999,11 @@ def descprob (descpath, ancpath, cutoff=None, getcsz=False):
     dtexts = set(_read_msg_texts(descpath))
     atexts = set(_read_msg_texts(ancpath))
 
+    return _descprob_texts(dtexts, atexts, cutoff, getcsz)
+
+
+def _descprob_texts (dtexts, atexts, cutoff, getcsz):
+
     # Make the computation commutative, by always taking
     # the file with less text as possible descendant.
     dtotchar = sum(len(t) for t in dtexts)
@@ -1808,3 +2089,209 @@ def _read_msg_texts (path):
 
     return msgids
 
+
+class AncestryIndex (object):
+    """
+    Index of PO files for quick search of possible ancestors.
+
+    To find ancestors of a PO file among many others by L{descprob},
+    the probability would have to be computed against each of them.
+    Instead, the files are added to this index, where message texts of
+    each file are read once and summarized into a MinHash signature
+    (by one permutation hashing, with rotation densification).
+    Signatures are split into bands, and files sharing any band
+    become candidates, which are ranked by the similarity estimated
+    from their complete signatures. The exact probability of ancestry
+    is then computed only for the top candidates.
+
+    Files should not be modified after being added to the index.
+    """
+
+    def __init__ (self, paths=(), numperm=128, bandsize=2):
+        """
+        Constructor.
+
+        The lower the band size, the more files become candidates,
+        i.e. the less similar the files need to be for one to be
+        proposed as the ancestor of the other.
+        The signature size must be divisible by the band size.
+
+        @param paths: paths of PO files to add to the index
+        @type paths: sequence of strings
+        @param numperm: size of signatures
+        @type numperm: int
+        @param bandsize: size of bands of signatures
+        @type bandsize: int
+        """
+
+        if numperm % bandsize != 0:
+            raise PologyError(
+                _("@info",
+                  "Signature size %(num1)d is not divisible "
+                  "by band size %(num2)d.",
+                  num1=numperm, num2=bandsize))
+        self._numperm = numperm
+        self._bandsize = bandsize
+
+        self._sigs = {}
+        self._nfeats = {}
+        self._buckets = {}
+
+        for path in paths:
+            self.add(path)
+
+
+    def add (self, path):
+        """
+        Add a PO file to the index.
+
+        Adding the same file again has no effect.
+
+        @param path: path to the PO file
+        @type path: string
+        """
+
+        if path in self._sigs:
+            return
+        sig, nfeats = self._signature(path)
+        self._sigs[path] = sig
+        self._nfeats[path] = nfeats
+        for bkey in self._bands(sig):
+            self._buckets.setdefault(bkey, []).append(path)
+
+
+    def __len__ (self):
+
+        return len(self._sigs)
+
+
+    def __contains__ (self, path):
+
+        return path in self._sigs
+
+
+    def candidates (self, path, limit=10):
+        """
+        Propose files from the index which may be ancestors of a file.
+
+        Candidates are files sharing at least one band of signatures
+        with the given file, ordered by estimated containment
+        of features of the smaller file in the larger.
+        The given file itself is never a candidate, while it does not
+        need to be in the index.
+
+        @param path: path to the PO file
+        @type path: string
+        @param limit: the maximum number of candidates (all if C{None})
+        @type limit: int or C{None}
+
+        @returns: paths of candidates with estimated similarities
+        @rtype: [(string, float)*]
+        """
+
+        sig, nfeats = self._sigs.get(path), self._nfeats.get(path)
+        if sig is None:
+            sig, nfeats = self._signature(path)
+
+        cpaths = set()
+        for bkey in self._bands(sig):
+            cpaths.update(self._buckets.get(bkey, ()))
+        cpaths.discard(path)
+
+        cands = []
+        for cpath in cpaths:
+            csig = self._sigs[cpath]
+            jsim = sum(x == y for x, y in zip(sig, csig)) / len(sig)
+            cnfeats = self._nfeats[cpath]
+            minnfeats = min(nfeats, cnfeats) or 1
+            csim = jsim * (nfeats + cnfeats) / ((1 + jsim) * minnfeats)
+            cands.append((cpath, min(csim, 1.0)))
+        cands.sort(key=lambda x: (-x[1], x[0]))
+        if limit is not None:
+            cands = cands[:limit]
+
+        return cands
+
+
+    def ancestors (self, path, limit=5, cutoff=None, minprob=0.0):
+        """
+        Find files from the index which are probably ancestors of a file.
+
+        Probability of ancestry is computed by L{descprob}
+        for top candidates proposed by L{candidates}.
+
+        @param path: path to the PO file
+        @type path: string
+        @param limit: the number of candidates to check
+        @type limit: int
+        @param cutoff: the cutoff for fuzzy matching (see L{descprob})
+        @type cutoff: float
+        @param minprob: the minimum probability of ancestry to report
+        @type minprob: float
+
+        @returns: paths of ancestors with probabilities,
+            from the most probable
+        @rtype: [(string, float)*]
+        """
+
+        dtexts = set(_read_msg_texts(path))
+        ancs = []
+        for cpath, csim in self.candidates(path, limit):
+            atexts = set(_read_msg_texts(cpath))
+            if not dtexts or not atexts:
+                continue
+            prob = _descprob_texts(dtexts, atexts, cutoff, False)
+            if prob >= minprob:
+                ancs.append((cpath, prob))
+        ancs.sort(key=lambda x: (-x[1], x[0]))
+
+        return ancs
+
+
+    # Features of a file are hashes of pairs of consecutive words
+    # in each message text (or its only word), so that also similar
+    # and not only equal texts contribute to the similarity of files.
+    _maxhash = (1 << 61) - 1
+
+    def _signature (self, path):
+
+        feats = set()
+        for text in set(_read_msg_texts(path)):
+            words = text.split()
+            if len(words) < 2:
+                feats.add(hash(text) & self._maxhash)
+            else:
+                for i in range(len(words) - 1):
+                    feats.add(hash((words[i], words[i + 1])) & self._maxhash)
+
+        # One permutation hashing: the minimum hash in each of
+        # the equal parts of the hash range.
+        numperm = self._numperm
+        binsize = (self._maxhash >> 1) // numperm + 1
+        sig = [None] * numperm
+        for h in feats:
+            # Mix bits, as hashes of strings may be uniform
+            # but those of numbers are not.
+            h = (h * 0x9e3779b97f4a7c15) & self._maxhash
+            b, v = divmod(h >> 1, binsize)
+            if sig[b] is None or v < sig[b]:
+                sig[b] = v
+        # Fill empty bins by rotation from the next non-empty bin.
+        if feats and None in sig:
+            dsig = list(sig)
+            for b in range(numperm):
+                if sig[b] is None:
+                    off = 1
+                    while sig[(b + off) % numperm] is None:
+                        off += 1
+                    dsig[b] = sig[(b + off) % numperm] + off * binsize
+            sig = dsig
+
+        return tuple(sig), len(feats)
+
+
+    def _bands (self, sig):
+
+        bsz = self._bandsize
+        return [(i, sig[i:i + bsz]) for i in range(0, len(sig), bsz)
+                if sig[i] is not None]
@@ -10,12 +10,13 @@ Common functionality for poediff and poepatch scripts.
 """
 
 import os
+import tempfile
 import time
 
 from pology import PologyError, _
 from pology.catalog import Catalog
 import pology.config as pology_config
-from pology.diff import msg_ediff, tdiff
+from pology.diff import msg_ediff, tmatch_many
 from pology.merge import merge_pofile
 from pology.message import MessageUnsafe
 
@@ -96,13 +97,16 @@ def msg_cleanup (msg):
             if msg.get(field) is not None:
                 setattr(msg, field, None)
 
+# Catalogs need not have been read from their file names on disk;
+# if they were not, rawf is the function which gives the raw content
+# of the catalog file, which is used when catalogs have to be merged.
 def diff_cats (cat1, cat2, ecat,
                merge=True, colorize=False, wrem=True, wadd=True, noobs=False,
-               upprogf=None):
+               upprogf=None, rawf=None):
 
     upprogf = upprogf or (lambda: None)
 
-    dpairs = _pair_msgs(cat1, cat2, merge, wrem, wadd, noobs, upprogf)
+    dpairs = _pair_msgs(cat1, cat2, merge, wrem, wadd, noobs, upprogf, rawf)
 
     # Order pairings such that they follow order of messages in
     # the new catalog wherever the new message exists.
@@ -132,22 +136,32 @@ def diff_cats (cat1, cat2, ecat,
     return ndiffed
 
 
-def cats_update_effort (cat1, cat2, upprogf=None):
+def cats_update_effort (cat1, cat2, upprogf=None, rawf=None):
 
     upprogf = upprogf or (lambda: None)
 
     dpairs = _pair_msgs(cat1, cat2, merge=True, wrem=False, wadd=True,
-                        noobs=False, upprogf=upprogf)
-
-    nntw_total = 0
+                        noobs=False, upprogf=upprogf, rawf=rawf)
 
+    # Character matches of old and new texts are computed for all pairs
+    # at once, being the most expensive part.
+    apairs = []
     for msg1, msg2 in dpairs:
         upprogf()
-
         if not msg2.active:
             continue
         if msg1 is None:
             msg1 = MessageUnsafe()
+        apairs.append((msg1, msg2))
+    tpairs = []
+    for msg1, msg2 in apairs:
+        tpairs.append((msg1.msgid, msg2.msgid))
+        tpairs.append((msg1.msgstr[0], msg2.msgstr[0]))
+    tmatches = tmatch_many(tpairs)
+
+    nntw_total = 0
+
+    for i, (msg1, msg2) in enumerate(apairs):
 
         # The update effort of the given old-new message pair is equal
         # to "nominal number of newly translated words" (NNTW),
@@ -180,11 +194,11 @@ def cats_update_effort (cat1, cat2, upprogf=None):
 
         wl = 6.0
         nwo = len(msg2.msgid) / wl
-        diffo, dro = tdiff(msg1.msgid, msg2.msgid, diffr=True)
-        newo = len([c for t, c in diffo if t == " "]) / wl
+        nequo, dro = tmatches[2 * i]
+        newo = nequo / wl
         ef = float(len(msg2.msgstr[0])) / len(msg2.msgid)
-        difft, drt = tdiff(msg1.msgstr[0], msg2.msgstr[0], diffr=True)
-        newt = len([c for t, c in difft if t == " "]) / (wl * ef)
+        nequt, drt = tmatches[2 * i + 1]
+        newt = nequt / (wl * ef)
         sro = 1.0 - dro
         srt = 1.0 - drt
         srb = 0.5
@@ -205,7 +219,7 @@ def _calc_text_update_effort (text1, text2):
 
 def _pair_msgs (cat1, cat2,
                 merge=True, wrem=True, wadd=True, noobs=False,
-                upprogf=None):
+                upprogf=None, rawf=None):
 
     upprogf = upprogf or (lambda: None)
 
@@ -245,9 +259,7 @@ def _pair_msgs (cat1, cat2,
             #print("===> merging: %s -> %s" % (cat1.filename, cat2.filename))
             # Merge is done if requested and both catalogs exist.
             if merge and not cat1.created() and not cat2.created():
-                mcat_pack[0] = merge_pofile(cat1.filename, cat2.filename,
-                                            getcat=True, monitored=False,
-                                            quiet=True, abort=True)
+                mcat_pack[0] = _merge_cats(cat1, cat2, rawf)
                 if noobs:
                     _rmobs_no_sync(mcat_pack[0])
             else:
@@ -301,6 +313,30 @@ def _pair_msgs (cat1, cat2,
     return dpairs
 
 
+def _merge_cats (cat1, cat2, rawf):
+
+    # Catalogs not read from disk are written to temporary files.
+    tmppaths = []
+    try:
+        fpaths = []
+        for cat in (cat1, cat2):
+            content = rawf(cat) if rawf else None
+            if content is None:
+                fpaths.append(cat.filename)
+            else:
+                fd, fpath = tempfile.mkstemp(prefix="poediff-", suffix=".po")
+                tmppaths.append(fpath)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                fpaths.append(fpath)
+        return merge_pofile(fpaths[0], fpaths[1],
+                            getcat=True, monitored=False,
+                            quiet=True, abort=True)
+    finally:
+        for fpath in tmppaths:
+            os.unlink(fpath)
+
+
 def _rmobs_no_sync (cat):
 
     for msg in cat:
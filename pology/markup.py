@@ -8,12 +8,15 @@ Convert and validate markup in text.
 """
 
 import os
+import pickle
 import re
 import codecs
 import xml.parsers.expat
+import threading
 import difflib
 
-from pology import PologyError, datadir, _, n_
+from pology import PologyError, datadir, version, _, n_
+from pology.cache import cachedir, file_hash, named_cache, text_hash
 from pology.comments import manc_parse_flag_list
 from pology.diff import adapt_spans
 from pology.entities import read_entities
@@ -27,6 +30,42 @@ from pology.report import format_item_list
 flag_no_check_markup = "no-check-markup"
 
 
+# Results of validation and conversion to plain text are remembered,
+# keyed by the text and identities of the specification objects
+# (markup specification, entities, etc.) used to produce them.
+# Such objects must not be modified after use.
+_validation_memo = named_cache("markup-validation", size=20000,
+                               persistent=False)
+_plain_memo = named_cache("markup-plain", size=20000, persistent=False)
+_memo_lock = threading.Lock()
+
+# Registered objects are kept alive, so that their identities
+# cannot be reused by other objects.
+_memo_objs = {}
+_memo_objs_limit = 1000
+
+def _memo_ident (obj):
+
+    if obj is None:
+        return None
+    # All empty collections mean the same.
+    if isinstance(obj, (list, tuple, set, frozenset, dict)) and not obj:
+        return 0
+
+    ident = _memo_objs.get(id(obj))
+    if ident is None:
+        # Too many objects, probably created on each call;
+        # start over rather than grow without bound.
+        if len(_memo_objs) >= _memo_objs_limit:
+            _memo_objs.clear()
+            _validation_memo.clear()
+            _plain_memo.clear()
+        ident = (obj, len(_memo_objs) + 1)
+        _memo_objs[id(obj)] = ident
+
+    return ident[1]
+
+
 _nlgr_rx = re.compile(r"\n{2,}")
 _wsgr_rx = re.compile(r"\s+", re.ASCII)
 
@@ -83,7 +122,7 @@ _ws_masks = {
 _ws_unmasks = dict([(y, x) for x, y in list(_ws_masks.items())])
 
 def xml_to_plain (text, tags=None, subs={}, ents={}, keepws=set(),
-                  ignels=set()):
+                  ignels=set(), offsets=False):
     """
     Convert any XML-like markup to plain text.
 
@@ -127,6 +166,19 @@ def xml_to_plain (text, tags=None, subs={}, ents={}, keepws=set(),
     It is assumed that the markup is well-formed, and if it is not
     the result is undefined; but best attempt at conversion is made.
 
+    If C{offsets} is C{True}, for each character of the plain text
+    its position in the original text is reported too, as a list
+    with one more element for the end of the plain text.
+    Characters produced by tags or entities are reported at the position
+    of the tag or entity, and replaced wrapped text at its start.
+    A span C{(s, e)} in the plain text thus starts at C{offsets[s]}
+    in the original text and its last character comes from C{offsets[e - 1]},
+    without having to compare the texts as L{pology.diff.adapt_spans} does.
+
+    Results are remembered for the text and the identities of
+    specification objects (C{tags}, C{subs}, etc.), so these objects
+    should not be modified after being used for conversion.
+
     There are several other functions in this module which deal with well known
     markups, such that it is not necessary to use this function with
     C{tags}, C{subs}, or C{ents} manually specified.
@@ -147,11 +199,30 @@ def xml_to_plain (text, tags=None, subs={}, ents={}, keepws=set(),
     @type keepws: sequence of strings
     @param ignels: tags or tag/types or elements to completely remove
     @type ignels: sequence of strings and (string, string) tuples
+    @param offsets: whether to report positions in the original text
+    @type offsets: bool
 
-    @returns: plain text version
-    @rtype: string
+    @returns: plain text version, and positions if requested
+    @rtype: string or (string, [int*])
     """
 
+    with _memo_lock:
+        key = (text, _memo_ident(tags), _memo_ident(subs), _memo_ident(ents),
+               _memo_ident(keepws), _memo_ident(ignels), bool(offsets))
+        res = _plain_memo.get(key)
+    if res is None:
+        res = _xml_to_plain(text, tags, subs, ents, keepws, ignels, offsets)
+        with _memo_lock:
+            _plain_memo.set(key, res)
+
+    plain, tmap = res
+    if offsets:
+        return plain, list(tmap)
+    return plain
+
+
+def _xml_to_plain (text, tags, subs, ents, keepws, ignels, offsets=False):
+
     # Convert some sequences to sets, for faster membership checks.
     if tags is not None and not isinstance(tags, set):
         tags = set(tags)
@@ -160,147 +231,307 @@ def xml_to_plain (text, tags=None, subs={}, ents={}, keepws=set(),
     if not isinstance(ignels, set):
         ignels = set(ignels)
 
+    # Positions in the original text of characters in the current text,
+    # with one more for the end of text; tracked only if requested.
+    tmap = list(range(len(text) + 1)) if offsets else None
+
     # Resolve user-supplied entities before tags,
     # as they may contain more markup.
     # (Resolve default entities after tags,
     # because the default entities can introduce invalid markup.)
-    text = _resolve_ents(text, ents, xml_entities)
-
-    # Build element tree, trying to work around badly formed XML
-    # (but do note when the closing element is missing).
-    # Element tree is constructed as list of tuples:
-    # (tag, opening_tag_literal, closing_tag_literal, atype, content)
-    # where atype is the value of type attribute (if any),
-    # and content is a sublist for given element;
-    # tag may be #text, when the content is string.
-    eltree = []
-    curel = eltree
-    parent = []
-    any_tag = False
-    p = 0
-    while True:
-        pp = p
-        p = text.find("<", p)
-        if p < 0:
-            break
-        curel.append(("#text", None, None, None, text[pp:p]))
-        tag_literal, tag, atype, opening, closing, p = _parse_tag(text, p)
-        if p < 0:
-            break
-        if opening: # opening tag
-            any_tag = True
-            curel.append([tag, tag_literal, None, atype, []])
-            parent.append(curel)
-            curel = curel[-1][-1]
-        if closing: # closing tag (can be both opening and closing)
-            if parent:
-                curel = parent.pop()
-                if not opening:
-                    # Record closing tag literal if not opening as well.
-                    curel[-1][2] = tag_literal
-            else: # faulty markup, move top element
-                eltree = [[tag, None, tag_literal, None, curel]]
-                curel = eltree
-    curel.append(("#text", None, None, None, text[pp:]))
-
-    # Replace tags.
-    text = _resolve_tags(eltree, tags, subs, keepws, ignels)
+    if ents and "&" in text:
+        if tmap is not None:
+            text, tmap = _resolve_ents(text, ents, xml_entities, tmap)
+        else:
+            text = _resolve_ents(text, ents, xml_entities)
+
+    # Replace tags in a single sweep through the text.
+    run = _PlainRun(text, tmap, tags, subs, keepws, ignels)
+    text, tmap = run.convert()
+
+    # Simplify whitespace.
+    text, tmap = _simplify_ws(text, tmap)
 
     # Resolve default entities.
-    text = _resolve_ents(text, xml_entities)
+    if "&" in text:
+        if tmap is not None:
+            text, tmap = _resolve_ents(text, xml_entities, {}, tmap)
+        else:
+            text = _resolve_ents(text, xml_entities)
 
-    return text
+    return text, tmap
+
+
+# Tags without attributes, the most frequent.
+_simple_tag_rx = re.compile(r"<(/?)([^\s/>]+)\s*(/?)>")
 
+# Parts of tags in general.
+_tag_lead_rx = re.compile(r"<\s*(/\s*)?")
+_tag_name_rx = re.compile(r"[^\s/>]*")
+_tag_gap_rx = re.compile(r"[\s/]*")
+_tag_attr_rx = re.compile(r"[^\s=/>]*")
+_tag_aftattr_rx = re.compile(r"[^=>]*")
+_tag_afteq_rx = re.compile(r"[^\"'>]*")
+_tag_rest_rx = re.compile(r"[^>]*")
 
-def _parse_tag (text, p):
+def _scan_tag (text, p):
     # text[p] must be "<"
+    # Returns tag, value of type attribute, whether the tag is opening,
+    # whether it is closing, and the position after the tag.
+    # Only the first quoted attribute value may contain > and /,
+    # a tag without > extends to the end of text.
 
+    tlen = len(text)
     tag = ""
     atype = None
-    opening = True
-    closing = False
-
-    tlen = len(text)
-    pp = p
-    in_str = False
-    in_tag = False
-    in_attr = False
-    in_lead = True
-    in_afterslash = False
-    in_aftereq = False
-    in_aftertag = False
-    in_afterattr = False
-    ntag = ""
-    nattr = ""
-    while True:
-        p += 1
-        if p >= tlen:
-            break
 
-        if in_lead and not text[p].isspace():
-            in_lead = False
-            opening = text[p] != "/"
-            if opening:
-                in_tag = True
-                p_tag = p
-            else:
-                in_afterslash = True
-        elif in_afterslash and not text[p].isspace():
-            in_afterslash = False
-            in_tag = True
-            p_tag = p
-        elif in_tag and (text[p].isspace() or text[p] in "/>"):
-            in_tag = False
-            in_aftertag = True
-            tag = text[p_tag:p]
-            ntag = tag.lower()
-        elif in_aftertag and not (text[p].isspace() or text[p] in "/>"):
-            in_aftertag = False
-            in_attr = True
-            p_attr = p
-        elif in_attr and (text[p].isspace() or text[p] in "=/>"):
-            in_attr = False
-            if text[p] != "=":
-                in_afterattr = True
+    m = _tag_lead_rx.match(text, p)
+    closing = m.group(1) is not None
+    opening = not closing
+    p = m.end()
+    if p >= tlen:
+        return tag, atype, opening, closing, tlen
+    if text[p] == ">":
+        return tag, atype, opening, closing, p + 1
+    if text[p] == "/":
+        closing = True
+
+    pe = _tag_name_rx.match(text, p + 1).end()
+    if pe >= tlen:
+        return tag, atype, opening, closing, tlen
+    tag = text[p:pe]
+
+    m = _tag_gap_rx.match(text, pe)
+    closing = closing or "/" in m.group()
+    p = m.end()
+    if p >= tlen:
+        return tag, atype, opening, closing, tlen
+    if text[p] == ">":
+        return tag, atype, opening, closing, p + 1
+
+    pe = _tag_attr_rx.match(text, p + 1).end()
+    if pe >= tlen:
+        return tag, atype, opening, closing, tlen
+    attr = text[p:pe]
+    if text[pe] == ">":
+        return tag, atype, opening, closing, pe + 1
+    if text[pe] != "=":
+        closing = closing or text[pe] == "/"
+        m = _tag_aftattr_rx.match(text, pe + 1)
+        closing = closing or "/" in m.group()
+        pe = m.end()
+        if pe >= tlen:
+            return tag, atype, opening, closing, tlen
+        if text[pe] == ">":
+            return tag, atype, opening, closing, pe + 1
+
+    m = _tag_afteq_rx.match(text, pe + 1)
+    closing = closing or "/" in m.group()
+    p = m.end()
+    if p >= tlen:
+        return tag, atype, opening, closing, tlen
+    if text[p] == ">":
+        return tag, atype, opening, closing, p + 1
+    pe = text.find(text[p], p + 1)
+    if pe < 0:
+        return tag, atype, opening, closing, tlen
+    if attr.lower() == "type":
+        atype = text[p + 1:pe].strip().replace(" ", "")
+
+    m = _tag_rest_rx.match(text, pe + 1)
+    closing = closing or "/" in m.group()
+    p = m.end()
+    if p >= tlen:
+        return tag, atype, opening, closing, tlen
+    return tag, atype, opening, closing, p + 1
+
+
+_default_subs = (" ", " ", None)
+
+class _PlainRun (object):
+    """
+    Single conversion of markup text to plain text with masked whitespace,
+    as described in L{xml_to_plain}.
+    """
+
+    def __init__ (self, text, tmap, tags, subs, keepws, ignels):
+
+        self.text = text
+        self.tmap = tmap
+        self.tags = tags
+        self.subs = subs
+        self.keepws = keepws
+        self.ignels = ignels
+
+
+    def convert (self):
+
+        # Elements are converted as soon as they are closed.
+        # Open elements are kept on the stack as tuples:
+        # (tag, atype, opening_tag_start, content_start, has_opening_tag,
+        #  content_segments_of_parent, content_maps_of_parent)
+        # (trying to work around badly formed XML).
+        text = self.text
+        tmap = self.tmap
+        tlen = len(text)
+        stack = []
+        segs = []
+        smaps = [] if tmap is not None else None
+        p = 0
+        while True:
+            pp = p
+            p = text.find("<", p)
+            if p < 0:
+                break
+            if p > pp:
+                segs.append(text[pp:p])
+                if smaps is not None:
+                    smaps.append(tmap[pp:p])
+            m = _simple_tag_rx.match(text, p)
+            if m:
+                tag = m.group(2)
+                atype = None
+                opening = not m.group(1)
+                closing = not opening or bool(m.group(3))
+                pe = m.end()
             else:
-                in_aftereq = True
-            attr = text[p_attr:p]
-            nattr = attr.lower()
-        elif in_aftereq and text[p] in ('"', "'"):
-            in_aftereq = False
-            in_str = True
-            quote_char = text[p]
-            p_str = p + 1
-        elif in_str and text[p] == quote_char:
-            in_str = False
-            s = text[p_str:p].strip().replace(" ", "")
-            if nattr == "type":
-                atype = s
-        elif in_afterattr and text[p] == "=":
-            in_afterattr = False
-            in_aftereq = True
-
-        if not in_str and text[p] == "/":
-            closing = True
-        if not in_str and text[p] == ">":
-            break
+                tag, atype, opening, closing, pe = _scan_tag(text, p)
+            if opening:
+                stack.append((tag, atype, p, pe, True, segs, smaps))
+                segs = []
+                smaps = [] if tmap is not None else None
+            if closing:
+                if stack:
+                    el = stack.pop()
+                    if opening:
+                        # Closing tag literal is not kept if opening too.
+                        conv, cmap = self._element(el, segs, smaps, p, None)
+                    else:
+                        conv, cmap = self._element(el, segs, smaps, p, pe)
+                    segs, smaps = el[5], el[6]
+                else: # faulty markup, make all so far an element
+                    el = (tag, None, 0, 0, False)
+                    conv, cmap = self._element(el, segs, smaps, p, pe)
+                    segs = []
+                    smaps = [] if tmap is not None else None
+                segs.append(conv)
+                if smaps is not None:
+                    smaps.append(cmap)
+            p = pe
+        if pp < tlen:
+            segs.append(text[pp:])
+            if smaps is not None:
+                smaps.append(tmap[pp:tlen])
+
+        # Close elements left open.
+        while stack:
+            el = stack.pop()
+            conv, cmap = self._element(el, segs, smaps, tlen, None)
+            segs, smaps = el[5], el[6]
+            segs.append(conv)
+            if smaps is not None:
+                smaps.append(cmap)
+
+        text = "".join(segs)
+        if smaps is not None:
+            smaps.append(tmap[tlen:])
+            tmap = _join_maps(smaps)
+
+        return text, tmap
+
+
+    def _element (self, el, segs, smaps, pc, pce):
+        # Convert element el with content segments and their maps,
+        # pc is where the element is closed and pce where its
+        # closing tag literal ends (None if there is none).
+
+        tag, atype, po, pco, has_otag = el[:5]
+        if tag in self.ignels or (tag, atype) in self.ignels:
+            # Complete element is ignored (by tag, or tag/type).
+            return "", ([] if smaps is not None else None)
+
+        text = self.text
+        tmap = self.tmap
+        pre_map = cont_map = post_map = None
+        if self.tags is None or tag in self.tags:
+            pre, post, cont = self.subs.get(tag, _default_subs)
+            if pre is None:
+                pre = ""
+            if post is None:
+                post = ""
+            if tmap is not None:
+                pre_map = [tmap[po]] * len(pre)
+                post_map = [tmap[pc]] * len(post)
+            cont_orig = cont
+            if not isinstance(cont, str):
+                cont = "".join(segs)
+                if tmap is not None:
+                    cont_map = _join_maps(smaps)
+                if tag in self.keepws:
+                    # Mask whitespace in wrapped text.
+                    cont, cont_map = _mask_ws(cont, cont_map)
+            if callable(cont_orig):
+                cont = cont_orig(cont)
+                cont_map = None
+            if tmap is not None and cont_map is None:
+                cont_map = [tmap[pco]] * len(cont)
+            # If space not significant,
+            # find first non-whitespace characters in wrapped text
+            # and shift them before surrounding replacements.
+            if tag not in self.keepws:
+                lcont = len(cont)
+                p1 = 0
+                while p1 < lcont and cont[p1].isspace():
+                    p1 += 1
+                p2 = lcont - 1
+                while p2 > 0 and cont[p2].isspace():
+                    p2 -= 1
+                pre = cont[:p1] + pre
+                post = post + cont[p2+1:]
+                cont = cont[p1:p2+1]
+                if tmap is not None:
+                    pre_map = cont_map[:p1] + pre_map
+                    post_map = post_map + cont_map[p2+1:]
+                    cont_map = cont_map[p1:p2+1]
+        else:
+            # Ignored tag, put back verbatim.
+            pre = text[po:pco] if has_otag else ""
+            post = text[pc:pce] if pce is not None else ""
+            cont = "".join(segs)
+            if tmap is not None:
+                pre_map = tmap[po:pco] if has_otag else []
+                post_map = tmap[pc:pce] if pce is not None else []
+                cont_map = _join_maps(smaps)
 
-    p += 1
-    tag_literal = text[pp:p]
+        conv = pre + cont + post
+        if tmap is not None:
+            return conv, pre_map + cont_map + post_map
+        return conv, None
 
-    return tag_literal, tag, atype, opening, closing, p
+
+def _join_maps (maps):
+
+    jmap = []
+    for smap in maps:
+        jmap.extend(smap)
+    return jmap
 
 
 _entity_rx = re.compile(r"&([\w:][\w\d.:-]*);", re.U)
 
-def _resolve_ents (text, ents={}, ignents={}):
+def _resolve_ents (text, ents={}, ignents={}, tmap=None):
     """
     Resolve XML entities as described in L{xml_to_plain}, ignoring some.
+
+    If positions in the original text are given for the characters of
+    the text, positions for the resolved text are returned too,
+    with whole entity values put at the positions of the entities.
     """
 
     # There may be entities within entities, so replace entities in each
     # entity value too before substituting in the main text.
     ntext = []
+    nmap = []
     p = 0
     while True:
         pp = p
@@ -308,6 +539,8 @@ def _resolve_ents (text, ents={}, ignents={}):
         if p < 0:
             break
         ntext.append(text[pp:p])
+        if tmap is not None:
+            nmap.extend(tmap[pp:p])
         m = _entity_rx.match(text, p)
         if m:
             name = m.group(1)
@@ -317,115 +550,125 @@ def _resolve_ents (text, ents={}, ignents={}):
                     # FIXME: Endless recursion if the entity repeats itself.
                     value = _resolve_ents(value, ents, ignents)
                     ntext.append(value)
+                    if tmap is not None:
+                        nmap.extend([tmap[p]] * len(value))
                 else:
                     # Put entity back as-is.
                     ntext.append(m.group(0))
+                    if tmap is not None:
+                        nmap.extend(tmap[p:m.end()])
             else: # ignored entity, do not touch
-                ntext.append(text[p:m.span()[1]])
-            p = m.span()[1]
+                ntext.append(text[p:m.end()])
+                if tmap is not None:
+                    nmap.extend(tmap[p:m.end()])
+            p = m.end()
         else:
             ntext.append(text[p]) # the ampersand
+            if tmap is not None:
+                nmap.append(tmap[p])
             p += 1
     ntext.append(text[pp:])
     text = "".join(ntext)
 
+    if tmap is not None:
+        nmap.extend(tmap[pp:])
+        return text, nmap
     return text
 
 
 # Ordinary around masked whitespace.
 _wsgr_premask_rx = re.compile(r"\s+(\x04~\w\w)")
 _wsgr_postmask_rx = re.compile(r"(\x04~\w\w)\s+")
+_ws_mask_rx = re.compile("|".join(map(re.escape, _ws_masks)))
 
-def _resolve_tags (elseq, tags=None, subs={}, keepws=set(), ignels=set()):
+def _simplify_ws (text, tmap=None):
     """
-    Replace XML tags as described in L{xml_to_plain}, given the parsed tree.
-    Split into top and recursive part.
+    Simplify whitespace in text with masked significant whitespace,
+    and unmask it. Positions of characters are updated if given.
     """
 
-    # Text with masked whitespace where significant.
-    text = _resolve_tags_r(elseq, tags, subs, keepws, ignels)
+    if tmap is None:
+        text = _wsgr_rx.sub(" ", text)
+        text = _wsgr_premask_rx.sub(r"\1", text)
+        text = _wsgr_postmask_rx.sub(r"\1", text)
+        text = text.strip()
 
-    # Simplify whitespace.
-    text = _wsgr_rx.sub(" ", text)
-    text = _wsgr_premask_rx.sub(r"\1", text)
-    text = _wsgr_postmask_rx.sub(r"\1", text)
-    text = text.strip()
+        # Unmask significant whitespace.
+        for mask, ws in _ws_masks.items():
+            text = text.replace(mask, ws)
 
-    # Unmask significant whitespace.
-    text = _unmask_ws(text)
+        # Remove excess newlines even if supposedly significant.
+        text = text.strip("\n")
+        text = _nlgr_rx.sub("\n\n", text)
 
-    # Remove excess newlines even if supposedly significant.
-    text = text.strip("\n")
-    text = _nlgr_rx.sub("\n\n", text)
+        return text, None
 
-    return text
+    # Same as above, but keeping the map.
+    space = lambda m, tmap: (" ", tmap[m.start():m.start() + 1])
+    text, tmap = _sub_map(_wsgr_rx, space, text, tmap)
+    mask = lambda m, tmap: (m.group(1), tmap[m.start(1):m.end(1)])
+    text, tmap = _sub_map(_wsgr_premask_rx, mask, text, tmap)
+    text, tmap = _sub_map(_wsgr_postmask_rx, mask, text, tmap)
+    text, tmap = _strip_map(text, tmap, None)
+    unmask = lambda m, tmap: (_ws_masks[m.group()], [tmap[m.start()]])
+    text, tmap = _sub_map(_ws_mask_rx, unmask, text, tmap)
+    text, tmap = _strip_map(text, tmap, "\n")
+    two_nl = lambda m, tmap: ("\n\n", tmap[m.start():m.start() + 2])
+    text, tmap = _sub_map(_nlgr_rx, two_nl, text, tmap)
 
+    return text, tmap
 
-def _resolve_tags_r (elseq, tags=None, subs={}, keepws=set(), ignels=set()):
 
-    segs = []
-    for el in elseq:
-        if el[0] in ignels or (el[0], el[3]) in ignels:
-            # Complete element is ignored (by tag, or tag/type).
-            continue
-
-        if el[0] == "#text":
-            segs.append(el[-1])
-        elif tags is None or el[0] in tags:
-            repl_pre, repl_post, repl_cont = subs.get(el[0], [" ", " ", None])
-            if repl_pre is None:
-                repl_pre = ""
-            if repl_post is None:
-                repl_post = ""
-            repl_cont_orig = repl_cont
-            if not isinstance(repl_cont, str):
-                repl_cont = _resolve_tags_r(el[-1], tags, subs, keepws, ignels)
-                if el[0] in keepws:
-                    # Mask whitespace in wrapped text.
-                    repl_cont = _mask_ws(repl_cont)
-            if callable(repl_cont_orig):
-                repl_cont = repl_cont_orig(repl_cont)
-            # If space not significant,
-            # find first non-whitespace characters in wrapped text
-            # and shift them before surrounding replacements.
-            if el[0] not in keepws:
-                lcont = len(repl_cont)
-                p1 = 0
-                while p1 < lcont and repl_cont[p1].isspace():
-                    p1 += 1
-                p2 = lcont - 1
-                while p2 > 0 and repl_cont[p2].isspace():
-                    p2 -= 1
-                repl_pre = repl_cont[:p1] + repl_pre
-                repl_post = repl_post + repl_cont[p2+1:]
-                repl_cont = repl_cont[p1:p2+1]
-            segs.append(repl_pre + repl_cont + repl_post)
-        else:
-            # Ignored tag, put back verbatim.
-            repl_pre = el[1]
-            if repl_pre is None:
-                repl_pre = ""
-            repl_post = el[2]
-            if repl_post is None:
-                repl_post = ""
-            repl_cont = _resolve_tags_r(el[-1], tags, subs, keepws, ignels)
-            segs.append(repl_pre + repl_cont + repl_post)
+def _sub_map (rx, replf, text, tmap):
+    # Like rx.sub(replf, text), but replf also gets positions
+    # of text characters and returns positions of replacement characters.
 
-    return "".join(segs)
+    ntext = []
+    nmap = []
+    p = 0
+    for m in rx.finditer(text):
+        ntext.append(text[p:m.start()])
+        nmap.extend(tmap[p:m.start()])
+        repl, rmap = replf(m, tmap)
+        ntext.append(repl)
+        nmap.extend(rmap)
+        p = m.end()
+    ntext.append(text[p:])
+    nmap.extend(tmap[p:])
 
+    return "".join(ntext), nmap
 
-def _mask_ws (text):
 
-    for mask, ws in list(_ws_masks.items()):
-        text = text.replace(ws, mask)
-    return text
+def _strip_map (text, tmap, chars):
 
+    stext = text.strip(chars)
+    if not stext:
+        return stext, tmap[len(text):]
+    p = len(text) - len(text.lstrip(chars))
 
-def _unmask_ws (text):
+    return stext, tmap[p:p + len(stext) + 1]
+
+
+def _mask_ws (text, tmap=None):
+
+    if tmap is None:
+        for mask, ws in _ws_masks.items():
+            text = text.replace(ws, mask)
+        return text, None
+
+    ntext = []
+    nmap = []
+    for c, pos in zip(text, tmap):
+        mask = _ws_unmasks.get(c)
+        if mask is not None:
+            ntext.append(mask)
+            nmap.extend([pos] * len(mask))
+        else:
+            ntext.append(c)
+            nmap.append(pos)
+
+    return "".join(ntext), nmap
 
-    for mask, ws in list(_ws_masks.items()):
-        text = text.replace(mask, ws)
-    return text
 
 _html_tags = set("""
     a address applet area b base basefont big blockquote body br button
@@ -454,19 +697,24 @@ _html_ignels = set([
     ("style", "text/css"),
 ])
 
-def html_to_plain (text):
+def html_to_plain (text, offsets=False):
     """
     Convert HTML markup to plain text.
 
     @param text: HTML text to convert to plain
     @type text: string
 
-    @returns: plain text version
-    @rtype: string
+    @param offsets: whether to report positions in the original text
+        (see L{xml_to_plain})
+    @type offsets: bool
+
+    @returns: plain text version, and positions if requested
+    @rtype: string or (string, [int*])
     """
 
     return xml_to_plain(text, _html_tags, _html_subs, _html_ents,
-                              _html_keepws, _html_ignels)
+                              _html_keepws, _html_ignels,
+                              offsets)
 
 
 def html_plain (*args, **kwargs):
@@ -500,19 +748,24 @@ _qtrich_ignels = set([
     ("style", "text/css"),
 ])
 
-def qtrich_to_plain (text):
+def qtrich_to_plain (text, offsets=False):
     """
     Convert Qt rich-text markup to plain text.
 
     @param text: Qt rich text to convert to plain
     @type text: string
 
-    @returns: plain text version
-    @rtype: string
+    @param offsets: whether to report positions in the original text
+        (see L{xml_to_plain})
+    @type offsets: bool
+
+    @returns: plain text version, and positions if requested
+    @rtype: string or (string, [int*])
     """
 
     return xml_to_plain(text, _qtrich_tags, _qtrich_subs, _qtrich_ents,
-                              _qtrich_keepws, _qtrich_ignels)
+                              _qtrich_keepws, _qtrich_ignels,
+                              offsets)
 
 
 _kuit_tags = set("""
@@ -542,19 +795,24 @@ _kuit_keepws = set("""
 _kuit_ignels = set([
 ])
 
-def kuit_to_plain (text):
+def kuit_to_plain (text, offsets=False):
     """
     Convert KUIT markup to plain text.
 
     @param text: KUIT text to convert to plain
     @type text: string
 
-    @returns: plain text version
-    @rtype: string
+    @param offsets: whether to report positions in the original text
+        (see L{xml_to_plain})
+    @type offsets: bool
+
+    @returns: plain text version, and positions if requested
+    @rtype: string or (string, [int*])
     """
 
     return xml_to_plain(text, _kuit_tags, _kuit_subs, _kuit_ents,
-                              _kuit_keepws, _kuit_ignels)
+                              _kuit_keepws, _kuit_ignels,
+                              offsets)
 
 
 _htkt_tags = set(list(_qtrich_tags) + list(_kuit_tags))
@@ -563,7 +821,7 @@ _htkt_ents = dict(list(_qtrich_ents.items()) + list(_kuit_ents.items()))
 _htkt_keepws = set(list(_qtrich_keepws) + list(_kuit_keepws))
 _htkt_ignels = set(list(_qtrich_ignels) + list(_kuit_ignels))
 
-def kde4_to_plain (text):
+def kde4_to_plain (text, offsets=False):
     """
     Convert KDE4 GUI markup to plain text.
 
@@ -577,12 +835,17 @@ def kde4_to_plain (text):
     @param text: KDE4 text to convert to plain
     @type text: string
 
-    @returns: plain text version
-    @rtype: string
+    @param offsets: whether to report positions in the original text
+        (see L{xml_to_plain})
+    @type offsets: bool
+
+    @returns: plain text version, and positions if requested
+    @rtype: string or (string, [int*])
     """
 
     return xml_to_plain(text, _htkt_tags, _htkt_subs, _htkt_ents,
-                              _htkt_keepws, _htkt_ignels)
+                              _htkt_keepws, _htkt_ignels,
+                              offsets)
 
 
 # Assembled on first use.
@@ -598,7 +861,7 @@ def _prep_docbook4_to_plain ():
 
     specpath = os.path.join(datadir(), "spec", "docbook4.l1")
     docbook4_l1 = collect_xml_spec_l1(specpath)
-    _dbk_tags = set(docbook4_l1.keys())
+    tags = set(docbook4_l1.keys())
 
     _dbk_subs = {
         "_nows" : ("", "", None),
@@ -607,7 +870,7 @@ def _prep_docbook4_to_plain ():
         "_ui" : ("[", "]", None),
         "_uipath" : ("", "", lambda s: re.sub(r"\]\s*\[", "->", s, re.U)),
     }
-    _dbk_subs.update([(x, _dbk_subs["_nows"]) for x in _dbk_tags])
+    _dbk_subs.update([(x, _dbk_subs["_nows"]) for x in tags])
     _dbk_subs.update([(x, _dbk_subs["_parabr"]) for x in
                       "para title".split()]) # FIXME: Add more.
     _dbk_subs.update([(x, _dbk_subs["_ws"]) for x in
@@ -632,22 +895,30 @@ def _prep_docbook4_to_plain ():
     _dbk_ignels = set([
     ])
 
-def docbook4_to_plain (text):
+    # Set last, as the indicator that all is prepared.
+    _dbk_tags = tags
+
+def docbook4_to_plain (text, offsets=False):
     """
     Convert Docbook 4.x markup to plain text.
 
     @param text: Docbook text to convert to plain
     @type text: string
 
-    @returns: plain text version
-    @rtype: string
+    @param offsets: whether to report positions in the original text
+        (see L{xml_to_plain})
+    @type offsets: bool
+
+    @returns: plain text version, and positions if requested
+    @rtype: string or (string, [int*])
     """
 
     if _dbk_tags is None:
         _prep_docbook4_to_plain()
 
     return xml_to_plain(text, _dbk_tags, _dbk_subs, _dbk_ents,
-                              _dbk_keepws, _dbk_ignels)
+                              _dbk_keepws, _dbk_ignels,
+                              offsets)
 
 
 def collect_xml_spec_l1 (specpath):
@@ -687,6 +958,11 @@ def collect_xml_spec_l1 (specpath):
 
     Specification file must be UTF-8 encoded.
 
+    Parsed specifications are shared by all callers in the process,
+    and must not be modified. They are also kept in compiled form
+    in the cache directory (see L{pology.cache.cachedir}),
+    and parsed again only when the specification file changes.
+
     @param specpath: path to level 1 specification file
     @type specpath: string
 
@@ -694,6 +970,65 @@ def collect_xml_spec_l1 (specpath):
     @rtype: dict
     """
 
+    specpath = os.path.abspath(specpath)
+    try:
+        st = os.stat(specpath)
+    except OSError:
+        # Let the parser report the error.
+        return _parse_xml_spec_l1(specpath)
+    skey = (specpath, st.st_mtime_ns, st.st_size)
+
+    with _xml_spec_l1_lock:
+        spec = _xml_spec_l1_cache.get(skey)
+        if spec is None:
+            spec = _compiled_xml_spec_l1(specpath)
+            _xml_spec_l1_cache[skey] = spec
+
+    return spec
+
+
+# Specifications already collected in this process,
+# by path and modification time and size of the file.
+_xml_spec_l1_cache = {}
+_xml_spec_l1_lock = threading.Lock()
+
+_compiled_spec_magic = b"PLL1S001"
+
+def _compiled_xml_spec_l1 (specpath):
+
+    fhash = file_hash([specpath]).encode("ascii")
+    vhash = text_hash(version())
+    name = os.path.basename(specpath)
+    cpath = os.path.join(cachedir("markup"),
+                         "%s-%s.pickle" % (name, text_hash(specpath).hex()[:12]))
+
+    try:
+        with open(cpath, "rb") as fh:
+            head = fh.read(len(_compiled_spec_magic) + len(fhash)
+                           + len(vhash))
+            if head == _compiled_spec_magic + fhash + vhash:
+                return pickle.load(fh)
+    except (OSError, EOFError, pickle.PickleError, AttributeError,
+            ValueError):
+        pass
+
+    spec = _parse_xml_spec_l1(specpath)
+
+    tmppath = "%s~%d" % (cpath, os.getpid())
+    try:
+        with open(tmppath, "wb") as fh:
+            fh.write(_compiled_spec_magic + fhash + vhash)
+            pickle.dump(spec, fh, 4)
+        os.replace(tmppath, cpath)
+    except (OSError, pickle.PickleError):
+        if os.path.isfile(tmppath):
+            os.unlink(tmppath)
+
+    return spec
+
+
+def _parse_xml_spec_l1 (specpath):
+
     ch_comm = "#"
     ch_attr = ":"
     ch_attre = "="
@@ -759,7 +1094,7 @@ def collect_xml_spec_l1 (specpath):
                      "Cannot compile regular expression %(regex)s.",
                      regex=(wch + rx_str + wch)),
                      lincol)
-        return lambda x: rx.search(x) is not None
+        return _RxLint(rx)
 
     spec = {}
     ctx = c_tag
@@ -903,6 +1238,20 @@ def collect_xml_spec_l1 (specpath):
     return spec
 
 
+# Validator of attribute values by a regular expression
+# (a class rather than a closure, to be picklable).
+class _RxLint (object):
+
+    def __init__ (self, rx):
+
+        self.rx = rx
+
+
+    def __call__ (self, value):
+
+        return self.rx.search(value) is not None
+
+
 class _L1Element:
 
     def __init__ (self, tag=None, attrs=None, mattrs=None, avlints=None,
@@ -931,9 +1280,24 @@ _lin_col_rx = re.compile(r":\s*line\s*\d+,\s*column\s*\d+", re.I)
 _dummy_top = "_"
 
 
-# Global data for XML checking.
-class _Global: pass
-_g_xml_l1 = _Global()
+# Validators for particular formats, shared by all their users.
+_shared_validators = {}
+_shared_validators_lock = threading.Lock()
+
+def _shared_validator (name, makef):
+
+    validator = _shared_validators.get(name)
+    if validator is None:
+        with _shared_validators_lock:
+            validator = _shared_validators.get(name)
+            if validator is None:
+                validator = makef()
+                _shared_validators[name] = validator
+    return validator
+
+
+# Marker for entities not given to the validation call.
+_no_ents = object()
 
 def validate_xml_l1 (text, spec=None, xmlfmt=None, ents=None,
                      casesens=True, accelamp=False):
@@ -961,6 +1325,10 @@ def validate_xml_l1 (text, spec=None, xmlfmt=None, ents=None,
     Text can be one or more entity definitions of the form C{<!ENTITY ...>},
     when special check is applied.
 
+    Results are remembered for the text, the identities of C{spec}
+    and C{ents} objects and the other parameters, so these objects
+    should not be modified after being used for validation.
+
     The result of the check is list of erroneous spans in the text,
     each given by start and end index (in Python standard semantics),
     and the error description, packed in a tuple.
@@ -986,63 +1354,250 @@ def validate_xml_l1 (text, spec=None, xmlfmt=None, ents=None,
     @rtype: list of (int, int, string) tuples
     """
 
-    if text.lstrip().startswith("<!ENTITY"):
-        return _validate_xml_entdef(text, xmlfmt)
-
-    # If ampersand accelerator marked allowed, replace one in non-entity
-    # position with &amp;, to let the parser proceed.
-    text_orig = text
-    if accelamp:
-        text = _escape_amp_accel(text)
-
-    # Make sure the text has a top tag.
-    text = "<%s>%s</%s>" % (_dummy_top, text, _dummy_top)
-
-    # Prepare parser.
-    xenc = "UTF-8"
-    parser = xml.parsers.expat.ParserCreate(xenc)
-    parser.UseForeignDTD() # not to barf on non-default XML entities
-    parser.StartElementHandler = _handler_start_element
-    parser.DefaultHandler = _handler_default
-
-    # Link state for handlers.
-    g = _g_xml_l1
-    g.text = text
-    g.spec = spec
-    g.xmlfmt = xmlfmt or "XML"
-    g.ents = ents
-    g.casesens = casesens
-    g.xenc = xenc
-    g.parser = parser
-    g.errcnt = 0
-    g.spans = []
-    g.tagstack = []
-
-    # Parse and check.
-    try:
-        parser.Parse(text.encode(xenc), True)
-    except xml.parsers.expat.ExpatError as e:
-        errmsg = _("@info a problem in the given type of markup "
-                   "(e.g. HTML, Docbook)",
-                   "%(mtype)s markup: %(snippet)s.",
-                   mtype=g.xmlfmt, snippet=e.args[0])
-        span = _make_span(text, e.lineno, e.offset, errmsg)
-        g.spans.append(span)
-
-    # Adapt spans back to original text.
-    pure_spans = [x[:2] for x in g.spans]
-    pure_spans = adapt_spans(text_orig, text, pure_spans, merge=False)
-    # Remove unhelpful line/column in error messages.
-    errmsgs = []
-    for errmsg, span in zip([x[2] for x in g.spans], pure_spans):
-        m = _lin_col_rx.search(errmsg)
-        if m:
-            errmsg = errmsg[:m.start()] + errmsg[m.end():]
-        errmsgs.append(errmsg)
-    # Put spans back together.
-    g.spans = [x + (y,) for x, y in zip(pure_spans, errmsgs)]
+    validator = XmlValidatorL1(spec, xmlfmt, ents, casesens, accelamp)
+    return validator.validate(text)
+
+
+class XmlValidatorL1 (object):
+    """
+    Validator of XML markup against L{level1<collect_xml_spec_l1>}
+    specification.
+
+    The validator holds the validation settings, and can be used
+    to validate any number of texts.
+    All the state of a particular validation is kept apart,
+    so the same validator can be used concurrently from several threads.
+
+    See L{validate_xml_l1} for description of the checks
+    and the results.
+    """
+
+    def __init__ (self, spec=None, xmlfmt=None, ents=None,
+                  casesens=True, accelamp=False, baseents=None):
+        """
+        Constructor.
+
+        See L{validate_xml_l1} for description of parameters.
+        Entities in C{baseents} are known in addition to those
+        given by C{ents}, if any.
+        """
+
+        self.spec = spec
+        self.xmlfmt = xmlfmt or "XML"
+        self.ents = ents
+        self.casesens = casesens
+        self.accelamp = accelamp
+        self.baseents = baseents
+
+
+    def validate (self, text, ents=_no_ents):
+        """
+        Validate markup in the text.
+
+        @param text: text to check
+        @type text: string
+        @param ents: set of known entities, instead of the one
+            given to the validator
+        @type ents: sequence
+
+        @returns: erroneous spans in the text
+        @rtype: list of (int, int, string) tuples
+        """
+
+        if ents is _no_ents:
+            ents = self.ents
+
+        with _memo_lock:
+            key = (_memo_ident(self.spec), self.xmlfmt, self.casesens,
+                   self.accelamp, _memo_ident(self.baseents),
+                   _memo_ident(ents), text)
+            spans = _validation_memo.get(key)
+        if spans is None:
+            spans = tuple(self._validate(text, ents))
+            with _memo_lock:
+                _validation_memo.set(key, spans)
+
+        return list(spans)
+
+
+    def _validate (self, text, ents):
+
+        if ents is not None and self.baseents is not None:
+            ents = Multidict([ents, self.baseents])
+
+        if text.lstrip().startswith("<!ENTITY"):
+            return _validate_xml_entdef(text, self.xmlfmt)
+
+        # If ampersand accelerator marked allowed, replace one in non-entity
+        # position with &amp;, to let the parser proceed.
+        text_orig = text
+        if self.accelamp:
+            text = _escape_amp_accel(text)
+
+        # Make sure the text has a top tag.
+        text = "<%s>%s</%s>" % (_dummy_top, text, _dummy_top)
+
+        # Parse and check.
+        run = _XmlL1Run(self, text, ents)
+        spans = run.parse()
+
+        # Adapt spans back to original text.
+        pure_spans = [x[:2] for x in spans]
+        pure_spans = adapt_spans(text_orig, text, pure_spans, merge=False)
+        # Remove unhelpful line/column in error messages.
+        errmsgs = []
+        for errmsg, span in zip([x[2] for x in spans], pure_spans):
+            m = _lin_col_rx.search(errmsg)
+            if m:
+                errmsg = errmsg[:m.start()] + errmsg[m.end():]
+            errmsgs.append(errmsg)
+        # Put spans back together.
+        return [x + (y,) for x, y in zip(pure_spans, errmsgs)]
+
+
+# State of a single validation by XmlValidatorL1,
+# linked to the parser through its handlers.
+class _XmlL1Run (object):
+
+    def __init__ (self, validator, text, ents):
+
+        self.text = text
+        self.spec = validator.spec
+        self.xmlfmt = validator.xmlfmt
+        self.ents = ents
+        self.casesens = validator.casesens
+        self.xenc = "UTF-8"
+        self.spans = []
+        self.tagstack = []
+
+        # Prepare parser.
+        self.parser = xml.parsers.expat.ParserCreate(self.xenc)
+        self.parser.UseForeignDTD() # not to barf on non-default XML entities
+        self.parser.StartElementHandler = self.handle_start_element
+        self.parser.DefaultHandler = self.handle_default
+
+
+    def parse (self):
+
+        try:
+            self.parser.Parse(self.text.encode(self.xenc), True)
+        except xml.parsers.expat.ExpatError as e:
+            errmsg = _("@info a problem in the given type of markup "
+                       "(e.g. HTML, Docbook)",
+                       "%(mtype)s markup: %(snippet)s.",
+                       mtype=self.xmlfmt, snippet=e.args[0])
+            span = _make_span(self.text, e.lineno, e.offset, errmsg)
+            self.spans.append(span)
+
+        # Break the reference cycle through handlers.
+        self.parser = None
+
+        return self.spans
+
+
+    def handle_start_element (self, tag, attrs):
+
+        if self.spec is None:
+            return
+
+        # Normalize names to lower case if allowed.
+        if not self.casesens:
+            tag = tag.lower()
+            attrs = dict([(x.lower(), y) for x, y in list(attrs.items())])
+
+        # Check existence of the tag.
+        if tag not in self.spec and tag != _dummy_top:
+            errmsg = _("@info",
+                       "%(mtype)s markup: unrecognized tag '%(tag)s'.",
+                       mtype=self.xmlfmt, tag=tag)
+            span = _make_span(self.text, self.parser.CurrentLineNumber,
+                              self.parser.CurrentColumnNumber + 1, errmsg)
+            self.spans.append(span)
+            return
+
+        if tag == _dummy_top:
+            return
+
+        elspec = self.spec[tag]
+        errmsgs = []
+
+        # Check applicability of attributes and validity of their values.
+        if elspec.attrs is not None:
+            for attr, aval in list(attrs.items()):
+                if attr not in elspec.attrs:
+                    errmsgs.append(_("@info",
+                                     "%(mtype)s markup: invalid attribute "
+                                     "'%(attr)s' to tag '%(tag)s'.",
+                                     mtype=self.xmlfmt, attr=attr, tag=tag))
+                else:
+                    avlint = elspec.avlints.get(attr)
+                    if avlint and not avlint(aval):
+                        errmsgs.append(_("@info",
+                                         "%(mtype)s markup: invalid value "
+                                         "'%(val)s' to attribute '%(attr)s'.",
+                                         mtype=self.xmlfmt, val=aval, attr=attr))
+
+        # Check presence of mandatory attributes.
+        if elspec.mattrs is not None:
+            for attr in elspec.mattrs:
+                if attr not in attrs:
+                    errmsgs.append(_("@info",
+                                     "%(mtype)s markup: missing mandatory attribute "
+                                     "'%(attr)s' to tag '%(tag)s'.",
+                                     mtype=self.xmlfmt, attr=attr, tag=tag))
+
+        # Check proper parentage.
+        if self.tagstack:
+            ptag = self.tagstack[-1]
+            pelspec = self.spec.get(ptag)
+            if (    pelspec is not None and pelspec.stags is not None
+                and tag not in pelspec.stags
+            ):
+                errmsgs.append(_("@info",
+                                 "%(mtype)s markup: tag '%(tag1)s' cannot be "
+                                 "a subtag of '%(tag2)s'.",
+                                 mtype=self.xmlfmt, tag1=tag, tag2=ptag))
+
+        # Record element stack.
+        self.tagstack.append(tag)
 
-    return g.spans
+        for errmsg in errmsgs:
+            span = _make_span(self.text, self.parser.CurrentLineNumber,
+                              self.parser.CurrentColumnNumber + 1, errmsg)
+            self.spans.append(span)
+
+
+    def handle_default (self, text):
+
+        if self.ents is not None and text.startswith('&') and text.endswith(';'):
+            ent = text[1:-1]
+            errmsg = None
+            if ent.startswith("#"):
+                if nument_to_char(ent) is None:
+                    errmsg = _("@info",
+                               "%(mtype)s markup: invalid numeric "
+                               "entity '%(ent)s'.",
+                               mtype=self.xmlfmt, ent=ent)
+            elif ent not in self.ents and ent not in xml_entities:
+                nearents = [] #difflib.get_close_matches(ent, self.ents)
+                if nearents:
+                    if len(nearents) > 5: # do not overwhelm message
+                        fmtents = format_item_list(nearents[:5], incmp=True)
+                    else:
+                        fmtents = format_item_list(nearents)
+                    errmsg = _("@info",
+                               "%(mtype)s markup: unknown entity '%(ent)s' "
+                               "(suggestions: %(entlist)s).",
+                               mtype=self.xmlfmt, ent=ent, entlist=fmtents)
+                else:
+                    errmsg = _("@info",
+                               "%(mtype)s markup: unknown entity '%(ent)s'.",
+                               mtype=self.xmlfmt, ent=ent)
+
+            if errmsg is not None:
+                span = _make_span(self.text, self.parser.CurrentLineNumber,
+                                  self.parser.CurrentColumnNumber + 1, errmsg)
+                self.spans.append(span)
 
 
 _ts_fence = "|/|"
@@ -1100,115 +1655,6 @@ def _escape_amp_accel (text):
     return text
 
 
-def _handler_start_element (tag, attrs):
-
-    g = _g_xml_l1
-
-    if g.spec is None:
-        return
-
-    # Normalize names to lower case if allowed.
-    if not g.casesens:
-        tag = tag.lower()
-        attrs = dict([(x.lower(), y) for x, y in list(attrs.items())])
-
-    # Check existence of the tag.
-    if tag not in g.spec and tag != _dummy_top:
-        errmsg = _("@info",
-                   "%(mtype)s markup: unrecognized tag '%(tag)s'.",
-                   mtype=g.xmlfmt, tag=tag)
-        span = _make_span(g.text, g.parser.CurrentLineNumber,
-                          g.parser.CurrentColumnNumber + 1, errmsg)
-        g.spans.append(span)
-        return
-
-    if tag == _dummy_top:
-        return
-
-    elspec = g.spec[tag]
-    errmsgs = []
-
-    # Check applicability of attributes and validity of their values.
-    if elspec.attrs is not None:
-        for attr, aval in list(attrs.items()):
-            if attr not in elspec.attrs:
-                errmsgs.append(_("@info",
-                                 "%(mtype)s markup: invalid attribute "
-                                 "'%(attr)s' to tag '%(tag)s'.",
-                                 mtype=g.xmlfmt, attr=attr, tag=tag))
-            else:
-                avlint = elspec.avlints.get(attr)
-                if avlint and not avlint(aval):
-                    errmsgs.append(_("@info",
-                                     "%(mtype)s markup: invalid value "
-                                     "'%(val)s' to attribute '%(attr)s'.",
-                                     mtype=g.xmlfmt, val=aval, attr=attr))
-
-    # Check presence of mandatory attributes.
-    if elspec.mattrs is not None:
-        for attr in elspec.mattrs:
-            if attr not in attrs:
-                errmsgs.append(_("@info",
-                                 "%(mtype)s markup: missing mandatory attribute "
-                                 "'%(attr)s' to tag '%(tag)s'.",
-                                 mtype=g.xmlfmt, attr=attr, tag=tag))
-
-    # Check proper parentage.
-    if g.tagstack:
-        ptag = g.tagstack[-1]
-        pelspec = g.spec.get(ptag)
-        if (    pelspec is not None and pelspec.stags is not None
-            and tag not in pelspec.stags
-        ):
-            errmsgs.append(_("@info",
-                             "%(mtype)s markup: tag '%(tag1)s' cannot be "
-                             "a subtag of '%(tag2)s'.",
-                             mtype=g.xmlfmt, tag1=tag, tag2=ptag))
-
-    # Record element stack.
-    g.tagstack.append(tag)
-
-    for errmsg in errmsgs:
-        span = _make_span(g.text, g.parser.CurrentLineNumber,
-                          g.parser.CurrentColumnNumber + 1, errmsg)
-        g.spans.append(span)
-
-
-def _handler_default (text):
-
-    g = _g_xml_l1
-
-    if g.ents is not None and text.startswith('&') and text.endswith(';'):
-        ent = text[1:-1]
-        errmsg = None
-        if ent.startswith("#"):
-            if nument_to_char(ent) is None:
-                errmsg = _("@info",
-                           "%(mtype)s markup: invalid numeric "
-                           "entity '%(ent)s'.",
-                           mtype=g.xmlfmt, ent=ent)
-        elif ent not in g.ents and ent not in xml_entities:
-            nearents = [] #difflib.get_close_matches(ent, g.ents)
-            if nearents:
-                if len(nearents) > 5: # do not overwhelm message
-                    fmtents = format_item_list(nearents[:5], incmp=True)
-                else:
-                    fmtents = format_item_list(nearents)
-                errmsg = _("@info",
-                           "%(mtype)s markup: unknown entity '%(ent)s' "
-                           "(suggestions: %(entlist)s).",
-                           mtype=g.xmlfmt, ent=ent, entlist=fmtents)
-            else:
-                errmsg = _("@info",
-                           "%(mtype)s markup: unknown entity '%(ent)s'.",
-                           mtype=g.xmlfmt, ent=ent)
-
-        if errmsg is not None:
-            span = _make_span(g.text, g.parser.CurrentLineNumber,
-                              g.parser.CurrentColumnNumber + 1, errmsg)
-            g.spans.append(span)
-
-
 # Text to fetch from the reported error position in XML stream.
 _near_xml_error_rx = re.compile(r"\W*[\w:.-]*[^\w\s>]*(\s*>)?", re.U)
 
@@ -1479,8 +1925,6 @@ def _get_entities (entspec):
     return entities
 
 
-_docbook4_l1 = None
-
 def validate_docbook4_l1 (text, ents=None):
     """
     Validate Docbook 4.x markup in text against L{level1<collect_xml_spec_l1>}
@@ -1502,13 +1946,12 @@ def validate_docbook4_l1 (text, ents=None):
     @rtype: list of (int, int, string) tuples
     """
 
-    global _docbook4_l1
-    if _docbook4_l1 is None:
+    def make ():
         specpath = os.path.join(datadir(), "spec", "docbook4.l1")
-        _docbook4_l1 = collect_xml_spec_l1(specpath)
+        xmlfmt = _("@item markup type", "Docbook4")
+        return XmlValidatorL1(collect_xml_spec_l1(specpath), xmlfmt)
 
-    xmlfmt = _("@item markup type", "Docbook4")
-    return validate_xml_l1(text, spec=_docbook4_l1, xmlfmt=xmlfmt, ents=ents)
+    return _shared_validator("docbook4", make).validate(text, ents)
 
 
 _db4_meta_msgctxt = set((
@@ -1583,8 +2026,6 @@ def check_docbook4_msg (strict=False, entities={}, mkeyw=None):
 _entpath_html = os.path.join(datadir(), "spec", "html.entities")
 html_entities = read_entities(_entpath_html)
 
-_html_l1 = None
-
 def validate_html_l1 (text, ents=None):
     """
     Validate HTML markup in text against L{level1<collect_xml_spec_l1>}
@@ -1605,17 +2046,13 @@ def validate_html_l1 (text, ents=None):
     @rtype: list of (int, int, string) tuples
     """
 
-    global _html_l1
-    if _html_l1 is None:
+    def make ():
         specpath = os.path.join(datadir(), "spec", "html.l1")
-        _html_l1 = collect_xml_spec_l1(specpath)
-
-    if ents is not None:
-        ents = Multidict([ents, html_entities])
+        xmlfmt = _("@item markup type", "HTML")
+        return XmlValidatorL1(collect_xml_spec_l1(specpath), xmlfmt,
+                              baseents=html_entities, accelamp=True, casesens=False)
 
-    xmlfmt = _("@item markup type", "HTML")
-    return validate_xml_l1(text, spec=_html_l1, xmlfmt=xmlfmt, ents=ents,
-                           accelamp=True, casesens=False)
+    return _shared_validator("html", make).validate(text, ents)
 
 
 def check_html (strict=False, entities={}, mkeyw=None):
@@ -1644,8 +2081,6 @@ def check_html_sp (strict=False, entities={}, mkeyw=None):
     return _check_xml_w(validate_html_l1, strict, entities, mkeyw, True)
 
 
-_qtrich_l1 = None
-
 def validate_qtrich_l1 (text, ents=None):
     """
     Validate Qt rich-text markup in text against L{level1<collect_xml_spec_l1>}
@@ -1667,17 +2102,13 @@ def validate_qtrich_l1 (text, ents=None):
     @rtype: list of (int, int, string) tuples
     """
 
-    global _qtrich_l1
-    if _qtrich_l1 is None:
+    def make ():
         specpath = os.path.join(datadir(), "spec", "qtrich.l1")
-        _qtrich_l1 = collect_xml_spec_l1(specpath)
+        xmlfmt = _("@item markup type", "Qt-rich")
+        return XmlValidatorL1(collect_xml_spec_l1(specpath), xmlfmt,
+                              baseents=html_entities, accelamp=True, casesens=False)
 
-    if ents is not None:
-        ents = Multidict([ents, html_entities])
-
-    xmlfmt = _("@item markup type", "Qt-rich")
-    return validate_xml_l1(text, spec=_qtrich_l1, xmlfmt=xmlfmt, ents=ents,
-                           accelamp=True, casesens=False)
+    return _shared_validator("qtrich", make).validate(text, ents)
 
 
 def check_qtrich (strict=False, entities={}, mkeyw=None):
@@ -1709,8 +2140,6 @@ def check_qtrich_sp (strict=False, entities={}, mkeyw=None):
 _entpath_kuit = os.path.join(datadir(), "spec", "kuit.entities")
 kuit_entities = read_entities(_entpath_kuit)
 
-_kuit_l1 = None
-
 def validate_kuit_l1 (text, ents=None):
     """
     Validate KUIT markup in text against L{level1<collect_xml_spec_l1>}
@@ -1730,21 +2159,18 @@ def validate_kuit_l1 (text, ents=None):
     @rtype: list of (int, int, string) tuples
     """
 
-    global _kuit_l1
-    if _kuit_l1 is None:
+    def make ():
         specpath = os.path.join(datadir(), "spec", "kuit.l1")
-        _kuit_l1 = collect_xml_spec_l1(specpath)
-
-    if ents is not None:
-        ents = Multidict([ents, kuit_entities])
+        xmlfmt = _("@item markup type", "KUIT")
+        return XmlValidatorL1(collect_xml_spec_l1(specpath), xmlfmt,
+                              baseents=kuit_entities, accelamp=True)
 
-    xmlfmt = _("@item markup type", "KUIT")
-    return validate_xml_l1(text, spec=_kuit_l1, xmlfmt=xmlfmt, ents=ents,
-                           accelamp=True)
+    return _shared_validator("kuit", make).validate(text, ents)
 
 
-_kde4_l1 = None
-_kde4_ents = None
+_kde4_ents = {}
+_kde4_ents.update(html_entities)
+_kde4_ents.update(kuit_entities)
 
 def validate_kde4_l1 (text, ents=None):
     """
@@ -1765,23 +2191,17 @@ def validate_kde4_l1 (text, ents=None):
     @rtype: list of (int, int, string) tuples
     """
 
-    global _kde4_l1, _kde4_ents
-    if _kde4_l1 is None:
-        _kde4_l1 = {}
+    def make ():
+        spec = {}
         spath1 = os.path.join(datadir(), "spec", "qtrich.l1")
-        _kde4_l1.update(collect_xml_spec_l1(spath1))
+        spec.update(collect_xml_spec_l1(spath1))
         spath2 = os.path.join(datadir(), "spec", "kuit.l1")
-        _kde4_l1.update(collect_xml_spec_l1(spath2))
-        _kde4_ents = {}
-        _kde4_ents.update(html_entities)
-        _kde4_ents.update(kuit_entities)
+        spec.update(collect_xml_spec_l1(spath2))
+        xmlfmt = _("@item markup type", "KDE")
+        return XmlValidatorL1(spec, xmlfmt, baseents=_kde4_ents,
+                              accelamp=True, casesens=False)
 
-    if ents is not None:
-        ents = Multidict([ents, _kde4_ents])
-
-    xmlfmt = _("@item markup type", "KDE")
-    return validate_xml_l1(text, spec=_kde4_l1, xmlfmt=xmlfmt, ents=ents,
-                           accelamp=True, casesens=False)
+    return _shared_validator("kde4", make).validate(text, ents)
 
 
 def check_kde4 (strict=False, entities={}, mkeyw=None):
@@ -1809,8 +2229,6 @@ def check_kde4_sp (strict=False, entities={}, mkeyw=None):
     return _check_xml_w(validate_kde4_l1, strict, entities, mkeyw, True)
 
 
-_pango_l1 = None
-
 def validate_pango_l1 (text, ents=None):
     """
     Validate Pango markup in text against L{level1<collect_xml_spec_l1>}
@@ -1828,17 +2246,13 @@ def validate_pango_l1 (text, ents=None):
     @rtype: list of (int, int, string) tuples
     """
 
-    global _pango_l1
-    if _pango_l1 is None:
+    def make ():
         specpath = os.path.join(datadir(), "spec", "pango.l1")
-        _pango_l1 = collect_xml_spec_l1(specpath)
-
-    if ents is not None:
-        ents = Multidict([ents, html_entities])
+        xmlfmt = _("@item markup type", "Pango")
+        return XmlValidatorL1(collect_xml_spec_l1(specpath), xmlfmt,
+                              baseents=html_entities, accelamp=True, casesens=False)
 
-    xmlfmt = _("@item markup type", "Pango")
-    return validate_xml_l1(text, spec=_pango_l1, xmlfmt=xmlfmt, ents=ents,
-                           accelamp=True, casesens=False)
+    return _shared_validator("pango", make).validate(text, ents)
 
 
 def check_pango (strict=False, entities={}, mkeyw=None):
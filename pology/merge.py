@@ -7,15 +7,19 @@ Merge PO files.
 @license: GPLv3
 """
 
+from collections import Counter
 import os
 import shutil
 from tempfile import NamedTemporaryFile
 
 from pology import PologyError, _, n_
 from pology.catalog import Catalog
-from pology.diff import editprob
+from pology.compendium import CompendiumIndex, compendium_index, ngrams
+from pology.diff import editprob_many, tmatch_many
 from pology.fsops import unicode_to_str
-from pology.message import Message
+from pology.header import Header
+from pology.message import Message, MessageUnsafe
+from pology.report import format_item_list
 from pology.split import proper_words
 
 
@@ -24,12 +28,18 @@ def merge_pofile (catpath, tplpath,
                   fuzzymatch=True, cmppaths=None, quiet=False,
                   fuzzex=False, minwnex=0, minasfz=0.0, refuzzy=False,
                   getcat=False, monitored=True,
-                  ignpotdate=False, abort=False):
+                  ignpotdate=False, abort=False, engine=None):
     """
     Merge a PO file with the PO template.
 
     This function is a frontend to C{msgmerge} command,
     providing some additional features on demand.
+    Instead of C{msgmerge}, the native merge engine can be used
+    (see L{merge_catalogs}), which merges catalogs in memory
+    and hands the result directly to any further processing.
+    The native engine also consults compendia through their indexes
+    (see L{compendium_index<compendium.compendium_index>}),
+    instead of reading them for every PO file merged.
 
     This function is usually used in one of three ways:
       - create a new PO file: the path is given with C{outpath} parameter
@@ -93,11 +103,23 @@ def merge_pofile (catpath, tplpath,
     @type ignpotdate: bool
     @param abort: whether to abort execution if C{msgmerge} fails
     @type abort: bool
+    @param engine: the merge engine, C{"msgmerge"} (default)
+        or C{"native"}
+    @type engine: string
 
     @returns: whether merging succeeded, or catalog object
     @rtype: bool or L{Catalog<catalog.Catalog>} or C{None}
     """
 
+    if engine is None:
+        engine = "msgmerge"
+    if engine not in _merge_engines:
+        raise PologyError(
+            _("@info",
+              "Unknown merge engine '%(name)s', "
+              "expected one of: %(namelist)s.",
+              name=engine, namelist=format_item_list(_merge_engines)))
+
     if wrapping is not None:
         wrap = "basic" in wrapping
         otherwrap = set(wrapping).difference(["basic"])
@@ -108,7 +130,7 @@ def merge_pofile (catpath, tplpath,
     # Store original catalog if change in template creation date
     # alone should be ignored, for check at the end.
     if ignpotdate:
-        orig_cat = Catalog(catpath, monitored=False)
+        orig_cat = _open_catalog(catpath, tplpath, monitored=False)
 
     # Determine which special operations are to be done.
     correct_exact_matches = cmppaths and (fuzzex or minwnex > 0)
@@ -116,9 +138,10 @@ def merge_pofile (catpath, tplpath,
     rebase_existing_fuzzies = refuzzy and fuzzymatch
 
     # Pre-process catalog if necessary.
-    if correct_exact_matches or rebase_existing_fuzzies:
+    may_open = correct_exact_matches or rebase_existing_fuzzies
+    if may_open:
         may_modify = rebase_existing_fuzzies
-        cat = Catalog(catpath, monitored=may_modify)
+        cat = _open_catalog(catpath, tplpath, monitored=may_modify)
 
         # In case compendium is being used,
         # collect keys of all non-translated messages,
@@ -170,15 +193,102 @@ def merge_pofile (catpath, tplpath,
                         cat.add_last(dmsg)
                         rebase_dummy_messages.append(dmsg)
 
-        if may_modify:
+        if may_modify and not cat.created():
             cat.sync()
 
     # Prepare temporary file if output path not given and not in update mode.
-    if not outpath and not update:
+    if engine == "msgmerge" and not outpath and not update:
         tmpf = NamedTemporaryFile(prefix="pology-merged-", suffix=".po")
         outpath = tmpf.name
 
     # Merge.
+    if engine == "native":
+        try:
+            cat = _merge_pofile_native(catpath, tplpath, outpath, update,
+                                       wrapping, fuzzymatch, cmppaths,
+                                       getcat, monitored,
+                                       cat if may_open else None,
+                                       tcat if correct_exact_matches else None)
+        except PologyError:
+            if abort:
+                raise
+            return None if getcat else False
+    elif not _merge_pofile_msgmerge(catpath, tplpath, outpath, update,
+                                    wrap, fuzzymatch, cmppaths, quiet,
+                                    abort):
+        return None if getcat else False
+
+    # Post-process merged catalog if necessary.
+    if (   getcat or otherwrap or correct_exact_matches
+        or correct_fuzzy_matches or ignpotdate or rebase_existing_fuzzies
+    ):
+        # If fine wrapping requested and catalog should not be returned,
+        # everything has to be reformatted, so no need to monitor the catalog.
+        # The natively merged catalog has already been created so.
+        if engine != "native":
+            catpath1 = outpath or catpath
+            monitored1 = monitored if getcat else (not otherwrap)
+            cat = Catalog(catpath1, monitored=monitored1, wrapping=wrapping)
+
+        # In case compendium is being used,
+        # make fuzzy exact matches which do not pass the word limit.
+        if correct_exact_matches:
+            acc = cat.accelerator()
+            for msg in cat:
+                if (    msg.key in nontrkeys and msg.translated
+                    and (   fuzzex
+                         or len(proper_words(msg.msgid, accels=acc)) < minwnex)
+                ):
+                    msg.fuzzy = True
+                    msg.msgctxt_previous = msg.msgctxt
+                    msg.msgid_previous = msg.msgid
+                    msg.msgid_plural_previous = msg.msgid_plural
+
+        # Eliminate fuzzy matches not passing the adjusted similarity limit.
+        if correct_fuzzy_matches:
+            fmsgs = [msg for msg in cat
+                     if msg.fuzzy and msg.msgid_previous is not None]
+            probs = editprob_many([(msg.msgid_previous, msg.msgid)
+                                   for msg in fmsgs])
+            for msg, prob in zip(fmsgs, probs):
+                if prob < minasfz:
+                    msg.clear()
+
+        # Revert template creation date change if it was the only change.
+        if ignpotdate:
+            fname = "POT-Creation-Date"
+            orig_potdate = orig_cat.header.get_field_value(fname)
+            new_potdate = cat.header.get_field_value(fname)
+            cat.header.replace_field_value(fname, orig_potdate)
+            if cat != orig_cat:
+                cat.header.replace_field_value(fname, new_potdate)
+
+        # Remove dummy messages added for rebasing of fuzzy messages
+        # that were obsoleted instead of promoted to fuzzy.
+        if rebase_existing_fuzzies:
+            for dmsg in rebase_dummy_messages:
+                if dmsg in cat and cat[dmsg].obsolete:
+                    cat.remove_on_sync(dmsg)
+
+        if not getcat and engine != "native":
+            cat.sync(force=otherwrap)
+
+    # Write out the natively merged catalog.
+    if engine == "native" and cat.filename:
+        cat.sync(force=otherwrap)
+        if update and outpath and catpath != outpath:
+            shutil.copyfile(outpath, catpath)
+
+    return cat if getcat else True
+
+
+_merge_engines = ("msgmerge", "native")
+
+# Merge using msgmerge, writing the result to the output path
+# and/or updating the catalog. Return whether merging succeeded.
+def _merge_pofile_msgmerge (catpath, tplpath, outpath, update,
+                            wrap, fuzzymatch, cmppaths, quiet, abort):
+
     opts = []
     if not update:
         opts.append("--output-file %s" % outpath)
@@ -209,7 +319,7 @@ def merge_pofile (catpath, tplpath,
                 _("@info",
                   "Cannot merge PO file '%(file1)s' with template '%(file2)s'.",
                   file1=catpath, file2=tplpath))
-        return None if getcat else False
+        return False
 
     # If the catalog had only header and no messages,
     # msgmerge will not write out anything.
@@ -221,55 +331,300 @@ def merge_pofile (catpath, tplpath,
     if update and outpath and catpath != outpath:
         shutil.copyfile(outpath, catpath)
 
-    # Post-process merged catalog if necessary.
-    if (   getcat or otherwrap or correct_exact_matches
-        or correct_fuzzy_matches or ignpotdate or rebase_existing_fuzzies
+    return True
+
+
+# Open the catalog to merge. If there is no catalog (e.g. the path is
+# /dev/null, for starting from the template alone), create an empty one,
+# with the header taken from the template, as msgmerge does.
+def _open_catalog (catpath, tplpath, monitored, tcat=None):
+
+    if (    catpath != os.devnull and os.path.exists(catpath)
+        and os.path.getsize(catpath) > 0
     ):
-        # If fine wrapping requested and catalog should not be returned,
-        # everything has to be reformatted, so no need to monitor the catalog.
-        catpath1 = outpath or catpath
-        monitored1 = monitored if getcat else (not otherwrap)
-        cat = Catalog(catpath1, monitored=monitored1, wrapping=wrapping)
+        return Catalog(catpath, monitored=monitored)
 
-        # In case compendium is being used,
-        # make fuzzy exact matches which do not pass the word limit.
-        if correct_exact_matches:
-            acc = cat.accelerator()
-            for msg in cat:
-                if (    msg.key in nontrkeys and msg.translated
-                    and (   fuzzex
-                         or len(proper_words(msg.msgid, accels=acc)) < minwnex)
-                ):
-                    msg.fuzzy = True
-                    msg.msgctxt_previous = msg.msgctxt
-                    msg.msgid_previous = msg.msgid
-                    msg.msgid_plural_previous = msg.msgid_plural
+    if tcat is None:
+        tcat = Catalog(tplpath, monitored=False)
+    cat = Catalog("", create=True, monitored=monitored)
+    cat.filename = catpath
+    cat.header = Header(tcat.header)
+    return cat
 
-        # Eliminate fuzzy matches not passing the adjusted similarity limit.
-        if correct_fuzzy_matches:
-            for msg in cat:
-                if msg.fuzzy and msg.msgid_previous is not None:
-                    if editprob(msg.msgid_previous, msg.msgid) < minasfz:
-                        msg.clear()
 
-        # Revert template creation date change if it was the only change.
-        if ignpotdate:
-            fname = "POT-Creation-Date"
-            orig_potdate = orig_cat.header.get_field_value(fname)
-            new_potdate = cat.header.get_field_value(fname)
-            cat.header.replace_field_value(fname, orig_potdate)
-            if cat != orig_cat:
-                cat.header.replace_field_value(fname, new_potdate)
+# Merge using the native engine, returning the merged catalog
+# with the file name set to the output path or the catalog path
+# (if updating), or empty otherwise. It is not synced yet.
+# The catalog and the template are reused if already open.
+def _merge_pofile_native (catpath, tplpath, outpath, update,
+                          wrapping, fuzzymatch, cmppaths,
+                          getcat, monitored, cat=None, tcat=None):
 
-        # Remove dummy messages added for rebasing of fuzzy messages
-        # that were obsoleted instead of promoted to fuzzy.
-        if rebase_existing_fuzzies:
-            for dmsg in rebase_dummy_messages:
-                if dmsg in cat and cat[dmsg].obsolete:
-                    cat.remove_on_sync(dmsg)
+    if tcat is None:
+        tcat = Catalog(tplpath, monitored=False)
+    if cat is None:
+        cat = _open_catalog(catpath, tplpath, monitored=False, tcat=tcat)
+    # Compendia are consulted through their indexes,
+    # which are built once and then shared by all merges.
+    cmpidxs = [compendium_index(x) for x in (cmppaths or [])]
 
-        if not getcat:
-            cat.sync(force=otherwrap)
+    # Monitoring is of no use if the catalog is only to be written out,
+    # as all messages are new.
+    monitored1 = monitored if getcat else False
+    mcat = merge_catalogs(cat, tcat, cmpidxs, fuzzymatch=fuzzymatch,
+                          keepprev=fuzzymatch, monitored=monitored1,
+                          wrapping=wrapping)
+    mcat.filename = outpath or (catpath if update else "")
 
-    return cat if getcat else True
+    return mcat
+
+
+
+def merge_catalogs (cat, tcat, cmpcats=(), fuzzymatch=True,
+                    keepprev=True, monitored=False, wrapping=None):
+    """
+    Merge a catalog with the template catalog in memory.
+
+    This is a native counterpart of C{msgmerge}, with the same semantics.
+    Messages are taken from the template, in template order,
+    and translations from their counterparts in the catalog.
+    A counterpart is a message with the same key (exact match),
+    or, if there is none and fuzzy matching is enabled,
+    the translated message with the most similar C{msgid} (fuzzy match),
+    which becomes fuzzy in the merged catalog.
+    Compendia are consulted in the same way,
+    with translations from the catalog preferred on exact matches.
+    A compendium may be given either as a catalog, or as its index
+    (see L{compendium_index<compendium.compendium_index>}),
+    which avoids parsing it anew on every merge.
+    Translated messages of the catalog without a counterpart in
+    the template are appended as obsolete.
+    The header is taken from the catalog, with C{POT-Creation-Date}
+    and C{Report-Msgid-Bugs-To} fields updated from the template.
+
+    Similarity of texts is computed as by C{msgmerge}, based on
+    the longest common subsequence of characters.
+    Candidates for fuzzy matching are first selected by character n-grams
+    shared with the template text, so that the template message need not
+    be compared with every message in the catalog and compendia.
+    This makes the choice heuristic, like that of C{msgmerge};
+    in rare cases, the two may pick different fuzzy matches.
+
+    The merged catalog is created anew, with the file name of the catalog,
+    and is not synced.
+
+    @param cat: the catalog to merge
+    @type cat: L{Catalog<catalog.Catalog>}
+    @param tcat: the template catalog
+    @type tcat: L{Catalog<catalog.Catalog>}
+    @param cmpcats: compendium catalogs or their indexes
+    @type cmpcats: sequence of L{Catalog<catalog.Catalog>}
+        or L{CompendiumIndex<compendium.CompendiumIndex>}
+    @param fuzzymatch: whether to perform fuzzy matching
+    @type fuzzymatch: bool
+    @param keepprev: whether to set previous fields on fuzzy messages
+    @type keepprev: bool
+    @param monitored: whether to create the merged catalog
+        in monitoring mode
+    @type monitored: bool
+    @param wrapping: the wrapping policy of the merged catalog (see
+        the parameter of the same name to
+        L{catalog constructor<catalog.Catalog>})
+    @type wrapping: sequence of strings
+
+    @returns: merged catalog
+    @rtype: L{Catalog<catalog.Catalog>}
+    """
+
+    MessageType = Message if monitored else MessageUnsafe
+
+    mcat = Catalog("", create=True, monitored=monitored, wrapping=wrapping)
+    mcat.filename = cat.filename
+    mcat.header = Header(cat.header)
+    for fname in ("POT-Creation-Date", "Report-Msgid-Bugs-To"):
+        fval = tcat.header.get_field_value(fname)
+        if fval is not None:
+            mcat.header.set_field(fname, fval)
+    nplurals = 2
+    if cat.header.get_field_value("Plural-Forms") is not None:
+        nplurals = cat.nplurals()
+
+    # Obsolete messages in compendia are not consulted.
+    # Indexed compendia are consulted after compendium catalogs,
+    # wherever they are given.
+    defmsgs = list(cat)
+    cmpidxs = []
+    for cmpcat in cmpcats:
+        if isinstance(cmpcat, CompendiumIndex):
+            cmpidxs.append(cmpcat)
+        else:
+            defmsgs.extend(x for x in cmpcat if not x.obsolete)
+
+    # Index definition messages by key, for exact matching.
+    # On equal keys, a translated message is preferred,
+    # and then the message which came first.
+    exact = {}
+    for msg in defmsgs:
+        omsg = exact.get(msg.key)
+        if omsg is None or (_is_blank(omsg) and not _is_blank(msg)):
+            exact[msg.key] = msg
+
+    tmsgs = list(tcat)
+    dmsgs = [exact.get(x.key) for x in tmsgs]
+    for i, tmsg in enumerate(tmsgs):
+        for cmpidx in cmpidxs:
+            if dmsgs[i] is not None and not _is_blank(dmsgs[i]):
+                break
+            msg = cmpidx.get(tmsg.key)
+            if msg is not None and (dmsgs[i] is None or not _is_blank(msg)):
+                dmsgs[i] = msg
+    fuzzies = [False] * len(tmsgs)
+    if fuzzymatch:
+        inds = [i for i, x in enumerate(dmsgs) if x is None]
+        if inds:
+            candmsgs = [x for x in defmsgs if not _is_blank(x)]
+            fmsgs = _select_fuzzy([tmsgs[i] for i in inds], candmsgs,
+                                  cmpidxs)
+            for i, fmsg in zip(inds, fmsgs):
+                dmsgs[i] = fmsg
+                fuzzies[i] = fmsg is not None
+
+    used = set()
+    for tmsg, dmsg, fuzzy in zip(tmsgs, dmsgs, fuzzies):
+        if dmsg is not None:
+            used.add(id(dmsg))
+        mmsg = _merge_message(tmsg, dmsg, fuzzy, nplurals, keepprev)
+        mcat.add_last(MessageType(mmsg))
+
+    # Translated messages of the catalog not used for merging,
+    # including those already obsolete, are kept as obsolete.
+    for msg in cat:
+        if id(msg) not in used and any(msg.msgstr):
+            omsg = MessageType(msg)
+            omsg.obsolete = True
+            omsg.auto_comment = type(omsg.auto_comment)()
+            omsg.source = type(omsg.source)()
+            mcat.add_last(omsg)
+
+    return mcat
+
+
+# Whether the message has no translation at all,
+# in which case it is the last choice among exact matches.
+def _is_blank (msg):
+
+    return len(msg.msgstr) == 1 and not msg.msgstr[0]
+
+
+# Create initial data for the merged message,
+# from template message and the matched message from definitions.
+def _merge_message (tmsg, dmsg, fuzzy, nplurals, keepprev):
+
+    plural = tmsg.msgid_plural is not None
+    mmsg = dict(msgctxt=tmsg.msgctxt, msgid=tmsg.msgid,
+                msgid_plural=tmsg.msgid_plural,
+                auto_comment=tmsg.auto_comment, source=tmsg.source)
+    flags = [x for x in tmsg.flag if x != "fuzzy"]
+    if dmsg is None:
+        mmsg["msgstr"] = [""] * (nplurals if plural else 1)
+        mmsg["flag"] = flags
+        return mmsg
+
+    msgstr = list(dmsg.msgstr)
+    if plural and dmsg.msgid_plural is None:
+        msgstr = msgstr[:1] * nplurals
+        fuzzy = True
+    elif not plural and dmsg.msgid_plural is not None:
+        msgstr = msgstr[:1]
+        fuzzy = True
+    elif plural and tmsg.msgid_plural != dmsg.msgid_plural:
+        fuzzy = True
+
+    # A fuzzy message keeps its previous fields (or lack of them),
+    # otherwise they are set to the matched message if it became fuzzy.
+    # Untranslated messages are never fuzzy.
+    prev = (None, None, None)
+    if dmsg.fuzzy:
+        fuzzy = True
+        prev = (dmsg.msgctxt_previous, dmsg.msgid_previous,
+                dmsg.msgid_plural_previous)
+    elif fuzzy:
+        prev = (dmsg.msgctxt, dmsg.msgid, dmsg.msgid_plural)
+    fuzzy = fuzzy and any(msgstr)
+    if keepprev and fuzzy:
+        (mmsg["msgctxt_previous"], mmsg["msgid_previous"],
+         mmsg["msgid_plural_previous"]) = prev
+
+    mmsg["manual_comment"] = dmsg.manual_comment
+    mmsg["msgstr"] = msgstr
+    mmsg["flag"] = (["fuzzy"] if fuzzy else []) + flags
+    return mmsg
+
+
+# Minimal similarity of texts for a fuzzy match, as in msgmerge.
+_fuzzy_threshold = 0.6
+
+# Bonus to similarity when the message has the same or no context,
+# to prefer such message on otherwise equal similarity, as in msgmerge.
+_fuzzy_context_bonus = 0.00001
+
+# The number of candidates compared by similarity.
+_fuzzy_max_cands = 20
+
+# Select best fuzzy matches of template messages among candidate
+# definition messages and messages from compendium indexes;
+# None for template messages which have no match.
+def _select_fuzzy (tmsgs, candmsgs, cmpidxs=()):
+
+    # Index candidates by n-grams of their msgids.
+    index = {}
+    for i, msg in enumerate(candmsgs):
+        for ngram in ngrams(msg.msgid):
+            index.setdefault(ngram, []).append(i)
+
+    # Collect the most promising candidates for each template message,
+    # and compare them all by similarity at once.
+    pairs = []
+    spans = []
+    for tmsg in tmsgs:
+        counts = Counter()
+        for ngram in ngrams(tmsg.msgid):
+            counts.update(index.get(ngram, ()))
+        lent = len(tmsg.msgid)
+        cands = []
+        for i, count in counts.items():
+            lenc = len(candmsgs[i].msgid)
+            # Similarity cannot exceed 2 * min(lenc, lent) / (lenc + lent).
+            if 2.0 * min(lenc, lent) > _fuzzy_threshold * (lenc + lent):
+                cands.append((-count, (0, i)))
+        # Candidates from compendium indexes come after all others.
+        for k, cmpidx in enumerate(cmpidxs):
+            for i, count in cmpidx.candidates(tmsg.msgid, _fuzzy_threshold,
+                                              _fuzzy_max_cands):
+                cands.append((-count, (k + 1, i)))
+        cands.sort()
+        cands = [x for c, x in cands[:_fuzzy_max_cands]]
+        # Compare in order of candidates, for the first best one to win.
+        cands.sort()
+        cmsgs = [candmsgs[i] if k == 0 else cmpidxs[k - 1].message(i)
+                 for k, i in cands]
+        spans.append((len(pairs), cmsgs))
+        pairs.extend((msg.msgid, tmsg.msgid) for msg in cmsgs)
+    matches = tmatch_many(pairs, engine="lcs")
+
+    fmsgs = []
+    for tmsg, (pos, cmsgs) in zip(tmsgs, spans):
+        best_msg = None
+        best_weight = _fuzzy_threshold
+        for k, msg in enumerate(cmsgs):
+            nmatch, diffratio = matches[pos + k]
+            weight = 1.0 - diffratio
+            if msg.msgctxt is None or msg.msgctxt == tmsg.msgctxt:
+                weight += _fuzzy_context_bonus
+            if weight > best_weight:
+                best_msg = msg
+                best_weight = weight
+        fmsgs.append(best_msg)
+
+    return fmsgs
 
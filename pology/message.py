@@ -297,6 +297,19 @@ class Message_base (object):
         self._colorize_prev = 0
 
 
+    # Messages are pickled by their instance dictionary.
+    # The state must be restored without going through attribute getters
+    # and setters, which expect the attribute handler to be already set.
+    def __getstate__ (self):
+
+        return self.__dict__
+
+
+    def __setstate__ (self, state):
+
+        self.__dict__.update(state)
+
+
     def __getattr__ (self, att):
         """
         Attribute getter.
@@ -425,10 +438,17 @@ class Message_base (object):
         if 0: pass
 
         elif att == "fuzzy":
+            # Flags of unsafe messages are kept in a dictionary, for order.
             if val == True:
-                self.flag.add("fuzzy")
+                if isinstance(self.flag, dict):
+                    self.flag["fuzzy"] = None
+                else:
+                    self.flag.add("fuzzy")
             elif "fuzzy" in self.flag:
-                self.flag.remove("fuzzy")
+                if isinstance(self.flag, dict):
+                    del self.flag["fuzzy"]
+                else:
+                    self.flag.remove("fuzzy")
 
         else:
             self.__dict__["^getsetattr"].__setattr__(self, att, val)
@@ -0,0 +1,249 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Filter messages, sharing filtered copies through a cache.
+
+Several sieves and rules prepare a filtered copy of each message
+before examining it (removing accelerators, markup, literals, etc.).
+When the same filter is applied to the same message again,
+be it by another rule, another sieve in the same run,
+or in a later run with persistent caches enabled
+(see L{set_persistent<cache.set_persistent>}),
+the filtered copy is fetched from the cache instead.
+
+A filter is identified by a filter identity given by the caller,
+which must be equal for filters which produce equal results.
+Since filters are usually composed of hooks, which may come from
+user files, the identity should include the L{hook_fingerprint}
+of each hook, so that filtered copies stored on disk are not reused
+after the code of a hook has been modified.
+Filters are taken to depend only on the message content
+and on the catalog properties which may be set from the outside
+(name, accelerator markers, markup types, language, environments);
+filters which depend on anything else should not be cached.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import os
+
+from pology import PologyError, _, version
+from pology.cache import file_hash, named_cache, text_hash
+from pology.message import MessageUnsafe
+
+
+_filtered_cache_size = 50000
+_filtered_cache_version = "2-%s" % version()
+
+_msg_fields = (
+    "manual_comment", "auto_comment", "source", "flag", "obsolete",
+    "msgctxt_previous", "msgid_previous", "msgid_plural_previous",
+    "msgctxt", "msgid", "msgid_plural", "msgstr",
+)
+
+def _dump_msg (msg):
+
+    return dict((x, msg.get(x)) for x in _msg_fields)
+
+
+def _load_msg (msgdict):
+
+    return MessageUnsafe(msgdict)
+
+
+def _filtered_cache ():
+
+    return named_cache("filtered-messages",
+                       size=_filtered_cache_size,
+                       version=_filtered_cache_version,
+                       dumpf=_dump_msg, loadf=_load_msg)
+
+
+_hook_fingerprints = {}
+
+def hook_fingerprint (hook):
+    """
+    Compute a fingerprint of the code of a hook.
+
+    Source files of the hook function, and of functions which it
+    refers to through its closure (as when the hook was created
+    by a hook factory or composed of other hooks), are hashed.
+
+    @param hook: the hook
+    @type hook: callable
+
+    @returns: fingerprint
+    @rtype: string
+    """
+
+    fprint = _hook_fingerprints.get(hook)
+    if fprint is None:
+        paths = set()
+        _collect_code_paths(hook, paths, set())
+        fprint = file_hash(sorted(paths))
+        _hook_fingerprints[hook] = fprint
+
+    return fprint
+
+
+def _collect_code_paths (obj, paths, seen):
+
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, (list, tuple)):
+        for elem in obj:
+            _collect_code_paths(elem, paths, seen)
+        return
+    if not callable(obj):
+        return
+
+    func = getattr(obj, "__func__", obj) # bound method
+    code = getattr(func, "__code__", None)
+    if code is None: # callable object
+        func = getattr(type(obj), "__call__", None)
+        code = getattr(func, "__code__", None)
+    if code is None: # builtin
+        return
+    if os.path.isfile(code.co_filename):
+        paths.add(os.path.abspath(code.co_filename))
+    for cell in func.__closure__ or ():
+        try:
+            _collect_code_paths(cell.cell_contents, paths, seen)
+        except ValueError: # empty cell
+            pass
+
+
+def message_fingerprint (msg):
+    """
+    Compute a fingerprint of message content.
+
+    All parts of the message which a filter may examine are included,
+    but not the position of the message in the catalog.
+
+    @param msg: the message
+    @type msg: L{Message_base}
+
+    @returns: fingerprint
+    @rtype: bytes
+    """
+
+    texts = [msg.msgctxt_previous, msg.msgid_previous,
+             msg.msgid_plural_previous,
+             msg.msgctxt, msg.msgid, msg.msgid_plural]
+    texts.append("\x01".join(msg.msgstr))
+    texts.append("\x01".join(msg.manual_comment))
+    texts.append("\x01".join(msg.auto_comment))
+    texts.append("\x01".join("%s:%s" % x for x in msg.source))
+    texts.append("\x01".join(msg.flag))
+    texts.append(msg.obsolete and "1" or "0")
+
+    return text_hash(*texts)
+
+
+def _catalog_fingerprint (cat):
+
+    accels = cat.accelerator()
+    if accels is not None:
+        accels = "".join(sorted(accels))
+    mtypes = cat.markup()
+    if mtypes is not None:
+        mtypes = ",".join(sorted(mtypes))
+    envs = cat.environment()
+    if envs is not None:
+        envs = ",".join(envs)
+
+    return (cat.name, accels, mtypes, cat.language(), envs)
+
+
+def filter_message (msg, cat, filtr, fid, envs=None):
+    """
+    Get a filtered copy of the message.
+
+    The filter is called on a copy of the message,
+    which it should modify in place.
+    If C{envs} is not C{None}, it is passed to the filter
+    as the third argument, and becomes part of the filter identity.
+
+    If the same filter was already applied to the message with
+    the same content, the cached filtered copy is returned.
+    Since filtered copies are shared, they must not be modified.
+
+    @param msg: the message to filter
+    @type msg: L{Message_base}
+    @param cat: the catalog to which the message belongs
+    @type cat: L{Catalog}
+    @param filtr: the filter
+    @type filtr: (msg, cat) -> None or (msg, cat, envs) -> None
+    @param fid: filter identity
+    @type fid: hashable and picklable
+    @param envs: environments to pass to the filter
+    @type envs: set or C{None}
+
+    @returns: filtered copy of the message
+    @rtype: L{MessageUnsafe}
+    """
+
+    if envs is not None:
+        envkey = ",".join(sorted(envs))
+    else:
+        envkey = None
+    key = (fid, envkey, _catalog_fingerprint(cat), message_fingerprint(msg))
+
+    cache = _filtered_cache()
+    msgf = cache.get(key)
+    if msgf is None:
+        msgf = MessageUnsafe(msg)
+        if envs is not None:
+            filtr(msgf, cat, envs)
+        else:
+            filtr(msgf, cat)
+        cache.set(key, msgf)
+
+    return msgf
+
+
+def msgstr_filter (filters):
+    """
+    Compose text filters into a message filter acting on translation.
+
+    Each filter is applied in turn to each C{msgstr} field.
+    Filters are called as type F1A hooks (taking only the text)
+    or, if that fails, as type F3A hooks (taking the text,
+    the message and the catalog).
+
+    @param filters: text filters, as pairs of the filter function
+        and its hook request (used for the filter identity,
+        together with the L{hook_fingerprint} of the function)
+    @type filters: [(callable, string)*]
+
+    @returns: message filter and its filter identity,
+        as expected by L{filter_message}
+    @rtype: ((msg, cat) -> None, tuple)
+    """
+
+    filters = list(filters)
+
+    def filtr (msgf, cat):
+
+        for i in range(len(msgf.msgstr)):
+            text = msgf.msgstr[i]
+            for tfilter, tfname in filters:
+                try: # try as type F1A hook
+                    text = tfilter(text)
+                except TypeError:
+                    try: # try as type F3A hook
+                        text = tfilter(text, msgf, cat)
+                    except TypeError:
+                        raise PologyError(
+                            _("@info",
+                              "Cannot execute filter '%(filt)s'.",
+                              filt=tfname))
+            msgf.msgstr[i] = text
+
+    fid = ("msgstr",) + tuple((x[1], hook_fingerprint(x[0]))
+                              for x in filters)
+
+    return filtr, fid
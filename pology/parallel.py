@@ -0,0 +1,166 @@
+# -*- coding: UTF-8 -*-
+
+"""
+Run independent pieces of work in parallel worker processes.
+
+Workers are started by forking the current process, so that they
+inherit all the state prepared before the work is started
+(loaded catalogs, rules, hooks, etc.) and do not need to set it up again.
+As a consequence, the work function may be any callable, including
+closures and bound methods, but the items and the results of the work
+must be picklable.
+Entries added by workers to persistent named caches
+(see L{pology.cache}) are passed back with the results
+and merged into caches of the main process.
+Where forking is not available, the work is done serially.
+
+@author: Chusslove Illich (Часлав Илић) <caslav.ilic@gmx.net>
+@license: GPLv3
+"""
+
+import multiprocessing
+import os
+
+from pology.cache import collect_updates, merge_updates, track_updates
+
+
+def cpu_count ():
+    """
+    Get the number of processors available to this process.
+
+    @rtype: int
+    """
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def can_fork ():
+    """
+    Check whether work can be distributed to forked worker processes.
+
+    @rtype: bool
+    """
+
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def resolve_jobs (jobs):
+    """
+    Resolve the number of parallel jobs as given by the user.
+
+    Zero or negative number means as many jobs as there are processors,
+    and C{None} means one job (serial execution).
+
+    @param jobs: requested number of jobs
+    @type jobs: int or C{None}
+
+    @returns: actual number of jobs
+    @rtype: int
+    """
+
+    if jobs is None:
+        return 1
+    if jobs <= 0:
+        return cpu_count()
+    return jobs
+
+
+def split_even (items, nparts):
+    """
+    Split a sequence into contiguous parts of nearly equal length.
+
+    Fewer parts than requested are returned if there are not enough items.
+
+    @param items: the sequence to split
+    @type items: sequence
+    @param nparts: number of parts
+    @type nparts: int
+
+    @returns: list of parts
+    @rtype: [list*]
+    """
+
+    items = list(items)
+    nparts = max(1, min(nparts, len(items)))
+    size, rest = divmod(len(items), nparts)
+    parts = []
+    pos = 0
+    for i in range(nparts):
+        end = pos + size + (1 if i < rest else 0)
+        parts.append(items[pos:end])
+        pos = end
+
+    return [x for x in parts if x]
+
+
+_work_funcs = {}
+
+def _call_work_func (args):
+
+    fkey, item = args
+    # A worker exiting on its own (e.g. through report.error) would leave
+    # the pool waiting for its result forever, so pass the exit instead.
+    try:
+        result = _work_funcs[fkey](item)
+    except SystemExit as e:
+        return True, e.code, {}
+    return False, result, collect_updates()
+
+
+def parallel_map (func, items, jobs):
+    """
+    Apply a function to each item in parallel worker processes.
+
+    Results are yielded in the order of items, each as soon as it
+    and all the results before it are ready.
+    If the number of jobs is 1 or less, or forking is not available,
+    the function is applied in the current process.
+
+    Items and results are passed between processes by pickling.
+    Any exception raised by the function, including C{SystemExit},
+    is propagated to the caller, after which remaining workers
+    are terminated.
+
+    @param func: the function to apply
+    @type func: (item) -> result
+    @param items: items of work
+    @type items: sequence
+    @param jobs: number of worker processes
+    @type jobs: int
+
+    @returns: results of the function
+    @rtype: generator
+    """
+
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1 or not can_fork():
+        for item in items:
+            yield func(item)
+        return
+
+    # Register the function before forking, so that workers can find it
+    # without pickling it.
+    fkey = id(func)
+    while fkey in _work_funcs:
+        fkey += 1
+    _work_funcs[fkey] = func
+    try:
+        ctx = multiprocessing.get_context("fork")
+        pool = ctx.Pool(min(jobs, len(items)), initializer=track_updates)
+        try:
+            for exited, result, updates in pool.imap(
+                _call_work_func, [(fkey, x) for x in items]
+            ):
+                if exited:
+                    raise SystemExit(result)
+                merge_updates(updates)
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        del _work_funcs[fkey]
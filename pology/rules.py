@@ -17,15 +17,19 @@ See C{doc/user/lingo.docbook#sec-lgrules} for detailed discussion of rules.
 """
 
 from codecs import open
+from hashlib import md5
 from locale import getlocale
 from os.path import dirname, basename, isdir, join, isabs
 from os import listdir
+import pickle
 import re
+import sqlite3
 import sys
 from time import time
 
-from pology import PologyError, datadir, _, n_
+from pology import PologyError, datadir, version, _, n_
 from pology.message import MessageUnsafe
+from pology.msgfilter import filter_message, hook_fingerprint
 from pology.config import strbool
 from pology.getfunc import get_hook_ireq, split_ireq
 from pology.report import report, warning, format_item_list
@@ -140,6 +144,181 @@ def loadRules(lang, envs=[], envOnly=False, ruleFiles=None, stat=False,
     return rules
 
 
+def ruleSetHash(rules, extra=()):
+    """Compute a hash identifying the behavior of the rule set
+    @param rules: list of rules, in the order of application
+    @param extra: additional strings on which results depend (e.g. environments)
+    @return: hexadecimal hash
+    @note: Rule patterns, validity definitions, filters, and hook requests
+    are taken into account, but not the code of hooks themselves.
+    To compensate, Pology version is taken into account too.
+    """
+    h=md5()
+    h.update(("%s\x05" % version()).encode("utf8"))
+    for item in extra:
+        h.update(("%s\x05" % item).encode("utf8"))
+    for rule in rules:
+        h.update(_ruleSignature(rule).encode("utf8", "surrogatepass"))
+    return h.hexdigest()
+
+
+def _ruleSignature(rule):
+
+    def rxstr(value):
+        if hasattr(value, "pattern"):
+            return value.pattern
+        elif isinstance(value, tuple):
+            return "\x03".join(rxstr(x) for x in value)
+        elif isinstance(value, list):
+            return "\x03".join(value)
+        return str(value)
+
+    segs=[str(rule.ident), rule.msgpart, rule.rawPattern, str(rule.hint),
+          str(rule.casesens), str(rule.disabled), str(rule.manual),
+          str(rule.environ), repr(getattr(rule.mfilter, "ident", rule.mfilter)),
+          repr(getattr(rule.trigger, "ident", rule.trigger))]
+    for entry in rule.valid:
+        segs.append("\x02".join("%s=%s" % (key, rxstr(value))
+                                for key, value in entry))
+    return "\x04".join(segs) + "\x05"
+
+
+class RuleResultStore(object):
+    """Persistent store of rule failures per message
+
+    Failures are kept in an SQLite database, keyed by the rule set hash
+    (see L{ruleSetHash}) and a key identifying the message in its context.
+    Rule sets which were not used for a while are removed
+    when the store is closed.
+    """
+
+    _expireDays=30
+    _commitEvery=1000
+
+    def __init__(self, path):
+        """Open the store, creating it if it does not exist
+        @param path: path to the database file
+        """
+        self.path=path
+        self._conn=sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results "
+                           "(ruleset TEXT, msgkey BLOB, failures BLOB, "
+                           "PRIMARY KEY (ruleset, msgkey))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rulesets "
+                           "(ruleset TEXT PRIMARY KEY, used REAL)")
+        self._usedRuleSets=set()
+        self._nput=0
+
+    def get(self, ruleset, msgkey):
+        """Get stored failures for a message
+        @param ruleset: rule set hash
+        @param msgkey: message key
+        @type msgkey: bytes
+        @return: failures as stored by L{put}, or None if not stored
+        """
+        self._usedRuleSets.add(ruleset)
+        row=self._conn.execute("SELECT failures FROM results "
+                               "WHERE ruleset=? AND msgkey=?",
+                               (ruleset, msgkey)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def put(self, ruleset, msgkey, failures):
+        """Store failures for a message
+        @param ruleset: rule set hash
+        @param msgkey: message key
+        @type msgkey: bytes
+        @param failures: list of (rule index, highlight) pairs, with
+            rule index being the position of the rule in the rule set
+        """
+        self._usedRuleSets.add(ruleset)
+        self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                           (ruleset, msgkey, pickle.dumps(failures, 4)))
+        self._nput+=1
+        if self._nput%self._commitEvery==0:
+            self._conn.commit()
+
+    def close(self):
+        """Record usage of rule sets, remove expired ones, and close the store"""
+        now=time()
+        for ruleset in self._usedRuleSets:
+            self._conn.execute("INSERT OR REPLACE INTO rulesets VALUES (?, ?)",
+                               (ruleset, now))
+        limit=now-self._expireDays*86400
+        expired=[x[0] for x in self._conn.execute(
+            "SELECT ruleset FROM rulesets WHERE used<?", (limit,))]
+        for ruleset in expired:
+            self._conn.execute("DELETE FROM results WHERE ruleset=?", (ruleset,))
+            self._conn.execute("DELETE FROM rulesets WHERE ruleset=?", (ruleset,))
+        self._conn.commit()
+        self._conn.close()
+
+
+class RuleMatcher(object):
+    """Find rules which cannot match a message, by a quick pass of patterns
+
+    Pattern rules are grouped by the message part to which they apply
+    and by their message filter, so that texts to match are extracted
+    once per group, and then searched by the patterns of all rules
+    in the group in one tight pass.
+    Rules whose patterns do not match anywhere can be skipped with
+    exactly the same outcome as when applied in full, while the rest
+    must still be applied (they may have validity definitions).
+
+    The pass is much cheaper than applying rules one by one, since most
+    rules do not match most messages. Combining patterns of a group
+    into a single alternation would be cheaper still in principle,
+    but Python regular expressions cannot search alternations as fast
+    as single patterns, which are searched by their leading literals.
+    """
+
+    def __init__(self, rules):
+        """Group rules for the quick pass
+        @param rules: rules to group, where possible
+        @type rules: list of L{Rule}
+        """
+        grouped={}
+        keys=[]
+        for rule in rules:
+            if rule.pattern is None or rule.disabled:
+                continue
+            key=(rule.msgpart, rule.mfilter)
+            if key not in grouped:
+                grouped[key]=[]
+                keys.append(key)
+            grouped[key].append((rule, rule.pattern.search))
+
+        self._groups=[]
+        for key in keys:
+            members=grouped[key]
+            self._groups.append((members[0][0], key[0], key[1], members))
+
+    def nonMatching(self, msgByFilter):
+        """Get rules which certainly do not match the message
+        @param msgByFilter: message as filtered by each filter of rules
+        @type msgByFilter: dict of filter to L{Message_base}
+        @return: rules which can be skipped
+        @rtype: set of L{Rule}
+        """
+        skip=set()
+        for rule0, msgpart, mfilter, members in self._groups:
+            msgf=msgByFilter[mfilter]
+            try:
+                texts=[x[2] for x in rule0._create_text_spec(msgpart, msgf)]
+            except IndexError:
+                # Leave it to rules to report.
+                continue
+            if len(texts)==1:
+                text=texts[0]
+                skip.update(rule for rule, search in members
+                            if search(text) is None)
+            else:
+                skip.update(rule for rule, search in members
+                            if all(search(x) is None for x in texts))
+        return skip
+
+
 _rule_start = "*"
 
 class _IdentError (Exception): pass
@@ -626,6 +805,11 @@ def _msgFilterComposeFinal (filterList):
             if fenvs is None or envs.intersection(fenvs):
                 func(msg, cat)
 
+    # Identity of the composition, for sharing filtered messages.
+    composition.ident = ("rules",) + tuple((x[1] and tuple(x[1]), x[3],
+                                            hook_fingerprint(x[2]))
+                                           for x in filterList)
+
     return composition
 
 
@@ -850,6 +1034,9 @@ def _triggerFromHook (fields):
                 hl.append(("msgstr", i, hook(msg.msgstr[i])))
             return hl
 
+    # Identity of the trigger, for identifying rule sets.
+    trigger.ident = ("hook", fieldDict["name"], msgpart)
+
     return trigger
 
 
@@ -1209,8 +1396,12 @@ class Rule(object):
 
         fmsg = msg
         if self.mfilter is not None:
-            fmsg = MessageUnsafe(msg)
-            self.mfilter(fmsg, cat, envs)
+            fident = getattr(self.mfilter, "ident", None)
+            if fident is not None:
+                fmsg = filter_message(msg, cat, self.mfilter, fident, envs)
+            else:
+                fmsg = MessageUnsafe(msg)
+                self.mfilter(fmsg, cat, envs)
 
         return fmsg
 
@@ -8,15 +8,21 @@ author: Javier Vinal (Javier Viñal) <fjvinal@gmail.com>
 @license: GPLv3
 """
 
+from array import array
+import mmap
 import os
 import codecs
 import re
+import shutil
+import subprocess
 import tempfile
 
-from pology import PologyError, datadir, _, n_
+from pology import PologyError, datadir, version, _, n_
+from pology.cache import cachedir, named_cache, text_hash, file_hash
 from pology.comments import manc_parse_flag_list, manc_parse_list
 import pology.config
 from pology.msgreport import report_on_msg
+from pology.parallel import parallel_map, split_even
 from pology.report import warning, format_item_list
 
 
@@ -28,7 +34,7 @@ elist_well_spelled = "well-spelled:"
 
 
 def check_spell (lang=None, encoding="UTF-8", variety=None, extopts={},
-                 envs=None, suponly=False, maxsugg=5):
+                 envs=None, suponly=False, maxsugg=5, pipe=False):
     """
     Check spelling using Aspell [hook factory].
 
@@ -65,7 +71,14 @@ def check_spell (lang=None, encoding="UTF-8", variety=None, extopts={},
 
     Misspelled words are reported to stdout, with suggestions if available.
     Maximum number of suggestions to display is selected by the C{maxsugg}
-    parameter; if negative, all suggestions are shown.
+    parameter; if negative, all suggestions are shown, and if zero,
+    suggestions are not even computed (which is much faster).
+
+    Aspell is normally used through its library. If C{pipe} is set to
+    C{True}, it is instead run as a long-lived C{aspell -a} process
+    (see L{AspellPipe}), to which all words of a text are sent at once;
+    this is faster when checking a lot of text. If the C{aspell} command
+    is not available, only internal supplemental dictionaries are used.
 
     Spell checking is performed by internally splitting text into words, and
     querying Aspell word by word. Spliting is performed in a simple fashion;
@@ -101,18 +114,20 @@ def check_spell (lang=None, encoding="UTF-8", variety=None, extopts={},
     @type suponly: bool
     @param maxsugg: maximum number of suggestions to show for misspelled word
     @type maxsugg: int
+    @param pipe: whether to run Aspell as a process instead of the library
+    @type pipe: bool
 
     @return: type S3A hook
     @rtype: C{(text, msg, cat) -> numerr}
     """
 
-    provider = "aspell-raw"
+    provider = pipe and "aspell-pipe" or "aspell-raw"
     return _check_spell_w(provider, lang, encoding, variety, extopts,
                           envs, suponly, maxsugg, False)
 
 
 def check_spell_sp (lang=None, encoding="UTF-8", variety=None, extopts={},
-                    envs=None, suponly=False, maxsugg=5):
+                    envs=None, suponly=False, maxsugg=5, pipe=False):
     """
     Like L{check_spell}, except that erroneous spans are returned
     instead of reporting problems to stdout [hook factory].
@@ -121,11 +136,13 @@ def check_spell_sp (lang=None, encoding="UTF-8", variety=None, extopts={},
     @rtype: C{(text, msg, cat) -> spans}
     """
 
-    provider = "aspell-raw"
+    provider = pipe and "aspell-pipe" or "aspell-raw"
     return _check_spell_w(provider, lang, encoding, variety, extopts,
                           envs, suponly, maxsugg, True)
 
 
+_aspell_providers = ("aspell-raw", "aspell-pipe")
+
 def _check_spell_w (provider, lang, encoding, variety, extopts,
                     envs, suponly, maxsugg, spanrep):
     """
@@ -144,7 +161,7 @@ def _check_spell_w (provider, lang, encoding, variety, extopts,
         return word_spans
 
     # Resolve provider.
-    if provider != "aspell-raw":
+    if provider not in _aspell_providers:
         enchant_cfg = pology.config.section("enchant")
         if not provider:
             provider = enchant_cfg.string("provider")
@@ -162,7 +179,7 @@ def _check_spell_w (provider, lang, encoding, variety, extopts,
             clang = lang
         elif cat.language() is not None:
             clang = cat.language()
-        elif provider != "aspell-raw":
+        elif provider not in _aspell_providers:
             clang = enchant_cfg.string("language")
         else:
             clang = None
@@ -175,19 +192,23 @@ def _check_spell_w (provider, lang, encoding, variety, extopts,
             cenvs = envs
         elif cat.environment() is not None:
             cenvs = cat.environment()
-        elif provider != "aspell-raw":
+        elif provider not in _aspell_providers:
             envs_str = enchant_cfg.string("environment")
             cenvs = envs_str.split(",") if envs_str else []
         else:
             cenvs = []
         ckey = (clang, tuple(cenvs))
         if ckey not in checkers:
-            if provider != "aspell-raw":
-                checkers[ckey] = _construct_enchant(provider, clang, cenvs,
-                                                    encoding, variety, suponly)
+            if provider not in _aspell_providers:
+                checker = _construct_enchant(provider, clang, cenvs,
+                                             encoding, variety, suponly)
             else:
-                checkers[ckey] = _construct_aspell(clang, cenvs, encoding,
-                                                   variety, extopts, suponly)
+                checker = _construct_aspell(clang, cenvs, encoding,
+                                            variety, extopts, suponly,
+                                            provider == "aspell-pipe")
+            extra = [encoding] + sorted("%s=%s" % x for x in extopts.items())
+            checkers[ckey] = cached_checker(checker, provider, clang, cenvs,
+                                            variety, suponly, extra, encoding)
 
         checker = checkers[ckey]
 
@@ -206,12 +227,18 @@ def _check_spell_w (provider, lang, encoding, variety, extopts,
         ignored_words = set(manc_parse_list(msg, elist_well_spelled, ","))
         word_spans = [x for x in word_spans if x[0] not in ignored_words]
 
+        # Check all words at once, if the checker can do that,
+        # so that checks of single words below are answered from cache.
+        if hasattr(checker, "check_words"):
+            checker.check_words(list(set(x[0].encode(encoding)
+                                         for x in word_spans)))
+
         spans = []
         for word, span in word_spans:
             encword = word.encode(encoding)
             if not checker.check(encword):
-                encsuggs = checker.suggest(encword)
-                maxsugg = 5 # limit to some reasonable number
+                # Suggestions are not computed if they will not be shown.
+                encsuggs = checker.suggest(encword) if maxsugg != 0 else []
                 incmp = False
                 if maxsugg > 0 and len(encsuggs) > maxsugg:
                     encsuggs = encsuggs[:maxsugg]
@@ -241,12 +268,31 @@ def _check_spell_w (provider, lang, encoding, variety, extopts,
 
 
 # Construct Aspell checker for given langenv.
-def _construct_aspell (lang, envs, encoding, variety, extopts, suponly):
+def _construct_aspell (lang, envs, encoding, variety, extopts, suponly,
+                       pipe=False):
+
+    if pipe and not suponly and not AspellPipe.available():
+        warning(_("@info",
+                  "Aspell command not found, checking only against "
+                  "internal supplemental dictionaries."))
+        suponly = True
+
+    if suponly:
+        # Create simple internal checker that only checks against
+        # internal supplemental dictionaries.
+        return _QuasiSpell(_supplement_words_or_error(lang, envs), encoding)
 
     # Get Pology's internal personal dictonary for this language.
     dictpath, temporary = _compose_personal_dict(lang, envs)
 
-    if not suponly:
+    if pipe:
+        try:
+            checker = AspellPipe(lang, encoding, variety, extopts, dictpath)
+        except PologyError:
+            if temporary:
+                os.unlink(dictpath)
+            raise
+    else:
         # Prepare Aspell options.
         aopts = {}
         aopts["lang"] = lang
@@ -274,14 +320,6 @@ def _construct_aspell (lang, envs, encoding, variety, extopts, suponly):
                 _("@info",
                   "Cannot initialize Aspell:\n%(msg)s",
                   msg=e))
-    else:
-        # Create simple internal checker that only checks against
-        # internal supplemental dictionaries.
-        if not dictpath:
-            raise PologyError(
-                _("@info",
-                  "No supplemental dictionaries found."))
-        checker = _QuasiSpell(dictpath, encoding)
 
     # Composited dictionary read by now, remove if temporary file.
     if temporary:
@@ -290,14 +328,12 @@ def _construct_aspell (lang, envs, encoding, variety, extopts, suponly):
     return checker
 
 
-# Collect all personal dictionaries found for given language/environment
-# and composit them into one file to pass to Aspell.
+# Collect paths of all personal dictionaries found for given
+# language/environment, in sorted order.
 # Environment is given as a relative subpath into the language directory;
 # a dictionary belongs to that environment if it is in the directory
 # pointed by the subpath, or any of the parent directories.
-# Return the path to composited file or None if there were no dictionaries,
-# and whether the file is really a temporary composition or not.
-def _compose_personal_dict (lang, envs):
+def _collect_personal_dicts (lang, envs):
 
     # Collect all applicable dictionary files
     # (for a given environment, in its subdirectiory and all above).
@@ -315,6 +351,16 @@ def _compose_personal_dict (lang, envs):
     dictpaths = list(dictpaths)
     dictpaths.sort()
 
+    return dictpaths
+
+
+# Collect all personal dictionaries found for given language/environment
+# and composit them into one file to pass to Aspell.
+# Return the path to composited file or None if there were no dictionaries,
+# and whether the file is really a temporary composition or not.
+def _compose_personal_dict (lang, envs):
+
+    dictpaths = _collect_personal_dicts(lang, envs)
     if not dictpaths:
         return None, False
 
@@ -371,18 +417,170 @@ def _read_dict_file (filepath):
     return words
 
 
-# Simple spell checker which reads Aspell's personal dictionary file.
+_supplement_words = {}
+
+def supplement_words (lang, envs=None):
+    """
+    Get the set of words in Pology's supplemental dictionaries.
+
+    Supplemental dictionaries are collected for the language and
+    environments in the same way as by L{check_spell}.
+    Their words are compiled once into a file in the cache directory
+    (see L{cachedir<cache.cachedir>}), which is rebuilt when contents of
+    dictionaries change, and which is then only mapped into memory
+    by subsequent runs. The same set object is returned on repeated
+    calls in the process.
+
+    @param lang: language code
+    @type lang: string
+    @param envs: environments for supplemental dictionaries
+    @type envs: list of strings
+
+    @returns: the set of words, or C{None} if there are no dictionaries
+    @rtype: L{SupplementWords} or C{None}
+    """
+
+    skey = (lang, tuple(envs or []))
+    if skey not in _supplement_words:
+        dictpaths = _collect_personal_dicts(lang, envs)
+        words = None
+        if dictpaths:
+            words = _compiled_supplement_words(lang, envs, dictpaths)
+        _supplement_words[skey] = words
+
+    return _supplement_words[skey]
+
+
+def _supplement_words_or_error (lang, envs):
+
+    words = supplement_words(lang, envs)
+    if words is None:
+        raise PologyError(
+            _("@info",
+              "No supplemental dictionaries found."))
+    return words
+
+
+_compiled_words_magic = b"PLWS0001"
+
+def _compiled_supplement_words (lang, envs, dictpaths):
+
+    dicthash = file_hash(dictpaths).encode("ascii")
+    envkey = text_hash("\x02".join(envs or [])).hex()[:12]
+    path = os.path.join(cachedir("spell"), "%s-%s.words" % (lang, envkey))
+
+    # Use the compiled file if built from current dictionaries.
+    try:
+        with open(path, "rb") as fh:
+            head = fh.read(len(_compiled_words_magic) + len(dicthash))
+            if head == _compiled_words_magic + dicthash:
+                return SupplementWords(fh.fileno(), len(head))
+    except (OSError, ValueError, IndexError, TypeError):
+        pass
+
+    # Compile words, sorted as encoded, for binary search:
+    # number of words, offsets of words into the data, and the data.
+    words = set()
+    for dictpath in dictpaths:
+        words.update(_read_dict_file(dictpath))
+    encwords = sorted(x.encode("UTF-8") for x in words)
+    offsets = array("I", [0])
+    for encword in encwords:
+        offsets.append(offsets[-1] + len(encword))
+    data = b"".join([_compiled_words_magic, dicthash,
+                     array("I", [len(encwords)]).tobytes(),
+                     offsets.tobytes()] + encwords)
+
+    try:
+        tmppath = "%s.%d" % (path, os.getpid())
+        with open(tmppath, "wb") as fh:
+            fh.write(data)
+        os.replace(tmppath, path)
+    except OSError:
+        # Not fatal, the words will be compiled again next time.
+        pass
+
+    return SupplementWords(data, len(_compiled_words_magic) + len(dicthash))
+
+
+class SupplementWords (object):
+    """
+    Sorted set of words, searched in compiled form.
+
+    Words are kept encoded in a single block of memory, either
+    mapped from a file or in memory, and looked up by binary search.
+    Membership can be tested with both strings and UTF-8 byte strings.
+
+    Objects of this class are created by L{supplement_words}.
+    """
+
+    def __init__ (self, source, pos):
+        """
+        Constructor.
+
+        @param source: file descriptor of compiled file, or compiled data
+        @type source: int or bytes
+        @param pos: offset of the word set within the source
+        @type pos: int
+        """
+
+        if isinstance(source, int):
+            self._buf = mmap.mmap(source, 0, access=mmap.ACCESS_READ)
+        else:
+            self._buf = source
+        view = memoryview(self._buf)
+        isize = array("I").itemsize
+        self._len = view[pos:pos + isize].cast("I")[0]
+        pos += isize
+        self._offsets = view[pos:pos + (self._len + 1) * isize].cast("I")
+        self._dpos = pos + (self._len + 1) * isize
+
+
+    def __len__ (self):
+
+        return self._len
+
+
+    def _word (self, i):
+
+        return self._buf[self._dpos + self._offsets[i]:
+                         self._dpos + self._offsets[i + 1]]
+
+
+    def __contains__ (self, word):
+
+        if isinstance(word, str):
+            word = word.encode("UTF-8")
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word(mid) < word:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self._len and self._word(lo) == word
+
+
+    def __iter__ (self):
+
+        for i in range(self._len):
+            yield self._word(i).decode("UTF-8")
+
+
+# Simple spell checker which checks against supplemental dictionaries.
 class _QuasiSpell (object):
 
-    def __init__ (self, dictpath, enc="UTF-8"):
+    def __init__ (self, words, enc="UTF-8"):
 
-        self._words = _read_dict_file(dictpath)
+        self._words = words
         self._enc = enc # of the raw text sent in for checking
 
 
     def check (self, encword):
 
-        word = str.decode(encword, self._enc)
+        word = encword
+        if isinstance(word, bytes):
+            word = word.decode(self._enc)
         return (   word in self._words
                 or word.lower() in self._words)
 
@@ -392,6 +590,345 @@ class _QuasiSpell (object):
         return []
 
 
+class AspellPipe (object):
+    """
+    Aspell checker running as a separate process in pipe mode.
+
+    The C{aspell -a} process is started once and kept running
+    until the checker is closed, and words are sent to it in batches.
+    This avoids the costs of going through the Aspell library word by word,
+    and Aspell produces suggestions together with the verdicts.
+
+    Words can be given either as strings or as byte strings
+    in the checker's encoding, and suggestions are returned
+    in the same form.
+    """
+
+    _batch_size = 64 # so that a batch of words fits into the input pipe
+
+    def __init__ (self, lang, encoding="UTF-8", variety=None, extopts={},
+                  dictpath=None):
+        """
+        Start the Aspell process.
+
+        @param lang: language of spelling dictionary
+        @type lang: string
+        @param encoding: encoding used by the dictionary
+        @type encoding: string
+        @param variety: variety of dictionary
+        @type variety: string
+        @param extopts: additional options to send to Aspell
+        @type extopts: dict
+        @param dictpath: path of the personal dictionary to use
+        @type dictpath: string
+        """
+
+        self._enc = encoding
+        cmdline = ["aspell", "-a", "--lang=%s" % lang,
+                   "--encoding=%s" % encoding]
+        if variety:
+            cmdline.append("--variety=%s" % variety)
+        if dictpath:
+            cmdline.append("--personal=%s" % os.path.abspath(dictpath))
+        for name, value in sorted(extopts.items()):
+            cmdline.append("--%s=%s" % (name, value))
+        self._cmdline = cmdline
+        self._start()
+
+
+    def _start (self):
+
+        # Process which started Aspell, to detect being used
+        # in a forked worker process.
+        self._pid = os.getpid()
+        cmdline = self._cmdline
+        # Error output goes to a file rather than a pipe, since it is read
+        # only on failure, and Aspell would block on a full pipe.
+        self._errf = tempfile.TemporaryFile()
+        try:
+            self._proc = subprocess.Popen(cmdline, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=self._errf)
+        except OSError as e:
+            self._errf.close()
+            raise PologyError(
+                _("@info",
+                  "Cannot start Aspell:\n%(msg)s",
+                  msg=e))
+
+        # Aspell starts by a banner line, or exits on configuration error.
+        banner = self._proc.stdout.readline()
+        if not banner.startswith(b"@(#)"):
+            self._proc.wait()
+            self._errf.seek(0)
+            errmsg = self._errf.read().decode(errors="replace")
+            self._errf.close()
+            raise PologyError(
+                _("@info",
+                  "Cannot initialize Aspell:\n%(msg)s",
+                  msg=errmsg.strip()))
+
+        # Terse mode, correct words produce no output.
+        self._proc.stdin.write(b"!\n")
+        self._proc.stdin.flush()
+
+        self._suggs = {}
+
+
+    @staticmethod
+    def available ():
+        """
+        Check whether the Aspell command is available.
+
+        @rtype: bool
+        """
+
+        return shutil.which("aspell") is not None
+
+
+    def _to_text (self, word):
+
+        return word.decode(self._enc) if isinstance(word, bytes) else word
+
+
+    def check_words (self, words):
+        """
+        Check a sequence of words at once.
+
+        Suggestions for unknown words are retained, so that calling
+        L{suggest} on them afterwards does not cost anything.
+
+        @param words: words to check
+        @type words: sequence of strings or byte strings
+
+        @returns: verdict for each word, C{True} if it is known
+        @rtype: [bool*]
+        """
+
+        # A forked worker must not talk to the Aspell process
+        # of its parent, so it starts its own.
+        if self._pid != os.getpid():
+            self._start()
+
+        # Suggestions are normally fetched soon after checking,
+        # so older ones can be dropped.
+        if len(self._suggs) > 10000:
+            self._suggs.clear()
+
+        verdicts = []
+        for i in range(0, len(words), self._batch_size):
+            batch = [self._to_text(x) for x in words[i:i + self._batch_size]]
+            # Caret protects words from being taken as pipe commands.
+            data = "".join("^%s\n" % x for x in batch)
+            self._proc.stdin.write(data.encode(self._enc))
+            self._proc.stdin.flush()
+            for word in batch:
+                known = True
+                # Results for each line are terminated by an empty line.
+                while True:
+                    line = self._proc.stdout.readline()
+                    if not line:
+                        raise PologyError(
+                            _("@info",
+                              "Aspell process terminated unexpectedly."))
+                    line = line.decode(self._enc).rstrip("\n")
+                    if not line:
+                        break
+                    if line.startswith("&"):
+                        known = False
+                        self._suggs[word] = line.split(": ", 1)[1].split(", ")
+                    elif line.startswith("#"):
+                        known = False
+                        self._suggs[word] = []
+                verdicts.append(known)
+
+        return verdicts
+
+
+    def check (self, word):
+
+        return self.check_words([word])[0]
+
+
+    def suggest (self, word):
+
+        tword = self._to_text(word)
+        if tword not in self._suggs:
+            self.check_words([tword])
+        suggs = self._suggs.pop(tword, [])
+        if isinstance(word, bytes):
+            suggs = [x.encode(self._enc) for x in suggs]
+        return suggs
+
+
+    def close (self):
+        """
+        Stop the Aspell process.
+        """
+
+        if self._pid == os.getpid() and self._proc.poll() is None:
+            self._proc.stdin.close()
+            self._proc.wait()
+            self._errf.close()
+
+
+def cached_checker (checker, provider, lang, envs, variety=None,
+                    suponly=False, extra=(), encoding="UTF-8"):
+    """
+    Wrap a spell checker to remember its verdicts and suggestions.
+
+    The checker can be any object with C{check(word)} and C{suggest(word)}
+    methods, like those of Aspell and Enchant checkers.
+    Results are kept in caches shared by all wrapped checkers
+    (named C{spell-verdicts} and C{spell-suggestions},
+    see L{pology.cache}), keyed by the word and everything else that
+    determines the result: the provider, language, environments, variety,
+    whether only supplemental dictionaries are used, any C{extra} strings
+    (e.g. encoding or provider options), and a hash of contents of
+    Pology's supplemental dictionaries for the language and environments.
+    Thus, when supplemental dictionaries are modified, earlier results
+    are no longer used.
+
+    Words found exactly as they are in supplemental dictionaries
+    (see L{supplement_words}) are accepted without asking the checker.
+
+    When caches are kept on disk between runs, they are also tied to
+    the Pology version, but not to the provider's system dictionaries.
+    If those are updated, the cache files should be removed
+    from the cache directory.
+
+    @param checker: the spell checker to wrap
+    @type checker: object
+    @param provider: name of the spell-checking provider
+    @type provider: string
+    @param lang: language of spelling dictionary
+    @type lang: string
+    @param envs: environments for supplemental dictionaries
+    @type envs: list of strings
+    @param variety: variety of dictionary
+    @type variety: string
+    @param suponly: whether only supplemental dictionaries are used
+    @type suponly: bool
+    @param extra: any other strings on which results depend
+    @type extra: sequence of strings
+    @param encoding: encoding of words given to the checker as byte strings
+    @type encoding: string
+
+    @returns: the wrapped checker
+    @rtype: object with C{check(word)} and C{suggest(word)} methods
+    """
+
+    dicthash = file_hash(_collect_personal_dicts(lang, envs))
+    ckey = text_hash(provider, lang, "\x02".join(envs or []), variety,
+                     str(bool(suponly)), dicthash, *extra)
+
+    supwords = supplement_words(lang, envs)
+
+    return _CachedChecker(checker, ckey, supwords, encoding)
+
+
+class _CachedChecker (object):
+
+    def __init__ (self, checker, ckey, supwords=None, encoding="UTF-8"):
+
+        self._checker = checker
+        self._ckey = ckey
+        self._supwords = supwords
+        self._enc = encoding
+        self._verdicts = named_cache("spell-verdicts", size=200000,
+                                     version=version())
+        self._suggestions = named_cache("spell-suggestions", size=20000,
+                                        version=version())
+
+
+    def _in_supplements (self, word):
+
+        if self._supwords is None:
+            return False
+        if isinstance(word, bytes) and self._enc.upper() != "UTF-8":
+            word = word.decode(self._enc)
+        return word in self._supwords
+
+
+    def check (self, word):
+
+        key = (self._ckey, word)
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            verdict = (   self._in_supplements(word)
+                       or bool(self._checker.check(word)))
+            self._verdicts.set(key, verdict)
+        return verdict
+
+
+    def check_words (self, words):
+
+        verdicts = [self._verdicts.get((self._ckey, x)) for x in words]
+        verdicts = [v if v is not None else (self._in_supplements(x) or None)
+                    for x, v in zip(words, verdicts)]
+        unknown = [x for x, v in zip(words, verdicts) if v is None]
+        if unknown:
+            if hasattr(self._checker, "check_words"):
+                checked = self._checker.check_words(unknown)
+            else:
+                checked = [bool(self._checker.check(x)) for x in unknown]
+            for word, verdict in zip(unknown, checked):
+                self._verdicts.set((self._ckey, word), verdict)
+            checked = iter(checked)
+            verdicts = [v if v is not None else next(checked)
+                        for v in verdicts]
+        return verdicts
+
+
+    def suggest (self, word):
+
+        key = (self._ckey, word)
+        suggs = self._suggestions.get(key)
+        if suggs is None:
+            suggs = tuple(self._checker.suggest(word))
+            self._suggestions.set(key, suggs)
+        return list(suggs)
+
+
+    def suggest_words (self, words, jobs=1):
+        """
+        Get suggestions for a sequence of words at once.
+
+        Suggestions not yet known are computed only once per word,
+        divided among the given number of worker processes.
+
+        @param words: words to get suggestions for
+        @type words: sequence of strings or byte strings
+        @param jobs: number of worker processes
+        @type jobs: int
+
+        @returns: suggestions for each word
+        @rtype: [[string*]*]
+        """
+
+        suggs = [self._suggestions.get((self._ckey, x)) for x in words]
+        missing = list(dict.fromkeys(x for x, s in zip(words, suggs)
+                                     if s is None))
+        if missing:
+            checker = self._checker
+            def work (part):
+                return [tuple(checker.suggest(x)) for x in part]
+            parts = split_even(missing, jobs * 4 if jobs > 1 else 1)
+            computed = {}
+            for part, results in zip(parts, parallel_map(work, parts, jobs)):
+                for word, wsuggs in zip(part, results):
+                    self._suggestions.set((self._ckey, word), wsuggs)
+                    computed[word] = wsuggs
+            suggs = [s if s is not None else computed[x]
+                     for x, s in zip(words, suggs)]
+        return [list(x) for x in suggs]
+
+
+    def __getattr__ (self, name):
+
+        return getattr(self._checker, name)
+
+
 def check_spell_ec (provider=None, lang=None, encoding="UTF-8", variety=None,
                     envs=None, suponly=False, maxsugg=5):
     """
@@ -433,7 +970,8 @@ def check_spell_ec (provider=None, lang=None, encoding="UTF-8", variety=None,
 
     Misspelled words are reported to stdout, with suggestions if available.
     Maximum number of suggestions to display is selected by the C{maxsugg}
-    parameter; if negative, all suggestions are shown.
+    parameter; if negative, all suggestions are shown, and if zero,
+    suggestions are not even computed (which is much faster).
 
     Spell checking is performed by internally splitting text into words, and
     querying provider word by word. Spliting is performed in a simple fashion;
@@ -497,75 +1035,71 @@ def check_spell_ec_sp (provider=None, lang=None, encoding="UTF-8", variety=None,
 # Construct Enchant checker for given langenv.
 def _construct_enchant (provider, lang, envs, encoding, variety, suponly):
 
+    if suponly:
+        # Create simple internal checker that only checks against
+        # internal supplemental dictionaries.
+        return _QuasiSpell(_supplement_words_or_error(lang, envs), encoding)
+
     # Get Pology's internal personal dictonary for this language.
     dictpath, temporary = _compose_personal_dict(lang, envs)
 
-    if not suponly:
-        try:
-            import enchant
-        except ImportError:
-            pkgs = ["python-enchant"]
-            raise PologyError(_("@info",
-                                "Python wrapper for Enchant not found, "
-                                "please install it (possible package names: "
-                                "%(pkglist)s).",
-                                pkglist=format_item_list(pkgs)))
-
-        # Create Enchant broker.
-        try:
-            broker = enchant.Broker()
-        except Exception as e:
+    try:
+        import enchant
+    except ImportError:
+        pkgs = ["python-enchant"]
+        raise PologyError(_("@info",
+                            "Python wrapper for Enchant not found, "
+                            "please install it (possible package names: "
+                            "%(pkglist)s).",
+                            pkglist=format_item_list(pkgs)))
+
+    # Create Enchant broker.
+    try:
+        broker = enchant.Broker()
+    except Exception as e:
+        raise PologyError(
+            _("@info",
+              "Cannot initialize Enchant:\n%(msg)s",
+              msg=e))
+
+    # Find Enchant language.
+    e_langs = list(filter(broker.dict_exists, [variety, lang]))
+    if e_langs:
+        e_lang = e_langs[0]
+    else:
+        if variety is not None:
             raise PologyError(
                 _("@info",
-                  "Cannot initialize Enchant:\n%(msg)s",
-                  msg=e))
-
-        # Find Enchant language.
-        e_langs = list(filter(broker.dict_exists, [variety, lang]))
-        if e_langs:
-            e_lang = e_langs[0]
+                  "Language '%(lang)s' and variety '%(var)s' "
+                  "not known to Enchant.",
+                  lang=lang, var=variety))
         else:
-            if variety is not None:
-                raise PologyError(
-                    _("@info",
-                      "Language '%(lang)s' and variety '%(var)s' "
-                      "not known to Enchant.",
-                      lang=lang, var=variety))
-            else:
-                raise PologyError(
-                    _("@info",
-                      "Language '%(lang)s' not known to Enchant.",
-                      lang=lang))
-
-        # Choose the provider for the selected language.
-        try:
-            broker.set_ordering((e_lang or "*"), provider)
-        except Exception as e:
             raise PologyError(
                 _("@info",
-                  "Cannot configure Enchant for provider '%(pvd)s':\n%(msg)s",
-                  pvd=provider, msg=e))
+                  "Language '%(lang)s' not known to Enchant.",
+                  lang=lang))
 
-        # Create checker and test functionality.
-        try:
-            if dictpath is None:
-                checker = enchant.Dict(e_lang, broker)
-            else:
-                checker = enchant.DictWithPWL(e_lang, dictpath, None, broker)
-            checker.check(".")
-        except Exception:
-            raise PologyError(
-                _("@info",
-                  "Enchant test check for language '%(lang)s' failed.",
-                  lang=e_lang))
-    else:
-        # Create simple internal checker that only checks against
-        # internal supplemental dictionaries.
-        if not dictpath:
-            raise PologyError(
-                _("@info",
-                  "No supplemental dictionaries found."))
-        checker = _QuasiSpell(dictpath, encoding)
+    # Choose the provider for the selected language.
+    try:
+        broker.set_ordering((e_lang or "*"), provider)
+    except Exception as e:
+        raise PologyError(
+            _("@info",
+              "Cannot configure Enchant for provider '%(pvd)s':\n%(msg)s",
+              pvd=provider, msg=e))
+
+    # Create checker and test functionality.
+    try:
+        if dictpath is None:
+            checker = enchant.Dict(e_lang, broker)
+        else:
+            checker = enchant.DictWithPWL(e_lang, dictpath, None, broker)
+        checker.check(".")
+    except Exception:
+        raise PologyError(
+            _("@info",
+              "Enchant test check for language '%(lang)s' failed.",
+              lang=e_lang))
 
     # Composited dictionary read by now, remove if temporary file.
     if temporary:
@@ -14,6 +14,7 @@ various version control systems.
 import os
 import re
 import shutil
+import subprocess
 import tempfile
 
 from pology import PologyError, _, n_
@@ -250,6 +251,81 @@ class VcsBase (object):
               "fetching of a versioned path."))
 
 
+    def export_files (self, path, rev, selectf=None, rewrite=None):
+        """
+        Export contents of all files in a versioned file or directory.
+
+        Like L{export}, but instead of copying to a destination path,
+        contents of the files under C{path} in the revision C{rev}
+        are returned as byte strings, together with local paths
+        of the files (as they would be in the working copy).
+        Files can be selected by a function C{selectf}, which takes
+        the local path and returns C{True} if the file is to be exported.
+
+        Files not existing in the revision are not reported,
+        but if the revision cannot be exported at all,
+        an error is signaled.
+
+        The default implementation goes through L{export} and temporary
+        files, while particular VCS may do it more efficiently,
+        e.g. by streaming all contents from a single process.
+
+        @param path: path of the versioned file or directory in local repository
+        @type path: string
+        @param rev: revision to export
+        @type rev: string or C{None}
+        @param selectf: function to select files to export by local path
+        @type selectf: (string)->bool or None
+        @param rewrite: function to filter resolved repository path
+        @type rewrite: (string, string)->string or None
+
+        @return: local paths and contents of exported files, sorted by path
+        @rtype: [(string, bytes)*]
+        """
+
+        tmpdir = tempfile.mkdtemp(prefix="pology-export-")
+        try:
+            expath = os.path.join(tmpdir, "export")
+            if not self.export(path, rev, expath, rewrite=rewrite):
+                raise PologyError(
+                    _("@info",
+                      "Cannot export path '%(path)s' "
+                      "in revision '%(rev)s'.",
+                      path=path, rev=rev))
+            if os.path.isfile(expath):
+                lexpaths = [(path, expath)]
+            else:
+                lexpaths = []
+                for root, dirs, files in os.walk(expath):
+                    for fname in files:
+                        fpath = os.path.join(root, fname)
+                        rpath = fpath[len(expath) + len(os.path.sep):]
+                        lexpaths.append((os.path.join(path, rpath), fpath))
+                lexpaths.sort()
+            contents = []
+            for lpath, fpath in lexpaths:
+                if selectf and not selectf(lpath):
+                    continue
+                with open(fpath, "rb") as f:
+                    contents.append((lpath, f.read()))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        return contents
+
+
+    def close (self):
+        """
+        Release any resources held by this VCS object.
+
+        For example, a VCS may keep some helper processes running
+        between operations, which are stopped by this method.
+        The object can still be used afterwards.
+        """
+
+        pass
+
+
     def commit (self, paths, message=None, msgfile=None, incparents=True):
         """
         Commit paths to the repository.
@@ -784,6 +860,10 @@ class VcsGit (VcsBase):
         self._env = os.environ.copy()
         self._env["LC_ALL"] = "C"
 
+        # Running blob readers and their parent processes,
+        # by repository root.
+        self._catprocs = {}
+
 
     def _gitroot (self, paths):
 
@@ -974,6 +1054,95 @@ class VcsGit (VcsBase):
         return ret
 
 
+    def export_files (self, path, rev, selectf=None, rewrite=None):
+        # Base override.
+
+        root, rpath = self._gitroot(path)
+
+        if rev is None:
+            rev = "HEAD"
+
+        if rewrite:
+            rpath = rewrite(rpath, rev)
+
+        # List blobs in the tree at given revision.
+        cmdline = ["git", "ls-tree", "-r", "-z", rev]
+        if rpath:
+            cmdline.extend(["--", rpath])
+        res = collect_system(cmdline, wdir=root, env=self._env)
+        if res[2] != 0:
+            raise PologyError(
+                _("@info",
+                  "Cannot export path '%(path)s' "
+                  "in revision '%(rev)s'.",
+                  path=path, rev=rev))
+        lpaths = []
+        objids = []
+        for entry in res[0].split("\0"):
+            if not entry:
+                continue
+            spec, gpath = entry.split("\t", 1)
+            mode, otype, objid = spec.split()
+            if otype != "blob":
+                continue
+            if gpath == rpath:
+                lpath = path
+            else:
+                lpath = os.path.join(path, gpath[len(rpath):].lstrip("/"))
+            if selectf and not selectf(lpath):
+                continue
+            lpaths.append(lpath)
+            objids.append(objid)
+
+        return list(zip(lpaths, self._cat_blobs(root, objids)))
+
+
+    # Number of objects requested at once from the blob reader,
+    # so that pipe buffers never fill up.
+    _cat_batch_size = 64
+
+    def _cat_blobs (self, root, objids):
+
+        # The reader is kept running between calls, one per repository,
+        # but a forked worker process must start its own.
+        proc, pid = self._catprocs.get(root, (None, None))
+        if proc is None or pid != os.getpid():
+            proc = subprocess.Popen(["git", "cat-file", "--batch"],
+                                    cwd=root, env=self._env,
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE)
+            self._catprocs[root] = (proc, os.getpid())
+
+        contents = []
+        for i in range(0, len(objids), self._cat_batch_size):
+            batch = objids[i:i + self._cat_batch_size]
+            proc.stdin.write("".join(x + "\n" for x in batch).encode("ascii"))
+            proc.stdin.flush()
+            for objid in batch:
+                # Each object comes as "<id> <type> <size>" line,
+                # followed by the content and a newline.
+                spec = proc.stdout.readline().split()
+                if len(spec) != 3:
+                    raise PologyError(
+                        _("@info \"Git\" is a version control system",
+                          "Cannot read Git object '%(obj)s'.",
+                          obj=objid))
+                contents.append(proc.stdout.read(int(spec[2])))
+                proc.stdout.read(1)
+
+        return contents
+
+
+    def close (self):
+        # Base override.
+
+        for proc, pid in self._catprocs.values():
+            if pid == os.getpid() and proc.poll() is None:
+                proc.stdin.close()
+                proc.wait()
+        self._catprocs = {}
+
+
     def commit (self, paths, message=None, msgfile=None, incparents=True):
         # Base override.
 
@@ -11,8 +11,11 @@ Documented in C{doc/user/diffpatch.docbook#sec-dppatch}.
 """
 
 import filecmp
+import io
+import json
 import locale
 import os
+import re
 import shutil
 import sys
 
@@ -21,7 +24,7 @@ try:
 except Exception:
     pass
 
-from pology import version, _, n_, t_
+from pology import PologyError, version, _, n_, t_
 from pology.catalog import Catalog
 from pology.message import MessageUnsafe
 from pology.colors import ColorOptionParser, set_coloring_globals, cjoin
@@ -29,6 +32,7 @@ import pology.config as pology_config
 from pology.fsops import str_to_unicode, collect_catalogs
 from pology.fsops import exit_on_exception
 from pology.diff import msg_ediff
+from pology.parallel import parallel_map, resolve_jobs
 from pology.report import error, warning, report, format_item_list
 from pology.report import list_options
 from pology.report import init_file_progress
@@ -51,6 +55,7 @@ def main ():
     # Get defaults for command line options from global config.
     cfgsec = pology_config.section("poediff")
     def_do_merge = cfgsec.boolean("merge", True)
+    def_jobs = cfgsec.integer("jobs", None)
 
     # Setup options and parse the command line.
     usage = _("@info command usage",
@@ -83,6 +88,22 @@ def main ():
                "Paths are under version control by given VCS; "
                "can be one of: %(vcslist)s.",
                vcslist=format_item_list(showvcs)))
+    opars.add_option(
+        "-j", "--jobs",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="jobs", type="int", default=def_jobs,
+        help=_("@info command line option description",
+               "Diff pairs of files in this many parallel processes; "
+               "zero means as many as there are processors. "
+               "The resulting diff is the same as when files are diffed "
+               "one after another."))
+    opars.add_option(
+        "--json",
+        action="store_true", dest="json", default=False,
+        help=_("@info command line option description",
+               "With %(opt)s, output the update effort in JSON format, "
+               "in total and for each pair of files.",
+               opt="-U"))
     opars.add_option(
         "--list-options",
         action="store_true", dest="list_options", default=False,
@@ -134,6 +155,13 @@ def main ():
         help=_("@info command line option description",
                "Do not diff headers and do not write out the top header "
                "(resulting output cannot be used as patch)."))
+    opars.add_option(
+        "--stream",
+        action="store_true", dest="stream", default=False,
+        help=_("@info command line option description",
+               "Write out the diff of each pair of files as soon as "
+               "it is made, instead of collecting the complete diff first. "
+               "This bounds memory use when a great many files are diffed."))
     opars.add_option(
         "-U", "--update-effort",
         action="store_true", dest="update_effort", default=False,
@@ -235,91 +263,86 @@ def main ():
             paths.sort()
         pspecs = collect_pspecs_from_vcs(vcs, paths, revs, op.paired_only)
 
-    if not op.update_effort:
+    if not op.update_effort and op.stream:
+        if op.output:
+            file = open(op.output, "w", encoding="UTF-8")
+            writef = file.write
+        else:
+            writef = lambda text: report(text, newline=False)
+        stream_diff_pairs(pspecs, op.do_merge, writef,
+                          colorize=(not op.output),
+                          shdr=op.strip_headers,
+                          noobs=op.skip_obsolete,
+                          quiet=op.quiet,
+                          jobs=resolve_jobs(op.jobs))
+        if op.output:
+            file.close()
+    elif not op.update_effort:
         ecat, ndiffed = diff_pairs(pspecs, op.do_merge,
                                    colorize=(not op.output),
                                    shdr=op.strip_headers,
                                    noobs=op.skip_obsolete,
-                                   quiet=op.quiet)
+                                   quiet=op.quiet,
+                                   jobs=resolve_jobs(op.jobs))
         if ndiffed > 0:
             hmsgctxt = ecat.header.get_field_value(EDST.hmsgctxt_field)
-            lines = []
             msgs = list(ecat)
             if not op.strip_headers:
                 msgs.insert(0, ecat.header.to_msg())
-            for msg in msgs:
-                if op.strip_headers and msg.msgctxt == hmsgctxt:
-                    sepl = []
-                    sepl += [msg.manual_comment[0]]
-                    sepl += msg.msgid.split("\n")[:2]
-                    lines.extend(["# %s\n" % x for x in sepl])
-                    lines.append("\n")
-                else:
-                    lines.extend(msg.to_lines(force=True, wrapf=ecat.wrapf()))
+            lines = format_ediff(msgs, hmsgctxt, ecat.wrapf(),
+                                 op.strip_headers)
             diffstr = cjoin(lines)[:-1] # remove last newline
             if op.output:
-                file = open(op.output, "w")
-                file.write(diffstr.encode(ecat.encoding()))
+                file = open(op.output, "w", encoding=ecat.encoding())
+                file.write(diffstr + "\n")
                 file.close()
             else:
                 report(diffstr)
     else:
-        updeff = pairs_update_effort(pspecs, quiet=op.quiet)
-        ls = []
-        for kw, desc, val, fmtval in updeff:
-            ls.append(_("@info",
-                        "%(quantity)s: %(value)s",
-                        quantity=desc, value=fmtval))
-        report("\n".join(ls))
+        updeff, pupdeffs = pairs_update_effort(pspecs, quiet=op.quiet,
+                                               jobs=resolve_jobs(op.jobs))
+        if op.json:
+            data = dict((kw, val) for kw, desc, val, fmtval in updeff)
+            data["files"] = []
+            for vpaths, pupdeff in zip([x[1] for x in pspecs], pupdeffs):
+                fdata = {"old": vpaths[0], "new": vpaths[1]}
+                fdata.update((kw, val) for kw, desc, val, fmtval in pupdeff)
+                data["files"].append(fdata)
+            report(json.dumps(data, indent=2, ensure_ascii=False))
+        else:
+            ls = []
+            for kw, desc, val, fmtval in updeff:
+                ls.append(_("@info",
+                            "%(quantity)s: %(value)s",
+                            quantity=desc, value=fmtval))
+            report("\n".join(ls))
 
     # Clean up.
+    if vcs:
+        vcs.close()
     cleanup_tmppaths()
 
 
 def diff_pairs (pspecs, merge,
                 colorize=False, wrem=True, wadd=True, shdr=False, noobs=False,
-                quiet=False):
+                quiet=False, jobs=1):
 
     # Create diffs of messages.
     # Note: Headers will be collected and diffed after all messages,
     # to be able to check if any decoration to their message keys is needed.
-    wrappings = {}
+    wrappings = []
     ecat = Catalog("", create=True, monitored=False)
     hspecs = []
     ndiffed = 0
-    update_progress = None
-    if len(pspecs) > 1 and not quiet:
-        update_progress = init_file_progress([vp[1] for fp, vp in pspecs],
-                            addfmt=t_("@info:progress", "Diffing: %(file)s"))
-    for fpaths, vpaths in pspecs:
-        upprogf = None
-        if update_progress:
-            upprogf = lambda: update_progress(vpaths[1])
-            upprogf()
-        # Quick check if files are binary equal.
-        if fpaths[0] and fpaths[1] and filecmp.cmp(*fpaths):
-            continue
-        cats = []
-        for fpath in fpaths:
-            try:
-                cats.append(Catalog(fpath, create=True, monitored=False))
-            except Exception:
-                error_wcl(_("@info",
-                            "Cannot parse catalog '%(file)s'.",
-                            file=fpath), norem=[fpath])
+    for emsgs, hdrs, vpaths, cndiffed, wrapping in iter_diff_pairs(
+        pspecs, merge, colorize, wrem, wadd, noobs, quiet, jobs
+    ):
         tpos = len(ecat)
-        cndiffed = diff_cats(cats[0], cats[1], ecat,
-                             merge, colorize, wrem, wadd, noobs, upprogf)
-        hspecs.append(([not x.created() and x.header or None
-                        for x in cats], vpaths, tpos, cndiffed))
+        for emsg in emsgs:
+            ecat.add(emsg, len(ecat))
+        hspecs.append((hdrs, vpaths, tpos, cndiffed))
         ndiffed += cndiffed
-        # Collect and count wrapping policy used for to-catalog.
-        wrapping = cats[1].wrapping()
-        if wrapping not in wrappings:
-            wrappings[wrapping] = 0
-        wrappings[wrapping] += 1
-    if update_progress:
-        update_progress()
+        wrappings.append(wrapping)
 
     # Find appropriate length of context for header messages.
     hmsgctxt = get_msgctxt_for_headers(ecat)
@@ -339,14 +362,188 @@ def diff_pairs (pspecs, merge,
     if not shdr:
         ndiffed += incpos
 
-    # Set the most used wrapping policy for the ediff catalog.
-    if wrappings:
-        wrapping = sorted(list(wrappings.items()), key=lambda x: x[1])[-1][0]
+    set_ediff_wrapping(ecat, wrappings)
+
+    return ecat, ndiffed
+
+
+# Diff pairs of catalogs, possibly in parallel, and yield in order
+# the diff of each pair which is not binary equal, as the tuple of
+# (ediff messages, headers, visual paths, number of diffed messages,
+# wrapping policy of the new catalog).
+def iter_diff_pairs (pspecs, merge, colorize, wrem, wadd, noobs, quiet, jobs):
+
+    update_progress = None
+    if len(pspecs) > 1 and not quiet:
+        update_progress = init_file_progress([vp[1] for fp, vp in pspecs],
+                            addfmt=t_("@info:progress", "Diffing: %(file)s"))
+    def diff_pair_w (pspec):
+        fpaths, vpaths = pspec
+        upprogf = None
+        if update_progress and jobs <= 1:
+            upprogf = lambda: update_progress(vpaths[1])
+            upprogf()
+        return diff_pair(fpaths, merge, colorize, wrem, wadd, noobs, upprogf)
+    # Pairs may be diffed in parallel, but diffs are collected
+    # in the original order, so that the result is always the same.
+    results = parallel_map(diff_pair_w, pspecs, jobs)
+    for (fpaths, vpaths), result in zip(pspecs, results):
+        if update_progress and jobs > 1:
+            update_progress(vpaths[1])
+        if result is None:
+            continue
+        emsgs, hdrs, cndiffed, wrapping, badpath = result
+        if badpath is not None:
+            error_wcl(_("@info",
+                        "Cannot parse catalog '%(file)s'.",
+                        file=badpath), norem=[badpath])
+        yield emsgs, hdrs, vpaths, cndiffed, wrapping
+    if update_progress:
+        update_progress()
+
+
+# Set the most used wrapping policy of diffed catalogs
+# for the ediff catalog.
+def set_ediff_wrapping (ecat, wrappings):
+
+    counts = {}
+    for wrapping in wrappings:
+        counts[wrapping] = counts.get(wrapping, 0) + 1
+    if counts:
+        wrapping = sorted(list(counts.items()), key=lambda x: x[1])[-1][0]
         ecat.set_wrapping(wrapping)
         if wrapping is not None:
             ecat.header.set_field("X-Wrapping", ", ".join(wrapping))
 
-    return ecat, ndiffed
+
+# Like diff_pairs, but write out the diff of each pair as soon as it is made.
+# The ediff header, and the context of header messages, must be known
+# before the first diff is written; they are determined by a quick pass
+# through diffed catalogs, which reads only their headers and
+# looks for contexts which would conflict.
+# Return the number of diffed messages.
+def stream_diff_pairs (pspecs, merge, writef,
+                       colorize=False, wrem=True, wadd=True, shdr=False,
+                       noobs=False, quiet=False, jobs=1):
+
+    ecat = Catalog("", create=True, monitored=False)
+    hmsgctxt, wrappings = scan_pairs(pspecs)
+    init_ediff_header(ecat.header, hmsgctxt=hmsgctxt)
+    set_ediff_wrapping(ecat, wrappings)
+
+    ndiffed = 0
+    pending = []
+    for emsgs, hdrs, vpaths, cndiffed, wrapping in iter_diff_pairs(
+        pspecs, merge, colorize, wrem, wadd, noobs, quiet, jobs
+    ):
+        ehmsg, anydiff = diff_hdrs(hdrs[0], hdrs[1], vpaths[0], vpaths[1],
+                                   hmsgctxt, ecat, colorize)
+        if not (anydiff or cndiffed):
+            continue
+        msgs = [ehmsg] + emsgs
+        if ndiffed == 0 and not shdr:
+            msgs.insert(0, ecat.header.to_msg())
+        ndiffed += cndiffed + (0 if shdr else 1)
+        text = cjoin(format_ediff(msgs, hmsgctxt, ecat.wrapf(), shdr))
+        # When headers are stripped, separators of pairs where only
+        # headers differ are held back until some message is diffed,
+        # as otherwise nothing is written (same as in diff_pairs).
+        if ndiffed == 0:
+            pending.append(text)
+            continue
+        for ptext in pending:
+            writef(ptext)
+        pending = []
+        writef(text)
+
+    return ndiffed
+
+
+# Quickly determine context for header messages and wrapping policies
+# of catalogs to be diffed (see stream_diff_pairs).
+# Contexts consisting only of header context elements appear in the diff
+# with one more element, due to escaping of trailing elements;
+# the header context is made different from all such contexts.
+def scan_pairs (pspecs):
+
+    el = re.escape(EDST.hmsgctxt_el)
+    elrx = re.compile(r'"(%s*)"' % el)
+    ctxtrx = re.compile(r'msgctxt\s+"%s*"(?:\s*(?:#[~|]*)?\s*"%s*")*'
+                        % (el, el))
+    ellens = set()
+    wrappings = []
+    for fpaths, vpaths in pspecs:
+        if same_files(*fpaths):
+            continue
+        wrapping = None
+        for i, fpath in enumerate(fpaths):
+            if not fpath:
+                continue
+            content = read_content(fpath)
+            # Any encoding compatible with ASCII is fine for this.
+            text = content.decode("latin1")
+            for m in ctxtrx.finditer(text):
+                ellen = sum(len(x) for x in elrx.findall(m.group(0)))
+                if ellen > 0:
+                    ellens.add(ellen + 1)
+            if i == 1:
+                try:
+                    cat = Catalog(fpath, monitored=False, headonly=True,
+                                  readfh=io.BytesIO(content))
+                    wrapping = cat.wrapping()
+                except Exception:
+                    # Reported when diffing.
+                    pass
+        wrappings.append(wrapping)
+
+    ellen = 1
+    while ellen in ellens:
+        ellen += 1
+
+    return EDST.hmsgctxt_el * ellen, wrappings
+
+
+# Format ediff messages for output.
+# If headers are stripped, header messages are reduced to separators.
+def format_ediff (msgs, hmsgctxt, wrapf, shdr):
+
+    lines = []
+    for msg in msgs:
+        if shdr and msg.msgctxt == hmsgctxt:
+            sepl = []
+            sepl += [msg.manual_comment[0]]
+            sepl += msg.msgid.split("\n")[:2]
+            lines.extend(["# %s\n" % x for x in sepl])
+            lines.append("\n")
+        else:
+            lines.extend(msg.to_lines(force=True, wrapf=wrapf))
+
+    return lines
+
+
+# Diff a pair of catalogs into a local list of ediff messages.
+# Return None if files are binary equal, otherwise the tuple of
+# (ediff messages, headers, number of diffed messages, wrapping policy,
+# path of the catalog which could not be parsed or None).
+# Everything returned can be passed back from a worker process.
+def diff_pair (fpaths, merge, colorize, wrem, wadd, noobs, upprogf=None):
+
+    # Quick check if files are binary equal.
+    if same_files(*fpaths):
+        return None
+    cats = []
+    for fpath in fpaths:
+        try:
+            cats.append(open_catalog(fpath))
+        except Exception:
+            return [], [], 0, None, fpath
+    lecat = Catalog("", create=True, monitored=False)
+    cndiffed = diff_cats(cats[0], cats[1], lecat,
+                         merge, colorize, wrem, wadd, noobs, upprogf,
+                         rawf=exported_content)
+    hdrs = [not x.created() and x.header or None for x in cats]
+
+    return list(lecat), hdrs, cndiffed, cats[1].wrapping(), None
 
 
 # Collect and pair catalogs as list [(fpath1, fpath2)].
@@ -359,6 +556,12 @@ def collect_file_pairs (dpath1, dpath2, paired_only):
 
     bysub1, bysub2 = list(map(collect_and_split_fpaths, (dpath1, dpath2)))
 
+    return pair_split_fpaths(bysub1, bysub2, paired_only)
+
+
+# Pair catalogs as split by collect_and_split_fpaths.
+def pair_split_fpaths (bysub1, bysub2, paired_only):
+
     # Try to pair files by subdirectories.
     # FIXME: Can and should anything smarter be done?
     fpairs = []
@@ -400,86 +603,168 @@ def collect_and_split_fpaths (dpath):
 def collect_pspecs_from_vcs (vcs, paths, revs, paired_only):
 
     pspecs = []
-    # FIXME: Use tempfile module.
-    expref = "/tmp/poediff-export-"
-    exind = 0
     for path in paths:
-        expaths = {}
+        # Catalogs of the path in given revisions are exported into memory,
+        # and those in the working copy are taken as they are.
+        # Paths of exported catalogs are set to visual paths,
+        # which are unique and under which the content is recorded.
+        bysubs = []
+        rev_ms = []
         for rev in revs:
+            rev_m = ""
             if rev is None:
-                expaths[rev] = path
-            else:
-                expath = expref + "%d-%d-%s" % (os.getpid(), exind, rev)
-                exind += 1
                 if os.path.isfile(path):
-                    expath += ".po"
-                if not vcs.export(path, rev or None, expath):
+                    fpaths = [(path, path)]
+                else:
+                    fpaths = [(x, x) for x in collect_catalogs(path)]
+            else:
+                try:
+                    excats = vcs.export_files(path, rev or None,
+                                              selectf=is_catalog_path)
+                except PologyError:
                     error_wcl(_("@info",
                                 "Cannot export path '%(path)s' "
                                 "in revision '%(rev)s'.",
                                 path=path, rev=rev))
-                record_tmppath(expath)
-                expaths[rev] = expath
-        expaths = [os.path.normpath(expaths[x]) for x in revs]
-        fpairs = collect_file_pairs(expaths[0], expaths[1], paired_only)
-        for fpair in fpairs:
-            fpaths = []
-            vpaths = []
-            for fpath, expath, rev in zip(fpair, expaths, revs):
-                if rev is not None:
-                    if not fpath:
-                        fpath_m = ""
-                    elif os.path.isdir(path):
-                        fpath_m = fpath[len(expath) + len(os.path.sep):]
-                        fpath_m = os.path.join(path, fpath_m)
-                    else:
-                        fpath_m = path
-                    rev_m = rev or vcs.revision(path)
-                    vpath = fpath_m + EDST.filerev_sep + rev_m
+                rev_m = rev or vcs.revision(path)
+                fpaths = []
+                for lpath, content in excats:
+                    vpath = lpath + EDST.filerev_sep + rev_m
+                    record_exported(vpath, content)
+                    fpaths.append((lpath, vpath))
+            rev_ms.append(rev_m)
+            bysub = {}
+            for lpath, fpath in fpaths:
+                if os.path.isfile(path):
+                    subdir, filename = "", os.path.basename(path)
                 else:
-                    vpath = fpath
-                fpaths.append(fpath)
-                vpaths.append(vpath)
-            pspecs.append((fpaths, vpaths))
+                    subdir, filename = os.path.split(os.path.relpath(lpath,
+                                                                     path))
+                bysub.setdefault(subdir, {})[filename] = fpath
+            bysubs.append(bysub)
+        fpairs = pair_split_fpaths(bysubs[0], bysubs[1], paired_only)
+        for fpair in fpairs:
+            # Missing exported catalog is shown only by revision.
+            vpaths = [x or (rev_m and EDST.filerev_sep + rev_m)
+                      for x, rev_m in zip(fpair, rev_ms)]
+            pspecs.append((fpair, vpaths))
 
     return pspecs
 
 
-def pairs_update_effort (pspecs, quiet=False):
+def is_catalog_path (path):
+
+    return path.endswith(".po") or path.endswith(".pot")
+
+
+# Compute update effort between pairs of catalogs, possibly in parallel.
+# Return the total update effort, and the update effort for each pair.
+def pairs_update_effort (pspecs, quiet=False, jobs=1):
 
     update_progress = None
     if len(pspecs) > 1 and not quiet:
         update_progress = init_file_progress([vp[1] for fp, vp in pspecs],
                             addfmt=t_("@info:progress", "Diffing: %(file)s"))
-    nntw_total = 0.0
-    for fpaths, vpaths in pspecs:
+    def pair_update_effort_w (pspec):
+        fpaths, vpaths = pspec
         upprogf = None
-        if update_progress:
+        if update_progress and jobs <= 1:
             upprogf = lambda: update_progress(vpaths[1])
             upprogf()
-        # Quick check if files are binary equal.
-        if fpaths[0] and fpaths[1] and filecmp.cmp(*fpaths):
-            continue
-        cats = []
-        for fpath in fpaths:
-            try:
-                cats.append(Catalog(fpath, create=True, monitored=False))
-            except Exception:
-                error_wcl(_("@info",
-                            "Cannot parse catalog '%(file)s'.",
-                            file=fpath), norem=[fpath])
-        nntw = cats_update_effort(cats[0], cats[1], upprogf)
+        return pair_update_effort(fpaths, upprogf)
+    nntw_total = 0.0
+    pupdeffs = []
+    for (fpaths, vpaths), (nntw, badpath) in zip(
+        pspecs, parallel_map(pair_update_effort_w, pspecs, jobs)
+    ):
+        if update_progress and jobs > 1:
+            update_progress(vpaths[1])
+        if badpath is not None:
+            error_wcl(_("@info",
+                        "Cannot parse catalog '%(file)s'.",
+                        file=badpath), norem=[badpath])
         nntw_total += nntw
+        pupdeffs.append(make_update_effort(nntw))
     if update_progress:
         update_progress()
 
+    return make_update_effort(nntw_total), pupdeffs
+
+
+# Compute update effort between two catalogs.
+# Return the nominal number of newly translated words,
+# and the path of the catalog which could not be parsed, if any.
+def pair_update_effort (fpaths, upprogf=None):
+
+    # Quick check if files are binary equal.
+    if same_files(*fpaths):
+        return 0.0, None
+    cats = []
+    for fpath in fpaths:
+        try:
+            cats.append(open_catalog(fpath))
+        except Exception:
+            return 0.0, fpath
+    nntw = cats_update_effort(cats[0], cats[1], upprogf,
+                              rawf=exported_content)
+    return nntw, None
+
+
+def make_update_effort (nntw):
+
     updeff = [
         ("nntw", _("@item", "nominal newly translated words"),
-         nntw_total, "%.0f" % nntw_total),
+         nntw, "%.0f" % nntw),
     ]
     return updeff
 
 
+# Contents of catalogs exported from VCS, by visual path.
+# These are recorded before diffing, so that worker processes
+# have them too.
+_exported = {}
+
+def record_exported (vpath, content):
+
+    _exported[vpath] = content
+
+
+def exported_content (cat):
+
+    return _exported.get(cat.filename)
+
+
+# Open catalog from disk or from exported contents.
+# Empty path gives an empty catalog.
+def open_catalog (fpath):
+
+    content = _exported.get(fpath)
+    if content is not None:
+        return Catalog(fpath, monitored=False, readfh=io.BytesIO(content))
+    else:
+        return Catalog(fpath, create=True, monitored=False)
+
+
+# Read raw content of a catalog file, from disk or exported contents.
+def read_content (fpath):
+
+    content = _exported.get(fpath)
+    if content is None:
+        with open(fpath, "rb") as f:
+            content = f.read()
+    return content
+
+
+# Check if two catalog files are binary equal.
+def same_files (fpath1, fpath2):
+
+    if not fpath1 or not fpath2:
+        return False
+    if fpath1 not in _exported and fpath2 not in _exported:
+        return filecmp.cmp(fpath1, fpath2)
+    return read_content(fpath1) == read_content(fpath2)
+
+
 # Cleanup of temporary paths.
 _tmppaths = set()
 
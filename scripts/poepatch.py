@@ -28,6 +28,7 @@ from pology.msgreport import error_on_msg, warning_on_msg
 import pology.config as pology_config
 from pology.fsops import str_to_unicode, mkdirpath, collect_catalogs
 from pology.fsops import exit_on_exception
+from pology.parallel import parallel_map, resolve_jobs
 from pology.catalog import Catalog
 from pology.message import Message, MessageUnsafe
 from pology.header import Header
@@ -36,6 +37,7 @@ from pology.diff import msg_ediff, msg_ediff_to_new, msg_ediff_to_old
 from pology.internal.poediffpatch import MPC, EDST
 from pology.internal.poediffpatch import msg_eq_fields, msg_copy_fields
 from pology.internal.poediffpatch import msg_clear_prev_fields
+from pology.internal.poediffpatch import msg_cleanup
 from pology.internal.poediffpatch import diff_cats
 from pology.internal.poediffpatch import init_ediff_header
 from pology.internal.poediffpatch import get_msgctxt_for_headers
@@ -60,6 +62,7 @@ def main ():
     # Get defaults for command line options from global config.
     cfgsec = pology_config.section("poepatch")
     def_do_merge = cfgsec.boolean("merge", True)
+    def_jobs = cfgsec.integer("jobs", None)
 
     # Setup options and parse the command line.
     usage = _("@info command usage",
@@ -99,6 +102,15 @@ def main ():
         dest="input",
         help=_("@info command line option description",
                "Read the patch from the given file instead of standard input."))
+    opars.add_option(
+        "-j", "--jobs",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="jobs", type="int", default=def_jobs,
+        help=_("@info command line option description",
+               "Patch files in this many parallel processes; "
+               "zero means as many as there are processors. "
+               "The result is the same as when files are patched "
+               "one after another."))
     opars.add_option(
         "-n", "--no-merge",
         action="store_false", dest="do_merge", default=def_do_merge,
@@ -228,122 +240,63 @@ def apply_ediff (op):
     rcat = Catalog("", create=True, monitored=False, wrapping=ecat.wrapping())
     init_ediff_header(rcat.header, hmsgctxt=hmsgctxt, extitle="rejects")
 
-    # Apply diff to catalogs.
+    # Check that each part of the ediff has a catalog to patch,
+    # before any catalog is patched.
+    # Directories for new catalogs are created here,
+    # so that parallel workers do not race to create them.
     for fpaths, ehmsg, emsgs in edsplits:
-        # Open catalog for patching.
-        fpath1, fpath2 = fpaths
-        if fpath1:
-            # Diff from an existing catalog, open it.
-            if not os.path.isfile(fpath1):
-                warning(_("@info",
-                          "Path '%(path)s' is not a file or does not exist, "
-                          "skipping it.",
-                          path=fpath1))
-                continue
-            try:
-                cat = Catalog(fpath1)
-            except Exception:
-                warning(_("@info",
-                          "Error reading catalog '%(file)s', skipping it.",
-                          file=fpath1))
-                continue
-        elif fpath2:
-            # New catalog added in diff, create it (or open if it exists).
-            try:
-                mkdirpath(os.path.dirname(fpath2))
-                cat = Catalog(fpath2, create=True)
-                if cat.created():
-                    cat.set_wrapping(ecat.wrapping())
-            except Exception:
-                if os.path.isfile(fpath2):
-                    warning(_("@info",
-                              "Error reading catalog '%(file)s', skipping it.",
-                              file=fpath1))
-                else:
-                    warning(_("@info",
-                              "Cannot create catalog '%(file)s', skipping it.",
-                              file=fpath2))
-                continue
-        else:
+        if not fpaths[0] and not fpaths[1]:
             error(_("@info",
                     "Both catalogs in ediff indicated not to exist."))
+        elif not fpaths[0]:
+            try:
+                mkdirpath(os.path.dirname(fpaths[1]))
+            except Exception:
+                pass # reported when patching
+
+    # Group parts of the ediff by the catalog which they patch,
+    # so that each catalog is patched by a single worker,
+    # in the order in which its parts appear in the ediff.
+    isplits_by_path = {}
+    for i, (fpaths, ehmsg, emsgs) in enumerate(edsplits):
+        isplits_by_path.setdefault(fpaths[0] or fpaths[1], []).append(i)
+    isplit_groups = sorted(isplits_by_path.values())
+    def patch_group (isplits):
+        return [patch_catalog(edsplits[i], ecat, op) for i in isplits]
 
-        # Do not try to patch catalog with embedded differences
-        # (i.e. previously patched using -e).
-        if cat.header.get_field_value(EDST.hmsgctxt_field) is not None:
-            warning(_("@info",
-                      "Catalog '%(file)s' already contains "
-                      "embedded differences, skipping it.",
-                      file=cat.filename))
-            continue
-
-        # Do not try to patch catalog if the patch contains
-        # unresolved split differences.
-        if reduce(lambda r, x: r or _flag_ediff_to_new in x.flag,
-                  emsgs, False):
-            warning(_("@info",
-                      "Patch for catalog '%(file)s' contains unresolved "
-                      "split differences, skipping it.",
-                      file=cat.filename))
-            continue
-
-        # Patch the catalog.
-        rejected_ehmsg = patch_header(cat, ehmsg, ecat, op)
-        rejected_emsgs_flags = patch_messages(cat, emsgs, ecat, op)
-        any_rejected = rejected_ehmsg or rejected_emsgs_flags
-        if fpath2 or any_rejected:
-            created = cat.created()
-            if cat.sync():
-                if not created:
-                    if any_rejected and op.embed:
-                        report(_("@info:progress E is for \"with embedding\"",
-                                 "Partially patched (E): %(file)s",
-                                 file=cat.filename))
-                    elif any_rejected:
-                        report(_("@info:progress",
-                                 "Partially patched: %(file)s",
-                                 file=cat.filename))
-                    elif op.embed:
-                        report(_("@info:progress E is for \"with embedding\"",
-                                 "Patched (E): %(file)s",
-                                 file=cat.filename))
-                    else:
-                        report(_("@info:progress",
-                                 "Patched: %(file)s",
-                                 file=cat.filename))
-                else:
-                    if op.embed:
-                        report(_("@info:progress E is for \"with embedding\"",
-                                 "Created (E): %(file)s",
-                                 file=cat.filename))
-                    else:
-                        report(_("@info:progress",
-                                 "Created: %(file)s",
-                                 file=cat.filename))
-            else:
-                pass #report("unchanged: %s" % cat.filename)
-        else:
-            os.unlink(fpath1)
-            report(_("@info:progress",
-                     "Removed: %(file)s",
-                     file=fpath1))
-
-        # If there were any rejects and reembedding is not in effect,
-        # record the necessary to present them.
-        if any_rejected and not op.embed:
-            if not rejected_ehmsg:
-                # Clean header diff.
-                ehmsg.manual_comment = ehmsg.manual_comment[:1]
-                ehmsg.msgstr[0] = ""
-            rcat.add_last(ehmsg)
-            for emsg, flag in rejected_emsgs_flags:
-                # Reembed to avoid any conflicts.
-                msg1, msg2, msg1_s, msg2_s = resolve_diff_pair(emsg)
-                emsg = msg_ediff(msg1_s, msg2_s,
-                                 emsg=msg2_s, ecat=rcat, enoctxt=hmsgctxt)
-                if flag:
-                    emsg.flag.add(flag)
-                rcat.add_last(emsg)
+    # Apply diff to catalogs.
+    # Catalogs may be patched in parallel, but the results are
+    # reported and rejects collected in the order of the ediff.
+    results = {}
+    inext = 0
+    for isplits, gresults in zip(isplit_groups,
+                                 parallel_map(patch_group, isplit_groups,
+                                              resolve_jobs(op.jobs))):
+        results.update(list(zip(isplits, gresults)))
+        while inext in results:
+            fpaths, ehmsg, emsgs = edsplits[inext]
+            notes, rejected_ehmsg, rejected_emsgs_flags = results.pop(inext)
+            inext += 1
+            for notef, text in notes:
+                notef(text)
+            any_rejected = rejected_ehmsg or rejected_emsgs_flags
+
+            # If there were any rejects and reembedding is not in effect,
+            # record the necessary to present them.
+            if any_rejected and not op.embed:
+                if not rejected_ehmsg:
+                    # Clean header diff.
+                    ehmsg.manual_comment = ehmsg.manual_comment[:1]
+                    ehmsg.msgstr[0] = ""
+                rcat.add_last(ehmsg)
+                for emsg, flag in rejected_emsgs_flags:
+                    # Reembed to avoid any conflicts.
+                    msg1, msg2, msg1_s, msg2_s = resolve_diff_pair(emsg)
+                    emsg = msg_ediff(msg1_s, msg2_s,
+                                     emsg=msg2_s, ecat=rcat, enoctxt=hmsgctxt)
+                    if flag:
+                        add_flag(emsg, flag)
+                    rcat.add_last(emsg)
 
     # If there were any rejects, write them out.
     if len(rcat) > 0:
@@ -366,6 +319,120 @@ def apply_ediff (op):
                  file=rcat.filename))
 
 
+# Patch one catalog by one part of the ediff.
+# Return notes to report (as pairs of reporting function and text),
+# whether the header diff was rejected, and rejected messages with flags.
+def patch_catalog (edsplit, ecat, op):
+
+    fpaths, ehmsg, emsgs = edsplit
+    notes = []
+
+    # Open catalog for patching.
+    fpath1, fpath2 = fpaths
+    if fpath1:
+        # Diff from an existing catalog, open it.
+        if not os.path.isfile(fpath1):
+            notes.append((warning,
+                          _("@info",
+                            "Path '%(path)s' is not a file or does not exist, "
+                            "skipping it.",
+                            path=fpath1)))
+            return notes, False, []
+        try:
+            cat = Catalog(fpath1)
+        except Exception:
+            notes.append((warning,
+                          _("@info",
+                            "Error reading catalog '%(file)s', skipping it.",
+                            file=fpath1)))
+            return notes, False, []
+    else:
+        # New catalog added in diff, create it (or open if it exists).
+        try:
+            mkdirpath(os.path.dirname(fpath2))
+            cat = Catalog(fpath2, create=True)
+            if cat.created():
+                cat.set_wrapping(ecat.wrapping())
+        except Exception:
+            if os.path.isfile(fpath2):
+                notes.append((warning,
+                              _("@info",
+                                "Error reading catalog '%(file)s', "
+                                "skipping it.",
+                                file=fpath1)))
+            else:
+                notes.append((warning,
+                              _("@info",
+                                "Cannot create catalog '%(file)s', "
+                                "skipping it.",
+                                file=fpath2)))
+            return notes, False, []
+
+    # Do not try to patch catalog with embedded differences
+    # (i.e. previously patched using -e).
+    if cat.header.get_field_value(EDST.hmsgctxt_field) is not None:
+        notes.append((warning,
+                      _("@info",
+                        "Catalog '%(file)s' already contains "
+                        "embedded differences, skipping it.",
+                        file=cat.filename)))
+        return notes, False, []
+
+    # Do not try to patch catalog if the patch contains
+    # unresolved split differences.
+    if reduce(lambda r, x: r or _flag_ediff_to_new in x.flag,
+              emsgs, False):
+        notes.append((warning,
+                      _("@info",
+                        "Patch for catalog '%(file)s' contains unresolved "
+                        "split differences, skipping it.",
+                        file=cat.filename)))
+        return notes, False, []
+
+    # Patch the catalog.
+    rejected_ehmsg = patch_header(cat, ehmsg, ecat, op)
+    rejected_emsgs_flags = patch_messages(cat, emsgs, ecat, op)
+    any_rejected = rejected_ehmsg or rejected_emsgs_flags
+    if fpath2 or any_rejected:
+        created = cat.created()
+        if cat.sync():
+            if not created:
+                if any_rejected and op.embed:
+                    text = _("@info:progress E is for \"with embedding\"",
+                             "Partially patched (E): %(file)s",
+                             file=cat.filename)
+                elif any_rejected:
+                    text = _("@info:progress",
+                             "Partially patched: %(file)s",
+                             file=cat.filename)
+                elif op.embed:
+                    text = _("@info:progress E is for \"with embedding\"",
+                             "Patched (E): %(file)s",
+                             file=cat.filename)
+                else:
+                    text = _("@info:progress",
+                             "Patched: %(file)s",
+                             file=cat.filename)
+            else:
+                if op.embed:
+                    text = _("@info:progress E is for \"with embedding\"",
+                             "Created (E): %(file)s",
+                             file=cat.filename)
+                else:
+                    text = _("@info:progress",
+                             "Created: %(file)s",
+                             file=cat.filename)
+            notes.append((report, text))
+    else:
+        os.unlink(fpath1)
+        notes.append((report,
+                      _("@info:progress",
+                        "Removed: %(file)s",
+                        file=fpath1)))
+
+    return notes, rejected_ehmsg is not None, rejected_emsgs_flags
+
+
 # Patch application types.
 _pt_merge, _pt_insert, _pt_remove = list(range(3))
 
@@ -398,10 +465,19 @@ def patch_messages (cat, emsgs, ecat, options):
             if flag != _flag_ediff:
                 rejected_emsgs_flags.append((emsg_m, flag))
 
-    # Sort accepted patches by position of application.
-    patch_specs.sort(key=lambda x: x[3])
+    # Sort accepted patches by position of application,
+    # those without position first.
+    patch_specs.sort(key=lambda x: (x[3] is not None, x[3]))
 
     # Add accepted patches to catalog.
+    # They are first applied to the sequence of catalog messages,
+    # and then committed to the catalog all at once.
+    # Embedded diffs are checked for conflicts against the catalog
+    # as they are added, so then patches are applied to the catalog directly.
+    if not options.embed:
+        pcat = PatchedSequence(cat)
+    else:
+        pcat = cat
     incpos = 0
     for emsg, flag, typ, pos, msg1, msg2, msg1_s, msg2_s in patch_specs:
         if pos is not None:
@@ -423,32 +499,94 @@ def patch_messages (cat, emsgs, ecat, options):
         if 0:pass
         elif typ == _pt_merge:
             if not options.embed:
-                cat[pos].set_inv(msg2)
+                pcat[pos].set_inv(msg2)
             else:
-                cat[pos].flag.add(flag)
+                pcat[pos].flag.add(flag)
         elif typ == _pt_insert:
             if not options.embed:
-                cat.add(Message(msg2), pos)
+                pcat.add(Message(msg2), pos)
             else:
-                cat.add(Message(emsg), pos)
-                cat[pos].flag.add(flag)
+                pcat.add(Message(emsg), pos)
+                pcat[pos].flag.add(flag)
             incpos += 1
         elif typ == _pt_remove:
             if pos is None:
                 continue
             if not options.embed:
-                cat.remove(pos)
+                pcat.remove(pos)
                 incpos -= 1
             else:
-                cat[pos].flag.add(flag)
+                pcat[pos].flag.add(flag)
         else:
             error_on_msg(_("@info",
                            "Unknown patch type %(type)s.",
                            type=typ), emsg, ecat)
+    if pcat is not cat:
+        pcat.commit()
 
     return rejected_emsgs_flags
 
 
+# Sequence of messages of a catalog, to which patches are applied
+# as they would be to the catalog itself, by position.
+# Unlike in the catalog, the key-position index is not updated
+# on each insertion and removal; changes are committed to the catalog
+# in one pass at the end.
+class PatchedSequence (object):
+
+    def __init__ (self, cat):
+
+        self._cat = cat
+        self._msgs = list(cat)
+        # Messages by key, as the catalog would index them.
+        self._msgs_by_key = dict((x.key, x) for x in self._msgs)
+        self._modified = False
+
+
+    def __getitem__ (self, pos):
+
+        return self._msgs[pos]
+
+
+    def add (self, msg, pos):
+
+        omsg = self._msgs_by_key.get(msg.key)
+        if omsg is None:
+            self._msgs.insert(pos, msg)
+        else:
+            # Message with the same key is replaced, ignoring position.
+            for i in range(len(self._msgs)):
+                if self._msgs[i] is omsg:
+                    self._msgs[i] = msg
+                    break
+        self._msgs_by_key[msg.key] = msg
+        self._modified = True
+
+
+    def remove (self, pos):
+
+        msg = self._msgs.pop(pos)
+        self._msgs_by_key.pop(msg.key)
+        self._modified = True
+
+
+    def commit (self):
+
+        if not self._modified:
+            return
+        cat = self._cat
+        kept = set(id(x) for x in self._msgs)
+        cat.remove_more([i for i, x in enumerate(cat) if id(x) not in kept])
+        present = set(id(x) for x in cat)
+        msgpos = []
+        for i, msg in enumerate(self._msgs):
+            if id(msg) not in present:
+                # Position relative to catalog messages.
+                msgpos.append((msg, i - len(msgpos)))
+        cat.add_more(msgpos)
+        self._modified = False
+
+
 def msg_apply_diff (cat, emsg, ecat, pmsgkeys, striplets):
 
     msg1, msg2, msg1_s, msg2_s = resolve_diff_pair(emsg)
@@ -643,6 +781,12 @@ def build_splitting_triplets (emsgs, cat, options):
     cat1.header = cat.header
     cat2.header = cat.header
 
+    # Without merging, messages can be paired only by keys and
+    # previous keys, so only those messages from the catalog which share
+    # any of them with old and new messages need to be diffed.
+    if not options.do_merge:
+        cat = select_pairable(cat, (cat1, cat2))
+
     # Write created catalogs to disk if
     # msgmerge may be used on files during diffing.
     if options.do_merge:
@@ -679,6 +823,45 @@ def build_splitting_triplets (emsgs, cat, options):
     return striplets
 
 
+# Keys by which the message may be paired to another on diffing
+# without merging: its key, and its previous key if any.
+def pairing_keys (msg):
+
+    keys = [msg.key]
+    if msg.key_previous is not None:
+        keys.append(msg.key_previous)
+    return keys
+
+
+# Create a catalog with copies of messages from the given catalog
+# which may be paired on diffing with messages from other catalogs,
+# found through an index of the catalog by keys and previous keys.
+# Messages are first cleaned up as they would be by diffing.
+def select_pairable (cat, ocats):
+
+    msgs_by_key = {}
+    for msg in cat:
+        msg_cleanup(msg)
+        for key in pairing_keys(msg):
+            msgs_by_key.setdefault(key, []).append(msg)
+
+    selected = set()
+    for ocat in ocats:
+        for omsg in ocat:
+            msg_cleanup(omsg)
+            for key in pairing_keys(omsg):
+                for msg in msgs_by_key.get(key, []):
+                    selected.add(id(msg))
+
+    scat = Catalog("", create=True)
+    scat.header = cat.header
+    for msg in cat:
+        if id(msg) in selected:
+            scat.add(Message(msg), len(scat))
+
+    return scat
+
+
 def patch_header (cat, ehmsg, ecat, options):
 
     if not ehmsg.msgstr[0]: # no header diff, only metadata
@@ -715,7 +898,7 @@ def patch_header (cat, ehmsg, ecat, options):
             if cat.created():
                 cat.header = Header(hmsg2)
             ehmsg = MessageUnsafe(ehmsg)
-            ehmsg.flag.add(_flag_ediff)
+            add_flag(ehmsg, _flag_ediff)
             hmsgctxt = get_msgctxt_for_headers(cat)
             ehmsg.msgctxt = hmsgctxt
             cat.header.set_field(EDST.hmsgctxt_field, hmsgctxt)
@@ -725,6 +908,16 @@ def patch_header (cat, ehmsg, ecat, options):
         return ehmsg
 
 
+# Add flag to the message, also when its flags are kept in a dict
+# (as they are in unsafe messages).
+def add_flag (msg, flag):
+
+    if isinstance(msg.flag, dict):
+        msg.flag[flag] = None
+    else:
+        msg.flag.add(flag)
+
+
 # Clear header diff message of metadata.
 # A copy of the message is returned.
 def clear_header_metadata (ehmsg):
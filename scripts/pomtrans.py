@@ -23,6 +23,7 @@ import os
 from pology import datadir, version, _, n_
 from pology.catalog import Catalog
 from pology.colors import ColorOptionParser
+from pology.compendium import compendium_index
 import pology.config as pology_config
 from pology.entities import read_entities
 from pology.fsops import collect_catalogs, collect_system
@@ -219,13 +220,15 @@ def translate_parallel (paths, tsbuilder, options):
     slang = options.slang
     tlang = options.tlang
 
+    # The compendium is looked up through its index,
+    # which is cheap to open even for very large compendia.
     ccat = None
     if comppath is not None:
         if not os.path.isfile(comppath):
             error(_("@info",
                     "Compendium '%(file)s' does not exist.",
                     file=comppath))
-        ccat = Catalog(comppath, monitored=False)
+        ccat = compendium_index(comppath)
 
     if pathrepl is not None:
         lst = pathrepl.split(":")
@@ -277,8 +280,11 @@ def translate_parallel (paths, tsbuilder, options):
         # Translate collected texts.
         texts_tr = []
         for texts, scat in ((ptexts, pcat), (ctexts, ccat)):
+            if not texts:
+                texts_tr.append([])
+                continue
             transerv = get_transerv(slang, tlang, scat, cat, tsbuilder)
-            texts_tr.append(transerv.translate(texts) if texts else [])
+            texts_tr.append(transerv.translate(texts))
             if texts_tr[-1] is None:
                 texts_tr = None
                 break
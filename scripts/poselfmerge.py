@@ -44,6 +44,7 @@ def main ():
     def_minasfz = cfgsec.real("min-adjsim-fuzzy", 0.0)
     def_fuzzex = cfgsec.boolean("fuzzy-exact", False)
     def_refuzz = cfgsec.boolean("rebase-fuzzies", False)
+    def_engine = cfgsec.string("engine", "msgmerge")
 
     # Setup options and parse the command line.
     usage = _("@info command usage",
@@ -81,6 +82,15 @@ def main ():
         help=_("@info command line option description",
                "Catalog with existing translations, to additionally use for "
                "direct and fuzzy matches. Can be repeated."))
+    opars.add_option(
+        "-e", "--engine",
+        metavar=_("@info command line value placeholder", "NAME"),
+        action="store", dest="engine", default=def_engine,
+        help=_("@info command line option description",
+               "The merge engine to use, '%(name1)s' (default) "
+               "or '%(name2)s'. The native engine merges in memory, "
+               "without running external programs.",
+               name1="msgmerge", name2="native"))
     opars.add_option(
         "-v", "--verbose",
         action="store_true", dest="verbose", default=False,
@@ -144,12 +154,12 @@ def main ():
         self_merge_pofile(fname, op.compendiums,
                           op.fuzzy_exact, op.min_words_exact,
                           op.min_adjsim_fuzzy, op.rebase_fuzzies,
-                          cfgsec, op)
+                          cfgsec, op, op.engine)
 
 
 def self_merge_pofile (catpath, compendiums=[],
                        fuzzex=False, minwnex=0, minasfz=0.0, refuzzy=False,
-                       cfgsec=None, cmlopt=None):
+                       cfgsec=None, cmlopt=None, engine=None):
 
     # Create temporary files for merging.
     ext = ".tmp-selfmerge"
@@ -180,7 +190,7 @@ def self_merge_pofile (catpath, compendiums=[],
     merge_pofile(catpath_mod, potpath, update=True, wrapping=wrapping,
                  cmppaths=compendiums, fuzzex=fuzzex,
                  minwnex=minwnex, minasfz=minasfz, refuzzy=refuzzy,
-                 abort=True)
+                 abort=True, engine=engine)
 
     # Overwrite original with temporary catalog.
     shutil.move(catpath_mod, catpath)
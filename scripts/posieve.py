@@ -23,6 +23,7 @@ import sys
 from types import ModuleType
 
 from pology import datadir, version, _, n_, t_
+from pology.cache import set_persistent, sync_caches, cache_stats
 from pology.catalog import Catalog, CatalogSyntaxError
 from pology.colors import ColorOptionParser, set_coloring_globals
 import pology.config as pology_config
@@ -41,6 +42,7 @@ from pology.stdcmdopt import add_cmdopt_filesfrom, add_cmdopt_incexc
 from pology.stdcmdopt import add_cmdopt_colors
 from pology.subcmd import ParamParser
 from pology.sieve import SieveMessageError, SieveCatalogError
+from pology.tabulate import tabulate
 
 
 def main ():
@@ -52,6 +54,7 @@ def main ():
     def_do_skip = cfgsec.boolean("skip-on-error", True)
     def_msgfmt_check = cfgsec.boolean("msgfmt-check", False)
     def_skip_obsolete = cfgsec.boolean("skip-obsolete", False)
+    def_persistent_cache = cfgsec.boolean("persistent-cache", False)
 
     # Setup options and parse the command line.
     usage = _("@info command usage",
@@ -145,6 +148,19 @@ def main ():
         action="store_false", dest="do_sync", default=True,
         help=_("@info command line option description",
                "Do not write any modifications to catalogs."))
+    opars.add_option(
+        "--persistent-cache",
+        action="store_true", dest="persistent_cache",
+        default=def_persistent_cache,
+        help=_("@info command line option description",
+               "Keep caches of intermediate results (e.g. filtered messages) "
+               "on disk, to reuse them in later runs."))
+    opars.add_option(
+        "--cache-stats",
+        action="store_true", dest="cache_stats", default=False,
+        help=_("@info command line option description",
+               "Report usage of caches of intermediate results "
+               "at the end of processing, to help tuning their sizes."))
     opars.add_option(
         "-q", "--quiet",
         action="store_true", dest="quiet", default=False,
@@ -200,6 +216,9 @@ def main ():
 
     set_coloring_globals(ctype=op.coloring_type, outdep=(not op.raw_colors))
 
+    if op.persistent_cache:
+        set_persistent(True)
+
     # Dummy-set all internal sieves as requested if sieve listing required.
     sieves_requested = []
     if op.list_sieves or op.list_sieve_names:
@@ -554,6 +573,11 @@ def main ():
                           "Finalization failed: %(msg)s",
                           msg=e))
 
+    sync_caches()
+
+    if op.cache_stats:
+        report_cache_stats()
+
     if op.output_modified:
         ofh = open(op.output_modified, "w")
         ofh.write("\n".join(modified_files) + "\n")
@@ -612,5 +636,30 @@ def read_config_params (scviews, cmdline_parspecs):
     return sel_params
 
 
+def report_cache_stats ():
+
+    # Only caches which were used.
+    stats = cache_stats()
+    names = sorted(x for x, y in stats.items() if y[2] + y[3] > 0)
+    if not names:
+        return
+    data = [[], [], [], [], []]
+    for name in names:
+        nentries, size, hits, misses = stats[name]
+        data[0].append(nentries)
+        data[1].append(size or None)
+        data[2].append(hits)
+        data[3].append(misses)
+        nlookups = hits + misses
+        data[4].append(100.0 * hits / nlookups if nlookups else None)
+    coln = [_("@title:column number of entries in a cache", "entries"),
+            _("@title:column maximum number of entries in a cache", "size"),
+            _("@title:column", "hits"),
+            _("@title:column", "misses"),
+            _("@title:column", "hit rate")]
+    dfmt = ["%d", "%d", "%d", "%d", "%.1f%%"]
+    report(tabulate(data, coln=coln, rown=names, dfmt=dfmt, none="-"))
+
+
 if __name__ == '__main__':
     exit_on_exception(main)
@@ -10,6 +10,7 @@ import os
 import re
 import shutil
 import sys
+import tempfile
 import time
 from functools import reduce
 
@@ -22,10 +23,12 @@ from pology import version, _, n_, t_, PologyError
 from pology.ascript import collect_ascription_associations
 from pology.ascript import collect_ascription_history
 from pology.ascript import make_ascription_selector
+from pology.cache import set_persistent, sync_caches
 from pology.catalog import Catalog
 from pology.header import Header, format_datetime
 from pology.message import Message, MessageUnsafe
 from pology.colors import ColorOptionParser
+from pology.compendium import compendium_index
 from pology.fsops import str_to_unicode, unicode_to_str
 from pology.fsops import mkdirpath, assert_system, collect_system
 from pology.fsops import getucwd, join_ncwd
@@ -34,6 +37,7 @@ from pology.fsops import exit_on_exception
 from pology.merge import merge_pofile
 from pology.monitored import Monpair, Monlist, Monset
 from pology.msgreport import report_on_msg
+from pology.parallel import parallel_map, resolve_jobs
 from pology.report import report, error, warning, format_item_list
 from pology.report import init_file_progress
 from pology.stdcmdopt import add_cmdopt_incexc, add_cmdopt_filesfrom
@@ -81,6 +85,15 @@ def main ():
         action="store_true", dest="force", default=False,
         help=_("@info command line option description",
                "Force some operations that are normally not advised."))
+    opars.add_option(
+        "-j", "--jobs",
+        metavar=_("@info command line value placeholder", "NUMBER"),
+        dest="jobs", type="int", default=None,
+        help=_("@info command line option description",
+               "Merge catalogs in this many parallel processes; "
+               "zero means as many as there are processors. "
+               "Catalogs are still updated and reported in the same order "
+               "as when merged one after another."))
     opars.add_option(
         "-q", "--quiet",
         action="store_true", dest="quiet", default=False,
@@ -91,11 +104,21 @@ def main ():
         action="store_true", dest="verbose", default=False,
         help=_("@info command line option description",
                "Output more detailed progress info"))
+    opars.add_option(
+        "--persistent-cache",
+        action="store_true", dest="persistent_cache", default=False,
+        help=_("@info command line option description",
+               "Keep caches of intermediate results (e.g. edit probabilities "
+               "of fuzzy messages on merge) on disk, to reuse them "
+               "in later runs."))
     add_cmdopt_filesfrom(opars)
     add_cmdopt_incexc(opars)
 
     options, free_args = opars.parse_args(str_to_unicode(sys.argv[1:]))
 
+    if options.persistent_cache:
+        set_persistent(True)
+
     # Look for the config file through parent directories.
     parent = getucwd()
     cfgpath = None
@@ -246,6 +269,8 @@ def main ():
         elif opmode == "deps":
             summit_deps(project, options)
 
+    sync_caches()
+
 
 class Project (object):
 
@@ -308,6 +333,7 @@ class Project (object):
 
             "merge_min_adjsim_fuzzy" : 0.0,
             "merge_rebase_fuzzy" : False,
+            "merge_engine" : "msgmerge",
 
             "scatter_min_completeness" : 0.0,
             "scatter_acc_completeness" : 0.0,
@@ -1281,15 +1307,50 @@ def summit_merge (project, options):
                                     addfmt=t_("@info:progress",
                                               "Merging: %(file)s"))
 
+    # Gather summit templates in summit-over-dynamic-templates mode.
+    # Gathering may touch more than the gathered catalog,
+    # so it is done up front rather than in parallel merges.
+    if project.templates_dynamic:
+        for merge_spec in merge_specs:
+            if merge_spec[0] == SUMMIT_ID:
+                upprogc = lambda: upprog(merge_spec[3])
+                summit_gather_single(merge_spec[1], project.tproject,
+                                     project.toptions,
+                                     update_progress=upprogc)
+
+    # Open the compendium index for the native merge engine, so that
+    # it is built (if needed) once, and shared by parallel merges.
+    if (    project.merge_engine == "native" and project.compendium_on_merge
+        and any(x[0] == SUMMIT_ID for x in merge_specs)
+    ):
+        compendium_index(project.compendium_on_merge)
+
     # Merge catalogs.
-    for merge_spec in merge_specs:
-        catpath = merge_spec[3]
+    # Catalogs may be merged in parallel, but merged catalogs are
+    # put in place of old catalogs and reported in the original order.
+    jobs = resolve_jobs(options.jobs)
+    def report_merging (catpath):
         if options.verbose:
             report(_("@info:progress",
                      "Merging %(file)s...",
                      file=catpath))
-        upprogc = lambda: upprog(catpath)
-        summit_merge_single(*(merge_spec + (project, options, upprogc)))
+    def merge_w (merge_spec):
+        upprogc = lambda: None
+        if jobs <= 1:
+            report_merging(merge_spec[3])
+            upprogc = lambda: upprog(merge_spec[3])
+        return summit_merge_single(*(merge_spec + (project, options, upprogc)))
+    results = parallel_map(merge_w, merge_specs, jobs)
+    for merge_spec, (warnings, tmp_path) in zip(merge_specs, results):
+        branch_id, catpath = merge_spec[0], merge_spec[3]
+        if jobs > 1:
+            report_merging(catpath)
+            upprog(catpath)
+        for msg in warnings:
+            warning(msg)
+        if tmp_path is not None:
+            summit_merge_finish(branch_id, catpath, tmp_path,
+                                project, options)
     upprog()
 
     # Remove template tree in summit-over-dynamic-templates mode.
@@ -2682,6 +2743,10 @@ def split_summit_comments (msg):
     return non_summit_comments, summit_comments
 
 
+# Merge a single catalog into a temporary file.
+# Return the list of warnings and the path of the merged catalog,
+# which is None if the catalog did not change
+# (see summit_merge_finish for the rest).
 def summit_merge_single (branch_id, catalog_name, catalog_subdir,
                          catalog_path, template_path,
                          wrapping, fuzzy_merging,
@@ -2689,14 +2754,11 @@ def summit_merge_single (branch_id, catalog_name, catalog_subdir,
 
     update_progress()
 
-    # Gather the summit template in summit-over-dynamic-templates mode.
-    if project.templates_dynamic and branch_id == SUMMIT_ID:
-        summit_gather_single(catalog_name, project.tproject, project.toptions,
-                             update_progress=update_progress)
-
-    # FIXME: Portable construction of temporary file.
-    tmp_path = os.path.join("/tmp", (  os.path.basename(catalog_path)
-                                     + "~merged-%d" % os.getpid()))
+    # Each catalog is merged in its own temporary directory,
+    # so that parallel merges cannot collide.
+    # The temporary catalog keeps the file name, as hooks may expect it.
+    tmp_dir = tempfile.mkdtemp(prefix="posummit-merged-")
+    tmp_path = os.path.join(tmp_dir, os.path.basename(catalog_path))
 
     # Whether to create pristine catalog from template.
     vivified = catalog_path in project.add_on_merge
@@ -2761,13 +2823,14 @@ def summit_merge_single (branch_id, catalog_name, catalog_subdir,
                            cmppaths=cmppaths, fuzzex=fuzzex, minwnex=minwnex,
                            getcat=getcat, monitored=monitored,
                            ignpotdate=ignpotdate,
-                           quiet=True, abort=False)
+                           quiet=True, abort=False,
+                           engine=project.merge_engine)
         if cat is None:
-            warning(_("@info",
+            shutil.rmtree(tmp_dir)
+            return [_("@info",
                       "Catalog '%(file1)s' not merged with "
                       "template '%(file2)s' due to errors on merging.",
-                      file1=catalog_path_mod, file2=template_path))
-            return
+                      file1=catalog_path_mod, file2=template_path)], None
         elif not getcat:
             # Catalog not requested, so the return value is True
             # indicating that the merge succedded.
@@ -2868,46 +2931,59 @@ def summit_merge_single (branch_id, catalog_name, catalog_subdir,
         exec_hook_file(branch_id, cat_name, catalog_subdir, tmp_path,
                        project.hook_on_merge_file)
 
-    # If there is any difference between merged and old catalog.
+    # If there is any difference between merged and old catalog,
+    # assert correctness of the merged catalog and leave it
+    # to be moved over the old.
     if vivified or not filecmp.cmp(catalog_path, tmp_path):
-        # Assert correctness of the merged catalog and move over the old.
         assert_system("msgfmt -c -o/dev/null %s " % tmp_path)
-        added = False
-        if vivified:
-            added = True
-            mkdirpath(os.path.dirname(catalog_path))
-        shutil.move(tmp_path, catalog_path)
-
-        # Add to version control if not already added.
-        vcs = project.summit_vcs if SUMMIT_ID else project.branches_vcs
-        if (    vcs
-            and (    branch_id == SUMMIT_ID or
-                 not project.bdict[branch_id].skip_version_control)
-            and not vcs.is_versioned(catalog_path)
-        ):
-            if not vcs.add(catalog_path):
-                warning(_("@info",
-                          "Cannot add '%(file)s' to version control.",
-                          file=catalog_path))
-
-        if options.verbose:
-            if added:
-                actype = _("@item:intext action performed on a catalog",
-                           "merged-added")
-                report(".+   (%s) %s" % (actype, catalog_path))
-            else:
-                actype = _("@item:intext action performed on a catalog",
-                           "merged")
-                report(".    (%s) %s" % (actype, catalog_path))
-        elif not options.quiet:
-            if added:
-                report(".+   %s" % catalog_path)
-            else:
-                report(".    %s" % catalog_path)
+        return [], tmp_path
 
     # Remove the temporary merged catalog.
-    if os.path.exists(tmp_path):
-        os.remove(tmp_path)
+    shutil.rmtree(tmp_dir)
+
+    return [], None
+
+
+# Move the merged catalog from the temporary path over the old catalog,
+# and add it to version control if needed.
+# This is done in the main process, in order of catalogs,
+# also when catalogs are merged in parallel.
+def summit_merge_finish (branch_id, catalog_path, tmp_path, project, options):
+
+    added = False
+    if catalog_path in project.add_on_merge:
+        added = True
+        mkdirpath(os.path.dirname(catalog_path))
+    shutil.move(tmp_path, catalog_path)
+    os.rmdir(os.path.dirname(tmp_path))
+
+    # Add to version control if not already added.
+    vcs = (project.summit_vcs if branch_id == SUMMIT_ID
+           else project.branches_vcs)
+    if (    vcs
+        and (    branch_id == SUMMIT_ID or
+             not project.bdict[branch_id].skip_version_control)
+        and not vcs.is_versioned(catalog_path)
+    ):
+        if not vcs.add(catalog_path):
+            warning(_("@info",
+                      "Cannot add '%(file)s' to version control.",
+                      file=catalog_path))
+
+    if options.verbose:
+        if added:
+            actype = _("@item:intext action performed on a catalog",
+                       "merged-added")
+            report(".+   (%s) %s" % (actype, catalog_path))
+        else:
+            actype = _("@item:intext action performed on a catalog",
+                       "merged")
+            report(".    (%s) %s" % (actype, catalog_path))
+    elif not options.quiet:
+        if added:
+            report(".+   %s" % catalog_path)
+        else:
+            report(".    %s" % catalog_path)
 
 
 # Put header fields in canonical form, for equality checking.
@@ -9,15 +9,17 @@ Documented in C{doc/user/sieving.docbook}.
 @license: GPLv3
 """
 
+from concurrent.futures import Future, ThreadPoolExecutor
 import json
-from http.client import HTTPConnection
+from http.client import HTTPConnection, HTTPException
 import socket
-import sys
+import threading
 from urllib.parse import urlencode
-from xml.dom.minidom import parseString
 
-from pology import _, n_
+from pology import PologyError, version, _, n_
+from pology.cache import named_cache, text_hash
 from pology.colors import cjoin
+from pology.msgfilter import filter_message, msgstr_filter
 from pology.msgreport import report_msg_to_lokalize, warning_on_msg
 from pology.report import report, warning
 from pology.sieve import SieveError, SieveCatalogError
@@ -27,7 +29,7 @@ from pology.getfunc import get_hook_ireq
 from pology.sieve import add_param_poeditors
 
 
-_REQUEST="/v2/check?language=%s&disabledRules=%s&%s"
+_REQUEST="/v2/check"
 
 def setup_sieve (p):
 
@@ -59,6 +61,20 @@ def setup_sieve (p):
                 desc=_("@info sieve parameter discription",
     "TCP port on the host which server uses to listen for queries."
     ))
+    p.add_param("jobs", int, defval=4,
+                metavar=_("@info sieve parameter value placeholder", "NUMBER"),
+                desc=_("@info sieve parameter discription",
+    "Number of requests to send to the server at once, "
+    "each over its own connection."
+    ))
+    p.add_param("batch", int, defval=1,
+                metavar=_("@info sieve parameter value placeholder", "NUMBER"),
+                desc=_("@info sieve parameter discription",
+    "Check this many translations in a single request to the server, "
+    "by joining them as separate paragraphs. "
+    "This reduces the number of requests, but rules which look "
+    "across paragraphs may report problems differently."
+    ))
                 
     add_param_poeditors(p)
 
@@ -78,7 +94,6 @@ class Sieve (object):
     def __init__ (self, params):
 
         self.nmatch = 0 # Number of match for finalize
-        self.connection=None # Connection to LanguageTool server
 
         self.setLang=params.lang
         self.setAccel=params.accel
@@ -97,13 +112,17 @@ class Sieve (object):
             "HUNSPELL_RULE",
             "UPPERCASE_SENTENCE_START",
         }
-        self.disabledRules = set(params.disable) or default_disabled_rules
+        self.disabledRules = set(params.disable or []) or default_disabled_rules
 
-        # Create connection to the LanguageTool server
-        self.connection=HTTPConnection(host, port)
+        # Create client for the LanguageTool server.
+        self.client=LanguageToolClient(host, port, params.jobs, params.batch)
+
+        # Messages waiting for responses, reported in order.
+        self.pending=[] # (message, catalog, [(text, future)*])
 
         self.pfilters = [[get_hook_ireq(x, abort=True), x]
                          for x in (params.filter or [])]
+        self.pfilter, self.pfilter_ident = msgstr_filter(self.pfilters)
 
 
     def process_header (self, hdr, cat):
@@ -127,75 +146,87 @@ class Sieve (object):
         if msg.obsolete:
             return
 
-        try:
-            for msgstr in msg.msgstr:
-
-                # Apply precheck filters.
-                for pfilter, pfname in self.pfilters:
-                    try: # try as type F1A hook
-                        msgstr = pfilter(msgstr)
-                    except TypeError:
-                        try: # try as type F3* hook
-                            msgstr = pfilter(msgstr, msg, cat)
-                        except TypeError:
-                            raise SieveError(
-                                _("@info",
-                                  "Cannot execute filter '%(filt)s'.",
-                                  filt=pfname))
-
-                self.connection.request(
-                    "GET",
-                    _REQUEST % (
-                        self.lang,
-                        ",".join(self.disabledRules),
-                        urlencode({"text":msgstr.encode("UTF-8")}),
-                    )
-                )
-                response=self.connection.getresponse()
-                if not response:
-                    continue
-                matches = json.loads(response.read())["matches"]
-                if not matches:
-                    continue
-                for match in matches:
-                    self.nmatch+=1
-                    report("-"*(len(msgstr)+8))
-                    report(_("@info",
-                                "<bold>%(file)s:%(line)d(#%(entry)d)</bold>",
-                                file=cat.filename, line=msg.refline, entry=msg.refentry))
-                    #TODO: create a report function in the right place
-                    #TODO: color in red part of context that make the mistake
-                    report(_("@info",
-                                "<bold>Context:</bold> %(snippet)s",
-                                snippet=match["context"]["text"]))
-                    report(_("@info",
-                                "(%(rule)s) <bold><red>==></red></bold> %(note)s",
-                                rule=match["rule"]["id"],
-                                note=match["message"]))
-                    report("")
-                    if self.lokalize:
-                        repls = [_("@label", "Grammar errors:")]
-                        repls.append(_(
-                            "@info",
-                            "<bold>%(file)s:%(line)d(#%(entry)d)</bold>",
-                            file=cat.filename,
-                            line=msg.refline,
-                            entry=msg.refentry
-                        ))
-                        repls.append(_(
-                            "@info",
-                            "(%(rule)s) <bold><red>==></red></bold> %(note)s",
-                            rule=match["rule"]["id"],
-                            note=match["message"]
-                        ))
-                        report_msg_to_lokalize(msg, cat, cjoin(repls, "\n"))
-        except socket.error:
-            raise SieveError(_("@info",
-                               "Cannot connect to LanguageTool server. "
-                               "Did you start it?"))
+        # Apply precheck filters.
+        msgf = msg
+        if self.pfilters:
+            msgf = filter_message(msg, cat, self.pfilter, self.pfilter_ident)
+
+        requests=[]
+        for msgstr in msgf.msgstr:
+            future=self.client.submit(self.lang, self.disabledRules, msgstr)
+            requests.append((msgstr, future))
+        self.pending.append((msg, cat, requests))
+
+        # Report messages for which all responses have arrived.
+        self._report_pending(wait=False)
+
+
+    def process_header_last (self, hdr, cat):
+
+        self._report_pending(wait=True)
+
+
+    def _report_pending (self, wait):
+
+        if wait:
+            self.client.flush()
+        while self.pending:
+            msg, cat, requests=self.pending[0]
+            if not wait and not all(f.done() for t, f in requests):
+                break
+            self.pending.pop(0)
+            for msgstr, future in requests:
+                try:
+                    matches=future.result()
+                except (socket.error, HTTPException):
+                    raise SieveError(_("@info",
+                                       "Cannot connect to LanguageTool server. "
+                                       "Did you start it?"))
+                except PologyError as e:
+                    raise SieveError(str(e))
+                self._report_matches(msg, cat, msgstr, matches)
+
+
+    def _report_matches (self, msg, cat, msgstr, matches):
+
+        for rule, note, context in matches:
+            self.nmatch+=1
+            report("-"*(len(msgstr)+8))
+            report(_("@info",
+                        "<bold>%(file)s:%(line)d(#%(entry)d)</bold>",
+                        file=cat.filename, line=msg.refline, entry=msg.refentry))
+            #TODO: create a report function in the right place
+            #TODO: color in red part of context that make the mistake
+            report(_("@info",
+                        "<bold>Context:</bold> %(snippet)s",
+                        snippet=context))
+            report(_("@info",
+                        "(%(rule)s) <bold><red>==></red></bold> %(note)s",
+                        rule=rule,
+                        note=note))
+            report("")
+            if self.lokalize:
+                repls = [_("@label", "Grammar errors:")]
+                repls.append(_(
+                    "@info",
+                    "<bold>%(file)s:%(line)d(#%(entry)d)</bold>",
+                    file=cat.filename,
+                    line=msg.refline,
+                    entry=msg.refentry
+                ))
+                repls.append(_(
+                    "@info",
+                    "(%(rule)s) <bold><red>==></red></bold> %(note)s",
+                    rule=rule,
+                    note=note
+                ))
+                report_msg_to_lokalize(msg, cat, cjoin(repls, "\n"))
 
 
     def finalize (self):
+        self._report_pending(wait=True)
+        self.client.close()
+
         if self.nmatch:
             msg = n_("@info:progress",
                      "Detected %(num)d problem in grammar and style.",
@@ -203,3 +234,200 @@ class Sieve (object):
                      num=self.nmatch)
             report("===== " + msg)
 
+
+class LanguageToolClient (object):
+    """
+    Client sending texts to a LanguageTool server for checking.
+
+    Texts are checked asynchronously: several requests are kept
+    in flight at once, each over its own persistent connection,
+    and optionally several texts are joined into one request.
+    Results are remembered in a named cache (C{grammar-matches},
+    see L{pology.cache}), keyed by the language, disabled rules
+    and the text, so that repeated texts are not sent again.
+    """
+
+    # Separator of texts joined into one request.
+    _separator = "\n\n"
+
+    def __init__ (self, host, port, jobs=4, batch=1):
+        """
+        Constructor.
+
+        @param host: host where the server is running
+        @type host: string
+        @param port: port on which the server listens
+        @type port: string or int
+        @param jobs: number of requests in flight at once
+        @type jobs: int
+        @param batch: number of texts to send in one request
+        @type batch: int
+        """
+
+        self._host = host
+        self._port = port
+        self._batch = max(1, batch)
+        self._executor = ThreadPoolExecutor(max(1, jobs))
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._cache = named_cache("grammar-matches", size=50000,
+                                  version=version())
+        self._queue = []
+        self._queue_key = None
+
+
+    def submit (self, lang, disabled, text):
+        """
+        Submit a text for checking.
+
+        Requests are sent when enough texts for a batch have been
+        submitted, or on L{flush}.
+
+        @param lang: language of the text
+        @type lang: string
+        @param disabled: identifiers of rules to disable
+        @type disabled: sequence of strings
+        @param text: the text
+        @type text: string
+
+        @returns: future resulting in the list of matches,
+            as (rule identifier, message, context) tuples
+        @rtype: Future
+        """
+
+        disabled = ",".join(sorted(disabled))
+        key = (lang, disabled, text_hash(text))
+        future = Future()
+        with self._lock:
+            matches = self._cache.get(key)
+        if matches is not None:
+            future.set_result(matches)
+            return future
+        if not text:
+            future.set_result([])
+            return future
+
+        if self._queue_key != (lang, disabled):
+            self.flush()
+            self._queue_key = (lang, disabled)
+        self._queue.append((key, text, future))
+        if len(self._queue) >= self._batch:
+            self.flush()
+
+        return future
+
+
+    def flush (self):
+        """
+        Send request for all submitted texts not sent yet.
+        """
+
+        if not self._queue:
+            return
+        lang, disabled = self._queue_key
+        queue = self._queue
+        self._queue = []
+        request = self._executor.submit(self._check, lang, disabled,
+                                        [x[1] for x in queue])
+        request.add_done_callback(lambda r: self._resolve(r, queue))
+
+
+    def _resolve (self, request, queue):
+
+        error = request.exception()
+        if error is not None:
+            for key, text, future in queue:
+                future.set_exception(error)
+            return
+        for (key, text, future), matches in zip(queue, request.result()):
+            with self._lock:
+                self._cache.set(key, matches)
+            future.set_result(matches)
+
+
+    def _connection (self):
+
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = HTTPConnection(self._host, self._port)
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+
+    def _post (self, body):
+
+        headers = {"Content-Type": "application/x-www-form-urlencoded",
+                   "Accept": "application/json"}
+        # The server may close an idle persistent connection,
+        # so try once more on a fresh one.
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request("POST", _REQUEST, body, headers)
+                response = conn.getresponse()
+                return response.status, response.read()
+            except (socket.error, HTTPException):
+                conn.close()
+                if attempt == 2:
+                    raise
+
+
+    def _check (self, lang, disabled, texts):
+
+        text = self._separator.join(texts)
+        body = urlencode({"language": lang, "disabledRules": disabled,
+                          "text": text})
+        status, data = self._post(body)
+        if status != 200:
+            raise PologyError(
+                _("@info",
+                  "LanguageTool server reported an error:\n%(msg)s",
+                  msg=data.decode("UTF-8", "replace").strip()))
+        matches = json.loads(data.decode("UTF-8"))["matches"]
+
+        # Server offsets count UTF-16 code units.
+        ends = []
+        end = 0
+        for text in texts:
+            end += len(text.encode("UTF-16-LE")) // 2
+            ends.append(end)
+            end += len(self._separator)
+        results = [[] for x in texts]
+        for match in matches:
+            i = 0
+            while i < len(ends) - 1 and match["offset"] >= ends[i]:
+                i += 1
+            context = match["context"]
+            ctext = context["text"]
+            if len(texts) > 1:
+                ctext = _cut_context(ctext, context["offset"],
+                                     context["length"], self._separator)
+            results[i].append((match["rule"]["id"], match["message"], ctext))
+
+        return results
+
+
+    def close (self):
+        """
+        Wait for all requests and close connections to the server.
+        """
+
+        self.flush()
+        self._executor.shutdown(wait=True)
+        for conn in self._connections:
+            conn.close()
+
+
+def _cut_context (text, offset, length, sep):
+
+    # Remove parts of neighboring texts from the context.
+    start = text.rfind(sep, 0, offset)
+    end = text.find(sep, offset + length)
+    if end >= 0:
+        text = text[:end]
+    if start >= 0:
+        text = text[start + len(sep):]
+    return text
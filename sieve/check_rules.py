@@ -12,36 +12,75 @@ Documented in C{doc/user/sieving.docbook}.
 
 from codecs import open
 import os
-from os.path import abspath, basename, dirname, exists, expandvars, join
+from os.path import abspath, basename, dirname, join
 import re
+import sqlite3
 import sys
-from time import strftime, strptime, mktime
+from time import strftime
 
 from pology import _, n_
+from pology.cache import cachedir, is_persistent, text_hash
 from pology.colors import cjoin
 from pology.comments import manc_parse_list, parse_summit_branches
 from pology.fsops import collect_files_by_ext
-from pology.message import MessageUnsafe
+from pology.msgfilter import filter_message, message_fingerprint
 from pology.msgreport import multi_rule_error, rule_xml_error
 from pology.msgreport import report_msg_to_lokalize
+from pology.parallel import parallel_map, resolve_jobs, split_even
 from pology.report import report, warning, format_item_list
-from pology.rules import loadRules, printStat
+from pology.rules import loadRules, printStat, ruleSetHash
+from pology.rules import RuleMatcher, RuleResultStore
 from pology.sieve import add_param_lang, add_param_env, add_param_poeditors
 from pology.timeout import TimedOutException
 from pology.sieve import SieveError, SieveCatalogError, SieveMessageError
 from functools import reduce
 
 
-# Pattern used to marshall path of cached files
-_MARSHALL = "+++"
-# Cache directory (for xml processing only)
-# FIXME: More portable location of cache.
-_CACHEDIR = expandvars("$HOME/.pology-check_rules-cache/")
+# Name of the file in cache directory which stores rule results.
+_RESULTS_FILE = "check-rules.sqlite"
 
 # Flag to add to failed messages, if requested.
 _flag_mark = "failed-rule"
 
 
+# Catalog properties on which rule results depend.
+# Header fields changed by every commit or merge (revision date,
+# last translator, template creation date...) must not be included,
+# or else all stored results of the catalog would be invalidated.
+# Only those fields are included which are examined by validity
+# entries of rules, as selected by the given field name regexes.
+def _catalogKey (cat, lang, envs, headRxs=()):
+
+    accels = cat.accelerator()
+    mtypes = cat.markup()
+    key = [
+        cat.name,
+        lang,
+        ",".join(envs),
+        cat.header.get_field_value("Plural-Forms"),
+        "".join(sorted(accels)) if accels is not None else None,
+        ",".join(sorted(mtypes)) if mtypes is not None else None,
+    ]
+    for name, value in cat.header.field:
+        if any(x.search(name) for x in headRxs):
+            key.extend([name, value])
+
+    return key
+
+
+# Regexes of header field names examined by validity entries of rules.
+def _headerFieldRxs (rules):
+
+    headRxs = []
+    for rule in rules:
+        for entry in rule.valid:
+            for key, value in entry:
+                if key.lstrip("!") == "head":
+                    headRxs.append(value[0])
+
+    return headRxs
+
+
 def setup_sieve (p):
 
     p.set_desc(_("@info sieve discription",
@@ -142,6 +181,27 @@ def setup_sieve (p):
     "Add '%(flag)s' flag to each message failed by a rule.",
     flag=_flag_mark
     ))
+    p.add_param("cache", bool, defval=False,
+                desc=_("@info sieve parameter discription",
+    "Keep results of checking in a cache, and on later runs "
+    "check only messages which were modified since. "
+    "Caching is always active when writing results into XML file, "
+    "or when persistent caches are requested by the caller."
+    ))
+    p.add_param("jobs", int, defval=0,
+                metavar=_("@info sieve parameter value placeholder", "NUMBER"),
+                desc=_("@info sieve parameter discription",
+    "Number of worker processes among which to divide messages "
+    "of large catalogs (see '%(par)s'). "
+    "Zero or less means as many as there are processors.",
+    par="parthresh"
+    ))
+    p.add_param("parthresh", int, defval=2000,
+                metavar=_("@info sieve parameter value placeholder", "NUMBER"),
+                desc=_("@info sieve parameter discription",
+    "Check messages of a catalog in parallel when the catalog "
+    "has at least this many messages."
+    ))
     p.add_param("byrule", bool, defval=False,
                 desc=_("@info sieve parameter discription",
     "Output failed messages ordered by sorted rule identifiers."
@@ -161,10 +221,8 @@ class Sieve (object):
         self.nmatch = 0 # Number of match for finalize
         self.rules = []   # List of rules objects loaded in memory
         self.xmlFile = None # File handle to write XML output
-        self.cacheFile = None # File handle to write XML cache
-        self.cachePath = None # Path to cache file
+        self.resultStore = None # Store of results by message
         self.filename = ""     # File name we are processing
-        self.cached = False    # Flag to indicate if process result is already is cache
 
         self.globalLang = params.lang
         self.globalEnvs = params.env
@@ -189,6 +247,14 @@ class Sieve (object):
 
         self.branches = params.branch and set(params.branch) or None
 
+        # Parallel checking of large catalogs, unless gathering statistics
+        # (which are collected in the process applying the rules).
+        self.jobs = resolve_jobs(params.jobs)
+        if self.stat:
+            self.jobs = 1
+        self.parThreshold = params.parthresh
+        self.preChecked = {}
+
         # Collect non-internal rule files.
         self.customRuleFiles = None
         if params.rfile or params.rdir:
@@ -213,15 +279,17 @@ class Sieve (object):
                           "Cannot open file '%(file)s'. XML output disabled.",
                           file=xmlPath))
 
-        if not exists(_CACHEDIR) and self.xmlFile:
-            #Create cache dir (only if we want wml output)
+        # Keep results by message, unless gathering statistics
+        # (which needs all rules to be actually applied).
+        if (params.cache or self.xmlFile or is_persistent()) and not self.stat:
+            storePath = join(cachedir(), _RESULTS_FILE)
             try:
-                os.mkdir(_CACHEDIR)
-            except IOError as e:
-                raise SieveError(_("@info",
-                                   "Cannot create cache directory '%(dir)s':\n"
-                                   "%(msg)s",
-                                   dir=_CACHEDIR, msg=e))
+                self.resultStore = RuleResultStore(storePath)
+            except sqlite3.Error as e:
+                warning(_("@info",
+                          "Cannot open cache file '%(file)s', "
+                          "caching disabled:\n%(msg)s",
+                          file=storePath, msg=e))
 
         if self.byrule:
             self.postFailedMessages = {}
@@ -255,80 +323,167 @@ class Sieve (object):
         rkey = (self.lang, tuple(self.envs))
         if rkey not in self._rulesCache:
             self._rulesCache[rkey] = self._loadRules(self.lang, self.envs)
-        self.rules, self.ruleFilters = self._rulesCache[rkey]
+        (self.rules, self.ruleFilters, self.ruleMatcher,
+         self.ruleSetKey, self.headRxs) = self._rulesCache[rkey]
+        self.ruleIndex = dict((x, i) for i, x in enumerate(self.rules))
 
+        # Catalog properties on which rule results depend,
+        # for keying results by message.
+        if self.resultStore:
+            self.catKey = _catalogKey(cat, self.lang, self.envs,
+                                      self.headRxs)
 
-    def process (self, msg, cat):
+        # Check messages of large catalogs in advance, in parallel.
+        self.preChecked = {}
+        if self.jobs > 1 and len(cat) >= self.parThreshold:
+            self._preCheckParallel(cat)
+
+
+    def _isSelected (self, msg):
 
         # Apply rules only on translated messages.
         if not msg.translated:
-            return
+            return False
 
         # Apply rules only to messages from selected branches.
         if self.branches:
             msg_branches = parse_summit_branches(msg)
             if not set.intersection(self.branches, msg_branches):
-                return
+                return False
+
+        return True
+
+
+    def _msgKey (self, msg):
+
+        return text_hash(*(self.catKey + [message_fingerprint(msg)]))
 
-        filename = basename(cat.filename)
 
-        # New file handling
+    def _preCheckParallel (self, cat):
+
+        # Select messages which are to be checked and not known already.
+        # Checked messages are recorded by content, so that if a message
+        # is modified by the time it is processed (e.g. by another sieve
+        # in the chain), it is checked again.
+        indices = []
+        fingerprints = {}
+        for i, msg in enumerate(cat):
+            if not self._isSelected(msg):
+                continue
+            if (self.resultStore
+                and self.resultStore.get(self.ruleSetKey, self._msgKey(msg))
+                    is not None
+            ):
+                continue
+            indices.append(i)
+            fingerprints[i] = message_fingerprint(msg)
+        if len(indices) < 2:
+            return
+
+        # Each worker checks a contiguous part of the catalog,
+        # with the rules loaded in the parent process.
+        def check (part):
+            results = []
+            for i in part:
+                msg = cat[i]
+                try:
+                    failedRules, complete = self._applyRules(msg, cat)
+                except SieveMessageError:
+                    # Leave it to be reported when processed.
+                    continue
+                failures = [(self.ruleIndex[rule], spans)
+                            for rule, spans, msgf in failedRules]
+                results.append((i, failures, complete))
+            return results
+
+        if self.ruleinfo:
+            report(n_("@info:progress",
+                      "Checking %(num)d message in parallel.",
+                      "Checking %(num)d messages in parallel.",
+                      num=len(indices)))
+        parts = split_even(indices, self.jobs * 4)
+        for results in parallel_map(check, parts, self.jobs):
+            for i, failures, complete in results:
+                self.preChecked[fingerprints[i]] = (failures, complete)
+
+
+    def process (self, msg, cat):
+
+        if not self._isSelected(msg):
+            return
+
+        # Handle start/end of files for XML output (not needed for text output)
+        filename = basename(cat.filename)
         if self.xmlFile and self.filename != filename:
-            newFile = True
-            self.cached = False # Reset flag
-            self.cachePath = join(_CACHEDIR, abspath(cat.filename).replace("/", _MARSHALL))
-            if self.cacheFile:
-                self.cacheFile.close()
             if self.filename != "":
                 # close previous
                 self.xmlFile.write("</po>\n")
+            self.xmlFile.write('<po name="%s">\n' % filename)
             self.filename = filename
-        else:
-            newFile = False
-
-        # Current file loaded from cache on previous message. Close and return
-        if self.cached:
-            # No need to analyze message, return immediately
-            if self.cacheFile:
-                self.cacheFile = None # Indicate cache has been used and flushed into xmlFile
-            return
 
-        # Does cache exist for this file ?
-        if self.xmlFile and newFile and exists(self.cachePath):
-            poDate = None
-            for headerName, headerValue in cat.header.field:
-                if headerName == "PO-Revision-Date":
-                    poDate = headerValue
-                    break
-
-            if poDate:
-                #Truncate daylight information
-                poDate = poDate.rstrip("GMT")
-                poDate = poDate[0:poDate.find("+")]
-                #Convert in sec since epoch time format
-                poDate = mktime(strptime(poDate, '%Y-%m-%d %H:%M'))
-                if os.stat(self.cachePath)[8] > poDate:
-                    if self.ruleinfo:
-                        report(_("@info:progress", "Using cache."))
-                    self.xmlFile.writelines(open(self.cachePath, "r", "utf-8").readlines())
-                    self.cached = True
-
-        # No cache available, create it for next time
-        if self.xmlFile and newFile and not self.cached:
-            if self.ruleinfo:
-                report(_("@info", "No cache available, processing file."))
-            self.cacheFile = open(self.cachePath, "w", "utf-8")
+        # Use known results if the message has not changed since last check.
+        msgKey = None
+        failedRules = None
+        if self.resultStore:
+            msgKey = self._msgKey(msg)
+            failures = self.resultStore.get(self.ruleSetKey, msgKey)
+            if failures is not None:
+                failedRules = self._replayFailures(failures, msg, cat)
+        if failedRules is None and self.preChecked:
+            prechk = self.preChecked.pop(message_fingerprint(msg), None)
+            if prechk is not None:
+                failures, complete = prechk
+                failedRules = self._replayFailures(failures, msg, cat)
+                if self.resultStore and complete:
+                    self.resultStore.put(self.ruleSetKey, msgKey, failures)
+        if failedRules is None:
+            failedRules, complete = self._applyRules(msg, cat)
+            if self.resultStore and complete:
+                failures = [(self.ruleIndex[rule], spans)
+                            for rule, spans, msgf in failedRules]
+                self.resultStore.put(self.ruleSetKey, msgKey, failures)
+
+        for rule, spans, msgf in failedRules:
+            self.nmatch += 1
+            if self.xmlFile:
+                # FIXME: rule_xml_error is actually broken,
+                # as it considers matching to always be on msgstr
+                # Multiple span are now supported as well as msgstr index
+
+                # Now, write to XML file if defined
+                rspans = [x[:2] for x in spans[0][2]]
+                pluid = spans[0][1]
+                xmlError = rule_xml_error(msg, cat, rule, rspans, pluid)
+                self.xmlFile.writelines(xmlError)
 
-        # Handle start/end of files for XML output (not needed for text output)
-        if self.xmlFile and newFile:
-            # open new po
-            if self.cached:
-                # We can return now, cache is used, no need to process catalog
-                return
+        if failedRules:
+            if not self.byrule:
+                multi_rule_error(msg, cat, failedRules, self.showmsg,
+                                 predelim=self._first_error)
+                self._first_error = False
             else:
-                poTag = '<po name="%s">\n' % filename
-                self.xmlFile.write(poTag) # Write to result
-                self.cacheFile.write(poTag) # Write to cache
+                for rule, spans, msgf in failedRules:
+                    if rule.ident not in self.postFailedMessages:
+                        self.postFailedMessages[rule.ident] = []
+                    self.postFailedMessages[rule.ident].append(
+                        (msg, cat, ((rule, spans, msgf))))
+
+            if self.mark:
+                msg.flag.add(_flag_mark)
+
+            if self.lokalize:
+                repls = [_("@label", "Failed rules:")]
+                for rule, hl, msgf in failedRules:
+                    repls.append(_("@item",
+                                "rule %(rule)s ==> %(msg)s",
+                                rule=rule.displayName, msg=rule.hint))
+                    for part, item, spans, fval in hl:
+                        repls.extend(["↳ %s" % x[2]
+                                     for x in spans if len(x) > 2])
+                report_msg_to_lokalize(msg, cat, cjoin(repls, "\n"))
+
+
+    def _applyRules (self, msg, cat):
 
         # Collect explicitly ignored rules by ID for this message.
         locally_ignored = manc_parse_list(msg, "skip-rule:", ",")
@@ -363,14 +518,17 @@ class Sieve (object):
         msgByFilter = {}
         for mfilter in self.ruleFilters:
             if mfilter is not None:
-                msgf = MessageUnsafe(msg)
-                mfilter(msgf, cat, envSet)
+                msgf = filter_message(msg, cat, mfilter, mfilter.ident, envSet)
             else:
                 msgf = msg
             msgByFilter[mfilter] = msgf
 
+        # Rules which certainly do not match need not be applied.
+        skipRules = self.ruleMatcher.nonMatching(msgByFilter)
+
         # Now the sieve itself. Check message with every rules
         failedRules = []
+        complete = True
         for rule in self.rules:
             if rule.disabled:
                 continue
@@ -380,6 +538,9 @@ class Sieve (object):
                 continue
             if rule.manual and not rule.ident in locally_applied:
                 continue
+            if rule in skipRules:
+                rule.count += 1
+                continue
             msgf = msgByFilter[rule.mfilter]
             try:
                 spans = rule.process(msgf, cat, envs=envSet, nofilter=True)
@@ -387,51 +548,28 @@ class Sieve (object):
                 warning(_("@info:progress",
                           "Rule '%(rule)s' timed out, skipping it.",
                           rule=rule.rawPattern))
+                complete = False
                 continue
             if spans:
-                self.nmatch += 1
-                if self.xmlFile:
-                    # FIXME: rule_xml_error is actually broken,
-                    # as it considers matching to always be on msgstr
-                    # Multiple span are now supported as well as msgstr index
-
-                    # Now, write to XML file if defined
-                    rspans = [x[:2] for x in spans[0][2]]
-                    pluid = spans[0][1]
-                    xmlError = rule_xml_error(msg, cat, rule, rspans, pluid)
-                    self.xmlFile.writelines(xmlError)
-                    if not self.cached:
-                        # Write result in cache
-                        self.cacheFile.writelines(xmlError)
                 if not self.showfmsg:
                     msgf = None
                 failedRules.append((rule, spans, msgf))
 
-        if failedRules:
-            if not self.byrule:
-                multi_rule_error(msg, cat, failedRules, self.showmsg,
-                                 predelim=self._first_error)
-                self._first_error = False
-            else:
-                for rule, spans, msgf in failedRules:
-                    if rule.ident not in self.postFailedMessages:
-                        self.postFailedMessages[rule.ident] = []
-                    self.postFailedMessages[rule.ident].append(
-                        (msg, cat, ((rule, spans, msgf))))
+        return failedRules, complete
 
-            if self.mark:
-                msg.flag.add(_flag_mark)
 
-            if self.lokalize:
-                repls = [_("@label", "Failed rules:")]
-                for rule, hl, msgf in failedRules:
-                    repls.append(_("@item",
-                                "rule %(rule)s ==> %(msg)s",
-                                rule=rule.displayName, msg=rule.hint))
-                    for part, item, spans, fval in hl:
-                        repls.extend(["↳ %s" % x[2]
-                                     for x in spans if len(x) > 2])
-                report_msg_to_lokalize(msg, cat, cjoin(repls, "\n"))
+    def _replayFailures (self, failures, msg, cat):
+
+        envSet = set(self.envs)
+        failedRules = []
+        for ruleIndex, spans in failures:
+            rule = self.rules[ruleIndex]
+            msgf = None
+            if self.showfmsg:
+                msgf = rule._filter_message(msg, cat, envSet)
+            failedRules.append((rule, spans, msgf))
+
+        return failedRules
 
 
     def finalize (self):
@@ -446,14 +584,12 @@ class Sieve (object):
 
         if self.xmlFile:
             # Close last po tag and xml file
-            if self.cached and self.cacheFile:
-                self.cacheFile.write("</po>\n")
-                self.cacheFile.close()
-                self.cacheFile = None
-            else:
+            if self.filename != "":
                 self.xmlFile.write("</po>\n")
             self.xmlFile.write("</pos>\n")
             self.xmlFile.close()
+        if self.resultStore:
+            self.resultStore.close()
         if self.nmatch > 0:
             msg = n_("@info:progress",
                      "Rules detected %(num)d problem.",
@@ -607,5 +743,13 @@ class Sieve (object):
                           "Active rules define %(num)d distinct filter sets.",
                           num=nflt))
 
-        return rules, ruleFilters
+        # Combine patterns of rules, to quickly skip those not matching.
+        ruleMatcher = RuleMatcher(rules)
+
+        # Hash of the rule set, for keying stored results.
+        ruleSetKey = ruleSetHash(rules, [lang] + list(envs))
+
+        headRxs = _headerFieldRxs(rules)
+
+        return rules, ruleFilters, ruleMatcher, ruleSetKey, headRxs
 
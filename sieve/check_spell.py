@@ -17,14 +17,17 @@ import re
 import sys
 from time import strftime
 
-from pology import datadir, _, n_
+from pology import PologyError, datadir, _, n_
 from pology.spell import flag_no_check_spell, elist_well_spelled
+from pology.spell import AspellPipe, cached_checker, supplement_words
 from pology.colors import cjoin
 from pology.comments import manc_parse_list, manc_parse_flag_list
 import pology.config as cfg
 from pology.getfunc import get_hook_ireq
+from pology.msgfilter import filter_message, msgstr_filter
 from pology.msgreport import spell_error, spell_xml_error
 from pology.msgreport import report_msg_to_lokalize
+from pology.parallel import resolve_jobs
 from pology.report import report, warning, format_item_list
 from pology.sieve import SieveError, SieveCatalogError
 from pology.split import proper_words
@@ -56,6 +59,23 @@ def setup_sieve (p):
                 desc=_("@info sieve parameter discription",
     "Build XML report file at given path."
     ))
+    p.add_param("pipe", bool, defval=False,
+                desc=_("@info sieve parameter discription",
+    "Run Aspell as a separate process and send it all words of "
+    "a message at once, instead of using the Aspell library."
+    ))
+    p.add_param("nosugg", bool, defval=False,
+                desc=_("@info sieve parameter discription",
+    "Do not compute suggestions for unknown words, only report them."
+    ))
+    p.add_param("jobs", int,
+                metavar=_("@info sieve parameter value placeholder", "NUMBER"),
+                desc=_("@info sieve parameter discription",
+    "Compute suggestions for unknown words after all messages "
+    "of a catalog have been checked, once for each distinct word, "
+    "divided among this many worker processes. "
+    "Zero or less means as many as there are processors."
+    ))
     p.add_param("simsp", bool, defval=False,
                 desc=_("@info sieve parameter discription",
     "Split text into words in a simpler way (deprecated,)."
@@ -131,6 +151,7 @@ class Sieve (object):
 
         self.pfilters = [[get_hook_ireq(x, abort=True), x]
                          for x in (params.filter or [])]
+        self.pfilter, self.pfilter_ident = msgstr_filter(self.pfilters)
 
         self.envs = None
         if self.envs is None and params.env is not None:
@@ -145,6 +166,15 @@ class Sieve (object):
         if not self.suponly:
             self.suponly = cfgs.boolean("supplements-only", False)
 
+        self.pipe = params.pipe
+        if not self.pipe:
+            self.pipe = cfgs.boolean("pipe", False)
+        if self.pipe and not self.suponly and not AspellPipe.available():
+            warning(_("@info",
+                      "Aspell command not found, checking only against "
+                      "internal supplemental dictionaries."))
+            self.suponly = True
+
         # NOTE: Temporary hack, remove when word splitting becomes smarter.
         self.simsp = params.simsp
         if not self.simsp:
@@ -152,6 +182,15 @@ class Sieve (object):
 
         self.lokalize = params.lokalize
 
+        # Suggestions are not needed when only listing unknown words.
+        self.nosugg = params.nosugg or self.unknownWords is not None
+
+        # Deferred computation of suggestions, in parallel.
+        self.jobs = None
+        if params.jobs is not None and not self.nosugg:
+            self.jobs = resolve_jobs(params.jobs)
+        self.pending = [] # (message, catalog, unknown words in message)
+
         # Language-dependent elements built along the way.
         self.aspells = {}
         self.ignoredContexts = {}
@@ -165,6 +204,9 @@ class Sieve (object):
 
     def process_header (self, hdr, cat):
 
+        # Report anything left from a catalog which was not completed.
+        self._report_pending()
+
         # Check if the catalog itself states the language, and if yes,
         # create the language-dependent stuff if not already created
         # for this language.
@@ -180,15 +222,24 @@ class Sieve (object):
             # New language.
             self.aspellOptions["lang"] = clang.encode(self.loc_encoding)
 
-            # Get Pology's internal personal dictonary for this langenv.
-            if ckey not in self.personalDicts: # may be in but None
+            # Get Pology's internal personal dictonary for this langenv
+            # (not needed when checking only against it).
+            if ckey not in self.personalDicts and not self.suponly:
                 self.personalDicts[ckey] = self._get_personal_dict(clang, cenvs)
-            if self.personalDicts[ckey]:
+            if self.personalDicts.get(ckey):
                 self.aspellOptions["personal-path"] = self.personalDicts[ckey].encode(self.loc_encoding)
             else:
                 self.aspellOptions.pop("personal-path", None) # remove previous
 
-            if not self.suponly:
+            if not self.suponly and self.pipe:
+                # Start Aspell process.
+                try:
+                    self.aspells[ckey] = AspellPipe(
+                        clang, self.encoding, self.variety, {},
+                        self.personalDicts[ckey])
+                except PologyError as e:
+                    raise SieveError(str(e))
+            elif not self.suponly:
                 # Create Aspell object.
                 import pology.external.pyaspell as A
                 try:
@@ -206,11 +257,17 @@ class Sieve (object):
             else:
                 # Create simple internal checker that only checks against
                 # internal supplemental dictionaries.
-                personalDict=self.personalDicts[ckey]
-                if not personalDict:
+                validWords=supplement_words(clang, cenvs)
+                if validWords is None:
                     raise SieveError(_("@info",
                                        "No supplemental dictionaries found."))
-                self.aspells[ckey]=_QuasiSpell(personalDict, self.encoding)
+                self.aspells[ckey]=_QuasiSpell(validWords, self.encoding)
+
+            # Remember verdicts and suggestions of the checker.
+            self.aspells[ckey] = cached_checker(self.aspells[ckey],
+                                                "aspell-raw", clang, cenvs,
+                                                self.variety, self.suponly,
+                                                [self.encoding], self.encoding)
 
             # Load list of contexts by which to ignore messages.
             self.ignoredContexts[ckey] = []
@@ -251,9 +308,14 @@ class Sieve (object):
             return
 
         id=0 # Count msgstr plural forms
-        failedSuggs=[] # pairs of wrong words and suggestions
+        unknown=[] # pairs of wrong words and msgstr indices
 
-        for msgstr in msg.msgstr:
+        # Apply precheck filters.
+        msgf = msg
+        if self.pfilters:
+            msgf = filter_message(msg, cat, self.pfilter, self.pfilter_ident)
+
+        for msgstr in msgf.msgstr:
             # Skip message with context in the ignoredContext list
             skip=False
             for context in self.ignoredContext:
@@ -273,19 +335,6 @@ class Sieve (object):
             if flag_no_check_spell in manc_parse_flag_list(msg, "|"):
                 continue
 
-            # Apply precheck filters.
-            for pfilter, pfname in self.pfilters:
-                try: # try as type F1A hook
-                    msgstr = pfilter(msgstr)
-                except TypeError:
-                    try: # try as type F3* hook
-                        msgstr = pfilter(msgstr, msg, cat)
-                    except TypeError:
-                        raise SieveError(
-                            _("@info",
-                              "Cannot execute filter '%(filt)s'.",
-                              filt=pfname))
-
             # Split text into words.
             if not self.simsp:
                 words=proper_words(msgstr, True, cat.accelerator(), msg.format)
@@ -301,32 +350,88 @@ class Sieve (object):
             locally_ignored = manc_parse_list(msg, elist_well_spelled, ",")
             words = [x for x in words if x not in locally_ignored]
 
+            # Check all words at once, so that checks of single words
+            # below are answered from cache.
+            try:
+                encodedWords=[x.encode(self.encoding) for x in set(words)]
+            except UnicodeEncodeError:
+                encodedWords=[] # reported below
+            self.aspell.check_words(encodedWords)
+
             for word in words:
-                # Encode word for Aspell.
-                encodedWord=word.encode(self.encoding)
+                try:
+                    # Encode word for Aspell.
+                    encodedWord=word.encode(self.encoding)
+                except UnicodeEncodeError:
+                    warning(_("@info",
+                              "Cannot encode word '%(word)s' in "
+                              "selected encoding '%(enc)s'.",
+                              word=word, enc=self.encoding))
+                    continue
                 spell=self.aspell.check(encodedWord)
                 if spell is False:
-                    try:
-                        self.nmatch+=1
-                        if self.unknownWords is not None:
-                            self.unknownWords.add(word)
-                        else:
-                            encodedSuggestions=self.aspell.suggest(encodedWord)
-                            suggestions=[i.decode(self.encoding) for i in encodedSuggestions]
-                            failedSuggs.append((word, suggestions))
-                            if self.xmlFile:
-                                xmlError=spell_xml_error(msg, cat, word, suggestions, id)
-                                self.xmlFile.writelines(xmlError)
-                            else:
-                                spell_error(msg, cat, word, suggestions)
-                    except UnicodeEncodeError:
-                        warning(_("@info",
-                                  "Cannot encode word '%(word)s' in "
-                                  "selected encoding '%(enc)s'.",
-                                  word=word, enc=self.encoding))
+                    self.nmatch+=1
+                    if self.unknownWords is not None:
+                        self.unknownWords.add(word)
+                    else:
+                        unknown.append((word, id))
             id+=1 # Increase msgstr id count
 
-        if failedSuggs and self.lokalize:
+        if not unknown:
+            return
+
+        if self.jobs is not None:
+            # Suggestions are computed when the catalog is done.
+            self.pending.append((msg, cat, unknown))
+        else:
+            suggestions={}
+            if not self.nosugg:
+                for word, id in unknown:
+                    if word not in suggestions:
+                        suggestions[word]=self._decode_suggestions(
+                            self.aspell.suggest(word.encode(self.encoding)))
+            self._report_unknown(msg, cat, unknown, suggestions)
+
+
+    def process_header_last (self, hdr, cat):
+
+        self._report_pending()
+
+
+    def _report_pending (self):
+
+        if not self.pending:
+            return
+
+        words=list(dict.fromkeys(word for msg, cat, unknown in self.pending
+                                      for word, id in unknown))
+        encodedSuggestions=self.aspell.suggest_words(
+            [x.encode(self.encoding) for x in words], self.jobs)
+        suggestions=dict((word, self._decode_suggestions(encsuggs))
+                         for word, encsuggs in zip(words, encodedSuggestions))
+        for msg, cat, unknown in self.pending:
+            self._report_unknown(msg, cat, unknown, suggestions)
+        self.pending=[]
+
+
+    def _decode_suggestions (self, encodedSuggestions):
+
+        return [x.decode(self.encoding) for x in encodedSuggestions]
+
+
+    def _report_unknown (self, msg, cat, unknown, suggestions):
+
+        failedSuggs=[] # pairs of wrong words and suggestions
+        for word, id in unknown:
+            wordSuggestions=suggestions.get(word, [])
+            failedSuggs.append((word, wordSuggestions))
+            if self.xmlFile:
+                xmlError=spell_xml_error(msg, cat, word, wordSuggestions, id)
+                self.xmlFile.writelines(xmlError)
+            else:
+                spell_error(msg, cat, word, wordSuggestions)
+
+        if self.lokalize:
             repls=[_("@label", "Spelling errors:")]
             for word, suggs in failedSuggs:
                 if suggs:
@@ -340,6 +445,13 @@ class Sieve (object):
 
 
     def finalize (self):
+        self._report_pending()
+
+        # Stop Aspell processes.
+        for checker in self.aspells.values():
+            if hasattr(checker, "close"):
+                checker.close()
+
         # Remove composited personal dictionaries.
         for tmpDictFile in list(self.tmpDictFiles.values()):
             if isfile(tmpDictFile):
@@ -445,18 +557,20 @@ def _read_dict_file (fname):
     return words
 
 
-# Simple spell checker which reads Aspell's personal dictionary file.
+# Simple spell checker which checks against supplemental dictionaries.
 class _QuasiSpell (object):
 
-    def __init__ (self, dictfile, encoding="UTF-8"):
+    def __init__ (self, validWords, encoding="UTF-8"):
 
-        self.validWords = _read_dict_file(dictfile)
+        self.validWords = validWords
         self.encoding = encoding # of the raw text sent in for checking
 
 
     def check (self, encWord):
 
-        word=str.decode(encWord, self.encoding)
+        word=encWord
+        if isinstance(word, bytes):
+            word=word.decode(self.encoding)
         if (    word not in self.validWords
             and word.lower() not in self.validWords
         ):
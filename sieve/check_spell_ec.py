@@ -20,10 +20,12 @@ from time import strftime
 
 from pology import PologyError, datadir, _, n_
 from pology.spell import flag_no_check_spell, elist_well_spelled
+from pology.spell import cached_checker
 from pology.colors import cjoin
 from pology.comments import manc_parse_list, manc_parse_flag_list
 import pology.config as cfg
 from pology.getfunc import get_hook_ireq
+from pology.msgfilter import filter_message, msgstr_filter
 from pology.msgreport import report_on_msg
 from pology.msgreport import report_msg_to_lokalize
 from pology.msgreport import spell_xml_error
@@ -137,6 +139,7 @@ class Sieve (object):
 
         self.pfilters = [[get_hook_ireq(x, abort=True), x]
                          for x in (params.filter or [])]
+        self.pfilter, self.pfilter_ident = msgstr_filter(self.pfilters)
 
         self.suponly = params.suponly
 
@@ -201,7 +204,10 @@ class Sieve (object):
                       "No spelling dictionary for language '%(lang)s' and "
                       "provider '%(prov)s'.",
                       lang=clang, prov=self.providers))
-            self.checkers[ckey] = checker
+            # Remember verdicts and suggestions of the checker.
+            self.checkers[ckey] = cached_checker(checker, self.providers,
+                                                 clang, cenvs, None,
+                                                 self.suponly)
 
         # Get language-dependent stuff.
         self.checker = self.checkers[ckey]
@@ -285,25 +291,17 @@ class Sieve (object):
                                     word=word),
                                     msg, cat)
 
-        for msgstr in msg.msgstr:
+        # Apply precheck filters.
+        msgf = msg
+        if self.pfilters:
+            msgf = filter_message(msg, cat, self.pfilter, self.pfilter_ident)
+
+        for msgstr in msgf.msgstr:
 
             # Skip message if explicitly requested.
             if flag_no_check_spell in manc_parse_flag_list(msg, "|"):
                 continue
 
-            # Apply precheck filters.
-            for pfilter, pfname in self.pfilters:
-                try: # try as type F1A hook
-                    msgstr = pfilter(msgstr)
-                except TypeError:
-                    try: # try as type F3* hook
-                        msgstr = pfilter(msgstr, msg, cat)
-                    except TypeError:
-                        raise SieveError(
-                            _("@info",
-                              "Cannot execute filter '%(filt)s'.",
-                              filt=pfname))
-
             # Split text into words.
             # TODO: See to use markup types somehow.
             words = proper_words(msgstr, True, cat.accelerator(), msg.format)
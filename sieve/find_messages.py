@@ -19,8 +19,9 @@ from pology.message import MessageUnsafe
 from pology.remove import remove_accel_msg
 from pology.fsops import str_to_unicode
 from pology.getfunc import get_hook_ireq
-from pology.match import make_msg_matcher, make_matcher, make_filtered_msg
+from pology.match import make_msg_matcher, make_matcher
 from pology.match import ExprError
+from pology.msgfilter import filter_message
 from pology.msgreport import report_msg_content
 from pology.msgreport import report_msg_to_lokalize
 from pology.report import report, error, warning, format_item_list
@@ -351,6 +352,7 @@ class Sieve (object):
         self.pfilters = []
         for hreq in self.p.filter or []:
             self.pfilters.append(get_hook_ireq(hreq, abort=True))
+        self.pfilter_ident = ("noaccel",) + tuple(self.p.filter or [])
 
         # Unless replacement or marking requested, no need to monitor/sync.
         if self.p.replace is None and not self.p.mark:
@@ -371,7 +373,7 @@ class Sieve (object):
         """
 
         # Prepare filtered message for matching.
-        msgf = make_filtered_msg(msg, cat, filters=self.pfilters)
+        msgf = filter_message(msg, cat, self._filter_msg, self.pfilter_ident)
 
         # Match the message.
         hl_spec = []
@@ -408,6 +410,14 @@ class Sieve (object):
         return 0 if match else 1
 
 
+    def _filter_msg (self, msgf, cat):
+
+        remove_accel_msg(msgf, cat)
+        for pfilter in self.pfilters:
+            for i in range(len(msgf.msgstr)):
+                msgf.msgstr[i] = pfilter(msgf.msgstr[i])
+
+
     def finalize (self):
 
         if self.nmatch:
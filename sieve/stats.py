@@ -16,7 +16,7 @@ import sys
 
 from pology import _, n_
 from pology.catalog import Catalog
-from pology.message import MessageUnsafe
+from pology.msgfilter import filter_message, msgstr_filter
 from pology.colors import ColorString, cjoin, cinterp
 from pology.comments import parse_summit_branches
 from pology.diff import tdiff
@@ -260,7 +260,8 @@ class Sieve (object):
         # Resolve filtering hooks.
         self.pfilters = []
         for hreq in self.p.filter or []:
-            self.pfilters.append(get_hook_ireq(hreq, abort=True))
+            self.pfilters.append((get_hook_ireq(hreq, abort=True), hreq))
+        self.pfilter, self.pfilter_ident = msgstr_filter(self.pfilters)
 
         # Indicators to the caller:
         self.caller_sync = False # no need to sync catalogs
@@ -349,10 +350,7 @@ class Sieve (object):
 
         # Prepare filtered message for counting.
         if self.pfilters:
-            msg = MessageUnsafe(msg)
-            for pfilter in self.pfilters:
-                for i in range(len(msg.msgstr)):
-                    msg.msgstr[i] = pfilter(msg.msgstr[i])
+            msg = filter_message(msg, cat, self.pfilter, self.pfilter_ident)
 
         # Count the words and characters in original and translation.
         # Remove shortcut markers prior to counting; don't include words
@@ -0,0 +1,107 @@
+from pology.catalog import Catalog
+from pology.message import Message
+
+from scripts.poediff import collect_file_pairs, diff_pairs
+from scripts.poediff import format_ediff, stream_diff_pairs
+from scripts.poediff import pairs_update_effort
+
+
+def _write_catalog(path, entries, msgctxt=None, header={}):
+    cat = Catalog(str(path), create=True)
+    for name, value in header.items():
+        cat.header.set_field(name, value)
+    for msgid, msgstr, fuzzy in entries:
+        flags = fuzzy and ["fuzzy"] or []
+        cat.add_last(Message(dict(msgctxt=msgctxt, msgid=msgid,
+                                  msgstr=[msgstr], flag=flags)))
+    cat.sync()
+
+
+def _make_pspecs(tmp_path):
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    for i in range(4):
+        (old / str(i)).mkdir(parents=True)
+        (new / str(i)).mkdir(parents=True)
+        entries = [("Message %d-%d" % (i, j), "Poruka %d" % j, False)
+                   for j in range(10)]
+        msgctxt = "~" if i == 2 else None
+        _write_catalog(old / str(i) / "foo.po", entries, msgctxt)
+        entries[i] = (entries[i][0], "Izmenjena poruka", True)
+        entries.append(("Message %d-new" % i, "", False))
+        _write_catalog(new / str(i) / "foo.po", entries, msgctxt)
+    _write_catalog(new / "bar.po", [("Same", "Isto", False)])
+    # A pair differing only in the header.
+    for path, translator in ((old / "baz.po", "Foo"), (new / "baz.po", "Bar")):
+        _write_catalog(path, [("Same", "Isto", False)],
+                       header={"Last-Translator": translator})
+    fpairs = collect_file_pairs(str(old), str(new), False)
+    return [(x, x) for x in fpairs]
+
+
+def test_parallel_diff_is_same_as_serial(tmp_path):
+    pspecs = _make_pspecs(tmp_path)
+
+    diffs = []
+    for jobs in (1, 3):
+        ecat, ndiffed = diff_pairs(pspecs, False, quiet=True, jobs=jobs)
+        diffs.append(([x.to_string() for x in ecat], ndiffed))
+    assert diffs[0] == diffs[1]
+    assert diffs[0][1] == 4 * 3 + 3
+
+
+def test_streamed_diff_is_same_as_collected(tmp_path):
+    pspecs = _make_pspecs(tmp_path)
+
+    for shdr in (False, True):
+        ecat, ndiffed = diff_pairs(pspecs, False, shdr=shdr, quiet=True)
+        hmsgctxt = ecat.header.get_field_value("X-Ediff-Header-Context")
+        assert hmsgctxt == "~"
+        msgs = list(ecat)
+        if not shdr:
+            msgs.insert(0, ecat.header.to_msg())
+        text = "".join(format_ediff(msgs, hmsgctxt, ecat.wrapf(), shdr))
+
+        chunks = []
+        sndiffed = stream_diff_pairs(pspecs, False, chunks.append,
+                                     shdr=shdr, quiet=True, jobs=2)
+        assert len(chunks) == 6
+        assert "".join(chunks) == text
+        assert sndiffed == ndiffed
+
+
+def test_streamed_diff_of_header_only_changes(tmp_path):
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    for path, translator in ((old / "baz.po", "Foo"), (new / "baz.po", "Bar")):
+        _write_catalog(path, [("Same", "Isto", False)],
+                       header={"Last-Translator": translator})
+    pspecs = [(x, x) for x in collect_file_pairs(str(old), str(new), False)]
+
+    for shdr in (False, True):
+        ecat, ndiffed = diff_pairs(pspecs, False, shdr=shdr, quiet=True)
+        chunks = []
+        sndiffed = stream_diff_pairs(pspecs, False, chunks.append,
+                                     shdr=shdr, quiet=True)
+        assert sndiffed == ndiffed == (0 if shdr else 1)
+        assert len(chunks) == (0 if shdr else 1)
+
+
+def test_parallel_update_effort_is_same_as_serial(tmp_path):
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    for i in range(4):
+        entries = [("Open the file number %d" % j, "Otvori fajl broj %d" % j,
+                    False) for j in range(10)]
+        _write_catalog(old / ("foo%d.po" % i), entries)
+        for j in range(i):
+            entries[j] = (entries[j][0], "Otvori datoteku broj %d" % j, False)
+        _write_catalog(new / ("foo%d.po" % i), entries)
+    fpairs = collect_file_pairs(str(old), str(new), False)
+    pspecs = [(x, x) for x in fpairs]
+
+    updeff, pupdeffs = pairs_update_effort(pspecs, quiet=True)
+    assert pupdeffs[0][0][2] == 0.0
+    assert 0.0 < pupdeffs[1][0][2] < pupdeffs[3][0][2]
+    assert updeff[0][2] == sum(x[0][2] for x in pupdeffs)
+    assert pairs_update_effort(pspecs, quiet=True, jobs=3) == (updeff, pupdeffs)
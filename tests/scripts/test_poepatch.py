@@ -0,0 +1,88 @@
+import optparse
+import re
+import shutil
+
+from pology.catalog import Catalog
+from pology.message import Message
+
+from scripts.poediff import collect_file_pairs, diff_pairs
+from scripts.poepatch import apply_ediff
+
+
+def _write_catalog(path, entries):
+    cat = Catalog(str(path), create=True)
+    for msgid, msgstr, line in entries:
+        cat.add_last(Message(dict(msgid=msgid, msgstr=[msgstr],
+                                  source=[("foo.cpp", line)])))
+    cat.sync()
+
+
+def _make_ediff(tmp_path):
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    old.mkdir()
+    new.mkdir()
+    for i in range(4):
+        entries = [("Message %d-%d" % (i, j), "Poruka %d" % j, 10 * j)
+                   for j in range(10)]
+        _write_catalog(old / ("foo%d.po" % i), entries)
+        entries[i] = (entries[i][0], "Izmenjena poruka", 10 * i)
+        entries.pop(i + 3)
+        entries.insert(i + 4, ("Message %d-new" % i, "Nova poruka",
+                               10 * (i + 5) - 5))
+        _write_catalog(new / ("foo%d.po" % i), entries)
+    fpairs = collect_file_pairs(str(old), str(new), False)
+    ecat, ndiffed = diff_pairs([(x, x) for x in fpairs], False, quiet=True)
+    ecat.filename = str(tmp_path / "ediff.po")
+    ecat.sync(force=True)
+    return old, new, ecat.filename
+
+
+def _patch(edfpath, target, jobs):
+    op = optparse.Values(dict(input=edfpath, directory=str(target),
+                              strip=None, embed=False, do_merge=False,
+                              aggressive=False, jobs=jobs))
+    apply_ediff(op)
+
+
+def _messages(path):
+    return [x.to_string() for x in Catalog(str(path))]
+
+
+def _rejects(path):
+    # Contexts of split rejects are padded randomly.
+    return [re.sub(r"(ctxtpad |\|)[a-z0-9]{5}", r"\1", x)
+            for x in _messages(path)]
+
+
+def test_patched_same_as_new(tmp_path):
+    old, new, edfpath = _make_ediff(tmp_path)
+
+    for jobs in (1, 3):
+        target = tmp_path / ("target%d" % jobs)
+        shutil.copytree(str(old), str(target))
+        _patch(edfpath, target, jobs)
+        for i in range(4):
+            fname = "foo%d.po" % i
+            assert _messages(target / fname) == _messages(new / fname)
+
+
+def test_parallel_rejects_same_as_serial(tmp_path):
+    old, new, edfpath = _make_ediff(tmp_path)
+    rejpath = tmp_path / "ediff.rej.po"
+
+    rejects = []
+    for jobs in (1, 3):
+        target = tmp_path / ("target%d" % jobs)
+        shutil.copytree(str(old), str(target))
+        for i in (1, 3):
+            fpath = target / ("foo%d.po" % i)
+            cat = Catalog(str(fpath))
+            cat[i].msgstr[0] = "Druga poruka"
+            cat.sync()
+        _patch(edfpath, target, jobs)
+        rejects.append(_rejects(rejpath))
+        rejpath.unlink()
+        assert _messages(target / "foo2.po") == _messages(new / "foo2.po")
+    assert rejects[0] == rejects[1]
+    assert len(rejects[0]) == 2 * 3
@@ -0,0 +1,137 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from pology.catalog import Catalog
+from pology.message import Message
+
+
+_posummit = os.path.join(os.path.dirname(__file__),
+                         "..", "..", "scripts", "posummit.py")
+
+_config = """
+S.over_templates = True
+
+S.summit = dict(
+    topdir=S.relpath("summit/%s" % S.lang),
+    topdir_templates=S.relpath("summit/templates"),
+)
+
+S.branches = [
+    dict(id="devel",
+         topdir=S.relpath("devel/%s" % S.lang),
+         topdir_templates=S.relpath("devel/templates"),
+         merge=True),
+]
+
+S.mappings = [
+]
+"""
+
+
+def _write_catalog(path, potdate, entries):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cat = Catalog(path, create=True)
+    cat.header.set_field("POT-Creation-Date", potdate)
+    for msgid, msgstr in entries:
+        cat.add_last(Message(dict(msgid=msgid, msgstr=[msgstr])))
+    cat.sync()
+
+
+def _make_summit(topdir):
+    for i in range(4):
+        entries = [("Message %d-%d" % (i, j), "Poruka %d" % j)
+                   for j in range(5)]
+        tentries = [(x, "") for x, y in entries]
+        tentries.insert(i, ("Message %d-new" % i, ""))
+        for tree in ("summit", "devel"):
+            path = os.path.join(topdir, tree, "sr", "foo%d.po" % i)
+            _write_catalog(path, "2010-01-01 00:00+0000", entries)
+            path = os.path.join(topdir, tree, "templates", "foo%d.pot" % i)
+            _write_catalog(path, "2010-02-01 00:00+0000", tentries)
+    with open(os.path.join(topdir, "summit-config-shared"), "w") as f:
+        f.write(_config)
+
+
+def _merge(topdir, jobs):
+    cmd = [sys.executable, _posummit,
+           os.path.join(topdir, "summit-config-shared"), "sr", "merge",
+           "-j", str(jobs)]
+    return subprocess.run(cmd, cwd=topdir, check=True,
+                          stdout=subprocess.PIPE).stdout.decode()
+
+
+@pytest.mark.skipif(not shutil.which("msgmerge"),
+                    reason="msgmerge not available")
+def test_parallel_merge_same_as_serial(tmp_path):
+    _make_summit(str(tmp_path / "serial"))
+    shutil.copytree(str(tmp_path / "serial"), str(tmp_path / "parallel"))
+
+    outputs = []
+    for name, jobs in (("serial", 1), ("parallel", 3)):
+        topdir = str(tmp_path / name)
+        output = _merge(topdir, jobs)
+        outputs.append(output.replace(topdir, ""))
+    assert outputs[0] == outputs[1]
+    assert outputs[0].count(".    ") == 8
+
+    for tree in ("summit", "devel"):
+        for i in range(4):
+            fname = os.path.join(tree, "sr", "foo%d.po" % i)
+            with open(str(tmp_path / "serial" / fname)) as f:
+                serial = f.read()
+            with open(str(tmp_path / "parallel" / fname)) as f:
+                assert f.read() == serial
+            assert "Message %d-new" % i in serial
+
+
+_native_config = _config + """
+S.merge_engine = "native"
+S.vivify_on_merge = True
+S.compendium_on_merge = S.relpath("compendium.po")
+"""
+
+
+def test_native_merge_with_vivification(tmp_path, monkeypatch):
+    # The merged catalogs are checked by msgfmt,
+    # which is not what is tested here.
+    if not shutil.which("msgfmt"):
+        script = tmp_path / "bin" / "msgfmt"
+        script.parent.mkdir()
+        script.write_text("#!/bin/sh\nexit 0\n")
+        script.chmod(0o755)
+        monkeypatch.setenv("PATH", str(script.parent), prepend=os.pathsep)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    topdir = str(tmp_path / "project")
+    _make_summit(topdir)
+    with open(os.path.join(topdir, "summit-config-shared"), "w") as f:
+        f.write(_native_config)
+    _write_catalog(os.path.join(topdir, "compendium.po"),
+                   "2010-01-01 00:00+0000",
+                   [("Message 9-0", "Poruka iz kompendijuma"),
+                    ("Message 0-new", "Nova poruka")])
+    tentries = [("Message 9-%d" % j, "") for j in range(3)]
+    _write_catalog(os.path.join(topdir, "summit", "templates", "foo9.pot"),
+                   "2010-02-01 00:00+0000", tentries)
+
+    _merge(topdir, 2)
+
+    cat = Catalog(os.path.join(topdir, "summit", "sr", "foo9.po"))
+    assert [x.msgstr[0] for x in cat] == ["Poruka iz kompendijuma"] * 3
+    assert [x.fuzzy for x in cat] == [False, True, True]
+    assert cat[1].msgid_previous == "Message 9-0"
+    assert cat.header.get_field_value("Language-Team") == "Nevernessian"
+    for tree in ("summit", "devel"):
+        cat = Catalog(os.path.join(topdir, tree, "sr", "foo0.po"))
+        assert cat[0].msgid == "Message 0-new"
+        assert cat[1].msgstr == ["Poruka 0"]
+    # Only the summit is merged with the compendium.
+    summit_cat = Catalog(os.path.join(topdir, "summit", "sr", "foo0.po"))
+    assert summit_cat[0].msgstr == ["Nova poruka"]
+    assert not summit_cat[0].fuzzy
+    devel_cat = Catalog(os.path.join(topdir, "devel", "sr", "foo0.po"))
+    assert devel_cat[0].msgid_previous == "Message 0-0"
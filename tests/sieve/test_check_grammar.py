@@ -0,0 +1,86 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+from urllib.parse import parse_qs
+
+import pytest
+
+from pology import PologyError
+from sieve.check_grammar import LanguageToolClient
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        form = parse_qs(self.rfile.read(length).decode("UTF-8"))
+        self.server.requests.append(form)
+        if self.path != "/v2/check" or form["language"] == ["xx"]:
+            self.send_response(400)
+            body = b"Error: unsupported language"
+        else:
+            text = form["text"][0]
+            matches = []
+            pos = text.find("teh")
+            while pos >= 0:
+                matches.append({
+                    "message": "Possible typo",
+                    "offset": pos,
+                    "length": 3,
+                    "context": {"text": text, "offset": pos, "length": 3},
+                    "rule": {"id": "TYPO"},
+                })
+                pos = text.find("teh", pos + 1)
+            self.send_response(200)
+            body = json.dumps({"matches": matches}).encode("UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_batched_results_are_split_per_text(server):
+    client = LanguageToolClient("127.0.0.1", server.server_port, 2, 3)
+    texts = ["teh one", "two", "three teh", "four", "teh teh"]
+    futures = [client.submit("aa", ["R2", "R1"], x) for x in texts]
+    client.flush()
+    results = [x.result() for x in futures]
+    client.close()
+
+    assert len(server.requests) == 2
+    assert server.requests[0]["disabledRules"] == ["R1,R2"]
+    assert [len(x) for x in results] == [1, 0, 1, 0, 2]
+    assert results[2] == [("TYPO", "Possible typo", "three teh")]
+
+
+def test_results_are_cached(server):
+    client = LanguageToolClient("127.0.0.1", server.server_port, 2, 1)
+    first = client.submit("bb", [], "teh cached").result()
+    second = client.submit("bb", [], "teh cached").result()
+    client.close()
+
+    assert first == second
+    assert len(server.requests) == 1
+
+
+def test_server_errors_are_raised(server):
+    client = LanguageToolClient("127.0.0.1", server.server_port, 1, 1)
+    future = client.submit("xx", [], "text")
+    with pytest.raises(PologyError):
+        future.result()
+    client.close()
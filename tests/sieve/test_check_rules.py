@@ -0,0 +1,45 @@
+from pology.catalog import Catalog
+from pology.message import Message
+from pology.rules import Rule
+from sieve.check_rules import _catalogKey, _headerFieldRxs
+
+
+def _catalog(path):
+    cat = Catalog(str(path), create=True)
+    cat.header.set_field("Language", "sr")
+    cat.header.set_field("Plural-Forms", "nplurals=3; plural=n%10==1 ? 0 : 1;")
+    cat.header.set_field("X-Accelerator-Marker", "&")
+    cat.add_last(Message(dict(msgid="Open", msgstr=["Otvori"])))
+    return cat
+
+
+def test_catalog_key_ignores_volatile_header_fields(tmp_path):
+    cat = _catalog(tmp_path / "foo.po")
+    key = _catalogKey(cat, "sr", ["kde"])
+
+    cat.header.set_field("PO-Revision-Date", "2030-01-01 00:00+0000")
+    cat.header.set_field("POT-Creation-Date", "2030-01-01 00:00+0000")
+    cat.header.set_field("Last-Translator", "Someone <someone@example.org>")
+    assert _catalogKey(cat, "sr", ["kde"]) == key
+
+    assert _catalogKey(cat, "sr", []) != key
+    assert _catalogKey(cat, "sr@latin", ["kde"]) != key
+    cat.header.set_field("Plural-Forms", "nplurals=2; plural=n != 1;")
+    assert _catalogKey(cat, "sr", ["kde"]) != key
+
+
+def test_catalog_key_includes_header_fields_examined_by_rules(tmp_path):
+    cat = _catalog(tmp_path / "foo.po")
+    cat.header.set_field("Language-Team", "Serbian")
+    rules = [Rule(r"foo", "msgstr"),
+             Rule(r"bar", "msgstr",
+                  valid=[[("!head", "/Language-Team/Serbian")]])]
+    headRxs = _headerFieldRxs(rules)
+    assert len(headRxs) == 1
+    key = _catalogKey(cat, "sr", [], headRxs)
+
+    cat.header.set_field("Last-Translator", "Someone <someone@example.org>")
+    assert _catalogKey(cat, "sr", [], headRxs) == key
+    cat.header.set_field("Language-Team", "Srpski")
+    assert _catalogKey(cat, "sr", [], headRxs) != key
+    assert _catalogKey(cat, "sr", []) == _catalogKey(cat, "sr", [], [])
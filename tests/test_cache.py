@@ -0,0 +1,27 @@
+from pology.cache import Cache
+
+
+def test_cache_drops_least_recently_used():
+    cache = Cache(size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_nonpersistent_cache_is_not_written(tmp_path, monkeypatch):
+    import pology.cache as C
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(C, "_persistent", True)
+    monkeypatch.setattr(C, "_caches", {})
+    C.named_cache("kept").set("a", 1)
+    C.named_cache("not-kept", persistent=False).set("a", 1)
+    C.sync_caches()
+    assert [x.name for x in tmp_path.glob("pology/*")] == ["kept.cache"]
+    assert "not-kept" in C.cache_stats()
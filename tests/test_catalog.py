@@ -22,3 +22,14 @@ def test_template_load():
         })
     ]
     assert actual == expected
+
+
+def test_remove_more(tmp_path):
+    catalog = Catalog(str(tmp_path / "foo.po"), create=True)
+    for i in range(6):
+        catalog.add_last(Message(dict(msgid="Message %d" % i)))
+    catalog.remove_more([4, 1, catalog[2]])
+    assert [x.msgid for x in catalog] == [
+        "Message 0", "Message 3", "Message 5"]
+    assert catalog.find(catalog[2]) == 2
+    assert Message(dict(msgid="Message 1")) not in catalog
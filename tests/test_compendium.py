@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from pology import PologyError
+import pology.compendium as C
+from pology.message import Message
+
+
+# Compendia concatenated by msgcat may contain messages with equal keys.
+_compendium_text = """
+msgid ""
+msgstr ""
+"Language: sr\\n"
+"Content-Type: text/plain; charset=UTF-8\\n"
+
+msgid "Open file"
+msgstr ""
+
+# checked
+msgid "Open file"
+msgstr "Otvori fajl"
+
+msgid "Open file"
+msgstr "Otvori datoteku"
+
+msgctxt "@action"
+msgid "Open"
+msgstr "Otvori"
+
+msgid "Save the document"
+msgstr "Sačuvaj dokument"
+
+msgid "Never translated"
+msgstr ""
+
+#~ msgid "Gone away"
+#~ msgstr "Otišlo"
+"""
+
+
+def _compendium(path, extra=""):
+    path.write_text(_compendium_text + extra, encoding="utf8")
+    return str(path)
+
+
+def test_compendium_index_lookup(tmp_path):
+    cmppath = _compendium(tmp_path / "compendium.po")
+    idxpath = C.build_compendium_index(cmppath, str(tmp_path / "cmp.idx"))
+    cmpidx = C.CompendiumIndex(idxpath)
+
+    assert len(cmpidx) == 4
+    assert cmpidx.filename == cmppath
+    assert cmpidx.header.get_field_value("Language") == "sr"
+    msg = cmpidx[Message(dict(msgid="Open file"))]
+    assert msg.msgstr == ["Otvori fajl"]
+    assert list(msg.manual_comment) == ["checked"]
+    assert cmpidx.get(Message(dict(msgid="Open", msgctxt="@action")).key)
+    assert Message(dict(msgid="Open")) not in cmpidx
+    assert Message(dict(msgid="Gone away")) not in cmpidx
+    assert cmpidx[Message(dict(msgid="Never translated"))].untranslated
+
+    cands = cmpidx.candidates("Save the documents", 0.6)
+    assert [cmpidx.message(i).msgid for i, n in cands] == ["Save the document"]
+    cands = cmpidx.candidates("Open the file", 0.0, limit=2)
+    assert [cmpidx.message(i).msgid for i, n in cands] == ["Open file", "Open"]
+    cmpidx.close()
+
+
+def test_compendium_index_rebuilt_on_change(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(C, "_indexes", {})
+    cmppath = _compendium(tmp_path / "compendium.po")
+
+    cmpidx = C.compendium_index(cmppath)
+    assert C.compendium_index(cmppath) is cmpidx
+    assert os.path.isfile(C.compendium_index_path(cmppath))
+
+    _compendium(tmp_path / "compendium.po",
+                '\nmsgid "Print"\nmsgstr "Štampaj"\n')
+    st = os.stat(cmppath)
+    os.utime(cmppath, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    cmpidx2 = C.compendium_index(cmppath)
+    assert cmpidx2 is not cmpidx
+    assert cmpidx._mmap.closed
+    assert cmpidx2[Message(dict(msgid="Print"))].msgstr == ["Štampaj"]
+
+    with pytest.raises(PologyError):
+        C.compendium_index(str(tmp_path / "missing.po"))
+
+
+def test_compendium_index_rejects_other_files(tmp_path):
+    path = tmp_path / "bogus.idx"
+    path.write_bytes(b"not an index at all")
+    with pytest.raises(PologyError):
+        C.CompendiumIndex(str(path))
@@ -0,0 +1,134 @@
+import random
+
+import pytest
+
+from pology import PologyError
+from pology.diff import AncestryIndex, descprob, editprob, editprob_many
+from pology.diff import set_diff_engine, tdiff, itdiff, tmatch_many
+
+
+def _lcs_len(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = row[:]
+        for j, y in enumerate(b):
+            row[j + 1] = prev[j] + 1 if x == y else max(prev[j + 1], row[j])
+    return row[-1]
+
+
+def test_lcs_engine_makes_minimal_diffs():
+    rnd = random.Random(1)
+    for i in range(500):
+        old = "".join(rnd.choice("abc ") for i in range(rnd.randint(0, 30)))
+        new = "".join(rnd.choice("abcd ") for i in range(rnd.randint(0, 30)))
+        dlist, dr = tdiff(old, new, diffr=True, engine="lcs")
+        assert "".join(x for t, x in dlist if t != "+") == old
+        assert "".join(x for t, x in dlist if t != "-") == new
+        nequal = len([t for t, x in dlist if t == " "])
+        assert nequal == _lcs_len(old, new)
+        if old or new:
+            assert dr == pytest.approx(1 - 2 * nequal / (len(old) + len(new)))
+
+
+def test_diff_engine_is_selectable():
+    s1 = "Two blue airplanes".split()
+    s2 = "Two bluish ships".split()
+    expected = itdiff(s1, s2)
+    prev_engine = set_diff_engine("lcs")
+    try:
+        assert itdiff(s1, s2) == expected
+    finally:
+        assert set_diff_engine(prev_engine) == "lcs"
+    with pytest.raises(PologyError):
+        set_diff_engine("none")
+
+
+def test_tmatch_many_matches_tdiff():
+    rnd = random.Random(2)
+    pairs = [("", ""), ("", "abc"), ("abc", "abc"), ("a" * 300, "a" * 300)]
+    for i in range(200):
+        old = "".join(rnd.choice("abc ") for i in range(rnd.randint(0, 30)))
+        new = rnd.choice([old, "abc abc", old + "d"])
+        pairs.append((old, new))
+    for engine in ("difflib", "lcs"):
+        expected = []
+        for old, new in pairs:
+            dlist, dr = tdiff(old, new, diffr=True, engine=engine)
+            expected.append((len([t for t, x in dlist if t == " "]), dr))
+        assert tmatch_many(pairs, engine=engine) == expected
+
+
+def test_editprob_many_matches_editprob():
+    from pology.cache import named_cache
+
+    memo = named_cache("editprob")
+    memo.clear()
+    new = "Open the selected file in a new window"
+    pairs = [
+        ("Open the selected file", new),
+        ("Open selected files in new windows", new),
+        ("Close the window", new),
+        (new, new),
+        ("", new),
+        (None, None),
+        (new, "Open the file"),
+    ]
+    probs = editprob_many(pairs)
+    assert probs[3:6] == [1.0, 0.0, 1.0]
+    assert 0.0 < probs[2] < probs[0] < 1.0
+    hits = memo.hits
+    assert [editprob(x, y) for x, y in pairs] == probs
+    assert memo.hits == hits + 4
+
+
+def _write_po(path, texts):
+    with open(path, "w") as f:
+        for text in texts:
+            f.write('msgid "%s"\nmsgstr ""\n\n' % text)
+    return str(path)
+
+
+def test_ancestry_index_finds_ancestors(tmp_path):
+    rnd = random.Random(2)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta",
+             "theta", "iota", "kappa", "lambda", "mu", "nu", "xi", "omicron"]
+    files = []
+    alltexts = []
+    for i in range(20):
+        texts = [" ".join(rnd.choice(words) for k in range(rnd.randint(1, 8)))
+                 for j in range(40)]
+        files.append(_write_po(tmp_path / ("f%d.po" % i), texts))
+        alltexts.append(texts)
+    index = AncestryIndex(files)
+    assert len(index) == 20 and files[0] in index
+
+    # A renamed file with some changes, and a half of a split file.
+    texts = list(alltexts[3])
+    texts[::5] = [x + " more" for x in texts[::5]]
+    renamed = _write_po(tmp_path / "renamed.po", texts)
+    half = _write_po(tmp_path / "half.po", alltexts[7][:20])
+
+    assert index.candidates(renamed)[0][0] == files[3]
+    ancs = index.ancestors(renamed, cutoff=0.8)
+    assert ancs[0] == (files[3], descprob(renamed, files[3], cutoff=0.8))
+    assert index.ancestors(half)[0][0] == files[7]
+    assert files[7] not in [x[0] for x in index.candidates(files[7])]
+
+
+
+def test_diff_engine_from_config(monkeypatch):
+    from configparser import ConfigParser
+    import pology.config
+    import pology.diff as D
+
+    config = ConfigParser()
+    config.read_string("[global]\ndiff-engine = lcs\n")
+    monkeypatch.setattr(pology.config, "_config", config)
+    monkeypatch.setattr(D, "_diff_engine", "difflib")
+    D._init_diff_engine()
+    assert D._diff_engine == "lcs"
+
+    config.set("global", "diff-engine", "foo")
+    with pytest.raises(SystemExit):
+        D._init_diff_engine()
+    assert D._diff_engine == "lcs"
@@ -1,6 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
-from pology.markup import _escape_amp_accel, xml_to_plain
+from pology.markup import _escape_amp_accel, xml_to_plain, docbook4_to_plain
+from pology.markup import XmlValidatorL1, validate_docbook4_l1
 
 @pytest.mark.parametrize(
     "input,output",
@@ -27,3 +30,96 @@ def test_escape_amp_accel(input, output):
 )
 def test_xml_to_plain(input, output):
     assert xml_to_plain(input) == output
+
+
+@pytest.mark.parametrize(
+    "input,output",
+    (
+        ("a <b>bold</b>  text", "a bold text"),
+        ("x<a href='1/2>3'>y</a>", "x y"),
+        ("<pre>a  b\n c</pre>", "a  b\n c"),
+        ("unclosed <i>ital", "unclosed ital"),
+        ("stray</i> close", "stray close"),
+        ("&lt;tag&gt; &amp;", "<tag> &"),
+    ),
+)
+def test_xml_to_plain_markup(input, output):
+    kwargs = {"keepws": ["pre"]} if "pre" in input else {}
+    plain, offsets = xml_to_plain(input, offsets=True, **kwargs)
+    assert plain == output
+    assert xml_to_plain(input, **kwargs) == plain
+    assert len(offsets) == len(plain) + 1
+    assert offsets[-1] <= len(input)
+    for c, p in zip(plain, offsets):
+        assert c.isspace() or input[p] in (c, "&")
+
+
+def test_plain_offsets_map_spans_back():
+    text = ("Choose <guimenu>File</guimenu> and then "
+            "<emphasis>&lt;Quit&gt;</emphasis>.")
+    plain, offsets = docbook4_to_plain(text, offsets=True)
+    assert plain == "Choose [File] and then <Quit>."
+    s = plain.index("File")
+    e = s + len("File")
+    assert text[offsets[s]:offsets[e - 1] + 1] == "File"
+    s = plain.index("<Quit>")
+    e = s + len("<Quit>")
+    assert text.startswith("&lt;Quit&gt;", offsets[s])
+    assert text.startswith("&gt;", offsets[e - 1])
+    assert text[offsets[plain.index("[")]] == "<"
+
+
+def test_validator_is_reentrant():
+    texts = [
+        "<emphasis>fine</emphasis> text",
+        "<emphasis>broken</emphsis>",
+        "unknown <tag>here</tag>",
+        "an &unknown; entity",
+    ] * 50
+    expected = [validate_docbook4_l1(x, ents={}) for x in texts]
+    assert all(expected[1:4])
+
+    with ThreadPoolExecutor(4) as executor:
+        spans = list(executor.map(lambda x: validate_docbook4_l1(x, ents={}),
+                                  texts))
+    assert spans == expected
+
+    validator = XmlValidatorL1(ents={})
+    assert validator.validate("a &b; c")
+    assert not validator.validate("a &b; c", ents=None)
+
+
+def test_validation_results_are_remembered():
+    from pology.cache import named_cache
+
+    memo = named_cache("markup-validation")
+    text = "<emphasis>remembered</emphsis>"
+    spans = validate_docbook4_l1(text, ents={})
+    spans.append(None)
+    hits = memo.hits
+    assert validate_docbook4_l1(text, ents={}) == spans[:-1]
+    assert memo.hits == hits + 1
+
+
+def test_spec_is_compiled_and_shared(tmp_path, monkeypatch):
+    import pology.markup as M
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(M, "_xml_spec_l1_cache", {})
+    specpath = tmp_path / "test.l1"
+    specpath.write_text("a : href=/^x/>b;\nb :>;\n")
+
+    spec = M.collect_xml_spec_l1(str(specpath))
+    assert M.collect_xml_spec_l1(str(specpath)) is spec
+    assert len(list(tmp_path.glob("cache/pology/markup/test.l1-*"))) == 1
+
+    monkeypatch.setattr(M, "_xml_spec_l1_cache", {})
+    spec2 = M.collect_xml_spec_l1(str(specpath))
+    assert spec2 is not spec
+    assert spec2["a"].stags == {"b"}
+    assert spec2["a"].avlints["href"]("xy")
+    assert not spec2["a"].avlints["href"]("yx")
+
+    specpath.write_text("a :>;\nc;\n")
+    monkeypatch.setattr(M, "_xml_spec_l1_cache", {})
+    assert sorted(M.collect_xml_spec_l1(str(specpath))) == ["a", "c"]
@@ -0,0 +1,260 @@
+import shutil
+
+import pytest
+
+from pology import PologyError
+from pology.catalog import Catalog
+from pology.compendium import CompendiumIndex, build_compendium_index
+from pology.merge import merge_catalogs, merge_pofile
+from pology.message import Message
+
+
+def _make_catalog(path, entries, potdate=None):
+    cat = Catalog(str(path), create=True)
+    cat.header.set_field("Plural-Forms", "nplurals=3; plural=n%10==1 ? 0 : 1;")
+    if potdate:
+        cat.header.set_field("POT-Creation-Date", potdate)
+    for entry in entries:
+        cat.add_last(Message(entry))
+    return cat
+
+
+def _catalog(tmp_path):
+    return _make_catalog(tmp_path / "foo.po", [
+        dict(msgid="Open file", msgstr=["Otvori fajl"],
+             manual_comment=["checked"]),
+        dict(msgid="Save the document", msgstr=["Sačuvaj dokument"]),
+        dict(msgid="Gone away", msgstr=["Otišlo"]),
+        dict(msgid="Never translated", msgstr=[""]),
+        dict(msgid="%d file", msgid_plural="%d files",
+             msgstr=["%d fajl", "%d fajla", "%d fajlova"]),
+        dict(msgid="Came back", msgstr=["Vratilo se"], obsolete=True),
+        dict(msgid="Quit", msgctxt="@action", msgstr=["Napusti"],
+             flag=["fuzzy"], msgid_previous="Quit program"),
+    ], potdate="2020-01-01 00:00+0000")
+
+
+def _template(tmp_path):
+    return _make_catalog(tmp_path / "foo.pot", [
+        dict(msgid="Open file", source=[("open.cpp", 10)],
+             flag=["kde-format"]),
+        dict(msgid="Save the documents", source=[("save.cpp", 20)]),
+        dict(msgid="Came back"),
+        dict(msgid="%d file", msgid_plural="%d files here",
+             msgstr=["", ""]),
+        dict(msgid="Quit", msgctxt="@action"),
+        dict(msgid="Something else entirely"),
+        dict(msgid="Never translated"),
+        dict(msgid="Print", msgstr=[""]),
+    ], potdate="2020-02-01 00:00+0000")
+
+
+def _states(cat):
+    return [(msg.msgctxt, msg.msgid, tuple(msg.msgstr), msg.fuzzy,
+             msg.obsolete, msg.msgid_previous)
+            for msg in cat]
+
+
+def test_merge_catalogs(tmp_path):
+    cat = _catalog(tmp_path)
+    tcat = _template(tmp_path)
+    cmpcat = _make_catalog(tmp_path / "compendium.po", [
+        dict(msgid="Print", msgstr=["Štampaj"]),
+        dict(msgid="Open file", msgstr=["Otvori datoteku"]),
+    ])
+
+    mcat = merge_catalogs(cat, tcat, [cmpcat])
+
+    assert _states(mcat) == [
+        (None, "Open file", ("Otvori fajl",), False, False, None),
+        (None, "Save the documents", ("Sačuvaj dokument",), True, False,
+         "Save the document"),
+        (None, "Came back", ("Vratilo se",), False, False, None),
+        (None, "%d file", ("%d fajl", "%d fajla", "%d fajlova"), True, False,
+         "%d file"),
+        ("@action", "Quit", ("Napusti",), True, False, "Quit program"),
+        (None, "Something else entirely", ("",), False, False, None),
+        (None, "Never translated", ("",), False, False, None),
+        (None, "Print", ("Štampaj",), False, False, None),
+        (None, "Gone away", ("Otišlo",), False, True, None),
+    ]
+    msg = mcat[0]
+    assert list(msg.manual_comment) == ["checked"]
+    assert list(msg.source) == [("open.cpp", 10)]
+    assert set(msg.flag) == set(["kde-format"])
+    assert mcat[-1].source == []
+    hdr = mcat.header
+    assert hdr.get_field_value("POT-Creation-Date") == "2020-02-01 00:00+0000"
+
+
+def test_merge_catalogs_compendium_index(tmp_path):
+    cmpcat = _make_catalog(tmp_path / "compendium.po", [
+        dict(msgid="Print", msgstr=["Štampaj"]),
+        dict(msgid="Open file", msgstr=["Otvori datoteku"]),
+        dict(msgid="Something else", msgstr=["Nešto drugo"]),
+    ])
+    cmpcat.sync()
+    idxpath = build_compendium_index(cmpcat.filename,
+                                     str(tmp_path / "compendium.idx"))
+
+    mcat1 = merge_catalogs(_catalog(tmp_path), _template(tmp_path), [cmpcat])
+    mcat2 = merge_catalogs(_catalog(tmp_path), _template(tmp_path),
+                           [CompendiumIndex(idxpath)])
+    assert _states(mcat1) == _states(mcat2)
+    assert mcat2[5].msgid_previous == "Something else"
+
+
+def test_merge_catalogs_no_fuzzy_matching(tmp_path):
+    mcat = merge_catalogs(_catalog(tmp_path), _template(tmp_path),
+                          fuzzymatch=False, keepprev=False)
+
+    assert mcat[1].msgstr == [""]
+    assert not mcat[1].fuzzy
+    assert mcat[3].fuzzy and mcat[3].msgid_previous is None
+    assert ("Sačuvaj dokument",) in [tuple(x.msgstr) for x in mcat
+                                     if x.obsolete]
+
+
+def test_merge_pofile_native(tmp_path):
+    _catalog(tmp_path).sync()
+    _template(tmp_path).sync()
+    catpath = str(tmp_path / "foo.po")
+    tplpath = str(tmp_path / "foo.pot")
+    outpath = str(tmp_path / "merged.po")
+
+    assert merge_pofile(catpath, tplpath, outpath=outpath, engine="native")
+    merged = Catalog(outpath)
+    mcat = merge_pofile(catpath, tplpath, getcat=True, engine="native")
+    assert _states(merged) == _states(mcat)
+    assert merged[1].fuzzy
+
+    merge_pofile(catpath, tplpath, update=True, engine="native",
+                 minasfz=0.9)
+    merged = Catalog(catpath)
+    assert merged[1].fuzzy
+    assert merged[4].msgstr == [""] and not merged[4].fuzzy
+
+
+def test_merge_pofile_native_from_template_only(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    _template(tmp_path).sync()
+    cmpcat = _make_catalog(tmp_path / "compendium.po", [
+        dict(msgid="Open file", msgstr=["Otvori datoteku"]),
+        dict(msgid="Save the document", msgstr=["Sačuvaj dokument"]),
+    ])
+    cmpcat.sync()
+    tplpath = str(tmp_path / "foo.pot")
+    outpath = str(tmp_path / "merged.po")
+
+    assert merge_pofile("/dev/null", tplpath, outpath=outpath,
+                        cmppaths=[cmpcat.filename], fuzzex=True,
+                        engine="native", abort=True)
+    mcat = Catalog(outpath)
+    assert mcat.header == Catalog(tplpath).header
+    assert mcat[0].msgstr == ["Otvori datoteku"] and mcat[0].fuzzy
+    assert mcat[1].msgid_previous == "Save the document"
+    assert not any(x.obsolete for x in mcat)
+
+
+def test_merge_pofile_native_reports_failure(tmp_path):
+    _template(tmp_path).sync()
+    catpath = str(tmp_path / "foo.po")
+    tplpath = str(tmp_path / "foo.pot")
+    with open(catpath, "w") as f:
+        f.write("msgid \"Unterminated\n")
+
+    assert merge_pofile(catpath, tplpath, outpath=catpath + ".merged",
+                        engine="native") is False
+    assert merge_pofile(catpath, tplpath, getcat=True, engine="native") is None
+    with pytest.raises(PologyError):
+        merge_pofile(catpath, tplpath, getcat=True, engine="native",
+                     abort=True)
+
+
+def _trees(tmp_path):
+    # Samples where the choice of fuzzy matches is not ambiguous,
+    # with all kinds of message parts that merging has to carry over.
+    words = ("file folder document image window dialog server account "
+             "message contact calendar printer network").split()
+    catpaths = []
+    for i, word in enumerate(words):
+        entries = []
+        tentries = []
+        for j in range(12):
+            msgid = "Cannot open the %s number %d" % (word, j)
+            msgstr = "Prevod %d" % j
+            if j == 7:
+                msgid += ", because " + " and ".join([word] * 12)
+                msgstr += ", zato što " + " i ".join([word] * 12)
+            entry = dict(msgid=msgid, msgstr=[msgstr],
+                         source=[("foo.cpp", j)])
+            if j % 3 == 0:
+                entry["manual_comment"] = ["Translator note %d" % j]
+            entries.append(entry)
+            if j % 4 == 1:
+                msgid += " now"
+            elif j % 4 == 2:
+                msgid = "Completely different %s text %d-%d" % (word, i, j)
+            tentry = dict(msgid=msgid, source=[("foo.cpp", j), ("bar.cpp", i)])
+            if j % 3 == 1:
+                tentry["auto_comment"] = ["i18n: context %d" % j]
+            if j % 4 == 0:
+                tentry["flag"] = ["kde-format"]
+            elif j == 7:
+                tentry["flag"] = ["no-wrap"]
+            tentries.append(tentry)
+        entries[5]["flag"] = ["fuzzy"]
+        entries[5]["msgid_previous"] = "Cannot open the %s" % word
+        entries.append(dict(msgid="%d item of " + word,
+                            msgid_plural="%d items of " + word,
+                            msgstr=["%d stavka", "%d stavke", "%d stavki"]))
+        entries.append(dict(msgid="Long gone " + word, msgstr=["Odavno"],
+                            obsolete=True))
+        tentries.append(dict(msgid="%d " + word, msgid_plural="%d " + word,
+                             msgstr=["", ""]))
+        tentries.append(dict(msgid="%d item of " + word,
+                             msgid_plural="%d items of " + word,
+                             msgstr=["", ""], flag=["kde-format"]))
+        catpath = tmp_path / ("cat%d.po" % i)
+        _make_catalog(catpath, entries, "2020-01-01 00:00+0000").sync()
+        _make_catalog(tmp_path / ("cat%d.pot" % i), tentries,
+                      "2020-02-01 00:00+0000").sync()
+        catpaths.append(str(catpath))
+    return catpaths
+
+
+def test_native_merges_sample_trees(tmp_path):
+    for catpath in _trees(tmp_path):
+        mcat = merge_pofile(catpath, catpath + "t", getcat=True,
+                            engine="native", abort=True)
+        assert mcat[0].flag == set(["kde-format"])
+        assert mcat[1].fuzzy and mcat[1].auto_comment == ["i18n: context 1"]
+        assert mcat[3].manual_comment == ["Translator note 3"]
+        assert mcat[7].flag == set(["no-wrap"])
+        pmsg = mcat[13]
+        assert pmsg.msgid_plural and pmsg.translated
+        assert len(pmsg.msgstr) == 3 and "kde-format" in pmsg.flag
+        assert [x.msgid for x in mcat if x.obsolete][-1].startswith("Long")
+
+        # Messages with no-wrap flag are not wrapped on column count.
+        outpath = catpath + ".merged"
+        merge_pofile(catpath, catpath + "t", outpath=outpath,
+                     engine="native", abort=True)
+        with open(outpath) as f:
+            lines = f.readlines()
+        assert lines.count('msgid "%s"\n' % mcat[7].msgid) == 1
+
+
+@pytest.mark.skipif(not shutil.which("msgmerge"),
+                    reason="msgmerge not available")
+def test_native_conforms_to_msgmerge(tmp_path):
+    for catpath in _trees(tmp_path):
+        tplpath = catpath + "t"
+        texts = []
+        for engine in ("msgmerge", "native"):
+            outpath = "%s.%s" % (catpath, engine)
+            merge_pofile(catpath, tplpath, outpath=outpath, engine=engine,
+                         abort=True)
+            with open(outpath) as f:
+                texts.append(f.read())
+        assert texts[0] == texts[1]
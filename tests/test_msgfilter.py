@@ -0,0 +1,58 @@
+import importlib.util
+import os
+
+from pology.catalog import Catalog
+from pology.message import Message
+from pology.msgfilter import filter_message, hook_fingerprint, msgstr_filter
+
+
+TEMPLATE_FILEPATH = os.path.join(
+    os.path.dirname(__file__), "files", "template.pot")
+
+
+def test_filter_message_shared():
+    catalog = Catalog(TEMPLATE_FILEPATH)
+    calls = []
+    def upper(text):
+        calls.append(text)
+        return text.upper()
+    filtr, fid = msgstr_filter([(upper, "test/upper")])
+
+    msg1 = Message({"msgid": "Open", "msgstr": ["ouvrir"]})
+    msg2 = Message({"msgid": "Open", "msgstr": ["ouvrir"]})
+    msgf1 = filter_message(msg1, catalog, filtr, fid)
+    msgf2 = filter_message(msg2, catalog, filtr, fid)
+
+    assert msgf1.msgstr == ["OUVRIR"]
+    assert msgf2 is msgf1
+    assert msg1.msgstr == ["ouvrir"]
+    assert calls == ["ouvrir"]
+
+
+def _load_hook(path, source):
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location("userhook", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.userhook
+
+
+def test_filter_identity_follows_hook_code(tmp_path):
+    path = tmp_path / "userhook.py"
+    hook1 = _load_hook(path, "def userhook(text):\n    return text.upper()\n")
+    fid1 = msgstr_filter([(hook1, "userhook")])[1]
+    assert msgstr_filter([(hook1, "userhook")])[1] == fid1
+
+    hook2 = _load_hook(path, "def userhook(text):\n    return text.lower()\n")
+    assert hook_fingerprint(hook2) != hook_fingerprint(hook1)
+    assert msgstr_filter([(hook2, "userhook")])[1] != fid1
+
+
+def test_hook_fingerprint_follows_factory_closure(tmp_path):
+    path = tmp_path / "userhook.py"
+    hook = _load_hook(path, "def userhook(text):\n    return text\n")
+    def factory(func):
+        return lambda text: func(text)
+    fprint = hook_fingerprint(factory(hook))
+    path.write_text("def userhook(text):\n    return text[::-1]\n")
+    assert hook_fingerprint(factory(hook)) != fprint
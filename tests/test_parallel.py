@@ -0,0 +1,55 @@
+import sys
+
+import pytest
+
+from pology.parallel import can_fork, parallel_map, split_even
+
+
+@pytest.mark.parametrize(
+    "items,nparts,output",
+    (
+        (range(5), 2, [[0, 1, 2], [3, 4]]),
+        (range(2), 4, [[0], [1]]),
+        ([], 3, []),
+    ),
+)
+def test_split_even(items, nparts, output):
+    assert split_even(items, nparts) == output
+
+
+def test_parallel_map_keeps_order():
+    offset = 10
+    def work(x):
+        return x + offset
+    assert list(parallel_map(work, range(20), 3)) == list(range(10, 30))
+
+
+def test_parallel_map_propagates_exit():
+    def work(x):
+        if x == 5:
+            sys.exit(3)
+        return x
+    with pytest.raises(SystemExit) as e:
+        list(parallel_map(work, range(10), 3))
+    assert e.value.code == 3
+
+
+@pytest.mark.skipif(not can_fork(), reason="needs forking")
+def test_parallel_map_merges_cache_updates(tmp_path, monkeypatch):
+    import pology.cache as C
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(C, "_persistent", True)
+    monkeypatch.setattr(C, "_caches", {})
+    shared = C.named_cache("shared")
+    def work(x):
+        shared.set(x, x * 2)
+        C.named_cache("worker-only", dumpf=str, loadf=int).set(x, x * 3)
+        return x
+    assert list(parallel_map(work, range(6), 3)) == list(range(6))
+    assert [shared.get(x) for x in range(6)] == [0, 2, 4, 6, 8, 10]
+
+    C.sync_caches()
+    monkeypatch.setattr(C, "_caches", {})
+    cache = C.named_cache("worker-only", dumpf=str, loadf=int)
+    assert [cache.get(x) for x in range(6)] == [0, 3, 6, 9, 12, 15]
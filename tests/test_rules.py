@@ -0,0 +1,59 @@
+from pology.cache import text_hash
+from pology.message import MessageUnsafe
+from pology.msgfilter import message_fingerprint
+from pology.rules import Rule, RuleMatcher, RuleResultStore, ruleSetHash
+
+
+def test_rule_matcher_skips_only_rules_not_matching():
+    rules = [
+        Rule(r"\bfoo\b", "msgstr"),
+        Rule(r"bar", "msgstr", casesens=False),
+        Rule(r"qux", "msgid"),
+        Rule(r"ba[rz]", "msgstr", valid=[[("span", "baz")]]),
+    ]
+    msg = MessageUnsafe({"msgid": "qux", "msgid_plural": "quxes",
+                         "msgstr": ["foo", "BAR baz"]})
+    skip = RuleMatcher(rules).nonMatching({None: msg})
+    assert skip == set()
+
+    msg = MessageUnsafe({"msgid": "none", "msgstr": ["food"]})
+    skip = RuleMatcher(rules).nonMatching({None: msg})
+    assert skip == set(rules)
+
+
+def _store_key(msg):
+    return text_hash("foo", message_fingerprint(msg))
+
+
+def test_rule_result_store_hit_and_miss(tmp_path):
+    rules = [Rule(r"\bfoo\b", "msgstr"), Rule(r"bar", "msgstr")]
+    ruleset = ruleSetHash(rules, ["sr"])
+    msg = MessageUnsafe({"msgid": "Foo", "msgstr": ["foo"]})
+
+    store = RuleResultStore(str(tmp_path / "results.sqlite"))
+    store.put(ruleset, _store_key(msg), [(0, [("msgstr", 0, [(0, 3)])])])
+    store.close()
+
+    store = RuleResultStore(str(tmp_path / "results.sqlite"))
+    assert store.get(ruleset, _store_key(msg)) == [
+        (0, [("msgstr", 0, [(0, 3)])])]
+    msg.msgstr[0] = "bar"
+    assert store.get(ruleset, _store_key(msg)) is None
+    store.close()
+
+
+def test_rule_set_hash_invalidates_results(tmp_path):
+    rules = [Rule(r"\bfoo\b", "msgstr")]
+    ruleset = ruleSetHash(rules, ["sr"])
+    assert ruleSetHash([Rule(r"\bfoo\b", "msgstr")], ["sr"]) == ruleset
+    msg = MessageUnsafe({"msgid": "Foo", "msgstr": ["foo"]})
+
+    store = RuleResultStore(str(tmp_path / "results.sqlite"))
+    store.put(ruleset, _store_key(msg), [])
+    assert store.get(ruleset, _store_key(msg)) == []
+    for ruleset2 in (ruleSetHash([Rule(r"\bfoos?\b", "msgstr")], ["sr"]),
+                     ruleSetHash(rules, ["sr", "kde"]),
+                     ruleSetHash(rules + [Rule(r"bar", "msgid")], ["sr"])):
+        assert ruleset2 != ruleset
+        assert store.get(ruleset2, _store_key(msg)) is None
+    store.close()
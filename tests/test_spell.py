@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from pology import PologyError
+from pology.spell import AspellPipe, cached_checker
+
+
+def test_spell_checker_results_are_cached():
+    class Checker:
+        calls = 0
+        def check(self, word):
+            self.calls += 1
+            return word == "good"
+        def suggest(self, word):
+            self.calls += 1
+            return ["good"]
+
+    checker = Checker()
+    cached = cached_checker(checker, "test", "xx", [])
+    for i in range(3):
+        assert cached.check("good")
+        assert not cached.check("bad")
+        assert cached.suggest("bad") == ["good"]
+    assert checker.calls == 3
+
+
+_fake_aspell = r'''#!/usr/bin/env python3
+import sys
+print("@(#) International Ispell Version 3.1.20 (but really Fake)")
+sys.stdout.flush()
+for line in sys.stdin:
+    line = line.rstrip("\n")
+    if line.startswith("^"):
+        for word in line[1:].split():
+            if word != "good":
+                print("& %s 1 0: good" % word)
+        print()
+        sys.stdout.flush()
+'''
+
+
+def test_aspell_pipe_checks_words_in_batches(tmp_path, monkeypatch):
+    script = tmp_path / "aspell"
+    script.write_text(_fake_aspell)
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    checker = AspellPipe("xx")
+    words = ["good", "bad"] * 100
+    assert checker.check_words(words) == [True, False] * 100
+    assert checker.suggest("bad") == ["good"]
+    assert checker.suggest(b"bad") == [b"good"]
+    assert checker.check(b"good")
+    checker.close()
+
+
+def test_aspell_pipe_does_not_block_on_error_output(tmp_path, monkeypatch):
+    # Warnings on every line, much more than fits into a pipe buffer.
+    script = tmp_path / "aspell"
+    script.write_text(_fake_aspell.replace(
+        'line = line.rstrip("\\n")',
+        'line = line.rstrip("\\n"); sys.stderr.write("warning\\n" * 1000)'))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    checker = AspellPipe("xx")
+    for i in range(20):
+        assert checker.check_words(["good", "bad"]) == [True, False]
+    checker.close()
+
+
+def test_aspell_pipe_reports_initialization_error(tmp_path, monkeypatch):
+    script = tmp_path / "aspell"
+    script.write_text("#!/bin/sh\necho 'No word lists for xx.' >&2\nexit 1\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    with pytest.raises(PologyError) as e:
+        AspellPipe("xx")
+    assert "No word lists for xx." in str(e.value)
+
+
+def test_supplement_words_are_compiled_and_reused(tmp_path, monkeypatch):
+    import pology.spell as S
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(S, "_supplement_words", {})
+    words = S.supplement_words("fr")
+    assert "ununoctium" in words
+    assert "ununoctium".encode() in words
+    assert "ununoctiumx" not in words
+    assert len(list(tmp_path.glob("pology/spell/fr-*.words"))) == 1
+
+    monkeypatch.setattr(S, "_supplement_words", {})
+    words2 = S.supplement_words("fr")
+    assert len(words2) == len(words)
+    assert sorted(words2) == sorted(words)
+    assert S.supplement_words("xx") is None
+
+
+def test_suggestions_computed_once_in_workers(tmp_path, monkeypatch):
+    script = tmp_path / "aspell"
+    script.write_text(_fake_aspell)
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    pipe = AspellPipe("xx")
+    cached = cached_checker(pipe, "test-workers", "xx", [])
+    words = ["bad%d" % i for i in range(20)] * 2
+    assert cached.suggest_words(words, 2) == [["good"]] * 40
+    pipe.close()
+    # All suggestions are now cached, the closed pipe is not used.
+    assert cached.suggest_words(words[:3], 2) == [["good"]] * 3
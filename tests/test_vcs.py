@@ -0,0 +1,37 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from pology.vcs import make_vcs
+
+
+@pytest.mark.skipif(not shutil.which("git"), reason="Git not available")
+def test_git_exports_files_of_revision(tmp_path):
+    def git(*args):
+        subprocess.run(["git", "-c", "user.name=T", "-c", "user.email=t@t",
+                        *args], cwd=tmp_path, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    (tmp_path / "po" / "sub").mkdir(parents=True)
+    (tmp_path / "po" / "a.po").write_bytes(b"a1\n")
+    (tmp_path / "po" / "sub" / "b.po").write_bytes(b"\x00b1")
+    (tmp_path / "po" / "notes.txt").write_text("notes")
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "first")
+    (tmp_path / "po" / "a.po").write_bytes(b"a2\n")
+    git("commit", "-q", "-a", "-m", "second")
+
+    vcs = make_vcs("git")
+    path = str(tmp_path / "po")
+    ispo = lambda x: x.endswith(".po")
+    assert vcs.export_files(path, "HEAD~1", selectf=ispo) == [
+        (os.path.join(path, "a.po"), b"a1\n"),
+        (os.path.join(path, "sub", "b.po"), b"\x00b1"),
+    ]
+    assert vcs.export_files(path, None, selectf=ispo)[0][1] == b"a2\n"
+    fpath = os.path.join(path, "a.po")
+    assert vcs.export_files(fpath, "HEAD~1") == [(fpath, b"a1\n")]
+    vcs.close()